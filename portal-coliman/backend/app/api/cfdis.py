@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from typing import List, Optional
@@ -8,30 +10,32 @@ import xml.etree.ElementTree as ET
 import os
 import shutil
 from pathlib import Path
-import zipfile
-import tempfile
 import logging
 from logging.handlers import RotatingFileHandler
-import requests
 from pydantic import BaseModel
 import base64
 import hashlib
+import json
+from uuid import uuid4
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.backends import default_backend
 from cryptography import x509
-try:
-    import rarfile
-except ImportError:
-    rarfile = None
-try:
-    import py7zr
-except ImportError:
-    py7zr = None
 
 from ..db.database import get_db
 from ..core.security import get_current_user
 from ..models.user import User
+from ..services.cfdi_folder_import import FolderImport
+from ..services.cfdi_ingestion import CfdiBatchWriter, ingest_file
+from ..services.cfdi_parser import parse_cfdi
+from ..services.cfdi_rollup import add_cfdis, remove_cfdis
+from ..services.cfdi_storage import INSUMOS_BASE_PATH, resolve_path, save_upload, save_xml_and_pdf
+from ..services import cfdi_detail, cfdi_jobs, cfdi_list
+from ..services.sat_consulta import (
+    SatCircuitOpenError, SatConsultaError, SatTimeoutError,
+    estatus_validacion_from_estado, get_sat_consulta_client
+)
+from ..services import sat_validacion, sat_validation_cache
 
 router = APIRouter(prefix="/api/cfdis", tags=["cfdis"])
 
@@ -41,6 +45,7 @@ class ValidarCFDIRequest(BaseModel):
     rfc_emisor: str
     rfc_receptor: str
     total: float
+    force_refresh: bool = False  # Ignorar la caché y consultar al SAT
 
 # Configurar logging
 log_dir = Path("C:/Git/Coliman/portal-coliman/backend/logs")
@@ -60,212 +65,14 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# Namespace del SAT para CFDI 4.0
-NAMESPACES = {
-    'cfdi': 'http://www.sat.gob.mx/cfd/4',
-    'tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital'
-}
-
 def parse_cfdi_xml(xml_content: bytes) -> dict:
     """Parse CFDI XML and extract main fields"""
     try:
-        root = ET.fromstring(xml_content)
-
-        # Obtener UUID del timbre fiscal
-        timbre = root.find('.//tfd:TimbreFiscalDigital', NAMESPACES)
-        uuid = timbre.get('UUID') if timbre is not None else None
-
-        # Datos del comprobante
-        comprobante_data = {
-            'uuid': uuid,
-            'version': root.get('Version'),
-            'fecha': root.get('Fecha'),
-            'sello': root.get('Sello'),
-            'forma_pago': root.get('FormaPago'),
-            'no_certificado': root.get('NoCertificado'),
-            'subtotal': float(root.get('SubTotal', 0)),
-            'moneda': root.get('Moneda'),
-            'total': float(root.get('Total', 0)),
-            'tipo_comprobante': root.get('TipoDeComprobante'),
-            'metodo_pago': root.get('MetodoPago'),
-            'lugar_expedicion': root.get('LugarExpedicion'),
-        }
-
-        # Datos del emisor
-        emisor = root.find('.//cfdi:Emisor', NAMESPACES)
-        if emisor is not None:
-            comprobante_data['emisor_rfc'] = emisor.get('Rfc')
-            comprobante_data['emisor_nombre'] = emisor.get('Nombre')
-            comprobante_data['emisor_regimen'] = emisor.get('RegimenFiscal')
-
-        # Datos del receptor
-        receptor = root.find('.//cfdi:Receptor', NAMESPACES)
-        if receptor is not None:
-            comprobante_data['receptor_rfc'] = receptor.get('Rfc')
-            comprobante_data['receptor_nombre'] = receptor.get('Nombre')
-            comprobante_data['receptor_uso_cfdi'] = receptor.get('UsoCFDI')
-
-        # Impuestos
-        impuestos = root.find('.//cfdi:Impuestos', NAMESPACES)
-        if impuestos is not None:
-            comprobante_data['total_impuestos_trasladados'] = float(impuestos.get('TotalImpuestosTrasladados', 0))
-            comprobante_data['total_impuestos_retenidos'] = float(impuestos.get('TotalImpuestosRetenidos', 0))
-
-        # Conceptos
-        conceptos = []
-        for concepto in root.findall('.//cfdi:Concepto', NAMESPACES):
-            concepto_data = {
-                'clave_prod_serv': concepto.get('ClaveProdServ'),
-                'cantidad': float(concepto.get('Cantidad', 0)),
-                'clave_unidad': concepto.get('ClaveUnidad'),
-                'unidad': concepto.get('Unidad'),
-                'descripcion': concepto.get('Descripcion'),
-                'valor_unitario': float(concepto.get('ValorUnitario', 0)),
-                'importe': float(concepto.get('Importe', 0)),
-                'descuento': float(concepto.get('Descuento', 0))
-            }
-            conceptos.append(concepto_data)
-
-        comprobante_data['conceptos'] = conceptos
-
-        return comprobante_data
+        return parse_cfdi(xml_content)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error al parsear XML: {str(e)}")
 
 
-def extract_compressed_file(file_content: bytes, filename: str) -> List[tuple]:
-    """Extract XML and PDF files from ZIP, RAR or 7Z archives"""
-    extracted_files = []
-
-    # Crear directorio temporal
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
-        compressed_path = temp_path / filename
-
-        # Guardar archivo comprimido
-        with open(compressed_path, 'wb') as f:
-            f.write(file_content)
-
-        try:
-            # Intentar extraer como ZIP
-            if filename.lower().endswith('.zip'):
-                with zipfile.ZipFile(compressed_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_path)
-            # Intentar extraer como RAR
-            elif filename.lower().endswith('.rar') and rarfile:
-                with rarfile.RarFile(compressed_path, 'r') as rar_ref:
-                    rar_ref.extractall(temp_path)
-            # Intentar extraer como 7Z
-            elif filename.lower().endswith('.7z') and py7zr:
-                with py7zr.SevenZipFile(compressed_path, mode='r') as z:
-                    z.extractall(path=temp_path)
-            else:
-                return []
-
-            # Buscar todos los archivos XML y PDF extraidos
-            # Primero agrupar por nombre base (UUID)
-            files_by_base = {}
-
-            for file_path in temp_path.rglob('*'):
-                if file_path.is_file():
-                    file_lower = file_path.name.lower()
-                    if file_lower.endswith('.xml') or file_lower.endswith('.pdf'):
-                        # Obtener nombre base sin extension
-                        base_name = file_path.stem
-
-                        if base_name not in files_by_base:
-                            files_by_base[base_name] = {'xml': None, 'pdf': None}
-
-                        with open(file_path, 'rb') as f:
-                            content = f.read()
-
-                        if file_lower.endswith('.xml'):
-                            files_by_base[base_name]['xml'] = (file_path.name, content)
-                        elif file_lower.endswith('.pdf'):
-                            files_by_base[base_name]['pdf'] = (file_path.name, content)
-
-            # Devolver solo los que tienen XML (el PDF es opcional)
-            for base_name, files in files_by_base.items():
-                if files['xml']:
-                    extracted_files.append({
-                        'xml': files['xml'],
-                        'pdf': files['pdf']
-                    })
-
-        except Exception as e:
-            print(f"Error extracting {filename}: {str(e)}")
-
-    return extracted_files
-
-
-def save_xml_file(file: UploadFile, base_path: str) -> tuple:
-    """Save XML file with date-based folder structure"""
-    now = datetime.now()
-    year = now.strftime("%Y")
-    month = now.strftime("%m")
-    day = now.strftime("%d")
-
-    # Crear estructura de carpetas: YYYY/MM/DD
-    target_dir = Path(base_path) / year / month / day
-    target_dir.mkdir(parents=True, exist_ok=True)
-
-    # Guardar archivo
-    file_path = target_dir / file.filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    return str(file_path), f"{year}/{month}/{day}/{file.filename}"
-
-
-def save_xml_content(filename: str, content: bytes, base_path: str) -> tuple:
-    """Save XML content with date-based folder structure"""
-    now = datetime.now()
-    year = now.strftime("%Y")
-    month = now.strftime("%m")
-    day = now.strftime("%d")
-
-    # Crear estructura de carpetas: YYYY/MM/DD
-    target_dir = Path(base_path) / year / month / day
-    target_dir.mkdir(parents=True, exist_ok=True)
-
-    # Guardar archivo
-    file_path = target_dir / filename
-    with open(file_path, "wb") as f:
-        f.write(content)
-
-    return str(file_path), f"{year}/{month}/{day}/{filename}"
-
-
-def save_xml_and_pdf(xml_filename: str, xml_content: bytes, pdf_data: tuple, base_path: str) -> tuple:
-    """Save XML and PDF files with date-based folder structure"""
-    now = datetime.now()
-    year = now.strftime("%Y")
-    month = now.strftime("%m")
-    day = now.strftime("%d")
-
-    # Crear estructura de carpetas: YYYY/MM/DD
-    target_dir = Path(base_path) / year / month / day
-    target_dir.mkdir(parents=True, exist_ok=True)
-
-    # Guardar archivo XML
-    xml_file_path = target_dir / xml_filename
-    with open(xml_file_path, "wb") as f:
-        f.write(xml_content)
-
-    xml_relative_path = f"{year}/{month}/{day}/{xml_filename}"
-    pdf_relative_path = None
-
-    # Guardar archivo PDF si existe
-    if pdf_data:
-        pdf_filename, pdf_content = pdf_data
-        pdf_file_path = target_dir / pdf_filename
-        with open(pdf_file_path, "wb") as f:
-            f.write(pdf_content)
-        pdf_relative_path = f"{year}/{month}/{day}/{pdf_filename}"
-
-    return xml_relative_path, pdf_relative_path
-
-
 @router.post("/upload")
 async def upload_cfdis(
     files: List[UploadFile] = File(...),
@@ -276,15 +83,14 @@ async def upload_cfdis(
     Subir archivos XML de CFDIs o archivos comprimidos (ZIP/RAR/7Z)
     - Soporta archivos XML, ZIP, RAR y 7Z
     - Extrae automáticamente archivos comprimidos
-    - Valida información del CFDI
+    - Valida información del CFDI (parseo en pool de procesos para cargas grandes)
     - Guarda en estructura de carpetas por fecha: Insumos XML/YYYY/MM/DD
-    - Registra en base de datos con estatus 'pendiente'
+    - Registra en base de datos con estatus 'pendiente', por lotes de CFDI_BATCH_SIZE
+      (una consulta de duplicados, INSERTs multi-fila y un commit por lote)
     - Evita duplicados por UUID
     """
-    # Usar ruta dentro del contenedor Docker (mapeada a carpeta local)
-    base_path = "/app/insumos_xml"
-    results = []
-    errors = []
+    writer = CfdiBatchWriter(db, current_user.client_id, save_files=save_xml_and_pdf)
+    errors = writer.errors
 
     # Log inicio del proceso
     logger.info("="*80)
@@ -293,312 +99,11 @@ async def upload_cfdis(
     for i, f in enumerate(files, 1):
         logger.info(f"  {i}. {f.filename} ({f.content_type})")
 
+    # Extracción, parseo e inserción son bloqueantes: se ejecutan en el threadpool
+    # para no detener el event loop (y a los demás usuarios) durante cargas grandes
     for file in files:
         try:
-            filename_lower = file.filename.lower()
-            logger.info(f"\n>>> Procesando archivo: {file.filename}")
-
-            # Verificar si es archivo comprimido (ZIP, RAR o 7Z)
-            if filename_lower.endswith('.zip') or filename_lower.endswith('.rar') or filename_lower.endswith('.7z'):
-                logger.info(f"    Tipo: Archivo comprimido ({file.filename.split('.')[-1].upper()})")
-
-                # Leer contenido del archivo comprimido
-                content = await file.read()
-                logger.info(f"    Tamaño: {len(content)} bytes")
-
-                # Extraer archivos XML del comprimido
-                logger.info(f"    Extrayendo archivos...")
-                extracted_files = extract_compressed_file(content, file.filename)
-
-                if not extracted_files:
-                    logger.warning(f"    ⚠ No se encontraron archivos XML en {file.filename}")
-                    errors.append({
-                        'filename': file.filename,
-                        'error': 'No se encontraron archivos XML en el archivo comprimido'
-                    })
-                    continue
-
-                logger.info(f"    ✓ Extraídos {len(extracted_files)} archivos XML")
-
-                # Procesar cada XML extraído (con su PDF opcional)
-                for idx, file_pair in enumerate(extracted_files, 1):
-                    try:
-                        # Extraer XML y PDF
-                        xml_filename, xml_content = file_pair['xml']
-                        pdf_data = file_pair['pdf']  # Puede ser None
-                        logger.info(f"\n    [{idx}/{len(extracted_files)}] Procesando XML: {xml_filename}")
-                        if pdf_data:
-                            logger.info(f"        • PDF asociado: {pdf_data[0]}")
-
-                        # Parsear XML
-                        logger.info(f"        • Parseando XML...")
-                        cfdi_data = parse_cfdi_xml(xml_content)
-
-                        if not cfdi_data.get('uuid'):
-                            logger.warning(f"        ⚠ No se encontró UUID en {xml_filename}")
-                            errors.append({
-                                'filename': f"{file.filename} > {xml_filename}",
-                                'error': 'No se encontró UUID en el XML'
-                            })
-                            continue
-
-                        logger.info(f"        • UUID: {cfdi_data['uuid']}")
-                        logger.info(f"        • Emisor: {cfdi_data.get('emisor_nombre')} ({cfdi_data.get('emisor_rfc')})")
-                        logger.info(f"        • Receptor: {cfdi_data.get('receptor_nombre')} ({cfdi_data.get('receptor_rfc')})")
-                        logger.info(f"        • Total: ${cfdi_data['total']} {cfdi_data['moneda']}")
-
-                        # Verificar duplicados en BD
-                        logger.info(f"        • Verificando duplicados...")
-                        existing_cfdi = db.execute(
-                            text("""SELECT id FROM cfdi WHERE uuid = :uuid AND client_id = :client_id"""),
-                            {"uuid": cfdi_data['uuid'], "client_id": current_user.client_id}
-                        ).fetchone()
-
-                        if existing_cfdi:
-                            logger.warning(f"        ⚠ CFDI duplicado - UUID: {cfdi_data['uuid']}")
-                            errors.append({
-                                'filename': f"{file.filename} > {xml_filename}",
-                                'error': f'CFDI duplicado (UUID: {cfdi_data["uuid"]})'
-                            })
-                            continue
-
-                        # Guardar archivos XML y PDF
-                        logger.info(f"        • Guardando archivos...")
-                        xml_relative_path, pdf_relative_path = save_xml_and_pdf(
-                            xml_filename, xml_content, pdf_data, base_path
-                        )
-                        logger.info(f"        • XML guardado en: Insumos XML/{xml_relative_path}")
-                        if pdf_relative_path:
-                            logger.info(f"        • PDF guardado en: Insumos XML/{pdf_relative_path}")
-
-                        # Insertar en base de datos
-                        logger.info(f"        • Insertando en base de datos...")
-                        cfdi_id = db.execute(
-                            text("""
-                            INSERT INTO cfdi (
-                                client_id, uuid, tipo_comprobante, serie, folio, fecha,
-                                emisor_rfc, emisor_nombre, emisor_regimen,
-                                receptor_rfc, receptor_nombre, receptor_uso_cfdi,
-                                subtotal, descuento, total, moneda, tipo_cambio,
-                                total_impuestos_trasladados, total_impuestos_retenidos,
-                                metodo_pago, forma_pago,
-                                xml_path, pdf_path, estatus_validacion
-                            ) VALUES (
-                                :client_id, :uuid, :tipo_comprobante, NULL, NULL, :fecha,
-                                :emisor_rfc, :emisor_nombre, :emisor_regimen,
-                                :receptor_rfc, :receptor_nombre, :receptor_uso_cfdi,
-                                :subtotal, 0, :total, :moneda, 1,
-                                :total_impuestos_trasladados, :total_impuestos_retenidos,
-                                :metodo_pago, :forma_pago,
-                                :xml_path, :pdf_path, 'pendiente'
-                            )
-                            """),
-                            {
-                                "client_id": current_user.client_id,
-                                "uuid": cfdi_data['uuid'],
-                                "tipo_comprobante": cfdi_data['tipo_comprobante'],
-                                "fecha": cfdi_data['fecha'],
-                                "emisor_rfc": cfdi_data.get('emisor_rfc'),
-                                "emisor_nombre": cfdi_data.get('emisor_nombre'),
-                                "emisor_regimen": cfdi_data.get('emisor_regimen'),
-                                "receptor_rfc": cfdi_data.get('receptor_rfc'),
-                                "receptor_nombre": cfdi_data.get('receptor_nombre'),
-                                "receptor_uso_cfdi": cfdi_data.get('receptor_uso_cfdi'),
-                                "subtotal": cfdi_data['subtotal'],
-                                "total": cfdi_data['total'],
-                                "moneda": cfdi_data['moneda'],
-                                "total_impuestos_trasladados": cfdi_data.get('total_impuestos_trasladados', 0),
-                                "total_impuestos_retenidos": cfdi_data.get('total_impuestos_retenidos', 0),
-                                "metodo_pago": cfdi_data.get('metodo_pago'),
-                                "forma_pago": cfdi_data.get('forma_pago'),
-                                "xml_path": xml_relative_path,
-                                "pdf_path": pdf_relative_path
-                            }
-                        )
-                        db.commit()
-
-                        cfdi_id_value = cfdi_id.lastrowid if hasattr(cfdi_id, 'lastrowid') else None
-                        logger.info(f"        • CFDI registrado con ID: {cfdi_id_value}")
-
-                        # Insertar conceptos
-                        num_conceptos = len(cfdi_data.get('conceptos', []))
-                        if num_conceptos > 0:
-                            logger.info(f"        • Insertando {num_conceptos} conceptos...")
-                        for concepto in cfdi_data.get('conceptos', []):
-                            db.execute(
-                                text("""
-                                INSERT INTO cfdi_conceptos (
-                                    cfdi_id, clave_prod_serv, clave_unidad, cantidad,
-                                    descripcion, valor_unitario, importe, descuento
-                                ) VALUES (
-                                    :cfdi_id, :clave_prod_serv, :clave_unidad, :cantidad,
-                                    :descripcion, :valor_unitario, :importe, :descuento
-                                )
-                                """),
-                                {
-                                    "cfdi_id": cfdi_id_value,
-                                    **concepto
-                                }
-                            )
-                        db.commit()
-                        if num_conceptos > 0:
-                            logger.info(f"        • ✓ Conceptos insertados correctamente")
-
-                        logger.info(f"        ✓✓ PROCESADO EXITOSAMENTE: {xml_filename}")
-
-                        results.append({
-                            'filename': f"{file.filename} > {xml_filename}",
-                            'uuid': cfdi_data['uuid'],
-                            'status': 'success',
-                            'path': f"Insumos XML/{xml_relative_path}",
-                            'pdf_path': f"Insumos XML/{pdf_relative_path}" if pdf_relative_path else None
-                        })
-
-                    except Exception as e:
-                        logger.error(f"        ✗ ERROR procesando {xml_filename}: {str(e)}")
-                        errors.append({
-                            'filename': f"{file.filename} > {xml_filename}",
-                            'error': str(e)
-                        })
-                        continue
-
-            # Si es archivo XML directo
-            elif filename_lower.endswith('.xml'):
-                logger.info(f"    Tipo: Archivo XML directo")
-
-                # Leer contenido
-                content = await file.read()
-                logger.info(f"    Tamaño: {len(content)} bytes")
-
-                # Parsear XML
-                logger.info(f"    Parseando XML...")
-                cfdi_data = parse_cfdi_xml(content)
-
-                if not cfdi_data.get('uuid'):
-                    logger.warning(f"    ⚠ No se encontró UUID en {file.filename}")
-                    errors.append({
-                        'filename': file.filename,
-                        'error': 'No se encontro UUID en el XML'
-                    })
-                    continue
-
-                logger.info(f"    UUID: {cfdi_data['uuid']}")
-                logger.info(f"    Emisor: {cfdi_data.get('emisor_nombre')} ({cfdi_data.get('emisor_rfc')})")
-                logger.info(f"    Receptor: {cfdi_data.get('receptor_nombre')} ({cfdi_data.get('receptor_rfc')})")
-                logger.info(f"    Total: ${cfdi_data['total']} {cfdi_data['moneda']}")
-
-                # Verificar duplicados en BD
-                logger.info(f"    Verificando duplicados...")
-                existing_cfdi = db.execute(
-                    text("""SELECT id FROM cfdi WHERE uuid = :uuid AND client_id = :client_id"""),
-                    {"uuid": cfdi_data['uuid'], "client_id": current_user.client_id}
-                ).fetchone()
-
-                if existing_cfdi:
-                    logger.warning(f"    ⚠ CFDI duplicado - UUID: {cfdi_data['uuid']}")
-                    errors.append({
-                        'filename': file.filename,
-                        'error': f'CFDI duplicado (UUID: {cfdi_data["uuid"]})'
-                    })
-                    continue
-
-                # Resetear puntero del archivo para guardarlo
-                file.file.seek(0)
-
-                # Guardar archivo físico
-                logger.info(f"    Guardando archivo...")
-                full_path, relative_path = save_xml_file(file, base_path)
-                logger.info(f"    Archivo guardado en: Insumos XML/{relative_path}")
-
-                # Insertar en base de datos
-                logger.info(f"    Insertando en base de datos...")
-                cfdi_id = db.execute(
-                    text("""
-                    INSERT INTO cfdi (
-                        client_id, uuid, tipo_comprobante, serie, folio, fecha,
-                        emisor_rfc, emisor_nombre, emisor_regimen,
-                        receptor_rfc, receptor_nombre, receptor_uso_cfdi,
-                        subtotal, descuento, total, moneda, tipo_cambio,
-                        total_impuestos_trasladados, total_impuestos_retenidos,
-                        metodo_pago, forma_pago,
-                        xml_path, estatus_validacion
-                    ) VALUES (
-                        :client_id, :uuid, :tipo_comprobante, NULL, NULL, :fecha,
-                        :emisor_rfc, :emisor_nombre, :emisor_regimen,
-                        :receptor_rfc, :receptor_nombre, :receptor_uso_cfdi,
-                        :subtotal, 0, :total, :moneda, 1,
-                        :total_impuestos_trasladados, :total_impuestos_retenidos,
-                        :metodo_pago, :forma_pago,
-                        :xml_path, 'pendiente'
-                    )
-                    """),
-                    {
-                        "client_id": current_user.client_id,
-                        "uuid": cfdi_data['uuid'],
-                        "tipo_comprobante": cfdi_data['tipo_comprobante'],
-                        "fecha": cfdi_data['fecha'],
-                        "emisor_rfc": cfdi_data.get('emisor_rfc'),
-                        "emisor_nombre": cfdi_data.get('emisor_nombre'),
-                        "emisor_regimen": cfdi_data.get('emisor_regimen'),
-                        "receptor_rfc": cfdi_data.get('receptor_rfc'),
-                        "receptor_nombre": cfdi_data.get('receptor_nombre'),
-                        "receptor_uso_cfdi": cfdi_data.get('receptor_uso_cfdi'),
-                        "subtotal": cfdi_data['subtotal'],
-                        "total": cfdi_data['total'],
-                        "moneda": cfdi_data['moneda'],
-                        "total_impuestos_trasladados": cfdi_data.get('total_impuestos_trasladados', 0),
-                        "total_impuestos_retenidos": cfdi_data.get('total_impuestos_retenidos', 0),
-                        "metodo_pago": cfdi_data.get('metodo_pago'),
-                        "forma_pago": cfdi_data.get('forma_pago'),
-                        "xml_path": relative_path
-                    }
-                )
-                db.commit()
-
-                cfdi_id_value = cfdi_id.lastrowid if hasattr(cfdi_id, 'lastrowid') else None
-                logger.info(f"    CFDI registrado con ID: {cfdi_id_value}")
-
-                # Insertar conceptos
-                num_conceptos = len(cfdi_data.get('conceptos', []))
-                if num_conceptos > 0:
-                    logger.info(f"    Insertando {num_conceptos} conceptos...")
-                for concepto in cfdi_data.get('conceptos', []):
-                    db.execute(
-                        text("""
-                        INSERT INTO cfdi_conceptos (
-                            cfdi_id, clave_prod_serv, clave_unidad, cantidad,
-                            descripcion, valor_unitario, importe, descuento
-                        ) VALUES (
-                            :cfdi_id, :clave_prod_serv, :clave_unidad, :cantidad,
-                            :descripcion, :valor_unitario, :importe, :descuento
-                        )
-                        """),
-                        {
-                            "cfdi_id": cfdi_id_value,
-                            **concepto
-                        }
-                    )
-                db.commit()
-                if num_conceptos > 0:
-                    logger.info(f"    ✓ Conceptos insertados correctamente")
-
-                logger.info(f"    ✓✓ PROCESADO EXITOSAMENTE: {file.filename}")
-
-                results.append({
-                    'filename': file.filename,
-                    'uuid': cfdi_data['uuid'],
-                    'status': 'success',
-                    'path': relative_path
-                })
-
-            else:
-                logger.warning(f"    ⚠ Formato no soportado: {file.filename}")
-                errors.append({
-                    'filename': file.filename,
-                    'error': 'Formato de archivo no soportado. Solo se aceptan XML, ZIP, RAR y 7Z'
-                })
-                continue
-
+            await run_in_threadpool(ingest_file, writer, file.filename, file.file)
         except Exception as e:
             logger.error(f"    ✗ ERROR CRÍTICO procesando {file.filename}: {str(e)}")
             errors.append({
@@ -607,6 +112,10 @@ async def upload_cfdis(
             })
             continue
 
+    # Parsear y registrar el último lote pendiente
+    rendimiento = await run_in_threadpool(writer.close)
+    results = writer.results
+
     # Log resumen final
     logger.info("\n" + "="*80)
     logger.info(f"RESUMEN FINAL DE CARGA")
@@ -624,36 +133,101 @@ async def upload_cfdis(
         'errors': len(errors),
         'total_files': len(files),
         'results': results,
-        'errors_detail': errors
+        'errors_detail': errors,
+        'rendimiento': rendimiento
     }
 
 
+@router.post("/upload-async", status_code=202)
+async def upload_cfdis_async(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Subir archivos de CFDIs para procesarlos en segundo plano
+    - Acepta los mismos formatos que /upload (XML, ZIP, RAR y 7Z)
+    - Guarda los archivos recibidos y encola un job de ingesta
+    - Responde de inmediato con el id del job; el avance se consulta en /jobs/{job_id}
+    """
+    job_key = uuid4().hex
+    archivos = []
+    for i, file in enumerate(files, 1):
+        # Prefijo con el índice para que dos archivos con el mismo nombre no se pisen
+        path = await run_in_threadpool(save_upload, file.file, f"{i:03d}_{file.filename}", job_key)
+        archivos.append({'filename': file.filename, 'path': path})
+
+    job_id = cfdi_jobs.create_job(
+        db,
+        current_user.client_id,
+        current_user.id,
+        cfdi_jobs.JOB_INGESTA,
+        {'job_key': job_key, 'archivos': archivos}
+    )
+
+    logger.info(f"CARGA EN SEGUNDO PLANO - Usuario: {current_user.email} | Job: {job_id} | Archivos: {len(files)}")
+
+    return {
+        'job_id': job_id,
+        'estado': cfdi_jobs.ESTADO_EN_COLA,
+        'total_files': len(files)
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_cfdi_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Consultar el estado de un job de CFDIs
+    - Contadores de procesados, exitosos, duplicados y errores mientras corre
+    - Throughput (por_segundo) calculado desde el inicio del job
+    """
+    job = cfdi_jobs.get_job(db, job_id, current_user.client_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+
 @router.post("/import-folder")
 async def import_from_folder(
+    reintentar_errores: bool = False,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Importar todos los archivos XML de la carpeta Insumos XML
-    - Escanea la carpeta C:/Git/Coliman/Insumos XML
-    - Copia archivos a estructura de carpetas por fecha
-    - Valida y registra en base de datos
-    - Evita duplicados por UUID
+    Importar los archivos XML de la carpeta Insumos XML (incluyendo subcarpetas YYYY/MM/DD)
+    - Importación incremental: los archivos sin cambios (tamaño y fecha de
+      modificación) desde la última importación se omiten sin leerlos
+    - Archivos con contenido ya importado (mismo sha256) se marcan como duplicados sin parsear
+    - Copia archivos nuevos a estructura de carpetas por fecha y los registra por lotes
+    - Si se interrumpe, la siguiente importación continúa desde el último lote registrado
+    - reintentar_errores: volver a procesar archivos que fallaron aunque no hayan cambiado
     """
     # Usar ruta dentro del contenedor Docker (mapeada a carpeta local)
-    base_path = "/app/insumos_xml"
-    source_folder = Path(base_path) / "Insumos XML"
+    source_folder = Path(INSUMOS_BASE_PATH) / "Insumos XML"
 
     if not source_folder.exists():
         raise HTTPException(status_code=404, detail=f"Carpeta no encontrada: {source_folder}")
 
-    results = []
-    errors = []
-
-    # Buscar todos los archivos XML en la carpeta
-    xml_files = list(source_folder.glob("*.xml"))
+    logger.info("="*80)
+    logger.info(f"IMPORTACIÓN DE CARPETA - Usuario: {current_user.email} (Client: {current_user.client_id})")
+
+    folder_import = FolderImport(db, current_user.client_id, source_folder, retry_errors=reintentar_errores)
+    rendimiento = await run_in_threadpool(folder_import.run)
+    results = folder_import.writer.results
+    errors = folder_import.writer.errors
+
+    logger.info(
+        f"  Archivos: {rendimiento['archivos']} | Sin cambios: {rendimiento['sin_cambios']} | "
+        f"Contenido conocido: {rendimiento['contenido_conocido']} | Procesados: {rendimiento['procesados']} | "
+        f"Exitosos: {len(results)} | Errores: {len(errors)}"
+    )
+    logger.info("="*80 + "\n")
 
-    if not xml_files:
+    if not rendimiento['archivos']:
         return {
             'success': 0,
             'errors': 0,
@@ -662,143 +236,14 @@ async def import_from_folder(
             'errors_detail': []
         }
 
-    for xml_file in xml_files:
-        try:
-            # Leer contenido del archivo
-            with open(xml_file, 'rb') as f:
-                content = f.read()
-
-            # Parsear XML
-            cfdi_data = parse_cfdi_xml(content)
-
-            if not cfdi_data.get('uuid'):
-                errors.append({
-                    'filename': xml_file.name,
-                    'error': 'No se encontró UUID en el XML'
-                })
-                continue
-
-            # Verificar duplicados en BD
-            existing_cfdi = db.execute(
-                text("""SELECT id FROM cfdi WHERE uuid = :uuid AND client_id = :client_id"""),
-                {"uuid": cfdi_data['uuid'], "client_id": current_user.client_id}
-            ).fetchone()
-
-            if existing_cfdi:
-                errors.append({
-                    'filename': xml_file.name,
-                    'error': f'CFDI duplicado (UUID: {cfdi_data["uuid"]})'
-                })
-                continue
-
-            # Copiar archivo XML y PDF (si existe) a estructura de carpetas por fecha
-            now = datetime.now()
-            year = now.strftime("%Y")
-            month = now.strftime("%m")
-            day = now.strftime("%d")
-
-            target_dir = Path(base_path) / year / month / day
-            target_dir.mkdir(parents=True, exist_ok=True)
-
-            # Copiar archivo XML
-            target_file = target_dir / xml_file.name
-            shutil.copy2(xml_file, target_file)
-            xml_relative_path = f"{year}/{month}/{day}/{xml_file.name}"
-
-            # Buscar y copiar PDF asociado (mismo nombre base)
-            pdf_relative_path = None
-            pdf_file = xml_file.with_suffix('.pdf')
-            if pdf_file.exists():
-                target_pdf = target_dir / pdf_file.name
-                shutil.copy2(pdf_file, target_pdf)
-                pdf_relative_path = f"{year}/{month}/{day}/{pdf_file.name}"
-
-            # Insertar en base de datos
-            cfdi_id = db.execute(
-                text("""
-                INSERT INTO cfdi (
-                    client_id, uuid, tipo_comprobante, serie, folio, fecha,
-                    emisor_rfc, emisor_nombre, emisor_regimen,
-                    receptor_rfc, receptor_nombre, receptor_uso_cfdi,
-                    subtotal, descuento, total, moneda, tipo_cambio,
-                    total_impuestos_trasladados, total_impuestos_retenidos,
-                    metodo_pago, forma_pago,
-                    xml_path, pdf_path, estatus_validacion
-                ) VALUES (
-                    :client_id, :uuid, :tipo_comprobante, NULL, NULL, :fecha,
-                    :emisor_rfc, :emisor_nombre, :emisor_regimen,
-                    :receptor_rfc, :receptor_nombre, :receptor_uso_cfdi,
-                    :subtotal, 0, :total, :moneda, 1,
-                    :total_impuestos_trasladados, :total_impuestos_retenidos,
-                    :metodo_pago, :forma_pago,
-                    :xml_path, :pdf_path, 'pendiente'
-                )
-                """),
-                {
-                    "client_id": current_user.client_id,
-                    "uuid": cfdi_data['uuid'],
-                    "tipo_comprobante": cfdi_data['tipo_comprobante'],
-                    "fecha": cfdi_data['fecha'],
-                    "emisor_rfc": cfdi_data.get('emisor_rfc'),
-                    "emisor_nombre": cfdi_data.get('emisor_nombre'),
-                    "emisor_regimen": cfdi_data.get('emisor_regimen'),
-                    "receptor_rfc": cfdi_data.get('receptor_rfc'),
-                    "receptor_nombre": cfdi_data.get('receptor_nombre'),
-                    "receptor_uso_cfdi": cfdi_data.get('receptor_uso_cfdi'),
-                    "subtotal": cfdi_data['subtotal'],
-                    "total": cfdi_data['total'],
-                    "moneda": cfdi_data['moneda'],
-                    "total_impuestos_trasladados": cfdi_data.get('total_impuestos_trasladados', 0),
-                    "total_impuestos_retenidos": cfdi_data.get('total_impuestos_retenidos', 0),
-                    "metodo_pago": cfdi_data.get('metodo_pago'),
-                    "forma_pago": cfdi_data.get('forma_pago'),
-                    "xml_path": xml_relative_path,
-                    "pdf_path": pdf_relative_path
-                }
-            )
-            db.commit()
-
-            cfdi_id_value = cfdi_id.lastrowid if hasattr(cfdi_id, 'lastrowid') else None
-
-            # Insertar conceptos
-            for concepto in cfdi_data.get('conceptos', []):
-                db.execute(
-                    """
-                    INSERT INTO cfdi_conceptos (
-                        cfdi_id, clave_prod_serv, clave_unidad, cantidad,
-                        descripcion, valor_unitario, importe, descuento
-                    ) VALUES (
-                        :cfdi_id, :clave_prod_serv, :clave_unidad, :cantidad,
-                        :descripcion, :valor_unitario, :importe, :descuento
-                    )
-                    """,
-                    {
-                        "cfdi_id": cfdi_id_value,
-                        **concepto
-                    }
-                )
-            db.commit()
-
-            results.append({
-                'filename': xml_file.name,
-                'uuid': cfdi_data['uuid'],
-                'status': 'success',
-                'path': relative_path
-            })
-
-        except Exception as e:
-            errors.append({
-                'filename': xml_file.name,
-                'error': str(e)
-            })
-            continue
-
     return {
         'success': len(results),
         'errors': len(errors),
-        'total_files': len(xml_files),
+        'total_files': rendimiento['archivos'],
+        'skipped': rendimiento['sin_cambios'] + rendimiento['contenido_conocido'],
         'results': results,
-        'errors_detail': errors
+        'errors_detail': errors,
+        'rendimiento': rendimiento
     }
 
 
@@ -806,29 +251,47 @@ async def import_from_folder(
 async def list_cfdis(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    emisor_rfc: Optional[str] = None,
+    receptor_rfc: Optional[str] = None,
+    tipo_comprobante: Optional[str] = None,
+    estatus_validacion: Optional[str] = None
 ):
-    """Listar CFDIs del cliente"""
-    cfdis = db.execute(
-        text("""
-        SELECT
-            id, uuid, fecha, tipo_comprobante,
-            emisor_rfc, emisor_nombre,
-            receptor_rfc, receptor_nombre,
-            subtotal, total, moneda,
-            estatus_validacion, created_at
-        FROM cfdi
-        WHERE client_id = :client_id
-        ORDER BY created_at DESC
-        LIMIT :limit OFFSET :skip
-        """),
-        {
-            "client_id": current_user.client_id,
-            "limit": limit,
-            "skip": skip
-        }
-    ).fetchall()
+    """
+    Listar CFDIs del cliente
+
+    Paginación por cursor: la respuesta trae `next_cursor` (None en la última
+    página) que se envía como `cursor` para pedir la siguiente. `skip` se
+    mantiene por compatibilidad y solo aplica cuando no se envía cursor.
+    """
+    limit = max(1, min(limit, cfdi_list.LIMITE_MAXIMO))
+    filtros = {
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'emisor_rfc': emisor_rfc.upper() if emisor_rfc else None,
+        'receptor_rfc': receptor_rfc.upper() if receptor_rfc else None,
+        'tipo_comprobante': tipo_comprobante,
+        'estatus_validacion': estatus_validacion
+    }
+    try:
+        for fecha in (fecha_inicio, fecha_fin):
+            if fecha:
+                datetime.strptime(fecha, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido. Use YYYY-MM-DD")
+
+    next_cursor = None
+    try:
+        if cursor or not skip:
+            cfdis, next_cursor = cfdi_list.fetch_page(db, current_user.client_id, filtros, cursor, limit)
+        else:
+            cfdis = cfdi_list.fetch_offset_page(db, current_user.client_id, filtros, skip, limit)
+    except cfdi_list.CursorInvalidoError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Convertir a lista de diccionarios
     result = []
@@ -849,15 +312,10 @@ async def list_cfdis(
             'created_at': str(cfdi[12]) if cfdi[12] else None
         })
 
-    # Contar total
-    total = db.execute(
-        text("SELECT COUNT(*) FROM cfdi WHERE client_id = :client_id"),
-        {"client_id": current_user.client_id}
-    ).fetchone()[0]
-
     return {
         'data': result,
-        'total': total,
+        'total': cfdi_list.count_cfdis(db, current_user.client_id, filtros),
+        'next_cursor': next_cursor,
         'skip': skip,
         'limit': limit
     }
@@ -870,76 +328,53 @@ async def get_cfdi(
     db: Session = Depends(get_db)
 ):
     """Obtener un CFDI por ID"""
-    cfdi_row = db.execute(
-        text("""
-        SELECT
-            id, uuid, fecha, tipo_comprobante, serie, folio,
-            emisor_rfc, emisor_nombre, emisor_regimen,
-            receptor_rfc, receptor_nombre, receptor_uso_cfdi,
-            subtotal, descuento, total, moneda, tipo_cambio,
-            total_impuestos_trasladados, total_impuestos_retenidos,
-            metodo_pago, forma_pago,
-            xml_path, estatus_validacion, created_at
-        FROM cfdi
-        WHERE id = :cfdi_id AND client_id = :client_id
-        """),
-        {"cfdi_id": cfdi_id, "client_id": current_user.client_id}
-    ).fetchone()
-
-    if not cfdi_row:
+    cfdi = cfdi_detail.load_cfdi(db, current_user.client_id, cfdi_id)
+    if not cfdi:
         raise HTTPException(status_code=404, detail="CFDI no encontrado")
+    return cfdi
 
-    # Obtener conceptos
-    conceptos_rows = db.execute(
-        text("""
-        SELECT
-            clave_prod_serv, cantidad, clave_unidad, unidad,
-            descripcion, valor_unitario, importe, descuento
-        FROM cfdi_conceptos
-        WHERE cfdi_id = :cfdi_id
-        """),
-        {"cfdi_id": cfdi_id}
-    ).fetchall()
-
-    conceptos = []
-    for row in conceptos_rows:
-        conceptos.append({
-            'clave_prod_serv': row[0],
-            'cantidad': float(row[1]) if row[1] else 0,
-            'clave_unidad': row[2],
-            'unidad': row[3],
-            'descripcion': row[4],
-            'valor_unitario': float(row[5]) if row[5] else 0,
-            'importe': float(row[6]) if row[6] else 0,
-            'descuento': float(row[7]) if row[7] else 0,
-        })
 
+class BatchGetRequest(BaseModel):
+    """Request para obtener el detalle de varios CFDIs: ids y/o UUIDs"""
+    ids: List[int] = []
+    uuids: List[str] = []
+
+
+@router.post("/batch-get")
+async def batch_get_cfdis(
+    request: BatchGetRequest,
+    formato: str = Query("json", alias="format", pattern="^(json|ndjson)$", description="json o ndjson"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtener el detalle (encabezado y conceptos) de hasta 1,000 CFDIs
+
+    Dos consultas por lote en lugar de dos por CFDI. Con `format=ndjson` la
+    respuesta es una línea JSON por CFDI, enviada conforme se lee; las claves
+    no encontradas salen como líneas con "error".
+    """
+    ids = list(dict.fromkeys(request.ids))
+    uuids = list(dict.fromkeys(u.strip().upper() for u in request.uuids if u.strip()))
+    if not ids and not uuids:
+        raise HTTPException(status_code=400, detail="Debe enviar ids o uuids")
+    if len(ids) + len(uuids) > cfdi_detail.MAX_POR_LOTE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {cfdi_detail.MAX_POR_LOTE} CFDIs por solicitud"
+        )
+
+    if formato == 'ndjson':
+        return StreamingResponse(
+            cfdi_detail.stream_ndjson(current_user.client_id, ids, uuids),
+            media_type="application/x-ndjson"
+        )
+
+    cfdis, no_encontrados = cfdi_detail.load_cfdis(db, current_user.client_id, ids, uuids)
     return {
-        'id': cfdi_row[0],
-        'uuid': cfdi_row[1],
-        'fecha': cfdi_row[2],
-        'tipo_comprobante': cfdi_row[3],
-        'serie': cfdi_row[4],
-        'folio': cfdi_row[5],
-        'emisor_rfc': cfdi_row[6],
-        'emisor_nombre': cfdi_row[7],
-        'emisor_regimen': cfdi_row[8],
-        'receptor_rfc': cfdi_row[9],
-        'receptor_nombre': cfdi_row[10],
-        'receptor_uso_cfdi': cfdi_row[11],
-        'subtotal': float(cfdi_row[12]) if cfdi_row[12] else 0,
-        'descuento': float(cfdi_row[13]) if cfdi_row[13] else 0,
-        'total': float(cfdi_row[14]) if cfdi_row[14] else 0,
-        'moneda': cfdi_row[15],
-        'tipo_cambio': float(cfdi_row[16]) if cfdi_row[16] else 1,
-        'total_impuestos_trasladados': float(cfdi_row[17]) if cfdi_row[17] else 0,
-        'total_impuestos_retenidos': float(cfdi_row[18]) if cfdi_row[18] else 0,
-        'metodo_pago': cfdi_row[19],
-        'forma_pago': cfdi_row[20],
-        'xml_path': cfdi_row[21],
-        'estatus_validacion': cfdi_row[22],
-        'created_at': cfdi_row[23],
-        'conceptos': conceptos
+        'data': cfdis,
+        'total': len(cfdis),
+        'no_encontrados': no_encontrados
     }
 
 
@@ -954,6 +389,15 @@ class ValidateCFDIRequest(BaseModel):
     receptor_rfc: str
     total: float
 
+class ValidarLoteRequest(BaseModel):
+    """Request para validación por lote: lista de UUIDs o filtros"""
+    uuids: Optional[List[str]] = None
+    fecha_inicio: Optional[str] = None  # formato: YYYY-MM-DD
+    fecha_fin: Optional[str] = None     # formato: YYYY-MM-DD
+    estatus: Optional[List[str]] = None  # por defecto: ['pendiente'] si no hay UUIDs
+    concurrencia: Optional[int] = None
+    force_refresh: bool = False  # Ignorar la caché y consultar al SAT
+
 class DescargaMasivaRequest(BaseModel):
     """Request para descarga masiva SAT"""
     fecha_inicio: str  # formato: YYYY-MM-DD
@@ -967,9 +411,43 @@ class DescargaMasivaRequest(BaseModel):
 # ENDPOINT: VALIDAR CFDI CON EL SAT
 # ============================================================================
 
+@router.get("/{cfdi_id}/archivo/{tipo}")
+async def download_cfdi_file(
+    cfdi_id: int,
+    tipo: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Descargar el XML o PDF de un CFDI (tipo: xml | pdf)"""
+    if tipo not in ('xml', 'pdf'):
+        raise HTTPException(status_code=400, detail="Tipo de archivo no válido (xml o pdf)")
+
+    cfdi_row = db.execute(
+        text("""
+        SELECT uuid, xml_path, pdf_path
+        FROM cfdi
+        WHERE id = :cfdi_id AND client_id = :client_id
+        """),
+        {"cfdi_id": cfdi_id, "client_id": current_user.client_id}
+    ).fetchone()
+
+    if not cfdi_row:
+        raise HTTPException(status_code=404, detail="CFDI no encontrado")
+
+    file_path = resolve_path(cfdi_row.xml_path if tipo == 'xml' else cfdi_row.pdf_path)
+    if not file_path or not file_path.exists():
+        raise HTTPException(status_code=404, detail=f"Archivo {tipo.upper()} no disponible")
+
+    return FileResponse(
+        file_path,
+        media_type='application/xml' if tipo == 'xml' else 'application/pdf',
+        filename=f"{cfdi_row.uuid}.{tipo}"
+    )
+
+
 @router.post("/validate")
 async def validate_cfdi_sat(
-    request: ValidateCFDIRequest,
+    request: ValidarCFDIRequest,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -978,109 +456,129 @@ async def validate_cfdi_sat(
 
     El SAT proporciona un servicio web para verificar la autenticidad de CFDIs.
     Este endpoint consulta el servicio y actualiza el estatus en la BD.
+    La consulta es asíncrona (no bloquea el worker) y usa el cliente
+    compartido con pool de conexiones, reintentos y circuit breaker.
 
     IMPORTANTE: El servicio del SAT puede tener un delay de hasta 72 horas.
     """
     logger.info(f"Validando CFDI UUID: {request.uuid}")
 
-    try:
-        # URL del servicio de consulta del SAT
-        sat_url = "https://consultaqr.facturaelectronica.sat.gob.mx/ConsultaCFDIService.svc"
-
-        # Preparar la expresión impresa (línea que aparece en el QR)
-        # Formato: https://verificacfdi.facturaelectronica.sat.gob.mx/default.aspx?id={UUID}&re={RFC_EMISOR}&rr={RFC_RECEPTOR}&tt={TOTAL}&fe={ULTIMOS_8_SELLO}
-        expresion_impresa = f"?re={request.rfc_emisor}&rr={request.rfc_receptor}&tt={request.total:.6f}&id={request.uuid}"
-
-        # SOAP Envelope para consulta
-        soap_body = f"""<?xml version="1.0" encoding="UTF-8"?>
-<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-                  xmlns:tem="http://tempuri.org/">
-   <soapenv:Header/>
-   <soapenv:Body>
-      <tem:Consulta>
-         <tem:expresionImpresa><![CDATA[{expresion_impresa}]]></tem:expresionImpresa>
-      </tem:Consulta>
-   </soapenv:Body>
-</soapenv:Envelope>"""
-
-        headers = {
-            'Content-Type': 'text/xml; charset=utf-8',
-            'SOAPAction': 'http://tempuri.org/IConsultaCFDIService/Consulta'
-        }
+    key = sat_validation_cache.cache_key(request.uuid, request.rfc_emisor, request.rfc_receptor, request.total)
+    resultado = None if request.force_refresh else sat_validation_cache.get(db, key)
 
-        logger.info(f"Consultando SAT para UUID: {request.uuid}")
-
-        # Hacer request al SAT
-        response = requests.post(sat_url, data=soap_body, headers=headers, timeout=30)
-
-        if response.status_code != 200:
-            logger.error(f"Error en consulta SAT: {response.status_code} - {response.text}")
-            raise HTTPException(status_code=502, detail=f"Error al consultar SAT: {response.status_code}")
-
-        # Parse respuesta SOAP
-        ns = {'s': 'http://schemas.xmlsoap.org/soap/envelope/',
-              'a': 'http://tempuri.org/'}
-
-        root = ET.fromstring(response.content)
-        consulta_result = root.find('.//a:ConsultaResult', ns)
-
-        if consulta_result is None:
-            logger.warning(f"Respuesta SAT sin resultado para UUID: {request.uuid}")
-            return {
-                'uuid': request.uuid,
-                'estado': 'No Encontrado',
-                'es_cancelable': 'No Disponible',
-                'estatus_cancelacion': 'No Disponible',
-                'validacion_efos': 'No Disponible',
-                'mensaje': 'El SAT no retornó información. Puede ser un delay de hasta 72 horas.'
-            }
-
-        # Extraer información de la respuesta
-        codigo_estatus = consulta_result.find('.//a:CodigoEstatus', ns)
-        estado = consulta_result.find('.//a:Estado', ns)
-        es_cancelable = consulta_result.find('.//a:EsCancelable', ns)
-        estatus_cancelacion = consulta_result.find('.//a:EstatusCancelacion', ns)
-        validacion_efos = consulta_result.find('.//a:ValidacionEFOS', ns)
-
-        resultado = {
-            'uuid': request.uuid,
-            'codigo_estatus': codigo_estatus.text if codigo_estatus is not None else 'N/A',
-            'estado': estado.text if estado is not None else 'No Encontrado',
-            'es_cancelable': es_cancelable.text if es_cancelable is not None else 'No Disponible',
-            'estatus_cancelacion': estatus_cancelacion.text if estatus_cancelacion is not None else 'No Disponible',
-            'validacion_efos': validacion_efos.text if validacion_efos is not None else 'No Disponible'
-        }
+    if resultado is not None:
+        resultado['origen'] = 'cache'
+    else:
+        try:
+            resultado = await get_sat_consulta_client().consultar(
+                request.uuid, request.rfc_emisor, request.rfc_receptor, request.total
+            )
+        except SatCircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except SatTimeoutError:
+            logger.error(f"Timeout al consultar SAT para UUID: {request.uuid}")
+            raise HTTPException(status_code=504, detail="Timeout al consultar el servicio del SAT")
+        except SatConsultaError as e:
+            logger.error(f"Error en consulta SAT: {str(e)}")
+            raise HTTPException(status_code=502, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error validando CFDI: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error al validar CFDI: {str(e)}")
 
-        logger.info(f"Resultado validación SAT: {resultado}")
-
-        # Actualizar estatus en BD si el CFDI existe
-        estatus_bd = 'valido' if resultado['estado'] == 'Vigente' else 'rechazado' if resultado['estado'] == 'Cancelado' else 'pendiente'
-
-        db.execute(
-            text("""
-            UPDATE cfdi
-            SET estatus_validacion = :estatus,
-                validacion_sat_fecha = NOW(),
-                validacion_sat_respuesta = :respuesta
-            WHERE uuid = :uuid AND client_id = :client_id
-            """),
-            {
-                "estatus": estatus_bd,
-                "respuesta": str(resultado),
-                "uuid": request.uuid,
-                "client_id": current_user.client_id
-            }
-        )
+        sat_validation_cache.store(db, key, resultado)
         db.commit()
+        resultado['origen'] = 'sat'
 
-        logger.info(f"CFDI actualizado en BD con estatus: {estatus_bd}")
+    logger.info(f"Resultado validación SAT: {resultado}")
 
+    if 'codigo_estatus' not in resultado:
+        logger.warning(f"Respuesta SAT sin resultado para UUID: {request.uuid}")
         return resultado
 
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout al consultar SAT para UUID: {request.uuid}")
-        raise HTTPException(status_code=504, detail="Timeout al consultar el servicio del SAT")
-    except Exception as e:
-        logger.error(f"Error validando CFDI: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error al validar CFDI: {str(e)}")
+    # Actualizar estatus en BD si el CFDI existe
+    estatus_bd = estatus_validacion_from_estado(resultado['estado'])
 
+    ids = [row.id for row in db.execute(
+        text("SELECT id FROM cfdi WHERE uuid = :uuid AND client_id = :client_id"),
+        {"uuid": request.uuid, "client_id": current_user.client_id}
+    )]
+
+    # Los agregados diarios se mueven del estatus anterior al nuevo
+    remove_cfdis(db, current_user.client_id, ids)
+    db.execute(
+        text("""
+        UPDATE cfdi
+        SET estatus_validacion = :estatus,
+            validacion_sat_fecha = NOW(),
+            validacion_sat_respuesta = :respuesta
+        WHERE uuid = :uuid AND client_id = :client_id
+        """),
+        {
+            "estatus": estatus_bd,
+            "respuesta": json.dumps({k: v for k, v in resultado.items() if k != 'origen'}),
+            "uuid": request.uuid,
+            "client_id": current_user.client_id
+        }
+    )
+    add_cfdis(db, current_user.client_id, ids)
+    db.commit()
+
+    logger.info(f"CFDI actualizado en BD con estatus: {estatus_bd}")
+
+    return resultado
+
+
+@router.post("/validate-batch", status_code=202)
+async def validate_cfdis_batch(
+    request: ValidarLoteRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Valida contra el SAT un conjunto de CFDIs en segundo plano
+
+    - Por lista de UUIDs o por filtros (rango de fechas y estatus; por defecto
+      los CFDIs en 'pendiente')
+    - RFCs y total se toman de la tabla cfdi
+    - Los resultados vigentes en caché no se consultan al SAT (salvo force_refresh)
+    - Concurrencia limitada (SAT_VALIDACION_LOTE_CONCURRENCIA) y un UPDATE
+      masivo por página de resultados
+    - Responde con el id del job; el avance se consulta en /jobs/{job_id}
+    """
+    filtros = {
+        'uuids': request.uuids,
+        'fecha_inicio': request.fecha_inicio,
+        'fecha_fin': request.fecha_fin,
+        'estatus': request.estatus if request.estatus or request.uuids else ['pendiente']
+    }
+
+    try:
+        for campo in ('fecha_inicio', 'fecha_fin'):
+            if filtros[campo]:
+                datetime.strptime(filtros[campo], '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido (YYYY-MM-DD)")
+
+    if request.concurrencia is not None and request.concurrencia < 1:
+        raise HTTPException(status_code=400, detail="La concurrencia debe ser mayor a 0")
+
+    total = sat_validacion.count_cfdis(db, current_user.client_id, filtros)
+    if not total:
+        return {'job_id': None, 'total': 0, 'message': 'No hay CFDIs que cumplan los filtros'}
+
+    job_id = cfdi_jobs.create_job(
+        db,
+        current_user.client_id,
+        current_user.id,
+        sat_validacion.JOB_VALIDACION,
+        {'filtros': filtros, 'concurrencia': request.concurrencia, 'force_refresh': request.force_refresh},
+        total=total
+    )
+
+    logger.info(f"VALIDACIÓN POR LOTE - Usuario: {current_user.email} | Job: {job_id} | CFDIs: {total}")
+
+    return {
+        'job_id': job_id,
+        'estado': cfdi_jobs.ESTADO_EN_COLA,
+        'total': total
+    }
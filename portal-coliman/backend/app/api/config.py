@@ -15,6 +15,7 @@ from app.db.database import get_db
 from app.models.user import User
 from app.models.app_config import AppConfig
 from app.core.security import get_current_user
+from app.services.cfdi_storage import gc_unreferenced_blobs
 
 router = APIRouter(prefix="/api/config", tags=["config"])
 
@@ -204,6 +205,10 @@ async def save_fiel_config(
         with open(config_file, 'w') as f:
             json.dump(config, f, indent=2)
 
+        # El servicio SAT en memoria se vuelve a cargar con la nueva e.firma
+        from app.services.sat_descarga import invalidar_servicio_sat
+        invalidar_servicio_sat()
+
         return {
             "message": "Configuración de FIEL guardada exitosamente",
             "rfc": rfc,
@@ -304,6 +309,9 @@ async def delete_fiel_config(
         # Eliminar archivo de configuración
         os.remove(config_file)
 
+        from app.services.sat_descarga import invalidar_servicio_sat
+        invalidar_servicio_sat()
+
         return {"message": "Configuración de FIEL eliminada exitosamente"}
 
     except Exception as e:
@@ -434,3 +442,21 @@ async def update_app_config(
         created_at=config.created_at,
         updated_at=config.updated_at
     )
+
+
+@router.post("/almacenamiento/gc")
+def gc_almacenamiento(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Elimina del almacenamiento por contenido los archivos XML/PDF que ningún
+    CFDI referencia (cargas cuyo INSERT falló). Solo administradores
+    """
+    if current_user.role not in ['admin', 'superadmin']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tienes permisos para limpiar el almacenamiento"
+        )
+
+    return gc_unreferenced_blobs(db)
@@ -9,10 +9,12 @@ from typing import Optional
 import logging
 import httpx
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 
 from app.db.database import get_db
 from app.core.security import get_current_user
 from app.models.user import User
+from app.services import cfdi_snapshot
 
 logger = logging.getLogger('mcp_agent')
 
@@ -30,6 +32,31 @@ class ChatResponse(BaseModel):
     tipo: str = "text"
 
 
+def _grupos(db: Session, client_id: str, por: list, top: Optional[int] = None, **filtros) -> Optional[list]:
+    """
+    Agrupación sobre el snapshot en memoria (app/services/cfdi_snapshot.py).
+    Retorna None si numpy no está instalado: quien llama usa SQL.
+    """
+    if not cfdi_snapshot.disponible():
+        return None
+    with cfdi_snapshot.snapshot_de(db, client_id) as snapshot:
+        return snapshot.agrupar(por, snapshot.filtro(**filtros), top=top)
+
+
+def _top_rfc(db: Session, client_id: str, rol: str, top: int, **filtros) -> Optional[list]:
+    """Top de emisores o receptores con los nombres de columna de la consulta SQL"""
+    grupos = _grupos(db, client_id, [rol], top=top, **filtros)
+    if grupos is None:
+        return None
+    return [
+        SimpleNamespace(**{
+            f'{rol}_nombre': g[rol]['nombre'], f'{rol}_rfc': g[rol]['rfc'],
+            'num_facturas': g['cantidad'], 'total': g['total']
+        })
+        for g in grupos
+    ]
+
+
 def get_cfdi_context(db: Session, client_id: str = "COLIMAN001") -> str:
     """Obtiene contexto de CFDIs para el agente"""
     try:
@@ -48,7 +75,20 @@ def get_cfdi_context(db: Session, client_id: str = "COLIMAN001") -> str:
             FROM cfdi
             WHERE client_id = :client_id
         """)
-        stats = db.execute(query_stats, {"client_id": client_id}).fetchone()
+        stats = None
+        if cfdi_snapshot.disponible():
+            with cfdi_snapshot.snapshot_de(db, client_id) as snapshot:
+                resumen = snapshot.resumen()
+                por_estatus = {g['estatus']: g['cantidad'] for g in snapshot.agrupar(['estatus'])}
+            stats = SimpleNamespace(
+                total_cfdis=resumen['cantidad'], monto_total=resumen['total'],
+                emisores_unicos=resumen['emisores_unicos'], receptores_unicos=resumen['receptores_unicos'],
+                fecha_mas_antigua=resumen['fecha_mas_antigua'], fecha_mas_reciente=resumen['fecha_mas_reciente'],
+                validos=por_estatus.get('valido', 0), pendientes=por_estatus.get('pendiente', 0),
+                rechazados=por_estatus.get('rechazado', 0)
+            )
+        if stats is None:
+            stats = db.execute(query_stats, {"client_id": client_id}).fetchone()
 
         # Top emisores
         query_top_emisores = text("""
@@ -59,7 +99,9 @@ def get_cfdi_context(db: Session, client_id: str = "COLIMAN001") -> str:
             ORDER BY total DESC
             LIMIT 5
         """)
-        top_emisores = db.execute(query_top_emisores, {"client_id": client_id}).fetchall()
+        top_emisores = _top_rfc(db, client_id, 'emisor', 5)
+        if top_emisores is None:
+            top_emisores = db.execute(query_top_emisores, {"client_id": client_id}).fetchall()
 
         # Resumen por tipo
         query_tipos = text("""
@@ -68,7 +110,11 @@ def get_cfdi_context(db: Session, client_id: str = "COLIMAN001") -> str:
             WHERE client_id = :client_id
             GROUP BY tipo_comprobante
         """)
-        tipos = db.execute(query_tipos, {"client_id": client_id}).fetchall()
+        tipos = _grupos(db, client_id, ['tipo'])
+        if tipos is None:
+            tipos = db.execute(query_tipos, {"client_id": client_id}).fetchall()
+        else:
+            tipos = [SimpleNamespace(tipo_comprobante=g['tipo'], cantidad=g['cantidad'], total=g['total']) for g in tipos]
 
         contexto = f"""
 DATOS DE CFDIs EN EL SISTEMA:
@@ -115,7 +161,17 @@ def procesar_consulta_natural(mensaje: str, db: Session, client_id: str = "COLIM
                 FROM cfdi
                 WHERE client_id = :client_id
             """)
-            result = db.execute(query, {"client_id": client_id}).fetchone()
+            por_tipo = _grupos(db, client_id, ['tipo'])
+            if por_tipo is not None:
+                monto = {g['tipo']: g['total'] for g in por_tipo}
+                result = SimpleNamespace(
+                    total_cfdis=sum(g['cantidad'] for g in por_tipo),
+                    monto_total=round(sum(monto.values()), 2),
+                    ingresos=monto.get('I', 0),
+                    egresos=monto.get('E', 0)
+                )
+            else:
+                result = db.execute(query, {"client_id": client_id}).fetchone()
 
             return {
                 "tipo": "totales",
@@ -146,7 +202,9 @@ def procesar_consulta_natural(mensaje: str, db: Session, client_id: str = "COLIM
                 ORDER BY total DESC
                 LIMIT 10
             """)
-            results = db.execute(query, {"client_id": client_id}).fetchall()
+            results = _top_rfc(db, client_id, 'receptor', 10, tipo='I')
+            if results is None:
+                results = db.execute(query, {"client_id": client_id}).fetchall()
 
             respuesta = "🏆 **Top 10 Clientes por Facturación**\n\n"
             datos = []
@@ -171,7 +229,9 @@ def procesar_consulta_natural(mensaje: str, db: Session, client_id: str = "COLIM
                 ORDER BY total DESC
                 LIMIT 10
             """)
-            results = db.execute(query, {"client_id": client_id}).fetchall()
+            results = _top_rfc(db, client_id, 'emisor', 10)
+            if results is None:
+                results = db.execute(query, {"client_id": client_id}).fetchall()
 
             respuesta = "📦 **Top 10 Proveedores por Facturación**\n\n"
             datos = []
@@ -199,7 +259,11 @@ def procesar_consulta_natural(mensaje: str, db: Session, client_id: str = "COLIM
                 ORDER BY mes DESC
                 LIMIT 12
             """)
-            results = db.execute(query, {"client_id": client_id}).fetchall()
+            meses = _grupos(db, client_id, ['mes'])
+            if meses is not None:
+                results = [SimpleNamespace(mes=g['mes'], cantidad=g['cantidad'], total=g['total']) for g in meses[::-1][:12]]
+            else:
+                results = db.execute(query, {"client_id": client_id}).fetchall()
 
             respuesta = "📅 **Tendencia Mensual de Facturación**\n\n"
             datos = []
@@ -229,7 +293,14 @@ def procesar_consulta_natural(mensaje: str, db: Session, client_id: str = "COLIM
                 FROM cfdi
                 WHERE client_id = :client_id AND estatus_validacion = 'pendiente'
             """)
-            count = db.execute(count_query, {"client_id": client_id}).fetchone()
+            pendientes = _grupos(db, client_id, [], estatus='pendiente')
+            if pendientes is not None:
+                count = SimpleNamespace(
+                    total=sum(g['cantidad'] for g in pendientes),
+                    monto=round(sum(g['total'] for g in pendientes), 2)
+                )
+            else:
+                count = db.execute(count_query, {"client_id": client_id}).fetchone()
 
             respuesta = f"⏳ **CFDIs Pendientes de Validación**\n\n"
             respuesta += f"**Total pendientes:** {count.total} facturas por ${float(count.monto or 0):,.2f}\n\n"
@@ -9,7 +9,8 @@ Referencias:
 - https://satcfdi.readthedocs.io/en/stable/
 """
 
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional, List
@@ -23,14 +24,13 @@ import logging
 from ..db.database import get_db
 from ..core.security import get_current_user
 from ..models.user import User
-from ..api.config import get_fiel_credentials
+from ..services import sat_descarga
+from ..services.sat_descarga import DOWNLOADS_DIR, SatDescargaError, SatFielError
 
 logger = logging.getLogger('sat_descarga_masiva')
 
 router = APIRouter(prefix="/api/sat-descarga-masiva", tags=["sat-descarga-masiva"])
 
-# Directorio para almacenar descargas
-DOWNLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "downloads", "sat_masivo")
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
 # ============================================================================
@@ -45,6 +45,7 @@ class SolicitudDescargaRequest(BaseModel):
     rfc_emisor: Optional[str] = None
     rfc_receptor: Optional[str] = None
     tipo_solicitud: str = "CFDI"  # CFDI o Metadata
+    modo: str = "completa"  # completa o incremental (Metadata primero; solo /sincronizar)
 
 
 class VerificaSolicitudRequest(BaseModel):
@@ -64,47 +65,41 @@ class DescargaPaqueteRequest(BaseModel):
 def get_sat_service():
     """Obtiene el servicio SAT configurado con las credenciales FIEL"""
     try:
-        from satcfdi.models import Signer
-        from satcfdi.pacs.sat import SAT
+        return sat_descarga.crear_servicio_sat()
+    except SatFielError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SatDescargaError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Obtener credenciales FIEL del sistema
-        creds = get_fiel_credentials()
-        if not creds or not creds.get('is_valid'):
-            raise HTTPException(
-                status_code=400,
-                detail="No hay credenciales FIEL configuradas o no son válidas. Por favor configura tu e.firma en Configuración > e.firma (FIEL) SAT"
-            )
-
-        # Cargar certificado y clave
-        with open(creds['cer_path'], 'rb') as f:
-            cer_data = f.read()
-
-        with open(creds['key_path'], 'rb') as f:
-            key_data = f.read()
-
-        # Crear el signer
-        signer = Signer.load(
-            certificate=cer_data,
-            key=key_data,
-            password=creds['password']
-        )
-
-        # Crear instancia del servicio SAT
-        sat_service = SAT(signer=signer)
 
-        return sat_service, signer
-
-    except ImportError:
-        raise HTTPException(
-            status_code=500,
-            detail="La librería satcfdi no está instalada. Por favor ejecuta: pip install satcfdi"
-        )
-    except Exception as e:
-        logger.error(f"Error al configurar servicio SAT: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al configurar servicio SAT: {str(e)}"
-        )
+def sincronizar_si_excede(db: Session, current_user: User, request: SolicitudDescargaRequest,
+                          tipo: str, fecha_inicio: datetime, fecha_fin: datetime) -> Optional[dict]:
+    """
+    Si el periodo no cabe en una sola solicitud al SAT (tope de CFDIs o de
+    días), lo registra como sincronización dividida en ventanas para el
+    scheduler en lugar de enviarlo. None si cabe en una solicitud.
+    """
+    ventanas = sat_descarga.planear_ventanas(
+        db, current_user.client_id, request.tipo_solicitud, fecha_inicio.date(), fecha_fin.date()
+    )
+    if len(ventanas) == 1:
+        return None
+
+    solicitud_id = sat_descarga.crear_solicitud(
+        db, current_user.client_id, current_user.id, tipo, fecha_inicio.date(), fecha_fin.date(),
+        request.tipo_solicitud, request.rfc_emisor, request.rfc_receptor
+    )
+    logger.info(f"Periodo {request.fecha_inicio} a {request.fecha_fin} dividido en {len(ventanas)} ventanas (sincronización {solicitud_id})")
+    return {
+        "success": True,
+        "mensaje": f"El periodo excede el tope por solicitud del SAT; se dividió en {len(ventanas)} solicitudes que se procesarán en segundo plano",
+        "solicitud_id": None,
+        "sincronizacion": sat_descarga.get_solicitud(db, solicitud_id, current_user.client_id),
+        "fecha_inicio": request.fecha_inicio,
+        "fecha_fin": request.fecha_fin,
+        "tipo": tipo
+    }
 
 
 # ============================================================================
@@ -134,15 +129,20 @@ async def solicitar_descarga_emitidos(
         fecha_inicio = datetime.strptime(request.fecha_inicio, "%Y-%m-%d")
         fecha_fin = datetime.strptime(request.fecha_fin, "%Y-%m-%d")
 
+        # Periodos sobre el tope del SAT se dividen y van al scheduler
+        dividida = sincronizar_si_excede(db, current_user, request, "emitidos", fecha_inicio, fecha_fin)
+        if dividida:
+            return dividida
+
         # Solicitar descarga de emitidos
         response = sat_service.recover_comprobante_emitted_request(
             fecha_inicial=fecha_inicio.date(),
             fecha_final=fecha_fin.date(),
-            rfc_receptor=request.rfc_receptor or signer.rfc,
+            rfc_receptor=request.rfc_receptor or None,
             tipo_solicitud=TipoDescargaMasivaTerceros.CFDI if request.tipo_solicitud == "CFDI" else TipoDescargaMasivaTerceros.METADATA
         )
 
-        solicitud_id = response.id_solicitud
+        solicitud_id = response.get('IdSolicitud')
 
         logger.info(f"Solicitud de emitidos creada exitosamente: {solicitud_id}")
 
@@ -150,7 +150,7 @@ async def solicitar_descarga_emitidos(
             "success": True,
             "mensaje": "Solicitud de descarga de CFDIs emitidos creada exitosamente",
             "solicitud_id": solicitud_id,
-            "codigo_estado": response.codigo_estado_solicitud,
+            "codigo_estado": response.get('CodEstatus'),
             "fecha_inicio": request.fecha_inicio,
             "fecha_fin": request.fecha_fin,
             "tipo": "emitidos"
@@ -187,6 +187,11 @@ async def solicitar_descarga_recibidos(
         fecha_inicio = datetime.strptime(request.fecha_inicio, "%Y-%m-%d")
         fecha_fin = datetime.strptime(request.fecha_fin, "%Y-%m-%d")
 
+        # Periodos sobre el tope del SAT se dividen y van al scheduler
+        dividida = sincronizar_si_excede(db, current_user, request, "recibidos", fecha_inicio, fecha_fin)
+        if dividida:
+            return dividida
+
         # Solicitar descarga de recibidos
         response = sat_service.recover_comprobante_received_request(
             fecha_inicial=fecha_inicio.date(),
@@ -195,7 +200,7 @@ async def solicitar_descarga_recibidos(
             tipo_solicitud=TipoDescargaMasivaTerceros.CFDI if request.tipo_solicitud == "CFDI" else TipoDescargaMasivaTerceros.METADATA
         )
 
-        solicitud_id = response.id_solicitud
+        solicitud_id = response.get('IdSolicitud')
 
         logger.info(f"Solicitud de recibidos creada exitosamente: {solicitud_id}")
 
@@ -203,7 +208,7 @@ async def solicitar_descarga_recibidos(
             "success": True,
             "mensaje": "Solicitud de descarga de CFDIs recibidos creada exitosamente",
             "solicitud_id": solicitud_id,
-            "codigo_estado": response.codigo_estado_solicitud,
+            "codigo_estado": response.get('CodEstatus'),
             "fecha_inicio": request.fecha_inicio,
             "fecha_fin": request.fecha_fin,
             "tipo": "recibidos"
@@ -254,13 +259,13 @@ async def verificar_solicitud(
             6: "Vencida"
         }
 
-        estado_codigo = response.estado_solicitud
+        estado_codigo = response.get('EstadoSolicitud')
         estado_texto = estado_map.get(estado_codigo, f"Desconocido ({estado_codigo})")
 
         # Obtener IDs de paquetes si está terminada
         paquetes = []
         if estado_codigo == 3:  # Terminada
-            paquetes = response.paquetes
+            paquetes = response.get('IdsPaquetes', [])
 
         logger.info(f"Estado de solicitud {request.solicitud_id}: {estado_texto}")
 
@@ -269,10 +274,10 @@ async def verificar_solicitud(
             "solicitud_id": request.solicitud_id,
             "estado_codigo": estado_codigo,
             "estado_texto": estado_texto,
-            "codigo_estado_solicitud": response.codigo_estado_solicitud,
-            "numero_cfdis": response.numero_cfdis if hasattr(response, 'numero_cfdis') else 0,
+            "codigo_estado_solicitud": response.get('CodigoEstadoSolicitud'),
+            "numero_cfdis": response.get('NumeroCFDIs', 0),
             "paquetes": paquetes,
-            "mensaje": response.mensaje if hasattr(response, 'mensaje') else ""
+            "mensaje": response.get('Mensaje', "")
         }
 
     except Exception as e:
@@ -299,11 +304,13 @@ async def descargar_paquete(
 
         sat_service, signer = get_sat_service()
 
-        # Descargar paquete
-        response = sat_service.recover_comprobante_download(id_paquete=request.paquete_id)
-
-        # El paquete viene en base64
-        paquete_data = response.paquete
+        # Descargar paquete (encabezado del SAT y contenido en base64)
+        header, paquete_data = sat_service.recover_comprobante_download(id_paquete=request.paquete_id)
+        if header.get('CodEstatus') != sat_descarga.CODIGO_ACEPTADA or not paquete_data:
+            raise HTTPException(
+                status_code=502,
+                detail=f"El SAT no entregó el paquete (código {header.get('CodEstatus')}): {header.get('Mensaje', '')}"
+            )
 
         # Decodificar base64
         zip_data = base64.b64decode(paquete_data)
@@ -336,6 +343,8 @@ async def descargar_paquete(
             "archivos": archivos_extraidos[:10]  # Primeros 10 archivos
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error al descargar paquete: {str(e)}")
         raise HTTPException(
@@ -352,7 +361,8 @@ async def procesar_descarga_completa(
     db: Session = Depends(get_db)
 ):
     """
-    Procesa una descarga completa: verifica estado, descarga todos los paquetes y procesa XMLs
+    Procesa una descarga completa: verifica estado, descarga todos los paquetes
+    (en paralelo) y registra sus CFDIs en la base de datos
     """
     try:
         logger.info(f"Procesando descarga completa para solicitud: {solicitud_id}")
@@ -362,42 +372,32 @@ async def procesar_descarga_completa(
         # 1. Verificar estado
         status_response = sat_service.recover_comprobante_status(solicitud_id)
 
-        if status_response.estado_solicitud != 3:
+        if status_response.get('EstadoSolicitud') != 3:
             return {
                 "success": False,
                 "mensaje": "La solicitud aún no está terminada. Por favor espera a que el SAT procese la solicitud.",
-                "estado": status_response.estado_solicitud
+                "estado": status_response.get('EstadoSolicitud')
             }
 
-        paquetes = status_response.paquetes
-
-        # 2. Descargar todos los paquetes
-        archivos_totales = []
-        for paquete_id in paquetes:
-            try:
-                response = sat_service.recover_comprobante_download(id_paquete=paquete_id)
-                zip_data = base64.b64decode(response.paquete)
-
-                # Extraer
-                extract_dir = os.path.join(DOWNLOADS_DIR, solicitud_id, paquete_id)
-                os.makedirs(extract_dir, exist_ok=True)
-
-                with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                    archivos_totales.extend([os.path.join(extract_dir, name) for name in zip_ref.namelist()])
+        paquetes = status_response.get('IdsPaquetes', [])
 
-            except Exception as e:
-                logger.error(f"Error descargando paquete {paquete_id}: {str(e)}")
+        # 2. Descargar los paquetes en paralelo y registrar sus CFDIs conforme llegan
+        resultado = await run_in_threadpool(
+            sat_descarga.ingerir_paquetes, db, current_user.client_id, sat_service, paquetes
+        )
 
-        logger.info(f"Descarga completa: {len(archivos_totales)} archivos descargados")
+        logger.info(
+            f"Descarga completa: {resultado['archivos_procesados']} archivos, "
+            f"{resultado['insertados']} CFDIs nuevos, {resultado['duplicados']} duplicados"
+        )
 
         return {
             "success": True,
             "mensaje": "Descarga completa procesada exitosamente",
             "solicitud_id": solicitud_id,
-            "paquetes_procesados": len(paquetes),
-            "archivos_descargados": len(archivos_totales),
-            "directorio": os.path.join(DOWNLOADS_DIR, solicitud_id)
+            "paquetes_procesados": len(paquetes) - len(resultado['paquetes_con_error']),
+            "archivos_descargados": resultado['archivos_procesados'],
+            **resultado
         }
 
     except Exception as e:
@@ -408,6 +408,76 @@ async def procesar_descarga_completa(
         )
 
 
+@router.post("/sincronizar")
+async def sincronizar(
+    request: SolicitudDescargaRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Registra una descarga masiva desatendida
+
+    El scheduler del backend envía la solicitud al SAT, verifica su estado
+    con backoff, descarga los paquetes en cuanto están listos y registra sus
+    CFDIs. El avance se consulta en GET /solicitudes/{id}.
+
+    modo=incremental pide primero la Metadata del periodo, actualiza los
+    cancelados y descarga XML solo de los días con CFDIs que no están
+    registrados (para sincronizaciones frecuentes).
+    """
+    if request.tipo_descarga not in sat_descarga.TIPOS:
+        raise HTTPException(status_code=400, detail="tipo_descarga debe ser 'emitidos' o 'recibidos'")
+    if request.tipo_solicitud not in sat_descarga.TIPOS_SOLICITUD:
+        raise HTTPException(status_code=400, detail="tipo_solicitud debe ser 'CFDI' o 'Metadata'")
+    if request.modo not in sat_descarga.MODOS:
+        raise HTTPException(status_code=400, detail="modo debe ser 'completa' o 'incremental'")
+    if request.modo == sat_descarga.MODO_INCREMENTAL and request.tipo_solicitud != 'CFDI':
+        raise HTTPException(status_code=400, detail="El modo incremental descarga CFDI (tipo_solicitud='CFDI')")
+    try:
+        fecha_inicio = datetime.strptime(request.fecha_inicio, "%Y-%m-%d").date()
+        fecha_fin = datetime.strptime(request.fecha_fin, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido (usar YYYY-MM-DD)")
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=400, detail="fecha_inicio debe ser anterior o igual a fecha_fin")
+
+    solicitud_id = sat_descarga.crear_solicitud(
+        db, current_user.client_id, current_user.id, request.tipo_descarga,
+        fecha_inicio, fecha_fin, request.tipo_solicitud, request.rfc_emisor, request.rfc_receptor,
+        modo=request.modo
+    )
+    logger.info(f"Sincronización {solicitud_id} registrada: {request.tipo_descarga} {request.modo} {request.fecha_inicio} a {request.fecha_fin}")
+
+    return {
+        "success": True,
+        "mensaje": "Descarga registrada; se procesará en segundo plano",
+        "solicitud": sat_descarga.get_solicitud(db, solicitud_id, current_user.client_id)
+    }
+
+
+@router.get("/solicitudes")
+async def listar_solicitudes(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Descargas masivas registradas por el cliente, las más recientes primero"""
+    return {"solicitudes": sat_descarga.list_solicitudes(db, current_user.client_id, limit)}
+
+
+@router.get("/solicitudes/{solicitud_id}")
+async def obtener_solicitud(
+    solicitud_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Estado y avance de una descarga masiva"""
+    solicitud = sat_descarga.get_solicitud(db, solicitud_id, current_user.client_id)
+    if not solicitud:
+        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    return solicitud
+
+
 @router.get("/info")
 async def info_descarga_masiva():
     """
@@ -425,20 +495,23 @@ async def info_descarga_masiva():
         ],
         "flujo": [
             "1. Configura tu e.firma en Configuración > e.firma (FIEL) SAT",
-            "2. Solicita descarga de emitidos o recibidos con rango de fechas",
-            "3. Verifica estado de la solicitud (puede tardar minutos)",
-            "4. Descarga paquetes cuando estén listos",
-            "5. Los XMLs se extraen automáticamente"
+            "2. Registra la descarga con POST /sincronizar (emitidos o recibidos, rango de fechas)",
+            "3. El backend verifica la solicitud en el SAT hasta que termine (puede tardar minutos u horas)",
+            "4. Los paquetes se descargan y sus CFDIs se registran automáticamente",
+            "5. Consulta el avance en GET /solicitudes"
         ],
         "endpoints": [
             "POST /solicitar-emitidos - Solicita CFDIs que emitiste (ventas)",
             "POST /solicitar-recibidos - Solicita CFDIs que recibiste (compras)",
             "POST /verificar - Verifica estado de solicitud",
             "POST /descargar-paquete - Descarga un paquete específico",
-            "POST /procesar-descarga-completa - Descarga y procesa todo automáticamente"
+            "POST /procesar-descarga-completa - Descarga y procesa todo automáticamente",
+            "POST /sincronizar - Solicita, verifica, descarga e ingiere en segundo plano (modo=incremental: Metadata primero y XML solo de lo faltante)",
+            "GET /solicitudes - Descargas registradas y su avance"
         ],
         "limitaciones": [
             "Máximo 5 años fiscales + año actual",
+            "Tope de CFDIs por solicitud del SAT: los periodos que lo exceden se dividen en ventanas automáticamente",
             "Procesamiento asíncrono (puede tardar minutos u horas según volumen)",
             "Requiere FIEL vigente y configurada"
         ]
@@ -0,0 +1,65 @@
+"""
+API de búsqueda de CFDIs por nombre, RFC, UUID, folio o concepto
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+import logging
+import time
+
+from app.db.database import get_db
+from app.core.security import get_current_user
+from app.models.user import User
+from app.services import cfdi_search
+
+logger = logging.getLogger('search')
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+
+@router.get("")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Texto, RFC, UUID o folio"),
+    limit: int = Query(20, ge=1, le=cfdi_search.LIMITE_MAXIMO),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Busca CFDIs del cliente
+
+    - UUID (completo, o los primeros 8+ caracteres con guion): búsqueda por prefijo
+    - RFC (completo o parcial con dígitos): emisor o receptor, exactos primero
+    - Folio (número, serie-folio como "A-12345" o término de 1-2 caracteres):
+      folio exacto, los de la serie indicada primero
+    - Texto: nombres, serie/folio y conceptos; todas las palabras, por
+      prefijo, ordenadas por relevancia. Palabras de menos de 3 letras se ignoran
+    """
+    inicio = time.perf_counter()
+    try:
+        modo, rows = cfdi_search.search_cfdis(db, current_user.client_id, q, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "query": q,
+        "modo": modo,
+        "data": [
+            {
+                "id": row.id,
+                "uuid": row.uuid,
+                "fecha": str(row.fecha) if row.fecha else None,
+                "tipo_comprobante": row.tipo_comprobante,
+                "serie": row.serie,
+                "folio": row.folio,
+                "emisor_rfc": row.emisor_rfc,
+                "emisor_nombre": row.emisor_nombre,
+                "receptor_rfc": row.receptor_rfc,
+                "receptor_nombre": row.receptor_nombre,
+                "total": float(row.total) if row.total else 0,
+                "moneda": row.moneda,
+                "estatus_validacion": row.estatus_validacion,
+                "relevancia": round(float(row.relevancia), 4)
+            }
+            for row in rows
+        ],
+        "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 1)
+    }
@@ -41,6 +41,61 @@ class Settings(BaseSettings):
     UPLOAD_FOLDER: str = "uploads"
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
 
+    # Ingesta de CFDIs
+    CFDI_BATCH_SIZE: int = 500  # CFDIs por lote (una transacción por lote)
+    CFDI_PARSE_WORKERS: int = 0  # Procesos del pool de parseo (0 = núcleos disponibles)
+    CFDI_PARSE_PARALLEL_MIN: int = 200  # Debajo de este número de XMLs se parsea en un solo núcleo
+    CFDI_PARSER_ENGINE: str = "lxml"  # lxml (una sola pasada) o etree (ElementTree)
+
+    # Jobs en segundo plano (tabla cfdi_jobs)
+    CFDI_JOB_WORKERS: int = 1  # Hilos que procesan la cola por proceso (0 = no procesar jobs aquí)
+    CFDI_JOB_POLL_SECONDS: float = 2.0  # Espera entre consultas a la cola cuando está vacía
+    CFDI_JOB_STALE_MINUTES: int = 10  # Jobs 'procesando' sin avance en este tiempo se reencolan
+
+    # Servicio de consulta de CFDI del SAT
+    SAT_CONSULTA_URL: str = "https://consultaqr.facturaelectronica.sat.gob.mx/ConsultaCFDIService.svc"
+    SAT_CONSULTA_TIMEOUT: float = 30.0  # Segundos por intento
+    SAT_CONSULTA_MAX_CONCURRENCIA: int = 10  # Consultas simultáneas (y conexiones) hacia el SAT
+    SAT_CONSULTA_REINTENTOS: int = 2  # Reintentos ante timeout, error de red o 5xx
+    SAT_CONSULTA_BACKOFF_BASE: float = 0.5  # Segundos base del backoff exponencial
+    SAT_CB_FALLAS: int = 5  # Consultas fallidas seguidas que abren el circuit breaker
+    SAT_CB_SEGUNDOS_ABIERTO: float = 30.0  # Tiempo con el circuito abierto antes de probar de nuevo
+    SAT_VALIDACION_LOTE_CONCURRENCIA: int = 5  # Consultas simultáneas de una validación por lote (máximo: SAT_CONSULTA_MAX_CONCURRENCIA)
+    SAT_VALIDACION_LOTE_PAGINA: int = 200  # CFDIs por página (un UPDATE masivo por página)
+
+    # Descarga masiva del SAT en segundo plano (tabla sat_download_requests)
+    SAT_DESCARGA_WORKERS: int = 1  # Hilos del scheduler por proceso (0 = no procesar solicitudes aquí)
+    SAT_DESCARGA_POLL_SECONDS: float = 5.0  # Espera entre consultas a la tabla cuando no hay pasos pendientes
+    SAT_DESCARGA_VERIFICAR_INICIAL_SEGUNDOS: int = 60  # Primera verificación tras enviar la solicitud o cambiar de estado
+    SAT_DESCARGA_VERIFICAR_MAX_SEGUNDOS: int = 1800  # Tope del backoff entre verificaciones
+    SAT_DESCARGA_VERIFICAR_FACTOR: float = 1.5  # Crecimiento del intervalo mientras el SAT no cambia de estado
+    SAT_DESCARGA_MAX_ERRORES: int = 5  # Errores seguidos con el SAT antes de marcar la solicitud como error
+    SAT_DESCARGA_LEASE_MINUTOS: int = 15  # Una solicitud tomada por un worker sin avance en este tiempo se retoma
+    SAT_DESCARGA_VENTANA_MAX_DIAS: int = 31  # Días máximos por solicitud al planear periodos largos (0 = sin límite)
+    SAT_DESCARGA_MAX_SOLICITUDES_ACTIVAS: int = 10  # Solicitudes enviadas al SAT sin terminar, como máximo
+    SAT_DESCARGA_CONCURRENCIA: int = 4  # Paquetes descargándose a la vez (y máximo en espera de ingesta)
+    SAT_DESCARGA_SPOOL_MB: int = 16  # Paquete decodificado en memoria hasta este tamaño; arriba, en archivo temporal
+
+    # Caché de resultados de validación SAT (vigencia por estado)
+    SAT_CACHE_TTL_CANCELADO_HORAS: int = 24 * 365  # Cancelado es definitivo
+    SAT_CACHE_TTL_VIGENTE_HORAS: int = 12  # Vigente puede cancelarse después
+    SAT_CACHE_TTL_OTROS_HORAS: int = 1  # No Encontrado (delay de publicación del SAT) y otros
+    SAT_CACHE_LRU_SIZE: int = 20000  # Entradas en memoria por proceso
+
+    # Caché de KPIs y reportes (se invalida al ingerir o validar CFDIs del cliente)
+    REPORT_CACHE_TTL_SECONDS: int = 300  # Vigencia máxima de un resultado (0 = sin caché)
+    REPORT_CACHE_MAX_ENTRIES: int = 2000  # Entradas en memoria por proceso
+
+    # Snapshot columnar de CFDIs en memoria para analítica (requiere numpy)
+    ANALYTICS_SNAPSHOT_MAX_CLIENTS: int = 20  # Clientes con snapshot en memoria por proceso (~32 bytes por CFDI)
+    ANALYTICS_SNAPSHOT_TTL_SECONDS: int = 3600  # Recarga completa periódica (recoge borrados)
+    # Margen al leer cambios por updated_at (transacciones que confirman tarde).
+    # Un cambio de estatus cuya transacción confirme más de este margen después
+    # de su updated_at no llega al snapshot hasta la siguiente recarga completa
+    # (a lo más ANALYTICS_SNAPSHOT_TTL_SECONDS); las altas y bajas sí se
+    # detectan porque el conteo deja de coincidir con cfdi_daily_rollup.
+    ANALYTICS_SNAPSHOT_OVERLAP_SECONDS: int = 300
+
     class Config:
         env_file = ".env"
         case_sensitive = True
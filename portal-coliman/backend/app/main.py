@@ -3,9 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.core.config import settings
 from app.db.database import engine, Base, get_db
-from app.api import auth, cfdis, sat_descarga_masiva, config, kpis, users, constancia_fiscal, ai_config, reports, catalogs
+from app.api import auth, cfdis, sat_descarga_masiva, config, kpis, users, constancia_fiscal, ai_config, reports, catalogs, search
 from app.models import user, constancia_fiscal as constancia_model, ai_config as ai_model, app_config as app_config_model  # Importar modelos
+from app.services.cfdi_parse_pool import shutdown_parse_pool
+from app.services.cfdi_jobs import start_job_workers, stop_job_workers
+from app.services.sat_descarga import start_descarga_scheduler, stop_descarga_scheduler
+from app.services.sat_consulta import bind_event_loop, close_sat_consulta_client
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 # Configurar logging
@@ -25,9 +30,18 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Error al crear tablas: {e}")
 
+    logger.info("⚙️ Iniciando workers de jobs de CFDIs...")
+    bind_event_loop(asyncio.get_running_loop())
+    start_job_workers()
+    start_descarga_scheduler()
+
     yield
 
     logger.info("👋 Cerrando aplicación...")
+    stop_job_workers()
+    stop_descarga_scheduler()
+    shutdown_parse_pool()
+    await close_sat_consulta_client()
 
 # Crear aplicación FastAPI
 app = FastAPI(
@@ -57,6 +71,7 @@ app.include_router(constancia_fiscal.router)
 app.include_router(ai_config.router)
 app.include_router(reports.router)
 app.include_router(catalogs.router)
+app.include_router(search.router)
 
 # Ruta raíz
 @app.get("/")
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción de CFDIs desde archivos comprimidos (ZIP, RAR y 7Z)
+
+Los miembros se leen directamente del archivo recibido, sin extraer a un
+directorio temporal, y se entregan por pares XML/PDF uno a la vez: la memoria
+usada depende del tamaño de un par, no del tamaño del archivo comprimido.
+"""
+import io
+import logging
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterator, List, Union
+try:
+    import rarfile
+except ImportError:
+    rarfile = None
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+
+logger = logging.getLogger('cfdi_operations')
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.7z')
+
+# Pares leídos por cada pasada de py7zr.read(): en archivos 7z sólidos cada
+# pasada descomprime desde el inicio del bloque, así que no conviene que sea 1
+SEVEN_ZIP_BATCH = 64
+
+
+def is_compressed_filename(filename: str) -> bool:
+    """Indica si el nombre corresponde a un archivo comprimido soportado"""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _basename(member_name: str) -> str:
+    return PurePosixPath(member_name.replace('\\', '/')).name
+
+
+def _index_pairs(member_names: List[str]) -> List[dict]:
+    """
+    Agrupa los miembros XML/PDF por nombre base (UUID) a partir del índice
+    del archivo, sin leer su contenido. Solo se retornan grupos con XML.
+    """
+    files_by_base = {}
+    for name in member_names:
+        name_lower = name.lower()
+        if name_lower.endswith('.xml'):
+            kind = 'xml'
+        elif name_lower.endswith('.pdf'):
+            kind = 'pdf'
+        else:
+            continue
+
+        base_name = PurePosixPath(name.replace('\\', '/')).stem
+        if base_name not in files_by_base:
+            files_by_base[base_name] = {'xml': None, 'pdf': None}
+        files_by_base[base_name][kind] = name
+
+    return [files for files in files_by_base.values() if files['xml']]
+
+
+def _iter_members(pairs: List[dict], read_member: Callable[[str], bytes]) -> Iterator[dict]:
+    for files in pairs:
+        pdf_name = files['pdf']
+        yield {
+            'xml': (_basename(files['xml']), read_member(files['xml'])),
+            'pdf': (_basename(pdf_name), read_member(pdf_name)) if pdf_name else None
+        }
+
+
+def _iter_zip(fileobj: BinaryIO) -> Iterator[dict]:
+    with zipfile.ZipFile(fileobj, 'r') as zip_ref:
+        names = [info.filename for info in zip_ref.infolist() if not info.is_dir()]
+        yield from _iter_members(_index_pairs(names), zip_ref.read)
+
+
+def _iter_rar(fileobj: BinaryIO) -> Iterator[dict]:
+    with rarfile.RarFile(fileobj, 'r') as rar_ref:
+        names = [info.filename for info in rar_ref.infolist() if not info.isdir()]
+        yield from _iter_members(_index_pairs(names), rar_ref.read)
+
+
+def _iter_7z(fileobj: BinaryIO) -> Iterator[dict]:
+    with py7zr.SevenZipFile(fileobj, mode='r') as z:
+        names = [info.filename for info in z.list() if not info.is_directory]
+        pairs = _index_pairs(names)
+
+        for start in range(0, len(pairs), SEVEN_ZIP_BATCH):
+            batch = pairs[start:start + SEVEN_ZIP_BATCH]
+            targets = [name for files in batch for name in (files['xml'], files['pdf']) if name]
+            contents = z.read(targets=targets)
+            z.reset()
+            yield from _iter_members(batch, lambda name: contents[name].read())
+
+
+def extract_compressed_file(source: Union[bytes, BinaryIO], filename: str) -> Iterator[dict]:
+    """
+    Itera los pares XML/PDF de un archivo ZIP, RAR o 7Z.
+
+    `source` puede ser el contenido en bytes o un archivo con seek (por
+    ejemplo `UploadFile.file`). Cada elemento es
+    {'xml': (nombre, bytes), 'pdf': (nombre, bytes) | None}.
+    """
+    fileobj = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    filename_lower = filename.lower()
+
+    if filename_lower.endswith('.zip'):
+        iterator = _iter_zip(fileobj)
+    elif filename_lower.endswith('.rar') and rarfile:
+        iterator = _iter_rar(fileobj)
+    elif filename_lower.endswith('.7z') and py7zr:
+        iterator = _iter_7z(fileobj)
+    else:
+        return
+
+    try:
+        yield from iterator
+    except Exception as e:
+        logger.error(f"Error extracting {filename}: {str(e)}")
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Detalle de CFDIs (encabezado y conceptos) por lote
+
+Los encabezados se leen con una consulta `IN` y los conceptos de todos ellos
+con otra: cargar N CFDIs cuesta dos viajes a la base, no 2N. El detalle de
+un solo CFDI (GET /api/cfdis/{id}) usa las mismas funciones.
+"""
+import json
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+
+MAX_POR_LOTE = 1000
+# CFDIs por par de consultas al entregar NDJSON: la respuesta empieza a
+# salir antes de leer el lote completo
+BLOQUE_NDJSON = 250
+
+COLUMNAS = """
+    id, uuid, fecha, tipo_comprobante, serie, folio,
+    emisor_rfc, emisor_nombre, emisor_regimen,
+    receptor_rfc, receptor_nombre, receptor_uso_cfdi,
+    subtotal, descuento, total, moneda, tipo_cambio,
+    total_impuestos_trasladados, total_impuestos_retenidos,
+    metodo_pago, forma_pago,
+    xml_path, estatus_validacion, created_at
+"""
+
+ENCABEZADOS_POR_ID_SQL = text(f"""
+    SELECT {COLUMNAS}
+    FROM cfdi
+    WHERE client_id = :client_id AND id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+ENCABEZADOS_POR_UUID_SQL = text(f"""
+    SELECT {COLUMNAS}
+    FROM cfdi
+    WHERE client_id = :client_id AND uuid IN :uuids
+""").bindparams(bindparam("uuids", expanding=True))
+
+CONCEPTOS_SQL = text("""
+    SELECT
+        cfdi_id, clave_prod_serv, cantidad, clave_unidad,
+        descripcion, valor_unitario, importe, descuento
+    FROM cfdi_conceptos
+    WHERE cfdi_id IN :ids
+    ORDER BY cfdi_id, id
+""").bindparams(bindparam("ids", expanding=True))
+
+
+def _float(valor, omision: float = 0) -> float:
+    return float(valor) if valor else omision
+
+
+def serialize_header(row) -> dict:
+    return {
+        'id': row.id,
+        'uuid': row.uuid,
+        'fecha': row.fecha,
+        'tipo_comprobante': row.tipo_comprobante,
+        'serie': row.serie,
+        'folio': row.folio,
+        'emisor_rfc': row.emisor_rfc,
+        'emisor_nombre': row.emisor_nombre,
+        'emisor_regimen': row.emisor_regimen,
+        'receptor_rfc': row.receptor_rfc,
+        'receptor_nombre': row.receptor_nombre,
+        'receptor_uso_cfdi': row.receptor_uso_cfdi,
+        'subtotal': _float(row.subtotal),
+        'descuento': _float(row.descuento),
+        'total': _float(row.total),
+        'moneda': row.moneda,
+        'tipo_cambio': _float(row.tipo_cambio, 1),
+        'total_impuestos_trasladados': _float(row.total_impuestos_trasladados),
+        'total_impuestos_retenidos': _float(row.total_impuestos_retenidos),
+        'metodo_pago': row.metodo_pago,
+        'forma_pago': row.forma_pago,
+        'xml_path': row.xml_path,
+        'estatus_validacion': row.estatus_validacion,
+        'created_at': row.created_at,
+        'conceptos': []
+    }
+
+
+def serialize_concepto(row) -> dict:
+    return {
+        'clave_prod_serv': row.clave_prod_serv,
+        'cantidad': _float(row.cantidad),
+        'clave_unidad': row.clave_unidad,
+        'descripcion': row.descripcion,
+        'valor_unitario': _float(row.valor_unitario),
+        'importe': _float(row.importe),
+        'descuento': _float(row.descuento),
+    }
+
+
+def load_cfdis(db: Session, client_id: str, ids: List[int] = (), uuids: List[str] = ()) -> Tuple[List[dict], dict]:
+    """
+    Carga encabezados y conceptos de los CFDIs del cliente.
+
+    Retorna (cfdis, no_encontrados): los CFDIs en el orden pedido (primero
+    los ids y después los UUIDs, sin repetir) y {'ids': [...], 'uuids': [...]}
+    con lo que no existe o es de otro cliente.
+    """
+    rows = []
+    if ids:
+        rows += db.execute(ENCABEZADOS_POR_ID_SQL, {"client_id": client_id, "ids": list(ids)}).fetchall()
+    if uuids:
+        rows += db.execute(ENCABEZADOS_POR_UUID_SQL, {"client_id": client_id, "uuids": list(uuids)}).fetchall()
+
+    por_id = {row.id: serialize_header(row) for row in rows}
+    if por_id:
+        for row in db.execute(CONCEPTOS_SQL, {"ids": list(por_id)}):
+            por_id[row.cfdi_id]['conceptos'].append(serialize_concepto(row))
+
+    por_uuid = {cfdi['uuid'].upper(): cfdi for cfdi in por_id.values()}
+    cfdis, vistos = [], set()
+    no_encontrados = {'ids': [], 'uuids': []}
+    for clave, indice, lista in [(i, por_id, 'ids') for i in ids] + [(u.upper(), por_uuid, 'uuids') for u in uuids]:
+        cfdi = indice.get(clave)
+        if cfdi is None:
+            no_encontrados[lista].append(clave)
+        elif cfdi['id'] not in vistos:
+            vistos.add(cfdi['id'])
+            cfdis.append(cfdi)
+    return cfdis, no_encontrados
+
+
+def load_cfdi(db: Session, client_id: str, cfdi_id: int) -> Optional[dict]:
+    cfdis, _ = load_cfdis(db, client_id, ids=[cfdi_id])
+    return cfdis[0] if cfdis else None
+
+
+def stream_ndjson(client_id: str, ids: List[int], uuids: List[str]) -> Iterator[bytes]:
+    """
+    Una línea JSON por CFDI, por bloques de BLOQUE_NDJSON. Lo que no se
+    encontró sale como {"id"|"uuid": ..., "error": "no encontrado"}.
+    Usa una sesión propia: la respuesta sigue enviándose después de que
+    termina el endpoint.
+    """
+    pedidos = [('ids', i) for i in ids] + [('uuids', u) for u in uuids]
+    enviados = set()
+    db = SessionLocal()
+    try:
+        for inicio in range(0, len(pedidos), BLOQUE_NDJSON):
+            bloque = pedidos[inicio:inicio + BLOQUE_NDJSON]
+            cfdis, no_encontrados = load_cfdis(
+                db, client_id,
+                ids=[v for lista, v in bloque if lista == 'ids'],
+                uuids=[v for lista, v in bloque if lista == 'uuids']
+            )
+            # Un CFDI pedido por id y por UUID en bloques distintos sale una vez
+            lineas = [jsonable_encoder(cfdi) for cfdi in cfdis if cfdi['id'] not in enviados]
+            enviados.update(cfdi['id'] for cfdi in cfdis)
+            lineas += [{'id': v, 'error': 'no encontrado'} for v in no_encontrados['ids']]
+            lineas += [{'uuid': v, 'error': 'no encontrado'} for v in no_encontrados['uuids']]
+            yield ''.join(json.dumps(linea, ensure_ascii=False) + '\n' for linea in lineas).encode('utf-8')
+    finally:
+        db.close()
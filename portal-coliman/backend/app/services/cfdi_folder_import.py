@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Importación incremental de CFDIs desde una carpeta
+
+Cada XML procesado queda registrado en `cfdi_import_manifest` con su tamaño,
+mtime y sha256. En una nueva importación los archivos sin cambios se omiten
+con una sola llamada a stat (sin leerlos ni parsearlos), y los archivos con
+contenido ya conocido (mismo sha256 en otra ruta) se marcan como duplicados
+sin parsear.
+
+El manifiesto se escribe después de registrar cada lote, así que una
+importación interrumpida se retoma desde el último lote completo.
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.cfdi_ingestion import CfdiBatchWriter
+from app.services.cfdi_storage import save_xml_and_pdf
+
+logger = logging.getLogger('cfdi_operations')
+
+ESTADO_IMPORTADO = 'importado'
+ESTADO_DUPLICADO = 'duplicado'
+ESTADO_ERROR = 'error'
+
+SELECT_MANIFEST_SQL = text("""
+    SELECT path, size, mtime_ns, sha256, uuid, estado
+    FROM cfdi_import_manifest
+    WHERE client_id = :client_id
+""")
+
+UPSERT_MANIFEST_SQL = text("""
+    INSERT INTO cfdi_import_manifest (
+        client_id, path, size, mtime_ns, sha256, uuid, estado, mensaje
+    ) VALUES (
+        :client_id, :path, :size, :mtime_ns, :sha256, :uuid, :estado, :mensaje
+    )
+    ON DUPLICATE KEY UPDATE
+        size = VALUES(size), mtime_ns = VALUES(mtime_ns), sha256 = VALUES(sha256),
+        uuid = VALUES(uuid), estado = VALUES(estado), mensaje = VALUES(mensaje)
+""")
+
+
+def iter_xml_files(folder: Path) -> Iterator[Tuple[str, os.DirEntry]]:
+    """Recorre la carpeta y sus subcarpetas (YYYY/MM/DD); retorna (ruta relativa, entry)"""
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.lower().endswith('.xml') and entry.is_file():
+                    yield Path(entry.path).relative_to(folder).as_posix(), entry
+
+
+def _find_pdf(xml_path: Path) -> Optional[Path]:
+    for suffix in ('.pdf', '.PDF'):
+        pdf_path = xml_path.with_suffix(suffix)
+        if pdf_path.exists():
+            return pdf_path
+    return None
+
+
+class FolderImport:
+    """Importación de una carpeta para un cliente, con manifiesto persistente"""
+
+    def __init__(self, db: Session, client_id: str, source_folder: Path, retry_errors: bool = False):
+        self.db = db
+        self.client_id = client_id
+        self.source_folder = source_folder
+        self.retry_errors = retry_errors
+        self.writer = CfdiBatchWriter(db, client_id, save_files=save_xml_and_pdf, on_progress=self._checkpoint)
+        # Archivos enviados al writer cuyo resultado aún no está en el manifiesto
+        self.in_flight: Dict[str, dict] = {}
+        self._results_seen = 0
+        self._errors_seen = 0
+        self.stats = {'archivos': 0, 'sin_cambios': 0, 'contenido_conocido': 0, 'procesados': 0}
+
+    def run(self) -> dict:
+        manifest = {row.path: row for row in self.db.execute(SELECT_MANIFEST_SQL, {"client_id": self.client_id})}
+        known_content = {row.sha256: row.uuid for row in manifest.values() if row.estado != ESTADO_ERROR and row.uuid}
+        self.db.rollback()
+        logger.info(f"    Manifiesto: {len(manifest)} archivos registrados")
+
+        pending_manifest = []
+        for relative_path, entry in iter_xml_files(self.source_folder):
+            self.stats['archivos'] += 1
+            stat = entry.stat()
+            previous = manifest.get(relative_path)
+
+            # 1. Sin cambios desde la última importación: solo stat
+            if previous and previous.size == stat.st_size and previous.mtime_ns == stat.st_mtime_ns \
+                    and (previous.estado != ESTADO_ERROR or not self.retry_errors):
+                self.stats['sin_cambios'] += 1
+                continue
+
+            with open(entry.path, 'rb') as f:
+                content = f.read()
+            sha256 = hashlib.sha256(content).hexdigest()
+            file_info = {'path': relative_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+            # 2. Contenido ya importado (archivo tocado, copiado o movido): sin parsear
+            if sha256 in known_content:
+                self.stats['contenido_conocido'] += 1
+                estado = ESTADO_IMPORTADO if previous and previous.sha256 == sha256 and previous.estado == ESTADO_IMPORTADO else ESTADO_DUPLICADO
+                pending_manifest.append(self._manifest_row(file_info, known_content[sha256], estado, None))
+                if len(pending_manifest) >= self.writer.chunk_size:
+                    self._write_manifest(pending_manifest)
+                    pending_manifest = []
+                continue
+
+            # 3. Archivo nuevo o modificado: parsear y registrar por lote
+            self.stats['procesados'] += 1
+            pdf_path = _find_pdf(Path(entry.path))
+            pdf_data = (pdf_path.name, pdf_path.read_bytes()) if pdf_path else None
+            self.in_flight[relative_path] = file_info
+            self.writer.add_xml(relative_path, entry.name, content, pdf_data)
+
+        self._write_manifest(pending_manifest)
+        rendimiento = self.writer.close()
+        # close() registra el último lote; los errores de parseo finales no pasan por flush
+        self._checkpoint(self.writer)
+
+        rendimiento.update(self.stats)
+        return rendimiento
+
+    def _manifest_row(self, file_info: dict, uuid: Optional[str], estado: str, mensaje: Optional[str]) -> dict:
+        return {
+            "client_id": self.client_id,
+            **file_info,
+            "uuid": uuid,
+            "estado": estado,
+            "mensaje": mensaje[:500] if mensaje else None
+        }
+
+    def _write_manifest(self, rows: list):
+        if rows:
+            self.db.execute(UPSERT_MANIFEST_SQL, rows)
+            self.db.commit()
+
+    def _checkpoint(self, writer: CfdiBatchWriter):
+        """Registra en el manifiesto el resultado de los archivos ya procesados"""
+        rows = []
+        for result in writer.results[self._results_seen:]:
+            file_info = self.in_flight.pop(result['filename'], None)
+            if file_info:
+                rows.append(self._manifest_row(file_info, result['uuid'], ESTADO_IMPORTADO, None))
+        for error in writer.errors[self._errors_seen:]:
+            file_info = self.in_flight.pop(error['filename'], None)
+            if file_info:
+                estado = ESTADO_DUPLICADO if error.get('duplicado') else ESTADO_ERROR
+                rows.append(self._manifest_row(file_info, error.get('uuid'), estado, error['error']))
+        self._results_seen = len(writer.results)
+        self._errors_seen = len(writer.errors)
+
+        try:
+            self._write_manifest(rows)
+        except Exception as e:
+            # Sin manifiesto estos archivos se vuelven a leer en la próxima importación
+            self.db.rollback()
+            logger.error(f"    ✗ ERROR actualizando manifiesto de importación: {str(e)}")
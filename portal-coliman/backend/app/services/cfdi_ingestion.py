@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Ingesta masiva de CFDIs en base de datos
+
+Los CFDIs de una carga se registran por lotes: los duplicados se resuelven
+con una sola consulta por lote, encabezados y conceptos se insertan con
+executemany (INSERT multi-fila) y se hace un único commit por lote, que
+incluye la actualización de los agregados diarios (cfdi_daily_rollup).
+"""
+import logging
+import os
+import time
+from typing import BinaryIO, Callable, List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.cfdi_archive import extract_compressed_file, is_compressed_filename
+from app.services.cfdi_parse_pool import parse_many
+from app.services.cfdi_rollup import add_cfdis
+from app.services.cfdi_search import index_cfdis
+from app.services.cfdi_storage import add_blob_refs
+
+logger = logging.getLogger('cfdi_operations')
+
+# Todos los valores van como parámetros: pymysql solo convierte executemany
+# en un INSERT multi-fila cuando cada elemento de VALUES es un placeholder.
+INSERT_CFDI_SQL = text("""
+    INSERT INTO cfdi (
+        client_id, uuid, tipo_comprobante, serie, folio, fecha,
+        emisor_rfc, emisor_nombre, emisor_regimen,
+        receptor_rfc, receptor_nombre, receptor_uso_cfdi,
+        subtotal, descuento, total, moneda, tipo_cambio,
+        total_impuestos_trasladados, total_impuestos_retenidos,
+        metodo_pago, forma_pago,
+        xml_path, pdf_path, estatus_validacion
+    ) VALUES (
+        :client_id, :uuid, :tipo_comprobante, :serie, :folio, :fecha,
+        :emisor_rfc, :emisor_nombre, :emisor_regimen,
+        :receptor_rfc, :receptor_nombre, :receptor_uso_cfdi,
+        :subtotal, :descuento, :total, :moneda, :tipo_cambio,
+        :total_impuestos_trasladados, :total_impuestos_retenidos,
+        :metodo_pago, :forma_pago,
+        :xml_path, :pdf_path, :estatus_validacion
+    )
+""")
+
+INSERT_CONCEPTO_SQL = text("""
+    INSERT INTO cfdi_conceptos (
+        cfdi_id, clave_prod_serv, clave_unidad, cantidad,
+        descripcion, valor_unitario, importe, descuento
+    ) VALUES (
+        :cfdi_id, :clave_prod_serv, :clave_unidad, :cantidad,
+        :descripcion, :valor_unitario, :importe, :descuento
+    )
+""")
+
+SELECT_UUIDS_SQL = text("""
+    SELECT id, uuid FROM cfdi
+    WHERE client_id = :client_id AND uuid IN :uuids
+""").bindparams(bindparam("uuids", expanding=True))
+
+
+def find_existing_uuids(db: Session, client_id: str, uuids: List[str]) -> dict:
+    """
+    Busca en una sola consulta qué UUIDs ya existen para el cliente.
+    Retorna {UUID en mayúsculas: id}
+    """
+    if not uuids:
+        return {}
+    rows = db.execute(SELECT_UUIDS_SQL, {"client_id": client_id, "uuids": list(uuids)}).fetchall()
+    return {row.uuid.upper(): row.id for row in rows}
+
+
+def build_cfdi_params(client_id: str, cfdi_data: dict, xml_path: str, pdf_path: Optional[str]) -> dict:
+    """Parámetros del INSERT de encabezado a partir del CFDI parseado"""
+    return {
+        "client_id": client_id,
+        "uuid": cfdi_data['uuid'],
+        "tipo_comprobante": cfdi_data['tipo_comprobante'],
+        "serie": cfdi_data.get('serie'),
+        "folio": cfdi_data.get('folio'),
+        "fecha": cfdi_data['fecha'],
+        "emisor_rfc": cfdi_data.get('emisor_rfc'),
+        "emisor_nombre": cfdi_data.get('emisor_nombre'),
+        "emisor_regimen": cfdi_data.get('emisor_regimen'),
+        "receptor_rfc": cfdi_data.get('receptor_rfc'),
+        "receptor_nombre": cfdi_data.get('receptor_nombre'),
+        "receptor_uso_cfdi": cfdi_data.get('receptor_uso_cfdi'),
+        "subtotal": cfdi_data['subtotal'],
+        "descuento": 0,
+        "total": cfdi_data['total'],
+        "moneda": cfdi_data['moneda'],
+        "tipo_cambio": 1,
+        "total_impuestos_trasladados": cfdi_data.get('total_impuestos_trasladados', 0),
+        "total_impuestos_retenidos": cfdi_data.get('total_impuestos_retenidos', 0),
+        "metodo_pago": cfdi_data.get('metodo_pago'),
+        "forma_pago": cfdi_data.get('forma_pago'),
+        "xml_path": xml_path,
+        "pdf_path": pdf_path,
+        "estatus_validacion": 'pendiente'
+    }
+
+
+def build_concepto_params(cfdi_id: int, concepto: dict) -> dict:
+    """Parámetros del INSERT de un concepto"""
+    return {
+        "cfdi_id": cfdi_id,
+        "clave_prod_serv": concepto.get('clave_prod_serv'),
+        "clave_unidad": concepto.get('clave_unidad'),
+        "cantidad": concepto.get('cantidad', 0),
+        "descripcion": concepto.get('descripcion'),
+        "valor_unitario": concepto.get('valor_unitario', 0),
+        "importe": concepto.get('importe', 0),
+        "descuento": concepto.get('descuento', 0)
+    }
+
+
+class CfdiBatchWriter:
+    """
+    Acumula CFDIs y los registra en lotes de `chunk_size`.
+
+    Los XML agregados con `add_xml` se parsean por lote con el pool de
+    procesos; `add` recibe CFDIs ya parseados.
+
+    `save_files(xml_filename, xml_content, pdf_data)` guarda los archivos de
+    un CFDI nuevo y retorna (xml_relative_path, pdf_relative_path).
+
+    `on_progress(writer)`, si se indica, se llama después de registrar cada
+    lote (por ejemplo para actualizar el avance de un job).
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        client_id: str,
+        save_files: Callable[[str, bytes, Optional[tuple]], tuple],
+        chunk_size: Optional[int] = None,
+        on_progress: Optional[Callable[["CfdiBatchWriter"], None]] = None
+    ):
+        self.db = db
+        self.client_id = client_id
+        self.save_files = save_files
+        self.chunk_size = chunk_size or settings.CFDI_BATCH_SIZE
+        self.on_progress = on_progress
+        self.unparsed = []
+        self.pending = []
+        self.results = []
+        self.errors = []
+        self.stats = {
+            'insertados': 0,
+            'duplicados': 0,
+            'conceptos': 0,
+            'lotes': 0,
+            'segundos_bd': 0.0
+        }
+        self._started = time.perf_counter()
+
+    def add_xml(self, filename: str, xml_filename: str, xml_content: bytes, pdf_data: Optional[tuple] = None):
+        """Agrega un XML sin parsear; se parsea junto con el resto de su lote"""
+        self.unparsed.append({
+            'filename': filename,
+            'xml_filename': xml_filename,
+            'xml_content': xml_content,
+            'pdf_data': pdf_data
+        })
+
+        if len(self.unparsed) >= self.chunk_size:
+            self._parse_unparsed()
+
+    def add(self, filename: str, xml_filename: str, xml_content: bytes, cfdi_data: dict, pdf_data: Optional[tuple] = None):
+        """Agrega un CFDI parseado; registra el lote cuando se llena"""
+        if not cfdi_data.get('uuid'):
+            self.errors.append({
+                'filename': filename,
+                'error': 'No se encontró UUID en el XML'
+            })
+            return
+
+        self.pending.append({
+            'filename': filename,
+            'xml_filename': xml_filename,
+            'xml_content': xml_content,
+            'pdf_data': pdf_data,
+            'cfdi_data': cfdi_data
+        })
+
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Registra el lote pendiente en una sola transacción"""
+        chunk, self.pending = self.pending, []
+        if not chunk:
+            return
+
+        inicio = time.perf_counter()
+        try:
+            self._write_chunk(chunk)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"    ✗ ERROR registrando lote de {len(chunk)} CFDIs: {str(e)}")
+            for entry in chunk:
+                self.errors.append({'filename': entry['filename'], 'error': str(e)})
+        finally:
+            self.stats['lotes'] += 1
+            self.stats['segundos_bd'] += time.perf_counter() - inicio
+
+        if self.on_progress:
+            self.on_progress(self)
+
+    @property
+    def processed(self) -> int:
+        """CFDIs procesados hasta ahora (registrados, duplicados o con error)"""
+        return len(self.results) + len(self.errors)
+
+    def close(self) -> dict:
+        """Registra lo pendiente y retorna las estadísticas de la carga"""
+        self._parse_unparsed()
+        self.flush()
+
+        segundos_total = time.perf_counter() - self._started
+        segundos_bd = self.stats['segundos_bd']
+        filas = self.stats['insertados'] + self.stats['conceptos']
+
+        self.stats['segundos_bd'] = round(segundos_bd, 3)
+        self.stats['segundos_total'] = round(segundos_total, 3)
+        self.stats['cfdis_por_segundo'] = round(self.stats['insertados'] / segundos_total, 1) if segundos_total > 0 else 0
+        self.stats['filas_bd_por_segundo'] = round(filas / segundos_bd, 1) if segundos_bd > 0 else 0
+
+        logger.info(
+            f"    Rendimiento: {self.stats['insertados']} CFDIs + {self.stats['conceptos']} conceptos "
+            f"en {self.stats['lotes']} lotes | {self.stats['cfdis_por_segundo']} CFDIs/s | "
+            f"{self.stats['filas_bd_por_segundo']} filas BD/s"
+        )
+        return self.stats
+
+    def _parse_unparsed(self):
+        items, self.unparsed = self.unparsed, []
+        if not items:
+            return
+
+        parsed = parse_many([item['xml_content'] for item in items])
+        for item, (cfdi_data, error) in zip(items, parsed):
+            if error:
+                logger.error(f"        ✗ ERROR procesando {item['xml_filename']}: {error}")
+                self.errors.append({'filename': item['filename'], 'error': error})
+                continue
+            self.add(item['filename'], item['xml_filename'], item['xml_content'], cfdi_data, item['pdf_data'])
+
+    def _write_chunk(self, chunk: List[dict]):
+        # 1. Duplicados: una consulta por lote + UUIDs repetidos dentro del lote
+        existing = find_existing_uuids(self.db, self.client_id, [e['cfdi_data']['uuid'] for e in chunk])
+        vistos = set()
+        nuevos = []
+        for entry in chunk:
+            uuid = entry['cfdi_data']['uuid']
+            if uuid.upper() in existing or uuid.upper() in vistos:
+                logger.warning(f"        ⚠ CFDI duplicado - UUID: {uuid}")
+                self.stats['duplicados'] += 1
+                self.errors.append({
+                    'filename': entry['filename'],
+                    'error': f'CFDI duplicado (UUID: {uuid})',
+                    'uuid': uuid,
+                    'duplicado': True
+                })
+                continue
+            vistos.add(uuid.upper())
+            nuevos.append(entry)
+
+        # 2. Guardar archivos de los CFDIs nuevos
+        rows = []
+        for entry in nuevos:
+            try:
+                entry['xml_path'], entry['pdf_path'] = self.save_files(
+                    entry['xml_filename'], entry['xml_content'], entry['pdf_data']
+                )
+                rows.append(entry)
+            except Exception as e:
+                logger.error(f"        ✗ ERROR guardando {entry['xml_filename']}: {str(e)}")
+                self.errors.append({'filename': entry['filename'], 'error': str(e)})
+
+        if not rows:
+            return
+
+        # 3. Insertar encabezados y conceptos; un commit por lote
+        try:
+            self._insert_rows(rows)
+            self.db.commit()
+        except Exception as e:
+            # Si el lote falla se reintenta fila por fila para aislar el CFDI problemático
+            self.db.rollback()
+            logger.warning(f"    ⚠ Falló inserción por lote ({str(e)}), reintentando fila por fila")
+            rows = self._insert_rows_individually(rows)
+
+        for entry in rows:
+            self.stats['insertados'] += 1
+            self.stats['conceptos'] += len(entry['cfdi_data'].get('conceptos', []))
+            self.results.append({
+                'filename': entry['filename'],
+                'uuid': entry['cfdi_data']['uuid'],
+                'status': 'success',
+                'path': f"Insumos XML/{entry['xml_path']}",
+                'pdf_path': f"Insumos XML/{entry['pdf_path']}" if entry['pdf_path'] else None
+            })
+
+    def _insert_rows(self, rows: List[dict]):
+        self.db.execute(INSERT_CFDI_SQL, [
+            build_cfdi_params(self.client_id, e['cfdi_data'], e['xml_path'], e['pdf_path'])
+            for e in rows
+        ])
+
+        # executemany no expone un lastrowid por fila: se recuperan los ids por UUID
+        ids = find_existing_uuids(self.db, self.client_id, [e['cfdi_data']['uuid'] for e in rows])
+
+        conceptos = [
+            build_concepto_params(ids[e['cfdi_data']['uuid'].upper()], concepto)
+            for e in rows
+            for concepto in e['cfdi_data'].get('conceptos', [])
+        ]
+        if conceptos:
+            self.db.execute(INSERT_CONCEPTO_SQL, conceptos)
+
+        # Referencias a los blobs guardados, en la misma transacción que los CFDIs
+        add_blob_refs(self.db, [p for e in rows for p in (e['xml_path'], e['pdf_path'])])
+
+        # Agregados diarios para KPIs y reportes, e índice de búsqueda
+        nuevos = [ids[e['cfdi_data']['uuid'].upper()] for e in rows]
+        add_cfdis(self.db, self.client_id, nuevos)
+        index_cfdis(self.db, self.client_id, nuevos)
+
+    def _insert_rows_individually(self, rows: List[dict]) -> List[dict]:
+        insertados = []
+        for entry in rows:
+            try:
+                self._insert_rows([entry])
+                self.db.commit()
+                insertados.append(entry)
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"        ✗ ERROR insertando {entry['xml_filename']}: {str(e)}")
+                self.errors.append({'filename': entry['filename'], 'error': str(e)})
+        return insertados
+
+
+def ingest_file(writer: CfdiBatchWriter, filename: str, fileobj: BinaryIO):
+    """
+    Encola en el writer los XML de un archivo recibido (XML directo o comprimido).
+    Es código bloqueante (lectura, parseo y BD): se ejecuta fuera del event loop.
+    """
+    errors = writer.errors
+    logger.info(f"\n>>> Procesando archivo: {filename}")
+
+    # Verificar si es archivo comprimido (ZIP, RAR o 7Z)
+    if is_compressed_filename(filename):
+        logger.info(f"    Tipo: Archivo comprimido ({filename.split('.')[-1].upper()})")
+
+        # El comprimido se lee directamente del archivo recibido, sin copiarlo a memoria
+        fileobj.seek(0, os.SEEK_END)
+        logger.info(f"    Tamaño: {fileobj.tell()} bytes")
+        fileobj.seek(0)
+
+        # Encolar cada XML extraído (con su PDF opcional); se parsean por lote
+        logger.info(f"    Extrayendo archivos...")
+        extraidos = 0
+        for file_pair in extract_compressed_file(fileobj, filename):
+            extraidos += 1
+            xml_filename, xml_content = file_pair['xml']
+            writer.add_xml(f"{filename} > {xml_filename}", xml_filename, xml_content, file_pair['pdf'])
+
+        if not extraidos:
+            logger.warning(f"    ⚠ No se encontraron archivos XML en {filename}")
+            errors.append({
+                'filename': filename,
+                'error': 'No se encontraron archivos XML en el archivo comprimido'
+            })
+            return
+
+        logger.info(f"    ✓ Extraídos {extraidos} archivos XML")
+
+    # Si es archivo XML directo
+    elif filename.lower().endswith('.xml'):
+        logger.info(f"    Tipo: Archivo XML directo")
+
+        content = fileobj.read()
+        logger.info(f"    Tamaño: {len(content)} bytes")
+        writer.add_xml(filename, filename, content)
+
+    else:
+        logger.warning(f"    ⚠ Formato no soportado: {filename}")
+        errors.append({
+            'filename': filename,
+            'error': 'Formato de archivo no soportado. Solo se aceptan XML, ZIP, RAR y 7Z'
+        })
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Jobs en segundo plano de CFDIs
+
+Los jobs se guardan en la tabla `cfdi_jobs`, que funciona como cola: los
+workers (hilos iniciados con la aplicación) toman el siguiente job con
+`SELECT ... FOR UPDATE SKIP LOCKED`, de modo que varias réplicas del backend
+pueden compartir la misma cola sin tomar dos veces el mismo job.
+
+Cada tipo de job tiene su handler (`register_job_handler`); el handler
+reporta su avance con `update_progress` y retorna el resultado final.
+"""
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.services.cfdi_ingestion import CfdiBatchWriter, ingest_file
+from app.services.cfdi_storage import remove_upload_dir, save_xml_and_pdf
+
+logger = logging.getLogger('cfdi_operations')
+
+JOB_INGESTA = 'ingesta'
+
+ESTADO_EN_COLA = 'en_cola'
+ESTADO_PROCESANDO = 'procesando'
+ESTADO_COMPLETADO = 'completado'
+ESTADO_ERROR = 'error'
+
+# Errores que se guardan en el job (el resto solo se cuenta)
+MAX_ERRORES_DETALLE = 500
+
+JOB_HANDLERS: Dict[str, Callable[[Session, dict], dict]] = {}
+
+_workers: List[threading.Thread] = []
+_stop_event = threading.Event()
+
+
+def register_job_handler(job_type: str):
+    """Registra la función que procesa los jobs de un tipo"""
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def create_job(db: Session, client_id: str, user_id: Optional[int], job_type: str, payload: dict, total: Optional[int] = None) -> int:
+    """Encola un job y retorna su id"""
+    result = db.execute(text("""
+        INSERT INTO cfdi_jobs (client_id, user_id, job_type, estado, payload, total)
+        VALUES (:client_id, :user_id, :job_type, :estado, :payload, :total)
+    """), {
+        "client_id": client_id,
+        "user_id": user_id,
+        "job_type": job_type,
+        "estado": ESTADO_EN_COLA,
+        "payload": json.dumps(payload),
+        "total": total
+    })
+    db.commit()
+    return result.lastrowid
+
+
+def get_job(db: Session, job_id: int, client_id: str) -> Optional[dict]:
+    """Estado y avance de un job del cliente (None si no existe)"""
+    row = db.execute(text("""
+        SELECT id, job_type, estado, total, procesados, exitosos, duplicados, errores,
+               errores_detalle, resultado, mensaje_error, created_at, started_at, finished_at,
+               TIMESTAMPDIFF(MICROSECOND, started_at, COALESCE(finished_at, NOW())) / 1000000 AS segundos
+        FROM cfdi_jobs
+        WHERE id = :job_id AND client_id = :client_id
+    """), {"job_id": job_id, "client_id": client_id}).fetchone()
+
+    if not row:
+        return None
+
+    segundos = float(row.segundos) if row.segundos is not None else 0
+    return {
+        'job_id': row.id,
+        'job_type': row.job_type,
+        'estado': row.estado,
+        'total': row.total,
+        'procesados': row.procesados,
+        'exitosos': row.exitosos,
+        'duplicados': row.duplicados,
+        'errores': row.errores,
+        'segundos': round(segundos, 1),
+        'por_segundo': round(row.procesados / segundos, 1) if segundos > 0 else 0,
+        'errores_detalle': json.loads(row.errores_detalle) if row.errores_detalle else [],
+        'resultado': json.loads(row.resultado) if row.resultado else None,
+        'mensaje_error': row.mensaje_error,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'started_at': row.started_at.isoformat() if row.started_at else None,
+        'finished_at': row.finished_at.isoformat() if row.finished_at else None
+    }
+
+
+def update_progress(db: Session, job_id: int, procesados: int, exitosos: int, duplicados: int, errores: int, total: Optional[int] = None):
+    """Actualiza los contadores de avance de un job (también sirve de heartbeat)"""
+    db.execute(text("""
+        UPDATE cfdi_jobs
+        SET procesados = :procesados, exitosos = :exitosos, duplicados = :duplicados,
+            errores = :errores, total = COALESCE(:total, total)
+        WHERE id = :job_id
+    """), {
+        "job_id": job_id,
+        "procesados": procesados,
+        "exitosos": exitosos,
+        "duplicados": duplicados,
+        "errores": errores,
+        "total": total
+    })
+    db.commit()
+
+
+def finish_job(db: Session, job_id: int, estado: str, resultado: Optional[dict] = None,
+               errores_detalle: Optional[list] = None, mensaje_error: Optional[str] = None):
+    """Marca un job como terminado"""
+    db.execute(text("""
+        UPDATE cfdi_jobs
+        SET estado = :estado, resultado = :resultado, errores_detalle = :errores_detalle,
+            mensaje_error = :mensaje_error, finished_at = NOW()
+        WHERE id = :job_id
+    """), {
+        "job_id": job_id,
+        "estado": estado,
+        "resultado": json.dumps(resultado, default=str) if resultado is not None else None,
+        "errores_detalle": json.dumps((errores_detalle or [])[:MAX_ERRORES_DETALLE]),
+        "mensaje_error": mensaje_error
+    })
+    db.commit()
+
+
+def claim_next_job(db: Session) -> Optional[dict]:
+    """Toma el siguiente job en cola y lo marca como 'procesando'"""
+    row = db.execute(text("""
+        SELECT id, client_id, user_id, job_type, payload
+        FROM cfdi_jobs
+        WHERE estado = :estado
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """), {"estado": ESTADO_EN_COLA}).fetchone()
+
+    if not row:
+        db.rollback()
+        return None
+
+    db.execute(text("""
+        UPDATE cfdi_jobs SET estado = :estado, started_at = NOW() WHERE id = :job_id
+    """), {"estado": ESTADO_PROCESANDO, "job_id": row.id})
+    db.commit()
+
+    return {
+        'id': row.id,
+        'client_id': row.client_id,
+        'user_id': row.user_id,
+        'job_type': row.job_type,
+        'payload': json.loads(row.payload) if row.payload else {}
+    }
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    """
+    Regresa a la cola los jobs 'procesando' sin avance reciente (por ejemplo,
+    si el proceso que los tenía se reinició). Reprocesar una ingesta es
+    seguro: los CFDIs ya registrados se reportan como duplicados.
+    """
+    result = db.execute(text("""
+        UPDATE cfdi_jobs
+        SET estado = :en_cola
+        WHERE estado = :procesando
+          AND updated_at < NOW() - INTERVAL :minutos MINUTE
+    """), {
+        "en_cola": ESTADO_EN_COLA,
+        "procesando": ESTADO_PROCESANDO,
+        "minutos": settings.CFDI_JOB_STALE_MINUTES
+    })
+    db.commit()
+    return result.rowcount
+
+
+def run_job(db: Session, job: dict):
+    """Ejecuta un job con su handler y registra el resultado"""
+    handler = JOB_HANDLERS.get(job['job_type'])
+    logger.info(f"Job {job['id']} ({job['job_type']}) iniciado - Client: {job['client_id']}")
+
+    try:
+        if handler is None:
+            raise ValueError(f"Tipo de job no soportado: {job['job_type']}")
+        resultado = handler(db, job)
+        errores_detalle = resultado.pop('errores_detalle', None)
+        finish_job(db, job['id'], ESTADO_COMPLETADO, resultado, errores_detalle)
+        logger.info(f"Job {job['id']} completado")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Job {job['id']} falló: {str(e)}")
+        finish_job(db, job['id'], ESTADO_ERROR, mensaje_error=str(e))
+
+
+@register_job_handler(JOB_INGESTA)
+def run_ingestion_job(db: Session, job: dict) -> dict:
+    """Procesa los archivos guardados de una carga en segundo plano"""
+    payload = job['payload']
+    archivos = payload.get('archivos', [])
+
+    def on_progress(writer: CfdiBatchWriter):
+        duplicados = writer.stats['duplicados']
+        update_progress(
+            db, job['id'],
+            procesados=writer.processed,
+            exitosos=len(writer.results),
+            duplicados=duplicados,
+            errores=len(writer.errors) - duplicados
+        )
+
+    writer = CfdiBatchWriter(db, job['client_id'], save_files=save_xml_and_pdf, on_progress=on_progress)
+
+    for archivo in archivos:
+        try:
+            with open(archivo['path'], 'rb') as fileobj:
+                ingest_file(writer, archivo['filename'], fileobj)
+        except Exception as e:
+            logger.error(f"    ✗ ERROR CRÍTICO procesando {archivo['filename']}: {str(e)}")
+            writer.errors.append({'filename': archivo['filename'], 'error': str(e)})
+
+    rendimiento = writer.close()
+    on_progress(writer)
+    remove_upload_dir(payload['job_key'])
+
+    return {
+        'total_files': len(archivos),
+        'rendimiento': rendimiento,
+        'errores_detalle': writer.errors
+    }
+
+
+def wait_or_stop(seconds: float) -> bool:
+    """Pausa dentro de un job; retorna True si la aplicación se está cerrando"""
+    return _stop_event.wait(seconds)
+
+
+def _worker_loop(worker_id: int):
+    logger.info(f"Worker de jobs {worker_id} iniciado")
+    while not _stop_event.is_set():
+        db = SessionLocal()
+        try:
+            job = claim_next_job(db)
+            if job:
+                run_job(db, job)
+                continue
+        except Exception as e:
+            logger.error(f"Worker de jobs {worker_id}: {str(e)}")
+        finally:
+            db.close()
+        _stop_event.wait(settings.CFDI_JOB_POLL_SECONDS)
+
+
+def start_job_workers():
+    """Inicia los hilos que procesan la cola de jobs (al iniciar la aplicación)"""
+    if _workers or settings.CFDI_JOB_WORKERS <= 0:
+        return
+
+    db = SessionLocal()
+    try:
+        reencolados = requeue_stale_jobs(db)
+        if reencolados:
+            logger.info(f"Jobs reencolados: {reencolados}")
+    except Exception as e:
+        logger.error(f"No se pudieron reencolar jobs pendientes: {str(e)}")
+    finally:
+        db.close()
+
+    _stop_event.clear()
+    for worker_id in range(settings.CFDI_JOB_WORKERS):
+        worker = threading.Thread(target=_worker_loop, args=(worker_id,), name=f"cfdi-job-{worker_id}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+
+def stop_job_workers(timeout: float = 5.0):
+    """Detiene los workers; el job en curso se retoma al reiniciar"""
+    _stop_event.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
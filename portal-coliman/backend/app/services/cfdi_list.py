@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Listado paginado de CFDIs de un cliente
+
+Paginación por llave (keyset) sobre (created_at, id) descendente: cada
+página continúa después de la última fila de la anterior, así que el costo
+no crece con la profundidad como con OFFSET. El cursor que recibe el
+cliente es opaco (base64 de created_at e id).
+
+El total no se cuenta en cada página: se calcula una vez por versión de
+datos del cliente (caché de report_cache). Sin filtros de RFC sale del
+agregado diario; con RFC, de un COUNT sobre el índice del RFC.
+"""
+import base64
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services import report_cache
+
+LIMITE_MAXIMO = 500
+
+# {where}: condiciones de build_filters (más la del cursor)
+LISTADO_SQL = """
+    SELECT
+        id, uuid, fecha, tipo_comprobante,
+        emisor_rfc, emisor_nombre,
+        receptor_rfc, receptor_nombre,
+        subtotal, total, moneda,
+        estatus_validacion, created_at
+    FROM cfdi
+    WHERE {where}
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+"""
+
+CURSOR_FILTRO = "(created_at < :cursor_created_at OR (created_at = :cursor_created_at AND id < :cursor_id))"
+
+
+class CursorInvalidoError(ValueError):
+    """El cursor recibido no fue generado por este endpoint"""
+
+
+def encode_cursor(created_at: datetime, cfdi_id: int) -> str:
+    raw = f"{created_at.strftime('%Y-%m-%d %H:%M:%S')}|{cfdi_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, cfdi_id = raw.split('|')
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S'), int(cfdi_id)
+    except Exception:
+        raise CursorInvalidoError("Cursor de paginación inválido")
+
+
+def build_filters(client_id: str, filtros: dict) -> Tuple[list, dict]:
+    """Condiciones sobre `cfdi` (fechas YYYY-MM-DD inclusive, por rango)"""
+    condiciones = ["client_id = :client_id"]
+    params = {"client_id": client_id}
+
+    if filtros.get('fecha_inicio'):
+        condiciones.append("fecha >= :fecha_inicio")
+        params["fecha_inicio"] = filtros['fecha_inicio']
+    if filtros.get('fecha_fin'):
+        condiciones.append("fecha < :fecha_fin_exclusiva")
+        params["fecha_fin_exclusiva"] = (
+            datetime.strptime(filtros['fecha_fin'], '%Y-%m-%d') + timedelta(days=1)
+        ).strftime('%Y-%m-%d')
+    for campo in ('emisor_rfc', 'receptor_rfc', 'tipo_comprobante', 'estatus_validacion'):
+        if filtros.get(campo):
+            condiciones.append(f"{campo} = :{campo}")
+            params[campo] = filtros[campo]
+
+    return condiciones, params
+
+
+def fetch_page(db: Session, client_id: str, filtros: dict, cursor: Optional[str], limit: int) -> Tuple[list, Optional[str]]:
+    """Retorna (filas, cursor de la página siguiente o None)"""
+    condiciones, params = build_filters(client_id, filtros)
+    if cursor:
+        params["cursor_created_at"], params["cursor_id"] = decode_cursor(cursor)
+        condiciones.append(CURSOR_FILTRO)
+
+    # Se pide una fila de más para saber si hay página siguiente
+    params["limit"] = limit + 1
+    rows = db.execute(text(LISTADO_SQL.format(where=' AND '.join(condiciones))), params).fetchall()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def fetch_offset_page(db: Session, client_id: str, filtros: dict, skip: int, limit: int) -> list:
+    """Página por OFFSET (compatibilidad con clientes que aún envían `skip`)"""
+    condiciones, params = build_filters(client_id, filtros)
+    params.update({"limit": limit, "skip": skip})
+    sql = LISTADO_SQL.format(where=' AND '.join(condiciones)) + " OFFSET :skip"
+    return db.execute(text(sql), params).fetchall()
+
+
+def _count(db: Session, client_id: str, filtros: dict) -> int:
+    if filtros.get('emisor_rfc') or filtros.get('receptor_rfc'):
+        condiciones, params = build_filters(client_id, filtros)
+        sql = f"SELECT COUNT(*) FROM cfdi WHERE {' AND '.join(condiciones)}"
+    else:
+        # Sin RFC todos los filtros existen en el agregado diario
+        condiciones = ["client_id = :client_id"]
+        params = {"client_id": client_id}
+        if filtros.get('fecha_inicio'):
+            condiciones.append("dia >= :fecha_inicio")
+            params["fecha_inicio"] = filtros['fecha_inicio']
+        if filtros.get('fecha_fin'):
+            condiciones.append("dia <= :fecha_fin")
+            params["fecha_fin"] = filtros['fecha_fin']
+        for campo in ('tipo_comprobante', 'estatus_validacion'):
+            if filtros.get(campo):
+                condiciones.append(f"{campo} = :{campo}")
+                params[campo] = filtros[campo]
+        sql = f"SELECT COALESCE(SUM(cantidad), 0) FROM cfdi_daily_rollup WHERE {' AND '.join(condiciones)}"
+
+    return int(db.execute(text(sql), params).scalar() or 0)
+
+
+def count_cfdis(db: Session, client_id: str, filtros: dict) -> int:
+    """Total de CFDIs con los filtros; se recalcula solo cuando cambian los datos del cliente"""
+    clave = tuple(sorted((k, v) for k, v in filtros.items() if v))
+    return report_cache.cached(db, "cfdis/list:total", client_id, clave, lambda: _count(db, client_id, filtros))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de procesos para parsear XML de CFDI
+
+El parseo es trabajo de CPU puro; para cargas grandes se reparte entre
+procesos y los resultados se retornan en el mismo orden de entrada. Las
+cargas pequeñas, y todas en equipos de un núcleo (ahí el pool es más lento
+que el parseo en serie), se parsean en el proceso actual.
+
+Los procesos se crean con 'forkserver': el pool se crea bajo demanda desde
+un hilo mientras corren los workers de jobs, el scheduler del SAT y el event
+loop, y un fork directo copiaría locks tomados por esos hilos (logging, pool
+de SQLAlchemy, httpx) a los hijos.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.cfdi_parser import parse_cfdi
+
+logger = logging.getLogger('cfdi_operations')
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    """Número de procesos configurados para el pool"""
+    return settings.CFDI_PARSE_WORKERS or os.cpu_count() or 1
+
+
+def _parse_one(xml_content: bytes) -> Tuple[Optional[dict], Optional[str]]:
+    """Parsea un XML; retorna (datos, None) o (None, mensaje de error)"""
+    try:
+        return parse_cfdi(xml_content), None
+    except Exception as e:
+        return None, f"Error al parsear XML: {str(e)}"
+
+
+def get_parse_executor() -> ProcessPoolExecutor:
+    """Obtiene (creándolo la primera vez) el pool compartido del proceso"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            logger.info(f"Iniciando pool de parseo con {pool_size()} procesos")
+            contexto = multiprocessing.get_context('forkserver')
+            # El servidor de fork importa el parser una vez; los hijos lo heredan
+            contexto.set_forkserver_preload(['app.services.cfdi_parser'])
+            _executor = ProcessPoolExecutor(max_workers=pool_size(), mp_context=contexto)
+        return _executor
+
+
+def shutdown_parse_pool():
+    """Detiene el pool compartido (al cerrar la aplicación)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def parse_many(
+    xml_contents: List[bytes],
+    executor: Optional[Executor] = None
+) -> List[Tuple[Optional[dict], Optional[str]]]:
+    """
+    Parsea una lista de XMLs y retorna [(datos, error), ...] en el mismo orden.
+
+    Con menos de CFDI_PARSE_PARALLEL_MIN XMLs, un pool de un proceso o un
+    solo núcleo se parsea en el proceso actual: enviar documentos a otros
+    procesos cuesta más en serialización de lo que se gana.
+    """
+    if executor is None:
+        if (len(xml_contents) < settings.CFDI_PARSE_PARALLEL_MIN or pool_size() == 1
+                or (os.cpu_count() or 1) <= 1):
+            return [_parse_one(content) for content in xml_contents]
+        executor = get_parse_executor()
+
+    workers = getattr(executor, '_max_workers', None) or pool_size()
+    chunksize = max(1, len(xml_contents) // (workers * 4))
+    return list(executor.map(_parse_one, xml_contents, chunksize=chunksize))
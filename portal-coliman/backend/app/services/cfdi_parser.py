@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Parseo de XML de CFDI
+
+Funciones puras (sin acceso a BD ni a FastAPI) para poder ejecutarlas tanto
+en el proceso del servidor como en los procesos del pool de parseo.
+
+Motores disponibles (CFDI_PARSER_ENGINE):
+- lxml: una sola pasada con un parser "target" de lxml, sin construir árbol.
+  Soporta CFDI 3.3 y 4.0 y los complementos Pagos 2.0 y Nómina 1.2.
+- etree: implementación original con ElementTree (solo CFDI 4.0).
+"""
+import xml.etree.ElementTree as ET
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from app.core.config import settings
+
+# Namespace del SAT para CFDI 4.0
+NAMESPACES = {
+    'cfdi': 'http://www.sat.gob.mx/cfd/4',
+    'tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital'
+}
+
+CFDI_NAMESPACES = ('http://www.sat.gob.mx/cfd/3', 'http://www.sat.gob.mx/cfd/4')
+TFD_NAMESPACE = 'http://www.sat.gob.mx/TimbreFiscalDigital'
+PAGOS_NAMESPACE = 'http://www.sat.gob.mx/Pagos20'
+NOMINA_NAMESPACE = 'http://www.sat.gob.mx/nomina12'
+
+
+def parse_cfdi(xml_content: bytes) -> dict:
+    """Parsea un CFDI con el motor configurado (lxml si está disponible)"""
+    if settings.CFDI_PARSER_ENGINE == 'lxml' and etree is not None:
+        return parse_cfdi_lxml(xml_content)
+    return parse_cfdi_etree(xml_content)
+
+
+def parse_cfdi_etree(xml_content: bytes) -> dict:
+    """Parse CFDI XML and extract main fields"""
+    root = ET.fromstring(xml_content)
+
+    # Obtener UUID del timbre fiscal
+    timbre = root.find('.//tfd:TimbreFiscalDigital', NAMESPACES)
+    uuid = timbre.get('UUID') if timbre is not None else None
+
+    # Datos del comprobante
+    comprobante_data = {
+        'uuid': uuid,
+        'version': root.get('Version'),
+        'serie': root.get('Serie'),
+        'folio': root.get('Folio'),
+        'fecha': root.get('Fecha'),
+        'sello': root.get('Sello'),
+        'forma_pago': root.get('FormaPago'),
+        'no_certificado': root.get('NoCertificado'),
+        'subtotal': float(root.get('SubTotal', 0)),
+        'moneda': root.get('Moneda'),
+        'total': float(root.get('Total', 0)),
+        'tipo_comprobante': root.get('TipoDeComprobante'),
+        'metodo_pago': root.get('MetodoPago'),
+        'lugar_expedicion': root.get('LugarExpedicion'),
+    }
+
+    # Datos del emisor
+    emisor = root.find('.//cfdi:Emisor', NAMESPACES)
+    if emisor is not None:
+        comprobante_data['emisor_rfc'] = emisor.get('Rfc')
+        comprobante_data['emisor_nombre'] = emisor.get('Nombre')
+        comprobante_data['emisor_regimen'] = emisor.get('RegimenFiscal')
+
+    # Datos del receptor
+    receptor = root.find('.//cfdi:Receptor', NAMESPACES)
+    if receptor is not None:
+        comprobante_data['receptor_rfc'] = receptor.get('Rfc')
+        comprobante_data['receptor_nombre'] = receptor.get('Nombre')
+        comprobante_data['receptor_uso_cfdi'] = receptor.get('UsoCFDI')
+
+    # Impuestos del comprobante (hijo directo; los de cada concepto van dentro de cfdi:Concepto)
+    impuestos = root.find('cfdi:Impuestos', NAMESPACES)
+    if impuestos is not None:
+        comprobante_data['total_impuestos_trasladados'] = float(impuestos.get('TotalImpuestosTrasladados', 0))
+        comprobante_data['total_impuestos_retenidos'] = float(impuestos.get('TotalImpuestosRetenidos', 0))
+
+    # Conceptos
+    conceptos = []
+    for concepto in root.findall('.//cfdi:Concepto', NAMESPACES):
+        concepto_data = {
+            'clave_prod_serv': concepto.get('ClaveProdServ'),
+            'cantidad': float(concepto.get('Cantidad', 0)),
+            'clave_unidad': concepto.get('ClaveUnidad'),
+            'unidad': concepto.get('Unidad'),
+            'descripcion': concepto.get('Descripcion'),
+            'valor_unitario': float(concepto.get('ValorUnitario', 0)),
+            'importe': float(concepto.get('Importe', 0)),
+            'descuento': float(concepto.get('Descuento', 0))
+        }
+        conceptos.append(concepto_data)
+
+    comprobante_data['conceptos'] = conceptos
+
+    return comprobante_data
+
+
+def _float(attrib, name: str) -> float:
+    return float(attrib.get(name, 0))
+
+
+class _CfdiTarget:
+    """
+    Receptor de eventos del parser de lxml: extrae todos los campos en una
+    sola pasada hacia adelante, sin construir el árbol. De los atributos
+    Sello/Certificado (los más pesados del documento) no se guarda nada salvo
+    los últimos 8 caracteres del sello, que usa la verificación del SAT.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.comprobante_data = {
+            'uuid': None,
+            'version': None,
+            'serie': None,
+            'folio': None,
+            'fecha': None,
+            'sello_fe': None,
+            'forma_pago': None,
+            'no_certificado': None,
+            'subtotal': 0.0,
+            'moneda': None,
+            'total': 0.0,
+            'tipo_comprobante': None,
+            'metodo_pago': None,
+            'lugar_expedicion': None,
+        }
+        self.conceptos = []
+        self.complementos = {}
+        self.pago_actual = None
+
+    def start(self, tag, attrib):
+        namespace, _, name = tag.rpartition('}')
+        namespace = namespace.lstrip('{')
+        depth = self.depth
+        self.depth += 1
+        data = self.comprobante_data
+
+        if namespace in CFDI_NAMESPACES:
+            if name == 'Comprobante' and depth == 0:
+                sello = attrib.get('Sello')
+                data.update({
+                    'version': attrib.get('Version'),
+                    'serie': attrib.get('Serie'),
+                    'folio': attrib.get('Folio'),
+                    'fecha': attrib.get('Fecha'),
+                    'sello_fe': sello[-8:] if sello else None,
+                    'forma_pago': attrib.get('FormaPago'),
+                    'no_certificado': attrib.get('NoCertificado'),
+                    'subtotal': _float(attrib, 'SubTotal'),
+                    'moneda': attrib.get('Moneda'),
+                    'total': _float(attrib, 'Total'),
+                    'tipo_comprobante': attrib.get('TipoDeComprobante'),
+                    'metodo_pago': attrib.get('MetodoPago'),
+                    'lugar_expedicion': attrib.get('LugarExpedicion'),
+                })
+            elif name == 'Emisor' and depth == 1:
+                data['emisor_rfc'] = attrib.get('Rfc')
+                data['emisor_nombre'] = attrib.get('Nombre')
+                data['emisor_regimen'] = attrib.get('RegimenFiscal')
+            elif name == 'Receptor' and depth == 1:
+                data['receptor_rfc'] = attrib.get('Rfc')
+                data['receptor_nombre'] = attrib.get('Nombre')
+                data['receptor_uso_cfdi'] = attrib.get('UsoCFDI')
+            elif name == 'Impuestos' and depth == 1:
+                # Solo los impuestos del comprobante, no los de cada concepto
+                data['total_impuestos_trasladados'] = _float(attrib, 'TotalImpuestosTrasladados')
+                data['total_impuestos_retenidos'] = _float(attrib, 'TotalImpuestosRetenidos')
+            elif name == 'Concepto' and depth == 2:
+                self.conceptos.append({
+                    'clave_prod_serv': attrib.get('ClaveProdServ'),
+                    'cantidad': _float(attrib, 'Cantidad'),
+                    'clave_unidad': attrib.get('ClaveUnidad'),
+                    'unidad': attrib.get('Unidad'),
+                    'descripcion': attrib.get('Descripcion'),
+                    'valor_unitario': _float(attrib, 'ValorUnitario'),
+                    'importe': _float(attrib, 'Importe'),
+                    'descuento': _float(attrib, 'Descuento')
+                })
+
+        elif namespace == TFD_NAMESPACE and name == 'TimbreFiscalDigital':
+            if data['uuid'] is None:
+                data['uuid'] = attrib.get('UUID')
+                data['fecha_timbrado'] = attrib.get('FechaTimbrado')
+
+        elif namespace == PAGOS_NAMESPACE:
+            pagos = self.complementos.setdefault('pagos', {'version': None, 'monto_total_pagos': 0.0, 'pagos': []})
+            if name == 'Pagos':
+                pagos['version'] = attrib.get('Version')
+            elif name == 'Totales':
+                pagos['monto_total_pagos'] = _float(attrib, 'MontoTotalPagos')
+            elif name == 'Pago':
+                self.pago_actual = {
+                    'fecha_pago': attrib.get('FechaPago'),
+                    'forma_pago': attrib.get('FormaDePagoP'),
+                    'moneda': attrib.get('MonedaP'),
+                    'monto': _float(attrib, 'Monto'),
+                    'documentos': []
+                }
+                pagos['pagos'].append(self.pago_actual)
+            elif name == 'DoctoRelacionado' and self.pago_actual is not None:
+                self.pago_actual['documentos'].append({
+                    'uuid': attrib.get('IdDocumento'),
+                    'num_parcialidad': attrib.get('NumParcialidad'),
+                    'imp_saldo_ant': _float(attrib, 'ImpSaldoAnt'),
+                    'imp_pagado': _float(attrib, 'ImpPagado'),
+                    'imp_saldo_insoluto': _float(attrib, 'ImpSaldoInsoluto')
+                })
+
+        elif namespace == NOMINA_NAMESPACE:
+            if name == 'Nomina':
+                self.complementos['nomina'] = {
+                    'version': attrib.get('Version'),
+                    'tipo_nomina': attrib.get('TipoNomina'),
+                    'fecha_pago': attrib.get('FechaPago'),
+                    'fecha_inicial_pago': attrib.get('FechaInicialPago'),
+                    'fecha_final_pago': attrib.get('FechaFinalPago'),
+                    'num_dias_pagados': _float(attrib, 'NumDiasPagados'),
+                    'total_percepciones': _float(attrib, 'TotalPercepciones'),
+                    'total_deducciones': _float(attrib, 'TotalDeducciones'),
+                    'total_otros_pagos': _float(attrib, 'TotalOtrosPagos')
+                }
+            elif name == 'Receptor' and 'nomina' in self.complementos:
+                self.complementos['nomina']['num_empleado'] = attrib.get('NumEmpleado')
+                self.complementos['nomina']['curp'] = attrib.get('Curp')
+
+    def end(self, tag):
+        self.depth -= 1
+
+    def data(self, data):
+        pass
+
+    def close(self) -> dict:
+        self.comprobante_data['conceptos'] = self.conceptos
+        self.comprobante_data['complementos'] = self.complementos
+        return self.comprobante_data
+
+
+def parse_cfdi_lxml(xml_content: bytes) -> dict:
+    """
+    Parsea un CFDI (3.3 o 4.0) en una sola pasada con lxml.
+
+    Retorna los mismos campos que `parse_cfdi_etree` (salvo `sello`, que se
+    reemplaza por `sello_fe`) más `fecha_timbrado` y `complementos`.
+    """
+    parser = etree.XMLParser(target=_CfdiTarget(), resolve_entities=False, no_network=True)
+    return etree.fromstring(xml_content, parser)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Agregados diarios de CFDIs (tabla cfdi_daily_rollup)
+
+Una fila por (cliente, día, tipo, forma de pago, método de pago, estatus) con
+cantidad y sumas de subtotal, descuento, total e impuestos. KPIs y reportes
+leen de aquí: su costo depende del número de días, no del de facturas.
+
+Se mantiene de forma incremental en la misma transacción que `cfdi`:
+- la ingesta suma los CFDIs insertados (`add_cfdis`);
+- la validación resta los CFDIs antes de cambiarles el estatus y los vuelve a
+  sumar después (`remove_cfdis` / `add_cfdis`).
+
+Los deltas se calculan en SQL a partir de las filas de `cfdi`, así los montos
+coinciden exactamente con los guardados (DECIMAL), sin redondeos en Python.
+Todo cambio al agregado incrementa la versión de datos del cliente, lo que
+invalida la caché de KPIs y reportes (app/services/report_cache.py).
+"""
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.services.report_cache import bump_data_version
+
+# NULL en forma/método de pago se guarda como '' porque forman parte de la llave
+APPLY_SQL = """
+    INSERT INTO cfdi_daily_rollup (
+        client_id, dia, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion,
+        cantidad, subtotal, descuento, total, impuestos_trasladados, impuestos_retenidos
+    )
+    SELECT
+        client_id, DATE(fecha), tipo_comprobante,
+        COALESCE(forma_pago, ''), COALESCE(metodo_pago, ''), COALESCE(estatus_validacion, 'pendiente'),
+        {signo} * COUNT(*),
+        {signo} * COALESCE(SUM(subtotal), 0),
+        {signo} * COALESCE(SUM(descuento), 0),
+        {signo} * COALESCE(SUM(total), 0),
+        {signo} * COALESCE(SUM(total_impuestos_trasladados), 0),
+        {signo} * COALESCE(SUM(total_impuestos_retenidos), 0)
+    FROM cfdi
+    WHERE client_id = :client_id {filtro}
+    GROUP BY client_id, DATE(fecha), tipo_comprobante,
+        COALESCE(forma_pago, ''), COALESCE(metodo_pago, ''), COALESCE(estatus_validacion, 'pendiente')
+    ON DUPLICATE KEY UPDATE
+        cantidad = cantidad + VALUES(cantidad),
+        subtotal = subtotal + VALUES(subtotal),
+        descuento = descuento + VALUES(descuento),
+        total = total + VALUES(total),
+        impuestos_trasladados = impuestos_trasladados + VALUES(impuestos_trasladados),
+        impuestos_retenidos = impuestos_retenidos + VALUES(impuestos_retenidos)
+"""
+
+SUMAR_SQL = text(APPLY_SQL.format(signo=1, filtro="AND id IN :ids")).bindparams(bindparam("ids", expanding=True))
+RESTAR_SQL = text(APPLY_SQL.format(signo=-1, filtro="AND id IN :ids")).bindparams(bindparam("ids", expanding=True))
+
+REBUILD_SQL = text(APPLY_SQL.format(signo=1, filtro=""))
+
+PURGE_SQL = text("""
+    DELETE FROM cfdi_daily_rollup
+    WHERE client_id = :client_id AND cantidad = 0
+""")
+
+
+def add_cfdis(db: Session, client_id: str, ids: List[int]):
+    """Suma los CFDIs indicados a sus agregados diarios (no hace commit)"""
+    if ids:
+        db.execute(SUMAR_SQL, {"client_id": client_id, "ids": list(ids)})
+        bump_data_version(db, client_id)
+
+
+def remove_cfdis(db: Session, client_id: str, ids: List[int]):
+    """Resta los CFDIs indicados de sus agregados diarios (no hace commit)"""
+    if ids:
+        db.execute(RESTAR_SQL, {"client_id": client_id, "ids": list(ids)})
+        db.execute(PURGE_SQL, {"client_id": client_id})
+        bump_data_version(db, client_id)
+
+
+def rebuild_client(db: Session, client_id: str):
+    """Recalcula desde cero los agregados de un cliente (reparación o carga inicial; no hace commit)"""
+    db.execute(text("DELETE FROM cfdi_daily_rollup WHERE client_id = :client_id"), {"client_id": client_id})
+    db.execute(REBUILD_SQL, {"client_id": client_id})
+    bump_data_version(db, client_id)
+
+
+def periodo_params(client_id: str, fecha_inicio: str, fecha_fin: str) -> dict:
+    """
+    Parámetros de un periodo de días completos (YYYY-MM-DD, ambos inclusive):
+    en el agregado `dia BETWEEN :fecha_inicio AND :fecha_fin` y en `cfdi`
+    `fecha >= :fecha_inicio AND fecha < :fecha_fin_exclusiva`.
+    """
+    fin_exclusivo = datetime.strptime(fecha_fin, '%Y-%m-%d').date() + timedelta(days=1)
+    return {
+        "client_id": client_id,
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "fecha_fin_exclusiva": fin_exclusivo.strftime('%Y-%m-%d')
+    }
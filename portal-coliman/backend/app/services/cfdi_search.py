@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda de CFDIs por texto (tabla cfdi_search)
+
+Una fila por CFDI con un documento de texto (nombres y RFC de emisor y
+receptor, serie, folio y descripciones de los conceptos) bajo un índice
+FULLTEXT de InnoDB. La búsqueda usa BOOLEAN MODE: todas las palabras son
+obligatorias y cada una se busca por prefijo ("ferret" encuentra
+"ferretería"); el orden es por relevancia de MySQL y después por fecha.
+
+UUIDs y RFCs no pasan por el índice de texto (el parser de FULLTEXT parte el
+UUID en los guiones): se buscan por prefijo sobre los índices B-tree de
+`cfdi`, que empiezan con client_id. Los folios (números, serie-folio como
+"A-12345" o términos más cortos que el token mínimo del índice) se buscan
+exactos sobre (client_id, folio).
+
+El índice FULLTEXT es uno para todos los clientes; cada documento empieza
+con un token del cliente (`token_cliente`) que la consulta exige, así MySQL
+solo evalúa y ordena los documentos del cliente.
+
+El documento se arma en SQL a partir de `cfdi` y `cfdi_conceptos`, en la
+misma transacción de la ingesta (`index_cfdis`), igual que el agregado
+diario (app/services/cfdi_rollup.py).
+"""
+import hashlib
+import re
+from typing import List, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+# Tamaño mínimo de palabra del índice (innodb_ft_min_token_size)
+MIN_PALABRA = 3
+LIMITE_MAXIMO = 50
+
+# GROUP_CONCAT se trunca en 1024 bytes por omisión; un CFDI puede tener
+# cientos de conceptos
+GROUP_CONCAT_SQL = text("SET SESSION group_concat_max_len = 1048576")
+
+INDEX_SQL = """
+    INSERT INTO cfdi_search (cfdi_id, client_id, contenido)
+    SELECT
+        c.id, c.client_id,
+        CONCAT_WS(' ',
+            CONCAT('t', LEFT(MD5(c.client_id), 16)),
+            c.emisor_nombre, c.receptor_nombre, c.emisor_rfc, c.receptor_rfc,
+            c.serie, c.folio, CONCAT(c.serie, c.folio),
+            GROUP_CONCAT(DISTINCT cc.descripcion SEPARATOR ' ')
+        )
+    FROM cfdi c
+    LEFT JOIN cfdi_conceptos cc ON cc.cfdi_id = c.id
+    WHERE c.client_id = :client_id {filtro}
+    GROUP BY c.id
+    ON DUPLICATE KEY UPDATE contenido = VALUES(contenido)
+"""
+
+INDEX_IDS_SQL = text(INDEX_SQL.format(filtro="AND c.id IN :ids")).bindparams(bindparam("ids", expanding=True))
+REINDEX_SQL = text(INDEX_SQL.format(filtro=""))
+
+COLUMNAS = """
+    cfdi.id, cfdi.uuid, cfdi.fecha, cfdi.tipo_comprobante, cfdi.serie, cfdi.folio,
+    cfdi.emisor_rfc, cfdi.emisor_nombre, cfdi.receptor_rfc, cfdi.receptor_nombre,
+    cfdi.total, cfdi.moneda, cfdi.estatus_validacion
+"""
+
+TEXTO_SQL = text(f"""
+    SELECT {COLUMNAS}, MATCH(cfdi_search.contenido) AGAINST (:consulta IN BOOLEAN MODE) AS relevancia
+    FROM cfdi_search
+    JOIN cfdi ON cfdi.id = cfdi_search.cfdi_id
+    WHERE MATCH(cfdi_search.contenido) AGAINST (:consulta IN BOOLEAN MODE)
+      AND cfdi_search.client_id = :client_id
+    ORDER BY relevancia DESC, cfdi.fecha DESC
+    LIMIT :limit
+""")
+
+UUID_SQL = text(f"""
+    SELECT {COLUMNAS}, 1 AS relevancia
+    FROM cfdi
+    WHERE cfdi.client_id = :client_id AND cfdi.uuid LIKE :prefijo
+    ORDER BY cfdi.uuid
+    LIMIT :limit
+""")
+
+# Folio exacto (idx_cfdi_client_folio); con serie, los que la tienen primero.
+# El número suelto solo cuenta con la serie pedida; el folio completo
+# ("A12345" guardado así) cuenta siempre
+FOLIO_SQL = text(f"""
+    SELECT {COLUMNAS}, IF(cfdi.serie = :serie, 2, 1) AS relevancia
+    FROM cfdi
+    WHERE cfdi.client_id = :client_id AND cfdi.folio IN :folios
+      AND (:serie IS NULL OR cfdi.serie = :serie OR cfdi.folio <> :numero)
+    ORDER BY relevancia DESC, cfdi.fecha DESC
+    LIMIT :limit
+""").bindparams(bindparam("folios", expanding=True))
+
+# Una rama por índice (emisor y receptor); el UNION quita duplicados
+RFC_SQL = text(f"""
+    SELECT * FROM (
+        (SELECT {COLUMNAS}, IF(cfdi.emisor_rfc = :rfc, 2, 1) AS relevancia
+         FROM cfdi
+         WHERE cfdi.client_id = :client_id AND cfdi.emisor_rfc LIKE :prefijo
+         ORDER BY cfdi.created_at DESC LIMIT :limit)
+        UNION
+        (SELECT {COLUMNAS}, IF(cfdi.receptor_rfc = :rfc, 2, 1) AS relevancia
+         FROM cfdi
+         WHERE cfdi.client_id = :client_id AND cfdi.receptor_rfc LIKE :prefijo
+         ORDER BY cfdi.created_at DESC LIMIT :limit)
+    ) r
+    ORDER BY relevancia DESC, fecha DESC
+    LIMIT :limit
+""")
+
+UUID_RE = re.compile(r'^[0-9A-F]{8}[0-9A-F-]*$')
+# Serie (letras) y folio numérico, con o sin separador: "A-12345", "FAC 0042", "12345"
+FOLIO_RE = re.compile(r'^(?:([A-ZÑ]{1,25})[\s-]*)?(\d+)$')
+RFC_RE = re.compile(r'^[A-ZÑ&]{3,4}\d{2,6}[A-Z0-9]{0,3}$')
+PALABRA_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def index_cfdis(db: Session, client_id: str, ids: List[int]):
+    """Crea o actualiza el documento de búsqueda de los CFDIs (sin commit)"""
+    if not ids:
+        return
+    db.execute(GROUP_CONCAT_SQL)
+    db.execute(INDEX_IDS_SQL, {"client_id": client_id, "ids": list(ids)})
+
+
+def reindex_client(db: Session, client_id: str):
+    """Reconstruye los documentos de búsqueda de un cliente (sin commit)"""
+    db.execute(text("DELETE FROM cfdi_search WHERE client_id = :client_id"), {"client_id": client_id})
+    db.execute(GROUP_CONCAT_SQL)
+    db.execute(REINDEX_SQL, {"client_id": client_id})
+
+
+def token_cliente(client_id: str) -> str:
+    """Token del cliente al inicio de cada documento (igual que en INDEX_SQL)"""
+    return 't' + hashlib.md5(client_id.encode('utf-8')).hexdigest()[:16]
+
+
+def clasificar(consulta: str) -> Tuple[str, str]:
+    """
+    Decide cómo resolver la consulta: ('uuid' | 'rfc', prefijo),
+    ('folio', término) o ('texto', expresión BOOLEAN MODE sin el token del
+    cliente). ValueError si no quedan palabras buscables.
+    """
+    termino = consulta.strip().upper()
+    # Un folio numérico largo también es hexadecimal: UUID solo con guion o completo
+    if UUID_RE.match(termino) and any(ch.isdigit() for ch in termino) and ('-' in termino or len(termino) >= 32):
+        if len(termino) == 32:
+            # Sin guiones: se guardan con ellos (8-4-4-4-12)
+            termino = '-'.join((termino[:8], termino[8:12], termino[12:16], termino[16:20], termino[20:]))
+        return 'uuid', termino
+    if RFC_RE.match(termino):
+        return 'rfc', termino
+    if FOLIO_RE.match(termino) or (len(termino) < MIN_PALABRA and PALABRA_RE.fullmatch(termino)):
+        return 'folio', termino
+
+    # Solo letras y dígitos: los operadores de BOOLEAN MODE (+ - * " ~ < >)
+    # que escriba el usuario no llegan a MySQL
+    palabras = [p for p in PALABRA_RE.findall(consulta.lower()) if len(p) >= MIN_PALABRA]
+    if not palabras:
+        raise ValueError(f"La búsqueda debe tener al menos una palabra de {MIN_PALABRA} caracteres, un folio, RFC o UUID")
+    return 'texto', ' '.join(f'+{p}*' for p in dict.fromkeys(palabras))
+
+
+def _folio_params(termino: str) -> dict:
+    """Folios candidatos de "A-12345": '12345' (con serie A), 'A12345' y 'A-12345' tal cual"""
+    match = FOLIO_RE.match(termino)
+    if not match or not match.group(1):
+        return {"folios": [termino], "serie": None, "numero": termino}
+    serie, numero = match.groups()
+    return {"folios": list(dict.fromkeys([numero, serie + numero, termino])), "serie": serie, "numero": numero}
+
+
+def search_cfdis(db: Session, client_id: str, consulta: str, limit: int) -> Tuple[str, list]:
+    """Retorna (modo, filas) para la consulta del usuario"""
+    modo, termino = clasificar(consulta)
+    if modo == 'uuid':
+        rows = db.execute(UUID_SQL, {"client_id": client_id, "prefijo": f"{termino}%", "limit": limit}).fetchall()
+    elif modo == 'rfc':
+        rows = db.execute(RFC_SQL, {"client_id": client_id, "rfc": termino, "prefijo": f"{termino}%", "limit": limit}).fetchall()
+        if not rows and FOLIO_RE.match(termino):
+            # "FAC123" parece RFC parcial pero puede ser serie y folio
+            modo = 'folio'
+    if modo == 'folio':
+        rows = db.execute(FOLIO_SQL, {"client_id": client_id, "limit": limit, **_folio_params(termino)}).fetchall()
+    elif modo == 'texto':
+        consulta_ft = f"+{token_cliente(client_id)} {termino}"
+        rows = db.execute(TEXTO_SQL, {"client_id": client_id, "consulta": consulta_ft, "limit": limit}).fetchall()
+    return modo, rows
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot columnar en memoria de los CFDIs de un cliente (NumPy)
+
+Guarda por cliente las columnas de hechos de `cfdi` como arreglos NumPy
+(unos 32 bytes por CFDI):
+- id: int64, ordenado (sirve para ubicar filas al actualizar)
+- dia: int32, días desde 1970-01-01
+- total: int64, centavos (las sumas son exactas)
+- tipo, forma de pago, método de pago y estatus: uint8 con diccionario
+- emisor y receptor: int32 con un diccionario de RFCs común (y el último
+  nombre visto de cada RFC como emisor y como receptor)
+
+Sobre el snapshot, agrupaciones por cualquier combinación de dimensiones y
+top-N se resuelven en memoria, sin consultar MySQL.
+
+Sincronización (en cada acceso, con un lock por cliente que también cubre
+la consulta):
+- Si la versión de datos del cliente (report_cache) no cambió, no se
+  consulta nada más.
+- Si cambió, se leen solo las filas con updated_at posterior a la última
+  sincronización (menos ANALYTICS_SNAPSHOT_OVERLAP_SECONDS, por
+  transacciones que confirman tarde): las nuevas se agregan y las
+  existentes (cambios de estatus) se sobrescriben. Una transacción que
+  confirme más tarde que ese margen queda fuera hasta la siguiente recarga
+  completa (las altas las detecta el conteo; los cambios de estatus no).
+- Si el número de filas no coincide con el agregado diario, o el snapshot
+  tiene más de ANALYTICS_SNAPSHOT_TTL_SECONDS, se recarga completo: el
+  snapshot nuevo se construye fuera del lock y luego reemplaza al anterior,
+  así las consultas sobre el anterior no esperan a la recarga.
+
+Requiere numpy (opcional): sin numpy `disponible()` es False.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.report_cache import get_data_version
+from app.services.ttl_lru import TTLLRU
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EPOCA = date(1970, 1, 1).toordinal()
+FILAS_POR_LOTE = 50000
+
+DIMENSIONES = ('dia', 'mes', 'tipo', 'forma_pago', 'metodo_pago', 'estatus', 'emisor', 'receptor')
+METRICAS = ('cantidad', 'total')
+
+COLUMNAS = """
+    id, fecha, total, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion,
+    emisor_rfc, emisor_nombre, receptor_rfc, receptor_nombre
+"""
+
+CARGA_SQL = text(f"""
+    SELECT {COLUMNAS}
+    FROM cfdi
+    WHERE client_id = :client_id
+""").execution_options(stream_results=True, yield_per=FILAS_POR_LOTE)
+
+CAMBIOS_SQL = text(f"""
+    SELECT {COLUMNAS}
+    FROM cfdi
+    WHERE client_id = :client_id AND updated_at >= :desde
+""").execution_options(stream_results=True, yield_per=FILAS_POR_LOTE)
+
+CONTEO_SQL = text("""
+    SELECT COALESCE(SUM(cantidad), 0) FROM cfdi_daily_rollup WHERE client_id = :client_id
+""")
+
+AHORA_SQL = text("SELECT NOW()")
+
+
+def disponible() -> bool:
+    return np is not None
+
+
+class _Diccionario:
+    """Valor <-> código entero; el código 0 es NULL"""
+
+    def __init__(self, maximo: int):
+        self.maximo = maximo
+        self.valores: list = [None]
+        self.codigos: dict = {None: 0}
+
+    def codigo(self, valor) -> int:
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            codigo = len(self.valores)
+            if codigo > self.maximo:
+                raise ValueError(f"Demasiados valores distintos para el diccionario ({self.maximo})")
+            self.codigos[valor] = codigo
+            self.valores.append(valor)
+        return codigo
+
+
+class CfdiSnapshot:
+    """Columnas de hechos de los CFDIs de un cliente"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.lock = threading.Lock()
+        self.version = None
+        self.sincronizado_db = None  # Hora de la BD al iniciar la última sincronización
+        self.cargado = None  # Hora local de la última recarga completa
+        self._vaciar()
+
+    def _vaciar(self):
+        self.tipos = _Diccionario(255)
+        self.formas = _Diccionario(255)
+        self.metodos = _Diccionario(255)
+        self.estatus_dic = _Diccionario(255)
+        self.rfcs = _Diccionario(2 ** 31 - 1)
+        self.nombres = {'emisor': [None], 'receptor': [None]}
+        self.id = np.empty(0, np.int64)
+        self.dia = np.empty(0, np.int32)
+        self.total = np.empty(0, np.int64)
+        self.tipo = np.empty(0, np.uint8)
+        self.forma = np.empty(0, np.uint8)
+        self.metodo = np.empty(0, np.uint8)
+        self.estatus = np.empty(0, np.uint8)
+        self.emisor = np.empty(0, np.int32)
+        self.receptor = np.empty(0, np.int32)
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    # ------------------------------------------------------------------
+    # Carga y sincronización
+    # ------------------------------------------------------------------
+
+    def _codigos_rfc(self, rfcs: Sequence, nombres: Sequence, rol: str):
+        codigos = np.fromiter(map(self.rfcs.codigo, rfcs), np.int32, len(rfcs))
+        por_rol = self.nombres[rol]
+        faltan = len(self.rfcs.valores) - len(por_rol)
+        if faltan > 0:
+            por_rol.extend([None] * faltan)
+        for codigo, nombre in zip(codigos.tolist(), nombres):
+            if nombre:
+                por_rol[codigo] = nombre
+        return codigos
+
+    def _codificar(self, rows: Sequence) -> dict:
+        n = len(rows)
+        # Transponer una vez (en C) y convertir columna por columna
+        (ids, fechas, totales, tipos, formas, metodos, estatus,
+         emisores, emisores_nombre, receptores, receptores_nombre) = zip(*rows)
+        return {
+            'id': np.fromiter(ids, np.int64, n),
+            'dia': np.fromiter((fecha.toordinal() - EPOCA for fecha in fechas), np.int32, n),
+            'total': np.fromiter((round((total or 0) * 100) for total in totales), np.int64, n),
+            'tipo': np.fromiter(map(self.tipos.codigo, tipos), np.uint8, n),
+            'forma': np.fromiter(map(self.formas.codigo, formas), np.uint8, n),
+            'metodo': np.fromiter(map(self.metodos.codigo, metodos), np.uint8, n),
+            'estatus': np.fromiter((self.estatus_dic.codigo(e or 'pendiente') for e in estatus), np.uint8, n),
+            'emisor': self._codigos_rfc(emisores, emisores_nombre, 'emisor'),
+            'receptor': self._codigos_rfc(receptores, receptores_nombre, 'receptor'),
+        }
+
+    def _aplicar(self, lote: dict):
+        """Sobrescribe las filas existentes del lote y agrega las nuevas"""
+        if not len(lote['id']):
+            return
+        posiciones = np.searchsorted(self.id, lote['id'])
+        existe = posiciones < len(self.id)
+        existe[existe] = self.id[posiciones[existe]] == lote['id'][existe]
+
+        for columna, valores in lote.items():
+            if columna != 'id':
+                getattr(self, columna)[posiciones[existe]] = valores[existe]
+
+        nuevas = ~existe
+        if nuevas.any():
+            ordenado = not len(self.id) or lote['id'][nuevas].min() > self.id[-1]
+            for columna, valores in lote.items():
+                setattr(self, columna, np.concatenate([getattr(self, columna), valores[nuevas]]))
+            if not ordenado or not np.all(np.diff(lote['id'][nuevas]) > 0):
+                orden = np.argsort(self.id, kind='stable')
+                for columna in lote:
+                    setattr(self, columna, getattr(self, columna)[orden])
+
+    def _leer_cambios(self, db: Session, desde: datetime):
+        result = db.execute(CAMBIOS_SQL, {"client_id": self.client_id, "desde": desde})
+        for rows in result.partitions(FILAS_POR_LOTE):
+            self._aplicar(self._codificar(rows))
+
+    def _cargar(self, db: Session):
+        """Recarga completa: se concatenan los lotes y se ordena una sola vez"""
+        self._vaciar()
+        lotes = [self._codificar(rows) for rows in db.execute(CARGA_SQL, {"client_id": self.client_id}).partitions(FILAS_POR_LOTE)]
+        if not lotes:
+            return
+        columnas = {columna: np.concatenate([lote[columna] for lote in lotes]) for columna in lotes[0]}
+        orden = np.argsort(columnas['id'], kind='stable')
+        for columna, valores in columnas.items():
+            setattr(self, columna, valores[orden])
+
+    @classmethod
+    def cargar(cls, db: Session, client_id: str) -> 'CfdiSnapshot':
+        """Snapshot nuevo con la carga completa del cliente"""
+        snapshot = cls(client_id)
+        version = get_data_version(db, client_id)
+        ahora_db = db.execute(AHORA_SQL).scalar()
+        snapshot._cargar(db)
+        snapshot.version = version
+        snapshot.sincronizado_db = ahora_db
+        snapshot.cargado = datetime.now()
+        return snapshot
+
+    def sincronizar(self, db: Session) -> bool:
+        """
+        Aplica los cambios incrementales (ver docstring del módulo). Retorna
+        False si hace falta una recarga completa, que no se hace aquí: la
+        hace `snapshot_de` con `cargar` fuera del lock.
+        """
+        if self.cargado is None or (
+            datetime.now() - self.cargado > timedelta(seconds=settings.ANALYTICS_SNAPSHOT_TTL_SECONDS)
+        ):
+            return False
+        version = get_data_version(db, self.client_id)
+        if version == self.version:
+            return True
+
+        ahora_db = db.execute(AHORA_SQL).scalar()
+        self._leer_cambios(db, self.sincronizado_db - timedelta(seconds=settings.ANALYTICS_SNAPSHOT_OVERLAP_SECONDS))
+        # Borrados o altas fuera de la ventana: recarga completa
+        if db.execute(CONTEO_SQL, {"client_id": self.client_id}).scalar() != len(self):
+            return False
+
+        self.version = version
+        self.sincronizado_db = ahora_db
+        return True
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def filtro(self, fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None,
+               tipo: Optional[str] = None, estatus: Optional[str] = None,
+               emisor_rfc: Optional[str] = None, receptor_rfc: Optional[str] = None):
+        """Máscara booleana de las filas que cumplen los filtros (fechas inclusive)"""
+        mascara = np.ones(len(self), bool)
+        if fecha_inicio:
+            mascara &= self.dia >= fecha_inicio.toordinal() - EPOCA
+        if fecha_fin:
+            mascara &= self.dia <= fecha_fin.toordinal() - EPOCA
+        for columna, diccionario, valor in (
+            (self.tipo, self.tipos, tipo),
+            (self.estatus, self.estatus_dic, estatus),
+            (self.emisor, self.rfcs, emisor_rfc),
+            (self.receptor, self.rfcs, receptor_rfc),
+        ):
+            if valor:
+                codigo = diccionario.codigos.get(valor.upper() if diccionario is self.rfcs else valor)
+                if codigo is None:
+                    return np.zeros(len(self), bool)
+                mascara &= columna == codigo
+        return mascara
+
+    def _dimension(self, nombre: str, mascara):
+        """(códigos >= 0, base, función que decodifica un código)"""
+        if nombre in ('dia', 'mes'):
+            dias = self.dia[mascara].astype(np.int64)
+            if nombre == 'mes':
+                valores = dias.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+                formato = lambda v: str(np.datetime64(int(v), 'M'))  # noqa: E731
+            else:
+                valores = dias
+                formato = lambda v: str(np.datetime64(int(v), 'D'))  # noqa: E731
+            minimo = int(valores.min()) if len(valores) else 0
+            base = int(valores.max()) - minimo + 1 if len(valores) else 1
+            return valores - minimo, base, lambda codigo: formato(codigo + minimo)
+
+        if nombre in ('emisor', 'receptor'):
+            columna = getattr(self, nombre)
+            nombres = self.nombres[nombre]
+            return (columna[mascara].astype(np.int64), len(self.rfcs.valores),
+                    lambda codigo: {'rfc': self.rfcs.valores[codigo], 'nombre': nombres[codigo] if codigo < len(nombres) else None})
+
+        columna, diccionario = {
+            'tipo': (self.tipo, self.tipos),
+            'forma_pago': (self.forma, self.formas),
+            'metodo_pago': (self.metodo, self.metodos),
+            'estatus': (self.estatus, self.estatus_dic),
+        }[nombre]
+        return columna[mascara].astype(np.int64), len(diccionario.valores), lambda codigo: diccionario.valores[codigo]
+
+    def agrupar(self, por: Sequence[str], mascara=None, top: Optional[int] = None,
+                orden: str = 'total') -> List[dict]:
+        """
+        Cantidad y total (en pesos) por cada combinación de las dimensiones
+        `por`. Con `top` se retornan los N grupos mayores según `orden`
+        ('total' o 'cantidad'); sin `top`, todos ordenados por dimensión.
+        """
+        if mascara is None:
+            mascara = np.ones(len(self), bool)
+        totales = self.total[mascara]
+        if not len(totales):
+            return []
+
+        # Una llave int64 por fila: las dimensiones en base mixta
+        llave = np.zeros(len(totales), np.int64)
+        dimensiones = []
+        capacidad = 1
+        for nombre in por:
+            codigos, base, decodificar = self._dimension(nombre, mascara)
+            capacidad *= base
+            if capacidad >= 2 ** 62:
+                raise ValueError("Demasiadas combinaciones de dimensiones")
+            llave = llave * base + codigos
+            dimensiones.append((nombre, base, decodificar))
+
+        # Ordenar por llave y sumar por tramos (exacto en enteros)
+        orden_filas = np.argsort(llave, kind='stable')
+        llave = llave[orden_filas]
+        inicios = np.flatnonzero(np.r_[True, llave[1:] != llave[:-1]])
+        grupos = llave[inicios]
+        cantidades = np.diff(np.r_[inicios, len(llave)])
+        sumas = np.add.reduceat(totales[orden_filas], inicios)
+
+        seleccion = np.arange(len(grupos))
+        if top:
+            metrica = sumas if orden == 'total' else cantidades
+            seleccion = np.argsort(-metrica, kind='stable')[:top]
+
+        resultado = []
+        for i in seleccion:
+            llave_grupo = int(grupos[i])
+            fila = {}
+            for nombre, base, decodificar in reversed(dimensiones):
+                llave_grupo, codigo = divmod(llave_grupo, base)
+                fila[nombre] = decodificar(codigo)
+            resultado.append({**dict(reversed(list(fila.items()))),
+                              'cantidad': int(cantidades[i]), 'total': int(sumas[i]) / 100})
+        return resultado
+
+    def resumen(self, mascara=None) -> dict:
+        """Totales, RFC distintos y rango de fechas de las filas de la máscara"""
+        if mascara is None:
+            mascara = np.ones(len(self), bool)
+        dias = self.dia[mascara]
+        return {
+            'cantidad': int(mascara.sum()),
+            'total': int(self.total[mascara].sum()) / 100,
+            'emisores_unicos': len(np.unique(self.emisor[mascara])),
+            'receptores_unicos': len(np.unique(self.receptor[mascara])),
+            'fecha_mas_antigua': str(np.datetime64(int(dias.min()), 'D')) if len(dias) else None,
+            'fecha_mas_reciente': str(np.datetime64(int(dias.max()), 'D')) if len(dias) else None,
+        }
+
+
+_snapshots = TTLLRU(settings.ANALYTICS_SNAPSHOT_MAX_CLIENTS)
+_snapshots_lock = threading.Lock()
+
+
+@contextmanager
+def snapshot_de(db: Session, client_id: str) -> Iterator[CfdiSnapshot]:
+    """
+    Snapshot del cliente sincronizado con la BD. Las consultas se hacen
+    dentro del `with`: el lock impide que una sincronización cambie los
+    arreglos a la mitad de una consulta. La recarga completa se hace sin
+    ningún lock tomado y el snapshot nuevo reemplaza al anterior en el LRU;
+    quien ya tenía el anterior termina su consulta sobre él.
+    """
+    with _snapshots_lock:
+        snapshot = _snapshots.get(client_id, datetime.now())
+    if snapshot is not None:
+        with snapshot.lock:
+            if snapshot.sincronizar(db):
+                yield snapshot
+                return
+
+    snapshot = CfdiSnapshot.cargar(db, client_id)
+    with _snapshots_lock:
+        # La vigencia en el LRU solo limita la memoria; la recarga
+        # periódica la controla el propio snapshot
+        _snapshots.put(client_id, datetime.max, snapshot)
+    with snapshot.lock:
+        yield snapshot
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento de archivos de CFDI (XML/PDF) y de cargas recibidas
+
+Los XML y PDF se guardan por contenido (SHA-256) dentro de la carpeta de
+insumos: Insumos XML/cas/ab/cd/<sha256>.xml. Un mismo documento subido varias
+veces ocupa un solo archivo y solo se escribe la primera vez; la tabla
+`cfdi_blobs` lleva cuántos CFDIs referencian cada blob. Los CFDIs no se
+borran, así que los conteos solo crecen; los blobs huérfanos (archivo guardado
+pero INSERT fallido) se limpian con `gc_unreferenced_blobs`, expuesto en
+POST /api/config/almacenamiento/gc.
+
+Los CFDIs registrados antes conservan su ruta por fecha (YYYY/MM/DD/archivo);
+`resolve_path` resuelve ambos formatos.
+
+Los archivos originales de las cargas en segundo plano se guardan en
+UPLOAD_FOLDER hasta que termina su job.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+# Ruta dentro del contenedor Docker (mapeada a la carpeta local "Insumos XML")
+INSUMOS_BASE_PATH = "/app/insumos_xml"
+
+# Carpeta del almacenamiento por contenido dentro de INSUMOS_BASE_PATH
+CAS_DIR = "cas"
+
+# Blobs sin referencias más recientes que esto no se borran (pueden ser de un lote en curso)
+GC_MIN_AGE_SECONDS = 24 * 3600
+
+UPSERT_BLOB_SQL = text("""
+    INSERT INTO cfdi_blobs (sha256, path, size, ref_count)
+    VALUES (:sha256, :path, :size, :refs)
+    ON DUPLICATE KEY UPDATE ref_count = ref_count + VALUES(ref_count)
+""")
+
+
+def cas_relative_path(sha256: str, ext: str) -> str:
+    """Ruta relativa de un blob: cas/ab/cd/<sha256>.<ext>"""
+    return f"{CAS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext.lower().lstrip('.')}"
+
+
+def is_cas_path(relative_path: Optional[str]) -> bool:
+    return bool(relative_path) and relative_path.startswith(f"{CAS_DIR}/")
+
+
+def sha256_from_path(relative_path: str) -> str:
+    return PurePosixPath(relative_path).stem
+
+
+def store_blob(content: bytes, ext: str, base_path: str = INSUMOS_BASE_PATH) -> str:
+    """
+    Guarda un contenido en el almacenamiento por contenido (SHA-256) y
+    retorna su ruta relativa. Si el contenido ya existe no se escribe nada,
+    solo se actualiza su mtime para que `gc_unreferenced_blobs` no lo borre
+    antes de que el llamador registre la referencia.
+
+    La escritura es atómica: archivo temporal en la misma carpeta + os.replace,
+    así un lector nunca ve un archivo a medias.
+    """
+    sha256 = hashlib.sha256(content).hexdigest()
+    relative_path = cas_relative_path(sha256, ext)
+    target = Path(base_path) / relative_path
+
+    try:
+        os.utime(target)
+        return relative_path
+    except FileNotFoundError:
+        pass
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return relative_path
+
+
+def resolve_path(stored_path: Optional[str], base_path: str = INSUMOS_BASE_PATH) -> Optional[Path]:
+    """
+    Ruta absoluta de un archivo a partir de `cfdi.xml_path` / `cfdi.pdf_path`.
+
+    Soporta rutas del almacenamiento por contenido (cas/...) y las rutas por
+    fecha anteriores (YYYY/MM/DD/archivo), con o sin el prefijo "Insumos XML/".
+    """
+    if not stored_path:
+        return None
+
+    relative = stored_path.replace('\\', '/')
+    if relative.startswith("Insumos XML/"):
+        relative = relative[len("Insumos XML/"):]
+
+    base = Path(base_path).resolve()
+    full_path = (base / relative).resolve()
+    # No permitir rutas fuera de la carpeta de insumos
+    if base not in full_path.parents:
+        return None
+    return full_path
+
+
+def _extension(filename: str, default: str) -> str:
+    suffix = PurePosixPath(filename).suffix
+    return suffix[1:] if suffix else default
+
+
+def save_xml_file(file, base_path: str = INSUMOS_BASE_PATH) -> tuple:
+    """Save an uploaded XML file in the content-addressed store"""
+    relative_path = store_blob(file.file.read(), _extension(file.filename, "xml"), base_path)
+    return str(Path(base_path) / relative_path), relative_path
+
+
+def save_xml_content(filename: str, content: bytes, base_path: str = INSUMOS_BASE_PATH) -> tuple:
+    """Save XML content in the content-addressed store"""
+    relative_path = store_blob(content, _extension(filename, "xml"), base_path)
+    return str(Path(base_path) / relative_path), relative_path
+
+
+def save_xml_and_pdf(xml_filename: str, xml_content: bytes, pdf_data: Optional[tuple], base_path: str = INSUMOS_BASE_PATH) -> tuple:
+    """Save XML and PDF files in the content-addressed store"""
+    xml_relative_path = store_blob(xml_content, _extension(xml_filename, "xml"), base_path)
+    pdf_relative_path = None
+
+    # Guardar archivo PDF si existe
+    if pdf_data:
+        pdf_filename, pdf_content = pdf_data
+        pdf_relative_path = store_blob(pdf_content, _extension(pdf_filename, "pdf"), base_path)
+
+    return xml_relative_path, pdf_relative_path
+
+
+def add_blob_refs(db: Session, relative_paths: List[Optional[str]], base_path: str = INSUMOS_BASE_PATH):
+    """
+    Suma una referencia por cada ruta (en la transacción del llamador, junto
+    con el INSERT de los CFDIs que las usan). Las rutas por fecha se ignoran.
+    """
+    counts = Counter(p for p in relative_paths if is_cas_path(p))
+    if not counts:
+        return
+
+    rows = []
+    for relative_path, refs in counts.items():
+        full_path = Path(base_path) / relative_path
+        rows.append({
+            "sha256": sha256_from_path(relative_path),
+            "path": relative_path,
+            "size": full_path.stat().st_size if full_path.exists() else 0,
+            "refs": refs
+        })
+    db.execute(UPSERT_BLOB_SQL, rows)
+
+
+def gc_unreferenced_blobs(db: Session, base_path: str = INSUMOS_BASE_PATH, min_age_seconds: int = GC_MIN_AGE_SECONDS) -> dict:
+    """
+    Elimina blobs sin referencias: los de CFDIs cuyo INSERT falló después de
+    guardar el archivo. Solo toma archivos con más de `min_age_seconds` para no
+    borrar los de un lote en curso. Retorna {'eliminados', 'bytes'}.
+
+    Cada candidato se renombra primero a un temporal y se vuelve a revisar su
+    mtime: si un `store_blob` concurrente lo reutilizó (y lo tocó) antes del
+    renombre, se restaura; si llega después, ya no lo encuentra y lo reescribe.
+    """
+    referenced = {row.sha256 for row in db.execute(text("SELECT sha256 FROM cfdi_blobs WHERE ref_count > 0"))}
+    cutoff = time.time() - min_age_seconds
+    stats = {'eliminados': 0, 'bytes': 0}
+
+    cas_root = Path(base_path) / CAS_DIR
+    if not cas_root.exists():
+        return stats
+
+    for blob in cas_root.glob("*/*/*"):
+        if blob.name.startswith(".tmp-") or blob.stem in referenced:
+            continue
+        try:
+            if blob.stat().st_mtime >= cutoff:
+                continue
+            quarantine = blob.with_name(f".tmp-gc-{blob.name}")
+            os.rename(blob, quarantine)
+        except FileNotFoundError:
+            continue
+
+        stat = quarantine.stat()
+        if stat.st_mtime >= cutoff:
+            os.replace(quarantine, blob)
+            continue
+        quarantine.unlink()
+        stats['eliminados'] += 1
+        stats['bytes'] += stat.st_size
+    return stats
+
+
+def job_upload_dir(job_key: str) -> Path:
+    """Carpeta donde se guardan los archivos originales de una carga en segundo plano"""
+    return Path(settings.UPLOAD_FOLDER) / "cfdi_jobs" / job_key
+
+
+def save_upload(fileobj: BinaryIO, filename: str, job_key: str) -> str:
+    """Copia por bloques un archivo recibido a la carpeta del job; retorna su ruta"""
+    target_dir = job_upload_dir(job_key)
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    # Solo el nombre base: el nombre lo controla el cliente
+    file_path = target_dir / Path(filename).name
+    fileobj.seek(0)
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(fileobj, buffer, length=1024 * 1024)
+    return str(file_path)
+
+
+def remove_upload_dir(job_key: str):
+    """Elimina los archivos originales de un job ya procesado"""
+    shutil.rmtree(job_upload_dir(job_key), ignore_errors=True)
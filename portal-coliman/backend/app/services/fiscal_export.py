@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación completa del reporte fiscal (CSV y XLSX)
+
+Incluye las mismas secciones de resumen que el reporte JSON y todas las
+facturas del periodo, una fila por concepto (los datos de la factura se
+repiten en cada concepto; una factura sin conceptos ocupa una fila).
+
+Las facturas se leen con un cursor del lado del servidor (stream_results)
+en una sesión propia y se escriben conforme llegan: la memoria no depende
+del número de facturas. El orden (fecha, id) sale de
+idx_cfdi_client_fecha_id sin filesort, así la primera fila llega de
+inmediato, y las filas de cada factura con sus conceptos quedan juntas por
+el id, sin depender del plan del join.
+- CSV: se entrega por bloques mientras se lee la consulta.
+- XLSX: openpyxl en modo write_only escribe las filas a disco; el archivo
+  terminado se entrega por bloques desde un temporal.
+"""
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterator, List
+
+from sqlalchemy import text
+
+from app.db.database import SessionLocal
+from app.services.cfdi_rollup import periodo_params
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+logger = logging.getLogger('reports')
+
+FILAS_POR_LOTE = 1000
+BLOQUE_BYTES = 64 * 1024
+MAX_FILAS_HOJA = 1048576  # Límite de filas de una hoja de Excel
+
+FACTURAS_SQL = text("""
+    SELECT
+        c.uuid, c.tipo_comprobante, c.serie, c.folio, c.fecha,
+        c.emisor_rfc, c.emisor_nombre, c.receptor_rfc, c.receptor_nombre,
+        c.subtotal, c.descuento, c.total,
+        c.total_impuestos_trasladados, c.total_impuestos_retenidos,
+        c.moneda, c.metodo_pago, c.forma_pago, c.estatus_validacion,
+        k.clave_prod_serv, k.clave_unidad, k.cantidad, k.descripcion,
+        k.valor_unitario, k.importe, k.descuento AS concepto_descuento
+    FROM cfdi c
+    LEFT JOIN cfdi_conceptos k ON k.cfdi_id = c.id
+    WHERE c.client_id = :client_id
+      AND c.fecha >= :fecha_inicio AND c.fecha < :fecha_fin_exclusiva
+    ORDER BY c.fecha DESC, c.id DESC
+""").execution_options(stream_results=True, yield_per=FILAS_POR_LOTE)
+
+ENCABEZADO_FACTURAS = [
+    'UUID', 'Tipo', 'Serie', 'Folio', 'Fecha',
+    'RFC Emisor', 'Nombre Emisor', 'RFC Receptor', 'Nombre Receptor',
+    'Subtotal', 'Descuento', 'Total', 'IVA Trasladado', 'ISR Retenido',
+    'Moneda', 'Método de Pago', 'Forma de Pago', 'Estatus',
+    'Clave Prod/Serv', 'Clave Unidad', 'Cantidad', 'Descripción',
+    'Valor Unitario', 'Importe', 'Descuento Concepto'
+]
+
+ENCABEZADO_TIPOS = ['Tipo', 'Código', 'Cantidad', 'Subtotal', 'Descuento', 'Total', 'IVA Trasladado', 'ISR Retenido']
+ENCABEZADO_EMISORES = ['RFC', 'Nombre', 'Régimen', 'Facturas', 'Subtotal', 'Total', 'IVA']
+ENCABEZADO_RECEPTORES = ['RFC', 'Nombre', 'Uso CFDI', 'Facturas', 'Subtotal', 'Total', 'IVA']
+
+
+def xlsx_disponible() -> bool:
+    return Workbook is not None
+
+
+def _valor(valor):
+    """Decimal a float y fechas a texto; el resto sin cambios"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    return valor
+
+
+def iter_facturas(client_id: str, fecha_inicio: str, fecha_fin: str) -> Iterator[list]:
+    """Filas (factura + concepto) del periodo, leídas con cursor del lado del servidor"""
+    db = SessionLocal()
+    try:
+        resultado = db.execute(FACTURAS_SQL, periodo_params(client_id, fecha_inicio, fecha_fin))
+        for row in resultado:
+            yield [_valor(v) for v in row]
+    finally:
+        db.close()
+
+
+def secciones_resumen(reporte: dict) -> List[tuple]:
+    """Secciones de resumen del reporte fiscal JSON como (título, encabezado, filas)"""
+    resumen = reporte['resumen_general']
+    return [
+        ("Reporte Fiscal", ['Campo', 'Valor'], [
+            ['Periodo inicio', reporte['periodo']['fecha_inicio']],
+            ['Periodo fin', reporte['periodo']['fecha_fin']],
+            ['Generado en', reporte['generado_en']],
+            ['Generado por', reporte['generado_por']],
+            ['Total ingresos', resumen['total_ingresos']],
+            ['Total egresos', resumen['total_egresos']],
+            ['Utilidad bruta', resumen['utilidad_bruta']],
+            ['Total IVA trasladado', resumen['total_iva_trasladado']],
+            ['Total ISR retenido', resumen['total_isr_retenido']],
+        ]),
+        ("Resumen por tipo", ENCABEZADO_TIPOS, [
+            [t['tipo'], t['codigo'], t['cantidad'], t['subtotal'], t['descuento'], t['total'], t['iva_trasladado'], t['isr_retenido']]
+            for t in reporte['resumen_por_tipo']
+        ]),
+        ("Desglose emisores", ENCABEZADO_EMISORES, [
+            [e['rfc'], e['nombre'], e['regimen'], e['num_facturas'], e['subtotal'], e['total'], e['iva']]
+            for e in reporte['desglose_emisores']
+        ]),
+        ("Desglose receptores", ENCABEZADO_RECEPTORES, [
+            [r['rfc'], r['nombre'], r['uso_cfdi'], r['num_facturas'], r['subtotal'], r['total'], r['iva']]
+            for r in reporte['desglose_receptores']
+        ]),
+    ]
+
+
+def stream_csv(reporte: dict, client_id: str) -> Iterator[bytes]:
+    """CSV (UTF-8 con BOM para Excel): secciones de resumen y después las facturas"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def vaciar() -> bytes:
+        datos = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return datos
+
+    buffer.write('\ufeff')
+    for titulo, encabezado, filas in secciones_resumen(reporte):
+        writer.writerow([titulo])
+        writer.writerow(encabezado)
+        writer.writerows(filas)
+        writer.writerow([])
+    yield vaciar()
+
+    writer.writerow(['Facturas'])
+    writer.writerow(ENCABEZADO_FACTURAS)
+    periodo = reporte['periodo']
+    for i, fila in enumerate(iter_facturas(client_id, periodo['fecha_inicio'], periodo['fecha_fin']), 1):
+        writer.writerow(fila)
+        if i % FILAS_POR_LOTE == 0:
+            yield vaciar()
+    yield vaciar()
+
+
+def stream_xlsx(reporte: dict, client_id: str) -> Iterator[bytes]:
+    """XLSX con una hoja por sección de resumen y una hoja de facturas"""
+    workbook = Workbook(write_only=True)
+    for titulo, encabezado, filas in secciones_resumen(reporte):
+        hoja = workbook.create_sheet(titulo[:31])
+        hoja.append(encabezado)
+        for fila in filas:
+            hoja.append(fila)
+
+    # Una hoja admite MAX_FILAS_HOJA filas; el resto continúa en "Facturas (2)", ...
+    hojas = 0
+    filas_hoja = MAX_FILAS_HOJA
+    periodo = reporte['periodo']
+    for fila in iter_facturas(client_id, periodo['fecha_inicio'], periodo['fecha_fin']):
+        if filas_hoja >= MAX_FILAS_HOJA:
+            hojas += 1
+            hoja = workbook.create_sheet("Facturas" if hojas == 1 else f"Facturas ({hojas})")
+            hoja.append(ENCABEZADO_FACTURAS)
+            filas_hoja = 1
+        hoja.append(fila)
+        filas_hoja += 1
+
+    if not hojas:
+        workbook.create_sheet("Facturas").append(ENCABEZADO_FACTURAS)
+
+    with tempfile.TemporaryFile() as archivo:
+        workbook.save(archivo)
+        archivo.seek(0)
+        while True:
+            bloque = archivo.read(BLOQUE_BYTES)
+            if not bloque:
+                break
+            yield bloque
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de KPIs del dashboard
+
+Calcula todos los KPIs de /api/kpis/dashboard con dos consultas en lugar de
+nueve:
+
+1. Agregación condicional sobre cfdi_daily_rollup (un renglón por día y
+   combinación de tipo/forma/método/estatus) agrupada por (tipo, estatus,
+   forma de pago, mes de tendencia, en periodo). De esos grupos se arman
+   total, ingresos, egresos, distribución por tipo, estado de validación,
+   formas de pago y tendencia mensual.
+2. Top 5 clientes y top 5 proveedores con ROW_NUMBER() por tipo de
+   comprobante; requiere los RFC, así que lee de `cfdi`.
+
+El periodo son días completos: fecha_fin se incluye entera.
+
+Requiere MySQL 8 (funciones de ventana).
+"""
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.cfdi_rollup import periodo_params
+
+TIPOS_COMPROBANTE = {
+    'I': 'Ingreso',
+    'E': 'Egreso',
+    'T': 'Traslado',
+    'N': 'Nómina',
+    'P': 'Pago'
+}
+
+MESES_TENDENCIA = 6
+TOP_N = 5
+
+AGREGADOS_SQL = text("""
+    SELECT
+        tipo_comprobante,
+        estatus_validacion,
+        NULLIF(forma_pago, '') AS forma_pago,
+        CASE WHEN dia >= :tendencia_desde THEN DATE_FORMAT(dia, '%Y-%m') END AS mes,
+        CASE WHEN dia BETWEEN :fecha_inicio AND :fecha_fin THEN 1 ELSE 0 END AS en_periodo,
+        SUM(cantidad) AS cantidad,
+        SUM(total) AS monto
+    FROM cfdi_daily_rollup
+    WHERE client_id = :client_id
+      AND (dia BETWEEN :fecha_inicio AND :fecha_fin OR dia >= :tendencia_desde)
+    GROUP BY tipo_comprobante, estatus_validacion, NULLIF(forma_pago, ''), mes, en_periodo
+""")
+
+TOP_SQL = text("""
+    SELECT tipo_comprobante, rfc, nombre, num_facturas, monto
+    FROM (
+        SELECT
+            tipo_comprobante,
+            CASE WHEN tipo_comprobante = 'I' THEN receptor_rfc ELSE emisor_rfc END AS rfc,
+            CASE WHEN tipo_comprobante = 'I' THEN receptor_nombre ELSE emisor_nombre END AS nombre,
+            COUNT(*) AS num_facturas,
+            SUM(total) AS monto,
+            ROW_NUMBER() OVER (PARTITION BY tipo_comprobante ORDER BY SUM(total) DESC) AS posicion
+        FROM cfdi
+        WHERE client_id = :client_id
+          AND fecha >= :fecha_inicio AND fecha < :fecha_fin_exclusiva
+          AND tipo_comprobante IN ('I', 'E')
+        GROUP BY tipo_comprobante, rfc, nombre
+    ) ranking
+    WHERE posicion <= :top_n
+    ORDER BY tipo_comprobante, posicion
+""")
+
+
+def restar_meses(fecha: datetime, meses: int) -> datetime:
+    """Resta meses de calendario (como DATE_SUB(..., INTERVAL n MONTH))"""
+    mes_total = fecha.year * 12 + fecha.month - 1 - meses
+    anio, mes = divmod(mes_total, 12)
+    mes += 1
+    # Ajustar al último día del mes destino si el día no existe (31 -> 30, 29 -> 28)
+    siguiente = date(anio + (mes == 12), mes % 12 + 1, 1)
+    ultimo_dia = (siguiente - timedelta(days=1)).day
+    return fecha.replace(year=anio, month=mes, day=min(fecha.day, ultimo_dia))
+
+
+def resolver_periodo(fecha_inicio: Optional[str], fecha_fin: Optional[str]) -> tuple:
+    """
+    Periodo del dashboard: por defecto los últimos 30 días. Si solo se indica
+    uno de los extremos, el otro se completa (fin = hoy, inicio = fin - 30 días).
+    """
+    if not fecha_fin:
+        fecha_fin = datetime.now().strftime('%Y-%m-%d')
+    if not fecha_inicio:
+        fecha_inicio = (datetime.strptime(fecha_fin, '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
+    return fecha_inicio, fecha_fin
+
+
+def _float(valor) -> float:
+    return float(valor) if valor else 0
+
+
+def compute_dashboard(db: Session, client_id: str, fecha_inicio: str, fecha_fin: str, ahora: Optional[datetime] = None) -> dict:
+    """Calcula los KPIs del dashboard para el cliente y periodo (YYYY-MM-DD)"""
+    ahora = ahora or datetime.now()
+    params = periodo_params(client_id, fecha_inicio, fecha_fin)
+    params["tendencia_desde"] = restar_meses(ahora, MESES_TENDENCIA).date()
+
+    # Pasada 1: agregación condicional
+    total_cfdis = 0
+    tipos = {}
+    validacion = {}
+    formas_pago = {}
+    tendencia = {}
+
+    for row in db.execute(AGREGADOS_SQL, params):
+        cantidad = row.cantidad
+        monto = _float(row.monto)
+
+        if row.en_periodo:
+            total_cfdis += cantidad
+
+            tipo = tipos.setdefault(row.tipo_comprobante, {'cantidad': 0, 'monto': 0.0})
+            tipo['cantidad'] += cantidad
+            tipo['monto'] += monto
+
+            validacion[row.estatus_validacion] = validacion.get(row.estatus_validacion, 0) + cantidad
+
+            if row.forma_pago is not None:
+                forma = formas_pago.setdefault(row.forma_pago, {'cantidad': 0, 'monto_total': 0.0})
+                forma['cantidad'] += cantidad
+                forma['monto_total'] += monto
+
+        if row.mes is not None and row.tipo_comprobante in ('I', 'E'):
+            mes = tendencia.setdefault(row.mes, {
+                'mes': row.mes,
+                'ingresos': 0,
+                'egresos': 0,
+                'cantidad_ingresos': 0,
+                'cantidad_egresos': 0
+            })
+            if row.tipo_comprobante == 'I':
+                mes['ingresos'] += monto
+                mes['cantidad_ingresos'] += cantidad
+            else:
+                mes['egresos'] += monto
+                mes['cantidad_egresos'] += cantidad
+
+    # Pasada 2: top clientes (receptores de ingresos) y proveedores (emisores de egresos)
+    top = {'I': [], 'E': []}
+    for row in db.execute(TOP_SQL, {**params, "top_n": TOP_N}):
+        top[row.tipo_comprobante].append({
+            "rfc": row.rfc,
+            "nombre": row.nombre,
+            "num_facturas": row.num_facturas,
+            "total": _float(row.monto)
+        })
+
+    ingresos = tipos.get('I', {'cantidad': 0, 'monto': 0.0})
+    egresos = tipos.get('E', {'cantidad': 0, 'monto': 0.0})
+
+    return {
+        "periodo": {
+            "fecha_inicio": fecha_inicio,
+            "fecha_fin": fecha_fin
+        },
+        "resumen_general": {
+            "total_cfdis": total_cfdis,
+            "total_ingresos": ingresos['monto'],
+            "promedio_ingresos": ingresos['monto'] / ingresos['cantidad'] if ingresos['cantidad'] else 0,
+            "total_egresos": egresos['monto'],
+            "promedio_egresos": egresos['monto'] / egresos['cantidad'] if egresos['cantidad'] else 0,
+            "utilidad": ingresos['monto'] - egresos['monto']
+        },
+        "distribucion_tipos": [
+            {
+                "tipo": TIPOS_COMPROBANTE.get(codigo, codigo),
+                "codigo": codigo,
+                "cantidad": valores['cantidad'],
+                "monto": valores['monto']
+            }
+            for codigo, valores in tipos.items()
+        ],
+        "top_clientes": top['I'],
+        "top_proveedores": top['E'],
+        "tendencia_mensual": sorted(tendencia.values(), key=lambda x: x['mes']),
+        "estado_validacion": [
+            {"estado": estado, "cantidad": cantidad}
+            for estado, cantidad in validacion.items()
+        ],
+        "formas_pago": [
+            {"forma_pago": forma, **valores}
+            for forma, valores in sorted(formas_pago.items(), key=lambda item: item[1]['cantidad'], reverse=True)[:TOP_N]
+        ]
+    }
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Comparación de periodos sobre la serie diaria del agregado (NumPy)
+
+Las comparativas de un reporte (periodo anterior, mismo periodo del año
+anterior, últimos 12 meses contra los 12 previos, rangos explícitos) se
+resuelven con una sola consulta a cfdi_daily_rollup: la serie diaria que
+cubre todas las ventanas pedidas. Sobre ella:
+- las sumas de cada ventana salen de las sumas acumuladas (dos lecturas por
+  ventana, todas las ventanas a la vez);
+- diferencias y variaciones se calculan para todas las comparaciones juntas;
+- las medias móviles de la tendencia son diferencias de la misma suma
+  acumulada.
+
+Los montos se llevan en centavos (int64): las sumas son exactas.
+
+Ventanas (parámetro `comparar`, separadas por comas):
+- anterior: misma duración, inmediatamente antes del periodo
+- mes_anterior / anio_anterior: mismas fechas un mes / un año antes
+- ultimos_12_meses: los 12 meses que terminan en la fecha fin contra los 12 previos
+- YYYY-MM-DD:YYYY-MM-DD: el periodo contra ese rango
+
+El periodo y cada rango explícito abarcan como máximo MAX_DIAS_VENTANA días
+(el tope de 5 años del SAT) y la serie completa MAX_DIAS_SERIE: la matriz se
+reserva para todos los días entre la primera y la última fecha.
+
+Requiere numpy (opcional): sin numpy `disponible()` es False y el reporte
+ejecutivo responde 501; `parse_comparaciones` no lo usa.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_COMPARACIONES = 6
+MAX_DIAS_VENTANA = 5 * 366
+MAX_DIAS_SERIE = 20 * 366
+MEDIAS_MOVILES = (7, 30)
+
+# Filas de la matriz de la serie
+METRICAS = ('cantidad', 'cantidad_ingresos', 'ingresos', 'egresos')
+CANTIDAD, CANTIDAD_INGRESOS, INGRESOS, EGRESOS = range(len(METRICAS))
+
+SERIE_SQL = text("""
+    SELECT
+        dia,
+        SUM(cantidad) as cantidad,
+        SUM(CASE WHEN tipo_comprobante = 'I' THEN cantidad ELSE 0 END) as cantidad_ingresos,
+        SUM(CASE WHEN tipo_comprobante = 'I' THEN total ELSE 0 END) as ingresos,
+        SUM(CASE WHEN tipo_comprobante = 'E' THEN total ELSE 0 END) as egresos
+    FROM cfdi_daily_rollup
+    WHERE client_id = :client_id AND dia BETWEEN :desde AND :hasta
+    GROUP BY dia
+    ORDER BY dia
+""")
+
+
+def disponible() -> bool:
+    return np is not None
+
+
+class Ventana(NamedTuple):
+    inicio: date
+    fin: date
+
+    def to_dict(self) -> dict:
+        return {"fecha_inicio": self.inicio.isoformat(), "fecha_fin": self.fin.isoformat()}
+
+    @property
+    def dias(self) -> int:
+        return (self.fin - self.inicio).days + 1
+
+
+class Comparacion(NamedTuple):
+    nombre: str
+    actual: Ventana
+    referencia: Ventana
+
+
+def _restar_meses(dia: date, meses: int) -> date:
+    """Misma fecha `meses` atrás (el 31 pasa al último día del mes destino)"""
+    total = dia.year * 12 + dia.month - 1 - meses
+    anio, mes = divmod(total, 12)
+    return date(anio, mes + 1, min(dia.day, calendar.monthrange(anio, mes + 1)[1]))
+
+
+def _fecha(valor: str) -> date:
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+def parse_comparaciones(comparar: str, fecha_inicio: str, fecha_fin: str) -> List[Comparacion]:
+    """
+    Ventanas de comparación del parámetro `comparar` para el periodo
+    (YYYY-MM-DD, ambos inclusive). ValueError si alguna no es válida o si
+    el periodo, un rango o la serie que los cubre exceden los topes.
+    """
+    periodo = Ventana(_fecha(fecha_inicio), _fecha(fecha_fin))
+    if periodo.inicio > periodo.fin:
+        raise ValueError("Periodo inválido: fecha inicio posterior a fecha fin")
+    if periodo.dias > MAX_DIAS_VENTANA:
+        raise ValueError(f"Periodo demasiado largo: máximo {MAX_DIAS_VENTANA} días")
+    duracion = periodo.fin - periodo.inicio
+
+    comparaciones = []
+    for nombre in dict.fromkeys(p.strip() for p in comparar.split(',') if p.strip()):
+        if nombre == 'anterior':
+            fin = periodo.inicio - timedelta(days=1)
+            referencia = Ventana(fin - duracion, fin)
+            comparaciones.append(Comparacion(nombre, periodo, referencia))
+        elif nombre in ('mes_anterior', 'anio_anterior'):
+            meses = 1 if nombre == 'mes_anterior' else 12
+            referencia = Ventana(_restar_meses(periodo.inicio, meses), _restar_meses(periodo.fin, meses))
+            comparaciones.append(Comparacion(nombre, periodo, referencia))
+        elif nombre == 'ultimos_12_meses':
+            actual = Ventana(_restar_meses(periodo.fin, 12) + timedelta(days=1), periodo.fin)
+            referencia = Ventana(_restar_meses(actual.inicio, 12), actual.inicio - timedelta(days=1))
+            comparaciones.append(Comparacion(nombre, actual, referencia))
+        elif ':' in nombre:
+            try:
+                referencia = Ventana(*(_fecha(f) for f in nombre.split(':')))
+            except (TypeError, ValueError):
+                raise ValueError(f"Rango de comparación inválido: {nombre} (usar YYYY-MM-DD:YYYY-MM-DD)")
+            if referencia.inicio > referencia.fin:
+                raise ValueError(f"Rango de comparación inválido: {nombre} (inicio posterior al fin)")
+            if referencia.dias > MAX_DIAS_VENTANA:
+                raise ValueError(f"Rango de comparación demasiado largo: {nombre} (máximo {MAX_DIAS_VENTANA} días)")
+            comparaciones.append(Comparacion(nombre, periodo, referencia))
+        else:
+            raise ValueError(f"Comparación desconocida: {nombre}")
+
+    if len(comparaciones) > MAX_COMPARACIONES:
+        raise ValueError(f"Máximo {MAX_COMPARACIONES} comparaciones por reporte")
+
+    ventanas = [periodo] + [v for c in comparaciones for v in (c.actual, c.referencia)]
+    if (max(v.fin for v in ventanas) - min(v.inicio for v in ventanas)).days + 1 > MAX_DIAS_SERIE:
+        raise ValueError(f"Las comparaciones cubren más de {MAX_DIAS_SERIE} días; usar rangos más cercanos al periodo")
+    return comparaciones
+
+
+class SerieDiaria:
+    """
+    Métricas diarias de un cliente entre `desde` y `hasta` (días sin CFDIs
+    en cero), con su suma acumulada: acumulado[:, i] es la suma de los días
+    anteriores al día i.
+    """
+
+    def __init__(self, desde: date, hasta: date, filas: Sequence):
+        self.desde = desde
+        self.dias = (hasta - desde).days + 1
+        valores = np.zeros((len(METRICAS), self.dias), dtype=np.int64)
+        if filas:
+            posiciones = np.fromiter((row.dia.toordinal() - desde.toordinal() for row in filas), dtype=np.int64)
+            valores[:, posiciones] = np.array([
+                [int(row.cantidad or 0) for row in filas],
+                [int(row.cantidad_ingresos or 0) for row in filas],
+                [round((row.ingresos or 0) * 100) for row in filas],
+                [round((row.egresos or 0) * 100) for row in filas],
+            ], dtype=np.int64)
+        self.valores = valores
+        self.acumulado = np.concatenate(
+            [np.zeros((len(METRICAS), 1), dtype=np.int64), np.cumsum(valores, axis=1)], axis=1
+        )
+
+    @classmethod
+    def cargar(cls, db: Session, client_id: str, ventanas: Sequence[Ventana]) -> 'SerieDiaria':
+        """Una consulta al agregado que cubre todas las ventanas"""
+        desde = min(v.inicio for v in ventanas)
+        hasta = max(v.fin for v in ventanas)
+        filas = db.execute(SERIE_SQL, {"client_id": client_id, "desde": desde, "hasta": hasta}).fetchall()
+        return cls(desde, hasta, filas)
+
+    def _posiciones(self, dias) -> 'np.ndarray':
+        # Días fuera de la serie cuentan como vacíos
+        return np.clip(np.asarray(dias, dtype=np.int64) - self.desde.toordinal(), 0, self.dias)
+
+    def sumas(self, ventanas: Sequence[Ventana]) -> 'np.ndarray':
+        """Matriz (métricas x ventanas) con la suma de cada ventana"""
+        inicios = self._posiciones([v.inicio.toordinal() for v in ventanas])
+        fines = self._posiciones([v.fin.toordinal() + 1 for v in ventanas])
+        return self.acumulado[:, fines] - self.acumulado[:, inicios]
+
+    def tramo(self, ventana: Ventana) -> 'np.ndarray':
+        """Valores diarios (métricas x días) de la ventana"""
+        inicio, fin = self._posiciones([ventana.inicio.toordinal(), ventana.fin.toordinal() + 1])
+        return self.valores[:, inicio:fin]
+
+    def media_movil(self, ventana: Ventana, dias: int) -> 'np.ndarray':
+        """
+        Media de los `dias` días que terminan en cada día de la ventana
+        (métricas x días). Usa los días previos a la ventana: la serie debe
+        empezar `dias - 1` días antes.
+        """
+        fines = self._posiciones(range(ventana.inicio.toordinal() + 1, ventana.fin.toordinal() + 2))
+        inicios = self._posiciones(range(ventana.inicio.toordinal() + 1 - dias, ventana.fin.toordinal() + 2 - dias))
+        return (self.acumulado[:, fines] - self.acumulado[:, inicios]) / dias
+
+
+def kpis(sumas: 'np.ndarray') -> dict:
+    """KPIs del reporte (arreglos, uno por ventana) a partir de `SerieDiaria.sumas`"""
+    ingresos = sumas[INGRESOS] / 100
+    egresos = sumas[EGRESOS] / 100
+    cantidad_ingresos = sumas[CANTIDAD_INGRESOS]
+    return {
+        "total_cfdis": sumas[CANTIDAD],
+        "ingresos": ingresos,
+        "egresos": egresos,
+        "utilidad": (sumas[INGRESOS] - sumas[EGRESOS]) / 100,
+        "ticket_promedio": np.divide(
+            ingresos, cantidad_ingresos,
+            out=np.zeros(len(ingresos)), where=cantidad_ingresos > 0
+        ),
+    }
+
+
+def variacion(actual: 'np.ndarray', referencia: 'np.ndarray') -> 'np.ndarray':
+    """Variación porcentual (2 decimales); 0 si la referencia no es positiva"""
+    referencia = referencia.astype(np.float64)
+    cambio = np.divide(
+        actual - referencia, referencia,
+        out=np.zeros(len(referencia)), where=referencia > 0
+    )
+    return np.round(cambio * 100, 2)
+
+
+def _valor(arreglo: 'np.ndarray', i: int):
+    valor = arreglo[i].item()
+    return round(valor, 2) if isinstance(valor, float) else valor
+
+
+def comparar(serie: SerieDiaria, comparaciones: Sequence[Comparacion]) -> List[dict]:
+    """
+    Todas las comparaciones a la vez: una sola lectura de sumas para las
+    ventanas actual y de referencia de cada una
+    """
+    if not comparaciones:
+        return []
+    n = len(comparaciones)
+    sumas = serie.sumas([c.actual for c in comparaciones] + [c.referencia for c in comparaciones])
+    metricas = kpis(sumas)
+
+    resultado = [
+        {
+            "nombre": c.nombre,
+            "actual": c.actual.to_dict(),
+            "referencia": c.referencia.to_dict(),
+            "kpis": {}
+        }
+        for c in comparaciones
+    ]
+    for metrica, valores in metricas.items():
+        actual, referencia = valores[:n], valores[n:]
+        diferencia = actual - referencia
+        variaciones = variacion(actual, referencia)
+        for i, comparacion in enumerate(resultado):
+            comparacion["kpis"][metrica] = {
+                "valor": _valor(actual, i),
+                "referencia": _valor(referencia, i),
+                "diferencia": _valor(diferencia, i),
+                "variacion": variaciones[i].item()
+            }
+    return resultado
+
+
+def tendencia(serie: SerieDiaria, ventana: Ventana) -> List[dict]:
+    """
+    Días con CFDIs de la ventana, con las medias móviles de MEDIAS_MOVILES
+    (la serie debe empezar max(MEDIAS_MOVILES) - 1 días antes de la ventana)
+    """
+    valores = serie.tramo(ventana)
+    medias = {dias: serie.media_movil(ventana, dias) for dias in MEDIAS_MOVILES}
+
+    resultado = []
+    for i in np.flatnonzero(valores[CANTIDAD]):
+        dia = {
+            "fecha": (ventana.inicio + timedelta(days=int(i))).isoformat(),
+            "ingresos": valores[INGRESOS, i].item() / 100,
+            "egresos": valores[EGRESOS, i].item() / 100,
+            "cantidad": valores[CANTIDAD, i].item()
+        }
+        for dias, media in medias.items():
+            dia[f"ingresos_media_{dias}"] = round(media[INGRESOS, i].item() / 100, 2)
+            dia[f"egresos_media_{dias}"] = round(media[EGRESOS, i].item() / 100, 2)
+        resultado.append(dia)
+    return resultado
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de resultados de KPIs y reportes por cliente
+
+Clave: (endpoint, client_id, periodo normalizado). El periodo se normaliza
+después de aplicar los valores por defecto, así que "sin fechas" y las
+mismas fechas explícitas comparten entrada.
+
+Los números solo cambian cuando se ingieren o revalidan CFDIs. Cada cliente
+tiene una versión de datos (tabla `client_data_version`) que se incrementa
+en la misma transacción que esos cambios; una entrada guardada con otra
+versión se descarta. Leer la versión es una consulta por llave primaria, así
+que un acierto no toca `cfdi` ni el agregado diario.
+
+Además de la versión, cada entrada vence a los REPORT_CACHE_TTL_SECONDS:
+los periodos por defecto y la tendencia dependen de la fecha actual.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Hashable, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.ttl_lru import TTLLRU
+
+SELECT_VERSION_SQL = text("""
+    SELECT version FROM client_data_version WHERE client_id = :client_id
+""")
+
+BUMP_VERSION_SQL = text("""
+    INSERT INTO client_data_version (client_id, version, updated_at)
+    VALUES (:client_id, 1, NOW())
+    ON DUPLICATE KEY UPDATE version = version + 1, updated_at = NOW()
+""")
+
+_lru = TTLLRU(settings.REPORT_CACHE_MAX_ENTRIES)
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def get_data_version(db: Session, client_id: str) -> int:
+    """Versión actual de los datos del cliente (0 si nunca ha cambiado)"""
+    return db.execute(SELECT_VERSION_SQL, {"client_id": client_id}).scalar() or 0
+
+
+def bump_data_version(db: Session, client_id: str):
+    """Invalida la caché del cliente; se ejecuta en la transacción del llamador"""
+    db.execute(BUMP_VERSION_SQL, {"client_id": client_id})
+
+
+def normalizar_periodo(fecha_inicio: str, fecha_fin: str) -> Tuple[str, str]:
+    """Fechas en formato canónico YYYY-MM-DD (ValueError si no son válidas)"""
+    return (
+        datetime.strptime(fecha_inicio, '%Y-%m-%d').strftime('%Y-%m-%d'),
+        datetime.strptime(fecha_fin, '%Y-%m-%d').strftime('%Y-%m-%d')
+    )
+
+
+def _contar(endpoint: str, evento: str):
+    with _stats_lock:
+        contadores = _stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        contadores[evento] += 1
+
+
+def cached(db: Session, endpoint: str, client_id: str, periodo: Hashable, compute: Callable[[], dict]) -> dict:
+    """
+    Retorna el resultado en caché de (endpoint, cliente, periodo) si sigue
+    vigente para la versión actual de datos; si no, lo calcula con `compute`.
+    El resultado es compartido: quien llama no debe modificarlo.
+    """
+    if settings.REPORT_CACHE_TTL_SECONDS <= 0:
+        return compute()
+
+    key = (endpoint, client_id, periodo)
+    version = get_data_version(db, client_id)
+    ahora = datetime.now()
+
+    entrada = _lru.get(key, ahora)
+    if entrada is not None and entrada[0] == version:
+        _contar(endpoint, 'hits')
+        return entrada[1]
+
+    _contar(endpoint, 'misses')
+    resultado = compute()
+    _lru.put(key, ahora + timedelta(seconds=settings.REPORT_CACHE_TTL_SECONDS), (version, resultado))
+    return resultado
+
+
+def stats() -> dict:
+    """Aciertos y fallos por endpoint desde que inició el proceso"""
+    with _stats_lock:
+        por_endpoint = {endpoint: dict(contadores) for endpoint, contadores in _stats.items()}
+
+    hits = sum(c['hits'] for c in por_endpoint.values())
+    misses = sum(c['misses'] for c in por_endpoint.values())
+    for contadores in por_endpoint.values():
+        total = contadores['hits'] + contadores['misses']
+        contadores['hit_ratio'] = round(contadores['hits'] / total, 4) if total else 0
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0,
+        'entradas': len(_lru),
+        'max_entradas': settings.REPORT_CACHE_MAX_ENTRIES,
+        'ttl_segundos': settings.REPORT_CACHE_TTL_SECONDS,
+        'por_endpoint': por_endpoint
+    }
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente asíncrono del servicio de consulta de CFDI del SAT (ConsultaCFDIService)
+
+Un solo cliente por proceso, compartido por la validación individual y la
+validación por lote:
+- httpx.AsyncClient con keep-alive: las consultas reutilizan conexiones TLS
+- Límite de consultas simultáneas al SAT (SAT_CONSULTA_MAX_CONCURRENCIA)
+- Reintentos con backoff exponencial y jitter ante timeouts, errores de red y 5xx
+- Circuit breaker: tras varias fallas seguidas se deja de consultar al SAT
+  por un tiempo y se responde de inmediato con SatCircuitOpenError
+"""
+import asyncio
+import logging
+import random
+import time
+import xml.etree.ElementTree as ET
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger('cfdi_operations')
+
+T = TypeVar('T')
+
+SOAP_ACTION = 'http://tempuri.org/IConsultaCFDIService/Consulta'
+
+SOAP_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+                  xmlns:tem="http://tempuri.org/">
+   <soapenv:Header/>
+   <soapenv:Body>
+      <tem:Consulta>
+         <tem:expresionImpresa><![CDATA[{expresion_impresa}]]></tem:expresionImpresa>
+      </tem:Consulta>
+   </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class SatConsultaError(Exception):
+    """Error al consultar el servicio del SAT"""
+
+
+class SatTimeoutError(SatConsultaError):
+    """El SAT no respondió a tiempo (después de los reintentos)"""
+
+
+class SatCircuitOpenError(SatConsultaError):
+    """El circuit breaker está abierto: no se consulta al SAT por ahora"""
+
+
+def build_expresion_impresa(uuid: str, rfc_emisor: str, rfc_receptor: str, total: float, sello_fe: Optional[str] = None) -> str:
+    """
+    Expresión impresa (la línea del QR):
+    ?re={RFC_EMISOR}&rr={RFC_RECEPTOR}&tt={TOTAL}&id={UUID}[&fe={ULTIMOS_8_SELLO}]
+    """
+    expresion = f"?re={rfc_emisor}&rr={rfc_receptor}&tt={total:.6f}&id={uuid}"
+    if sello_fe:
+        expresion += f"&fe={sello_fe}"
+    return expresion
+
+
+def parse_consulta_response(content: bytes, uuid: str) -> dict:
+    """
+    Extrae el resultado de la respuesta SOAP de ConsultaCFDIService.
+
+    ConsultaResult está en el namespace de tempuri.org, pero sus campos en el
+    del contrato de datos del SAT; se buscan por nombre local.
+    """
+    root = ET.fromstring(content)
+    consulta_result = root.find('.//{*}ConsultaResult')
+
+    if consulta_result is None:
+        return {
+            'uuid': uuid,
+            'estado': 'No Encontrado',
+            'es_cancelable': 'No Disponible',
+            'estatus_cancelacion': 'No Disponible',
+            'validacion_efos': 'No Disponible',
+            'mensaje': 'El SAT no retornó información. Puede ser un delay de hasta 72 horas.'
+        }
+
+    def campo(nombre: str, default: str) -> str:
+        elemento = consulta_result.find(f'{{*}}{nombre}')
+        return elemento.text if elemento is not None and elemento.text is not None else default
+
+    return {
+        'uuid': uuid,
+        'codigo_estatus': campo('CodigoEstatus', 'N/A'),
+        'estado': campo('Estado', 'No Encontrado'),
+        'es_cancelable': campo('EsCancelable', 'No Disponible'),
+        'estatus_cancelacion': campo('EstatusCancelacion', 'No Disponible'),
+        'validacion_efos': campo('ValidacionEFOS', 'No Disponible')
+    }
+
+
+def estatus_validacion_from_estado(estado: str) -> str:
+    """Estatus de cfdi.estatus_validacion según el estado reportado por el SAT"""
+    return 'valido' if estado == 'Vigente' else 'rechazado' if estado == 'Cancelado' else 'pendiente'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker simple (cerrado / abierto / medio abierto).
+
+    Se usa desde un solo event loop, así que no necesita locks.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'cerrado'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'medio_abierto'
+        return 'abierto'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'cerrado':
+            return True
+        if state == 'medio_abierto' and not self.half_open_in_flight:
+            # Una sola consulta de prueba; si funciona, el circuito se cierra
+            self.half_open_in_flight = True
+            return True
+        return False
+
+    def release_probe(self):
+        """Libera la consulta de prueba sin contarla (consulta cancelada)"""
+        self.half_open_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.half_open_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit breaker SAT abierto tras {self.failures} fallas seguidas")
+            self.opened_at = time.monotonic()
+
+
+class SatConsultaClient:
+    """Cliente del servicio de consulta del SAT con pool de conexiones"""
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        retries: Optional[int] = None,
+        backoff_base: Optional[float] = None
+    ):
+        self.url = url or settings.SAT_CONSULTA_URL
+        self.timeout = timeout or settings.SAT_CONSULTA_TIMEOUT
+        self.max_concurrency = max_concurrency or settings.SAT_CONSULTA_MAX_CONCURRENCIA
+        self.retries = settings.SAT_CONSULTA_REINTENTOS if retries is None else retries
+        self.backoff_base = settings.SAT_CONSULTA_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.breaker = CircuitBreaker(settings.SAT_CB_FALLAS, settings.SAT_CB_SEGUNDOS_ABIERTO)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Se crea dentro del event loop que lo usa
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60.0
+                ),
+                headers={
+                    'Content-Type': 'text/xml; charset=utf-8',
+                    'SOAPAction': SOAP_ACTION
+                }
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    def _backoff(self, attempt: int) -> float:
+        # Backoff exponencial con jitter para no sincronizar los reintentos
+        return self.backoff_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def consultar(self, uuid: str, rfc_emisor: str, rfc_receptor: str, total: float, sello_fe: Optional[str] = None) -> dict:
+        """
+        Consulta el estado de un CFDI en el SAT.
+
+        Lanza SatCircuitOpenError, SatTimeoutError o SatConsultaError.
+        """
+        client = self._get_client()
+        body = SOAP_TEMPLATE.format(
+            expresion_impresa=build_expresion_impresa(uuid, rfc_emisor, rfc_receptor, total, sello_fe)
+        )
+
+        # El límite de concurrencia incluye los reintentos: con el SAT lento no
+        # se multiplica la carga. El circuito se revisa ya dentro del límite para
+        # que las consultas en espera no salgan si se abrió mientras esperaban.
+        async with self._semaphore:
+            if not self.breaker.allow():
+                raise SatCircuitOpenError("Servicio del SAT no disponible temporalmente (circuit breaker abierto)")
+
+            # Toda salida registra el resultado en el circuit breaker: si no, una
+            # consulta de prueba (medio abierto) que no termina lo dejaría tomado
+            try:
+                return await self._intentar(client, body, uuid)
+            except SatConsultaError:
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.error(f"Consulta SAT fallida para UUID {uuid}: {type(e).__name__}: {e}")
+                raise SatConsultaError(f"Error al consultar SAT: {str(e) or type(e).__name__}") from e
+            except BaseException:
+                # Cancelada (cliente desconectado, job cancelado, apagado): no es falla del SAT
+                self.breaker.release_probe()
+                raise
+
+    async def _intentar(self, client: httpx.AsyncClient, body: str, uuid: str) -> dict:
+        """Intentos con backoff; registra éxito o falla en el circuit breaker"""
+        ultimo_error: Exception = SatConsultaError("Sin respuesta del SAT")
+        for attempt in range(self.retries + 1):
+            if attempt:
+                if self.breaker.state == 'abierto':
+                    break
+                await asyncio.sleep(self._backoff(attempt - 1))
+            try:
+                response = await client.post(self.url, content=body)
+            except httpx.TimeoutException as e:
+                ultimo_error = SatTimeoutError(f"Timeout al consultar el SAT ({type(e).__name__})")
+                continue
+            except httpx.TransportError as e:
+                ultimo_error = SatConsultaError(f"Error de conexión con el SAT: {str(e) or type(e).__name__}")
+                continue
+
+            if response.status_code >= 500:
+                ultimo_error = SatConsultaError(f"Error al consultar SAT: {response.status_code}")
+                continue
+            if response.status_code != 200:
+                # Errores 4xx no se reintentan (ni cuentan para el circuit breaker)
+                self.breaker.record_success()
+                raise SatConsultaError(f"Error al consultar SAT: {response.status_code}")
+
+            self.breaker.record_success()
+            return parse_consulta_response(response.content, uuid)
+
+        self.breaker.record_failure()
+        logger.error(f"Consulta SAT fallida para UUID {uuid}: {ultimo_error}")
+        raise ultimo_error
+
+
+_client: Optional[SatConsultaClient] = None
+_main_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_sat_consulta_client() -> SatConsultaClient:
+    """Cliente compartido del proceso"""
+    global _client
+    if _client is None:
+        _client = SatConsultaClient()
+    return _client
+
+
+def bind_event_loop(loop: asyncio.AbstractEventLoop):
+    """Registra el event loop de la aplicación (al iniciar), dueño del cliente compartido"""
+    global _main_loop
+    _main_loop = loop
+
+
+def run_with_client(func: Callable[[SatConsultaClient], Awaitable[T]]) -> T:
+    """
+    Ejecuta `func(cliente)` desde un hilo (por ejemplo, un worker de jobs).
+
+    Si la aplicación está corriendo, la corrutina se ejecuta en su event loop
+    con el cliente compartido: la validación por lote comparte conexiones,
+    límite de concurrencia y circuit breaker con la validación individual.
+    Fuera de la aplicación (scripts) se usa un cliente temporal.
+    """
+    if _main_loop is not None and _main_loop.is_running():
+        return asyncio.run_coroutine_threadsafe(func(get_sat_consulta_client()), _main_loop).result()
+
+    async def run_standalone():
+        client = SatConsultaClient()
+        try:
+            return await func(client)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run_standalone())
+
+
+async def close_sat_consulta_client():
+    """Cierra las conexiones del cliente compartido (al cerrar la aplicación)"""
+    if _client is not None:
+        await _client.aclose()
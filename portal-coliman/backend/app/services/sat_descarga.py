@@ -0,0 +1,1060 @@
+# -*- coding: utf-8 -*-
+"""
+Descarga masiva del SAT en segundo plano
+
+Cada sincronización es una fila de `sat_download_requests` que el scheduler
+lleva de principio a fin sin intervención:
+
+1. pendiente: se envía la solicitud al SAT (emitidos o recibidos) y se
+   guarda el IdSolicitud.
+2. solicitada: se verifica el estado (recover_comprobante_status) con
+   backoff: el intervalo crece SAT_DESCARGA_VERIFICAR_FACTOR veces por cada
+   verificación sin cambios, hasta SAT_DESCARGA_VERIFICAR_MAX_SEGUNDOS, y
+   vuelve al inicial cuando el SAT cambia de estado (aceptada -> en proceso).
+3. descargando: en cuanto el SAT termina, los paquetes se descargan en
+   paralelo (SAT_DESCARGA_CONCURRENCIA) y cada uno pasa a la ingesta
+   (CfdiBatchWriter) en cuanto llega: el base64 se decodifica por bloques a
+   un archivo temporal y los XML se leen del ZIP sin extraerlo a disco. Los
+   paquetes ingeridos se registran uno por uno: tras un reinicio se retoma
+   en el siguiente.
+4. completada, error, rechazada o vencida.
+
+Periodos largos: al registrar la sincronización, `planear_ventanas` divide
+el periodo en ventanas bajo el tope de CFDIs por solicitud del SAT (con los
+conteos diarios ya registrados del cliente) y cada ventana es una solicitud
+hija de la raíz ('dividida'). Si el SAT responde que una ventana excede el
+tope (código 5003), se parte en dos mitades. Las hijas avanzan en paralelo
+(a lo más SAT_DESCARGA_MAX_SOLICITUDES_ACTIVAS enviadas a la vez) y la raíz
+acumula sus resultados hasta que terminan todas.
+
+Los workers (hilos iniciados con la aplicación) toman el siguiente paso
+vencido con `SELECT ... FOR UPDATE SKIP LOCKED` y lo reservan moviendo
+next_check_at SAT_DESCARGA_LEASE_MINUTOS adelante: si el proceso muere a
+mitad de un paso, otro worker lo retoma al vencer la reserva. Durante la
+descarga un hilo la renueva cada tercio del plazo: un paquete que tarda más
+que la reserva no queda libre para otro worker a la mitad de su ingesta.
+
+En modo completa, los paquetes de Metadata se guardan en DOWNLOADS_DIR pero
+no se ingieren (no traen XML).
+
+Sincronización incremental (modo 'incremental'): cada ventana se pide
+primero como Metadata (UUID, fechas y estatus, sin XML). Los UUIDs de la
+Metadata se cruzan contra `cfdi` del cliente por bloques; los cancelados se
+actualizan con un UPDATE masivo y solo los días con UUIDs que faltan se
+piden después como CFDI, en solicitudes hijas de la misma raíz. Una
+sincronización diaria sin CFDIs nuevos no descarga ningún XML.
+"""
+import binascii
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.services.cfdi_ingestion import CfdiBatchWriter, ingest_file
+from app.services import sat_validation_cache
+from app.services.cfdi_storage import save_xml_and_pdf
+from app.services.sat_consulta import estatus_validacion_from_estado
+from app.services.sat_validacion import bulk_update_estatus
+
+logger = logging.getLogger('sat_descarga_masiva')
+
+# Directorio para almacenar descargas
+DOWNLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "downloads", "sat_masivo")
+
+# Caracteres base64 por bloque al decodificar un paquete (múltiplo de 4)
+BLOQUE_BASE64 = 4 * 256 * 1024
+
+TIPOS = ('emitidos', 'recibidos')
+TIPOS_SOLICITUD = ('CFDI', 'Metadata')
+MODO_COMPLETA = 'completa'
+MODO_INCREMENTAL = 'incremental'
+MODOS = (MODO_COMPLETA, MODO_INCREMENTAL)
+
+# UUIDs por consulta al cruzar la Metadata contra `cfdi`
+BLOQUE_UUIDS = 1000
+# Estatus de la Metadata del SAT
+ESTATUS_METADATA = {'1': 'Vigente', '0': 'Cancelado'}
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_SOLICITADA = 'solicitada'
+ESTADO_DESCARGANDO = 'descargando'
+ESTADO_COMPLETADA = 'completada'
+ESTADO_ERROR = 'error'
+ESTADO_RECHAZADA = 'rechazada'
+ESTADO_VENCIDA = 'vencida'
+# Periodo repartido en solicitudes hijas; la raíz pasa a completada o error
+# cuando terminan todas
+ESTADO_DIVIDIDA = 'dividida'
+ESTADOS_ACTIVOS = (ESTADO_PENDIENTE, ESTADO_SOLICITADA, ESTADO_DESCARGANDO)
+
+# Tope de CFDIs por solicitud del SAT y fracción que se usa al planear
+TOPE_CFDIS = {'CFDI': 200000, 'Metadata': 1000000}
+OCUPACION_PLANEADA = 0.8
+
+# EstadoSolicitud del SAT
+ESTADOS_SAT = {
+    1: "Aceptada",
+    2: "En Proceso",
+    3: "Terminada",
+    4: "Error",
+    5: "Rechazada",
+    6: "Vencida"
+}
+ESTADOS_SAT_FINALES = {4: ESTADO_ERROR, 5: ESTADO_RECHAZADA, 6: ESTADO_VENCIDA}
+# CodEstatus de una petición atendida
+CODIGO_ACEPTADA = '5000'
+# CodigoEstadoSolicitud "No se encontró la información": el periodo no tiene CFDIs
+CODIGO_SIN_INFORMACION = '5004'
+# "Tope máximo de elementos de la consulta": la ventana se parte en dos
+CODIGO_TOPE_MAXIMO = '5003'
+
+COLUMNAS = """
+    id, client_id, user_id, parent_id, tipo, tipo_solicitud, modo, fecha_inicio, fecha_fin,
+    rfc_emisor, rfc_receptor, estado, solicitud_id, estado_sat, codigo_estado,
+    numero_cfdis, paquetes, paquetes_descargados, resultado, verificaciones,
+    errores, mensaje, next_check_at, finished_at, created_at
+"""
+
+EXISTENTES_SQL = text("""
+    SELECT id, uuid, emisor_rfc, receptor_rfc, total, estatus_validacion
+    FROM cfdi
+    WHERE client_id = :client_id AND uuid IN :uuids
+""").bindparams(bindparam("uuids", expanding=True))
+
+CLAIM_SQL = text(f"""
+    SELECT {COLUMNAS}
+    FROM sat_download_requests
+    WHERE estado IN :activos AND next_check_at <= NOW()
+    ORDER BY next_check_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+""").bindparams(bindparam("activos", expanding=True))
+
+CONTEO_DIARIO_SQL = text("""
+    SELECT dia, SUM(cantidad) AS cantidad
+    FROM cfdi_daily_rollup
+    WHERE client_id = :client_id AND dia BETWEEN :fecha_inicio AND :fecha_fin
+    GROUP BY dia
+""")
+
+_workers: List[threading.Thread] = []
+_stop_event = threading.Event()
+
+# e.firma del proceso: (llave, signer). La llave es el RFC y el mtime de
+# fiel_config.json: cambiar la e.firma genera otra.
+_servicio_sat: Optional[tuple] = None
+_servicio_sat_lock = threading.Lock()
+# Servicio SAT de cada hilo: (signer, servicio), ver `_servicio_para`
+_servicio_hilo = threading.local()
+
+
+class SatDescargaError(Exception):
+    """Error al preparar o ejecutar una operación de descarga masiva"""
+
+
+class SatFielError(SatDescargaError):
+    """No hay e.firma configurada o no es válida"""
+
+
+def _fiel_mtime() -> Optional[int]:
+    from app.api.config import FIEL_DIR
+
+    try:
+        return os.stat(os.path.join(FIEL_DIR, "fiel_config.json")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _servicio_para(signer, clase):
+    """
+    Servicio SAT del hilo actual para `signer`. El objeto SAT de satcfdi
+    guarda y renueva su token de autenticación sin sincronización, así que
+    no se comparte entre hilos; el Signer (la parte costosa de cargar) sí.
+    Cada hilo se autentica una vez y reutiliza su token.
+    """
+    cargado = getattr(_servicio_hilo, 'actual', None)
+    if cargado is None or cargado[0] is not signer:
+        cargado = _servicio_hilo.actual = (signer, clase(signer=signer))
+    return cargado[1]
+
+
+def servicio_del_hilo(sat_service):
+    """Servicio SAT del hilo actual con el mismo Signer que `sat_service`"""
+    return _servicio_para(sat_service.signer, type(sat_service))
+
+
+def _cargar_signer(mtime: int):
+    from app.api.config import get_fiel_credentials
+
+    try:
+        from satcfdi.models import Signer
+    except ImportError:
+        raise SatDescargaError("La librería satcfdi no está instalada. Por favor ejecuta: pip install satcfdi")
+
+    creds = get_fiel_credentials()
+    if not creds or not creds.get('is_valid'):
+        raise SatFielError(
+            "No hay credenciales FIEL configuradas o no son válidas. "
+            "Por favor configura tu e.firma en Configuración > e.firma (FIEL) SAT"
+        )
+
+    try:
+        with open(creds['cer_path'], 'rb') as f:
+            cer_data = f.read()
+        with open(creds['key_path'], 'rb') as f:
+            key_data = f.read()
+        signer = Signer.load(certificate=cer_data, key=key_data, password=creds['password'])
+    except Exception as e:
+        raise SatDescargaError(f"Error al configurar servicio SAT: {str(e)}")
+
+    logger.info(f"e.firma cargada para {creds['rfc']}")
+    return (creds['rfc'], mtime), signer
+
+
+def crear_servicio_sat():
+    """
+    Servicio de descarga masiva (satcfdi) con las credenciales FIEL del
+    sistema. La e.firma se carga una vez por proceso (lectura de .cer/.key,
+    descifrado de la contraseña y de la llave privada) mientras no cambie
+    fiel_config.json; el servicio es uno por hilo (`_servicio_para`) y
+    reutiliza su token de autenticación.
+    """
+    global _servicio_sat
+    try:
+        from satcfdi.pacs.sat import SAT
+    except ImportError:
+        raise SatDescargaError("La librería satcfdi no está instalada. Por favor ejecuta: pip install satcfdi")
+    mtime = _fiel_mtime()
+
+    def vigente(cargado) -> bool:
+        return cargado is not None and mtime is not None and cargado[0][1] == mtime
+
+    cargado = _servicio_sat
+    if not vigente(cargado):
+        # Con el lock: peticiones simultáneas cargan la e.firma una sola vez
+        with _servicio_sat_lock:
+            cargado = _servicio_sat
+            if not vigente(cargado):
+                _servicio_sat = None
+                cargado = _servicio_sat = _cargar_signer(mtime)
+    _, signer = cargado
+    return _servicio_para(signer, SAT), signer
+
+
+def invalidar_servicio_sat():
+    """Descarta la e.firma del proceso (al guardar o eliminar la e.firma)"""
+    global _servicio_sat
+    with _servicio_sat_lock:
+        _servicio_sat = None
+
+
+# ============================================================================
+# SOLICITUDES
+# ============================================================================
+
+def planear_ventanas(db: Session, client_id: str, tipo_solicitud: str,
+                     fecha_inicio: date, fecha_fin: date) -> List[Tuple[date, date]]:
+    """
+    Divide el periodo en ventanas que el SAT acepte: a lo más
+    SAT_DESCARGA_VENTANA_MAX_DIAS días y un estimado de CFDIs bajo
+    OCUPACION_PLANEADA del tope por solicitud. El estimado son los CFDIs del
+    cliente ya registrados por día (emitidos y recibidos juntos, así que
+    sobrestima); los días sin datos cuentan como cero y, si aun así una
+    ventana excede el tope, el scheduler la parte en dos (`_dividir`).
+    """
+    tope = TOPE_CFDIS[tipo_solicitud] * OCUPACION_PLANEADA
+    max_dias = settings.SAT_DESCARGA_VENTANA_MAX_DIAS
+    conteos = {
+        row.dia: int(row.cantidad)
+        for row in db.execute(CONTEO_DIARIO_SQL, {
+            "client_id": client_id, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin
+        })
+    }
+
+    ventanas = []
+    inicio, acumulado = fecha_inicio, 0
+    for desplazamiento in range((fecha_fin - fecha_inicio).days + 1):
+        dia = fecha_inicio + timedelta(days=desplazamiento)
+        cantidad = conteos.get(dia, 0)
+        if dia > inicio and (acumulado + cantidad > tope or (max_dias and (dia - inicio).days >= max_dias)):
+            ventanas.append((inicio, dia - timedelta(days=1)))
+            inicio, acumulado = dia, 0
+        acumulado += cantidad
+    ventanas.append((inicio, fecha_fin))
+    return ventanas
+
+
+def _insertar_solicitud(db: Session, client_id: str, user_id: Optional[int], tipo: str,
+                        fecha_inicio: date, fecha_fin: date, tipo_solicitud: str,
+                        rfc_emisor: Optional[str], rfc_receptor: Optional[str],
+                        parent_id: Optional[int] = None, estado: str = ESTADO_PENDIENTE,
+                        modo: str = MODO_COMPLETA) -> int:
+    result = db.execute(text("""
+        INSERT INTO sat_download_requests (
+            client_id, user_id, parent_id, tipo, tipo_solicitud, modo, fecha_inicio, fecha_fin,
+            rfc_emisor, rfc_receptor, estado, next_check_at
+        ) VALUES (
+            :client_id, :user_id, :parent_id, :tipo, :tipo_solicitud, :modo, :fecha_inicio, :fecha_fin,
+            :rfc_emisor, :rfc_receptor, :estado, NOW()
+        )
+    """), {
+        "client_id": client_id,
+        "user_id": user_id,
+        "parent_id": parent_id,
+        "tipo": tipo,
+        "tipo_solicitud": tipo_solicitud,
+        "modo": modo,
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "rfc_emisor": rfc_emisor,
+        "rfc_receptor": rfc_receptor,
+        "estado": estado
+    })
+    return result.lastrowid
+
+
+def crear_solicitud(db: Session, client_id: str, user_id: Optional[int], tipo: str,
+                    fecha_inicio: date, fecha_fin: date, tipo_solicitud: str = 'CFDI',
+                    rfc_emisor: Optional[str] = None, rfc_receptor: Optional[str] = None,
+                    modo: str = MODO_COMPLETA) -> int:
+    """
+    Registra una sincronización; el scheduler la envía al SAT en su siguiente
+    vuelta. Si el periodo no cabe en una solicitud, se registra como
+    'dividida' con una solicitud hija por ventana (`planear_ventanas`).
+
+    En modo incremental las hijas piden Metadata (siempre hay raíz: ahí se
+    suman la conciliación y las descargas de CFDI que deriven de ella).
+    """
+    datos = (client_id, user_id, tipo)
+    filtros = (tipo_solicitud, rfc_emisor, rfc_receptor)
+    if modo == MODO_INCREMENTAL:
+        ventanas = planear_ventanas(db, client_id, 'Metadata', fecha_inicio, fecha_fin)
+        solicitud_id = _insertar_solicitud(
+            db, *datos, fecha_inicio, fecha_fin, 'CFDI', rfc_emisor, rfc_receptor,
+            estado=ESTADO_DIVIDIDA, modo=modo
+        )
+        for inicio, fin in ventanas:
+            _insertar_solicitud(
+                db, *datos, inicio, fin, 'Metadata', rfc_emisor, rfc_receptor,
+                parent_id=solicitud_id, modo=modo
+            )
+        logger.info(f"Solicitud {solicitud_id}: sincronización incremental {fecha_inicio} a {fecha_fin} ({len(ventanas)} ventanas de Metadata)")
+        db.commit()
+        return solicitud_id
+
+    ventanas = planear_ventanas(db, client_id, tipo_solicitud, fecha_inicio, fecha_fin)
+    if len(ventanas) == 1:
+        solicitud_id = _insertar_solicitud(db, *datos, fecha_inicio, fecha_fin, *filtros)
+    else:
+        solicitud_id = _insertar_solicitud(db, *datos, fecha_inicio, fecha_fin, *filtros, estado=ESTADO_DIVIDIDA)
+        for inicio, fin in ventanas:
+            _insertar_solicitud(db, *datos, inicio, fin, *filtros, parent_id=solicitud_id)
+        logger.info(f"Solicitud {solicitud_id}: {fecha_inicio} a {fecha_fin} dividida en {len(ventanas)} ventanas")
+    db.commit()
+    return solicitud_id
+
+
+def _json(valor, omision=None):
+    return json.loads(valor) if valor else omision
+
+
+def _fecha(valor) -> Optional[str]:
+    return valor.isoformat() if valor else None
+
+
+def serialize_solicitud(row) -> dict:
+    paquetes = _json(row.paquetes, [])
+    descargados = _json(row.paquetes_descargados, [])
+    return {
+        'id': row.id,
+        'parent_id': row.parent_id,
+        'tipo': row.tipo,
+        'tipo_solicitud': row.tipo_solicitud,
+        'modo': row.modo,
+        'fecha_inicio': _fecha(row.fecha_inicio),
+        'fecha_fin': _fecha(row.fecha_fin),
+        'rfc_emisor': row.rfc_emisor,
+        'rfc_receptor': row.rfc_receptor,
+        'estado': row.estado,
+        'solicitud_id': row.solicitud_id,
+        'estado_sat': row.estado_sat,
+        'estado_sat_texto': ESTADOS_SAT.get(row.estado_sat) if row.estado_sat else None,
+        'codigo_estado': row.codigo_estado,
+        'numero_cfdis': row.numero_cfdis,
+        'paquetes': len(paquetes),
+        'paquetes_descargados': len(descargados),
+        'resultado': _json(row.resultado),
+        'mensaje': row.mensaje,
+        'siguiente_paso': _fecha(row.next_check_at) if row.estado in ESTADOS_ACTIVOS else None,
+        'created_at': _fecha(row.created_at),
+        'finished_at': _fecha(row.finished_at)
+    }
+
+
+def get_solicitud(db: Session, solicitud_id: int, client_id: str) -> Optional[dict]:
+    """Estado de una sincronización del cliente (None si no existe), con sus ventanas si se dividió"""
+    row = db.execute(text(f"""
+        SELECT {COLUMNAS} FROM sat_download_requests
+        WHERE id = :id AND client_id = :client_id
+    """), {"id": solicitud_id, "client_id": client_id}).fetchone()
+    if not row:
+        return None
+
+    solicitud = serialize_solicitud(row)
+    if row.parent_id is None:
+        ventanas = db.execute(text(f"""
+            SELECT {COLUMNAS} FROM sat_download_requests
+            WHERE parent_id = :id AND estado <> :dividida
+            ORDER BY fecha_inicio
+        """), {"id": row.id, "dividida": ESTADO_DIVIDIDA}).fetchall()
+        if ventanas:
+            solicitud['ventanas'] = [serialize_solicitud(ventana) for ventana in ventanas]
+    return solicitud
+
+
+def list_solicitudes(db: Session, client_id: str, limit: int = 50) -> List[dict]:
+    """Sincronizaciones del cliente, las más recientes primero"""
+    rows = db.execute(text(f"""
+        SELECT {COLUMNAS} FROM sat_download_requests
+        WHERE client_id = :client_id AND parent_id IS NULL
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit
+    """), {"client_id": client_id, "limit": limit}).fetchall()
+    return [serialize_solicitud(row) for row in rows]
+
+
+def _actualizar(db: Session, registro_id: int, segundos: Optional[float] = None, **campos):
+    """
+    UPDATE de la solicitud con commit. `segundos` programa el siguiente paso
+    (None = no se toca next_check_at); los JSON se serializan aquí.
+    """
+    asignaciones = [f"{campo} = :{campo}" for campo in campos]
+    params = {
+        campo: json.dumps(valor) if isinstance(valor, (list, dict)) else valor
+        for campo, valor in campos.items()
+    }
+    if segundos is not None:
+        asignaciones.append("next_check_at = NOW() + INTERVAL :segundos SECOND")
+        params["segundos"] = int(segundos)
+    if campos.get('estado') and campos['estado'] not in ESTADOS_ACTIVOS:
+        asignaciones.append("finished_at = NOW()")
+    params["id"] = registro_id
+    db.execute(text(f"UPDATE sat_download_requests SET {', '.join(asignaciones)} WHERE id = :id"), params)
+    db.commit()
+
+
+def _lease() -> int:
+    return settings.SAT_DESCARGA_LEASE_MINUTOS * 60
+
+
+@contextlib.contextmanager
+def _renovar_reserva(registro_id: int):
+    """
+    Mantiene reservada la solicitud mientras dura el bloque: un hilo con su
+    propia sesión mueve next_check_at un plazo adelante cada tercio del plazo.
+    Al salir se detiene antes de que quien llama programe el siguiente paso.
+    """
+    detener = threading.Event()
+
+    def renovar():
+        while not detener.wait(max(_lease() / 3, 1)):
+            db = SessionLocal()
+            try:
+                db.execute(text("""
+                    UPDATE sat_download_requests
+                    SET next_check_at = NOW() + INTERVAL :segundos SECOND
+                    WHERE id = :id AND estado = :estado
+                """), {"segundos": _lease(), "id": registro_id, "estado": ESTADO_DESCARGANDO})
+                db.commit()
+            except Exception as e:
+                logger.warning(f"Solicitud {registro_id}: no se pudo renovar la reserva: {str(e)}")
+            finally:
+                db.close()
+
+    hilo = threading.Thread(target=renovar, name=f"sat-reserva-{registro_id}", daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def espera_verificacion(verificaciones: int) -> float:
+    """Segundos hasta la siguiente verificación tras `verificaciones` sin cambio de estado"""
+    return min(
+        settings.SAT_DESCARGA_VERIFICAR_INICIAL_SEGUNDOS * settings.SAT_DESCARGA_VERIFICAR_FACTOR ** verificaciones,
+        settings.SAT_DESCARGA_VERIFICAR_MAX_SEGUNDOS
+    )
+
+
+# ============================================================================
+# PAQUETES
+# ============================================================================
+
+def decodificar_paquete(paquete: Union[str, bytes]) -> BinaryIO:
+    """
+    Decodifica el base64 de un paquete por bloques en un archivo temporal
+    (en memoria hasta SAT_DESCARGA_SPOOL_MB, después en disco), sin armar
+    el ZIP completo como bytes. Retorna el archivo posicionado al inicio.
+    """
+    archivo = tempfile.SpooledTemporaryFile(max_size=settings.SAT_DESCARGA_SPOOL_MB * 1024 * 1024)
+    pendiente = b''
+    for inicio in range(0, len(paquete), BLOQUE_BASE64):
+        bloque = paquete[inicio:inicio + BLOQUE_BASE64]
+        if isinstance(bloque, str):
+            bloque = bloque.encode('ascii')
+        # Saltos de línea del base64: el bloque decodificable debe ser múltiplo de 4
+        bloque = pendiente + bloque.translate(None, b' \t\r\n')
+        corte = len(bloque) - len(bloque) % 4
+        archivo.write(binascii.a2b_base64(bloque[:corte]))
+        pendiente = bloque[corte:]
+    if pendiente:
+        raise SatDescargaError("Paquete con base64 incompleto")
+    archivo.seek(0)
+    return archivo
+
+
+def descargar_paquete(sat_service, paquete_id: str) -> BinaryIO:
+    """
+    Descarga y decodifica un paquete. satcfdi retorna (encabezado, base64);
+    si el SAT rechaza la descarga (CodEstatus distinto de 5000) el error es
+    el suyo, no el de un base64 vacío.
+    """
+    # Corre en los hilos del pool de descargas: cada uno con su servicio
+    header, paquete = servicio_del_hilo(sat_service).recover_comprobante_download(id_paquete=paquete_id)
+    codigo = header.get('CodEstatus')
+    if codigo != CODIGO_ACEPTADA or not paquete:
+        raise SatDescargaError(
+            f"El SAT no entregó el paquete {paquete_id} (código {codigo}): {header.get('Mensaje', '')}"
+        )
+    return decodificar_paquete(paquete)
+
+
+def descargar_paquetes(sat_service, paquetes: List[str], concurrencia: Optional[int] = None) -> Iterator[Tuple[str, Union[BinaryIO, Exception]]]:
+    """
+    Descarga paquetes con un pool acotado de hilos y entrega (paquete_id,
+    archivo) en cuanto cada uno está listo; si la descarga falló, el
+    segundo elemento es la excepción. Nunca hay más de `concurrencia`
+    paquetes descargados sin consumir: la memoria no crece con el número
+    de paquetes. Quien consume cierra cada archivo.
+    """
+    concurrencia = max(1, concurrencia or settings.SAT_DESCARGA_CONCURRENCIA)
+    siguientes = iter(paquetes)
+    en_curso = {}
+    with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="sat-paquete") as pool:
+        for paquete_id in itertools.islice(siguientes, concurrencia):
+            en_curso[pool.submit(descargar_paquete, sat_service, paquete_id)] = paquete_id
+        while en_curso:
+            listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                paquete_id = en_curso.pop(futuro)
+                siguiente = next(siguientes, None)
+                if siguiente is not None:
+                    en_curso[pool.submit(descargar_paquete, sat_service, siguiente)] = siguiente
+                try:
+                    archivo = futuro.result()
+                except Exception as e:
+                    yield paquete_id, e
+                    continue
+                yield paquete_id, archivo
+
+
+def guardar_paquete(archivo: BinaryIO, solicitud_id: str, paquete_id: str) -> str:
+    """Copia un paquete decodificado a DOWNLOADS_DIR/<solicitud>/<paquete>.zip"""
+    directorio = os.path.join(DOWNLOADS_DIR, solicitud_id)
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{paquete_id}.zip")
+    with open(ruta, 'wb') as destino:
+        shutil.copyfileobj(archivo, destino)
+    return ruta
+
+
+def ingerir_paquetes(db: Session, client_id: str, sat_service, paquetes: List[str]) -> dict:
+    """
+    Descarga los paquetes en paralelo y registra sus CFDIs conforme llegan:
+    los XML se leen del ZIP directamente hacia el parseo y el INSERT por
+    lotes, con un solo writer para todos los paquetes.
+    """
+    writer = CfdiBatchWriter(db, client_id, save_files=save_xml_and_pdf)
+    paquetes_con_error = []
+    for paquete_id, archivo in descargar_paquetes(sat_service, paquetes):
+        if isinstance(archivo, Exception):
+            logger.error(f"Error descargando paquete {paquete_id}: {str(archivo)}")
+            paquetes_con_error.append({'paquete_id': paquete_id, 'error': str(archivo)})
+            continue
+        with archivo:
+            ingest_file(writer, f"{paquete_id}.zip", archivo)
+
+    rendimiento = writer.close()
+    return {
+        'archivos_procesados': writer.processed,
+        'insertados': rendimiento['insertados'],
+        'duplicados': rendimiento['duplicados'],
+        'errores': len(writer.errors) - rendimiento['duplicados'],
+        'paquetes_con_error': paquetes_con_error,
+        'rendimiento': rendimiento
+    }
+
+
+# ============================================================================
+# METADATA (SINCRONIZACIÓN INCREMENTAL)
+# ============================================================================
+
+def leer_metadata(archivo: BinaryIO) -> Iterator[dict]:
+    """
+    Registros de un paquete de Metadata: ZIP con archivos de texto separados
+    por '~' cuya primera línea trae los nombres de columna (Uuid, RfcEmisor,
+    ..., FechaEmision, Estatus, FechaCancelacion). Se leen en streaming.
+    """
+    with zipfile.ZipFile(archivo) as zf:
+        for nombre in zf.namelist():
+            if not nombre.lower().endswith('.txt'):
+                continue
+            with zf.open(nombre) as crudo:
+                lineas = io.TextIOWrapper(crudo, encoding='utf-8-sig', errors='replace')
+                columnas = next(lineas, '').strip().split('~')
+                for linea in lineas:
+                    campos = linea.rstrip('\r\n').split('~')
+                    if len(campos) < 2:
+                        continue
+                    if len(campos) > len(columnas):
+                        # Un nombre con '~' desplaza las columnas: el UUID va al inicio
+                        # y fechas y estatus se alinean desde el final
+                        campos = campos[:1] + campos[len(campos) - len(columnas) + 1:]
+                    yield dict(zip(columnas, campos))
+
+
+def _dia_emision(registro: dict) -> Optional[date]:
+    try:
+        return datetime.strptime(registro.get('FechaEmision', '')[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def conciliar_metadata(db: Session, client_id: str, registros: Iterable[dict]) -> Tuple[dict, Set[date]]:
+    """
+    Cruza los UUIDs de la Metadata contra `cfdi` del cliente por bloques de
+    BLOQUE_UUIDS (un `IN` sobre la llave única client_id + uuid). Los CFDIs
+    que ya existen toman el estatus de la Metadata (cancelados) con un UPDATE
+    masivo por bloque; de los que faltan solo se regresa el día de emisión.
+    Los estatus cambiados y los cancelados se guardan también en la caché de
+    validación, en la misma transacción: una validación posterior no los
+    regresa a Vigente con un resultado en caché anterior.
+
+    Retorna (estadísticas, días con UUIDs faltantes). Hace commit por bloque.
+    """
+    stats = {'metadata_uuids': 0, 'existentes': 0, 'faltantes': 0, 'estatus_actualizados': 0}
+    dias_faltantes = set()
+
+    def procesar(bloque: Dict[str, dict]):
+        existentes = {
+            row.uuid.upper(): row
+            for row in db.execute(EXISTENTES_SQL, {"client_id": client_id, "uuids": list(bloque)})
+        }
+        actualizar = []
+        cache = []
+        for uuid, registro in bloque.items():
+            row = existentes.get(uuid)
+            if row is None:
+                stats['faltantes'] += 1
+                dia = _dia_emision(registro)
+                if dia:
+                    dias_faltantes.add(dia)
+                continue
+            estado = ESTATUS_METADATA.get(registro.get('Estatus', '').strip())
+            # 'revision' es una marca manual: la Metadata no la sobrescribe
+            if not estado:
+                continue
+            cambia = row.estatus_validacion != 'revision' and row.estatus_validacion != estatus_validacion_from_estado(estado)
+            if not cambia and estado != 'Cancelado':
+                continue
+            # Mismo formato que una consulta al SAT (sat_consulta.parse_consulta_response)
+            resultado = {
+                'uuid': row.uuid,
+                'codigo_estatus': 'Metadata de descarga masiva',
+                'estado': estado,
+                'es_cancelable': 'No Disponible',
+                'estatus_cancelacion': 'No Disponible',
+                'validacion_efos': 'No Disponible',
+                'fecha_cancelacion': registro.get('FechaCancelacion') or None,
+                'fuente': 'metadata'
+            }
+            cache.append((
+                sat_validation_cache.cache_key(row.uuid, row.emisor_rfc, row.receptor_rfc, row.total),
+                resultado
+            ))
+            if cambia:
+                actualizar.append((row.id, resultado))
+        stats['existentes'] += len(existentes)
+        stats['estatus_actualizados'] += len(actualizar)
+        bulk_update_estatus(db, client_id, actualizar)
+        sat_validation_cache.store_many(db, cache)
+        db.commit()
+
+    bloque = {}
+    for registro in registros:
+        uuid = (registro.get('Uuid') or '').strip().upper()
+        if not uuid:
+            continue
+        stats['metadata_uuids'] += 1
+        bloque[uuid] = registro
+        if len(bloque) >= BLOQUE_UUIDS:
+            procesar(bloque)
+            bloque = {}
+    if bloque:
+        procesar(bloque)
+    return stats, dias_faltantes
+
+
+def agrupar_dias(dias: Iterable[date]) -> List[Tuple[date, date]]:
+    """Rangos de días consecutivos: [d1, d2, d3, d7] -> [(d1, d3), (d7, d7)]"""
+    rangos = []
+    for dia in sorted(set(dias)):
+        if rangos and dia - rangos[-1][1] == timedelta(days=1):
+            rangos[-1] = (rangos[-1][0], dia)
+        else:
+            rangos.append((dia, dia))
+    return rangos
+
+
+# ============================================================================
+# PASOS DEL SCHEDULER
+# ============================================================================
+
+def _dividir(db: Session, solicitud, codigo: str):
+    """
+    La ventana excede el tope del SAT: se parte en dos mitades que cuelgan
+    de la misma raíz y vuelven a la cola (si una mitad también excede, se
+    vuelve a partir). Un solo día no se puede dividir más.
+    """
+    if solicitud.fecha_inicio >= solicitud.fecha_fin:
+        _actualizar(
+            db, solicitud.id, estado=ESTADO_ERROR, codigo_estado=codigo,
+            mensaje=f"El {solicitud.fecha_inicio} excede el tope de CFDIs por solicitud del SAT"
+        )
+        return
+
+    raiz = solicitud.parent_id or solicitud.id
+    mitad = solicitud.fecha_inicio + (solicitud.fecha_fin - solicitud.fecha_inicio) // 2
+    for inicio, fin in ((solicitud.fecha_inicio, mitad), (mitad + timedelta(days=1), solicitud.fecha_fin)):
+        _insertar_solicitud(
+            db, solicitud.client_id, solicitud.user_id, solicitud.tipo, inicio, fin,
+            solicitud.tipo_solicitud, solicitud.rfc_emisor, solicitud.rfc_receptor,
+            parent_id=raiz, modo=solicitud.modo
+        )
+    _actualizar(db, solicitud.id, estado=ESTADO_DIVIDIDA, codigo_estado=codigo, mensaje="Excede el tope del SAT")
+    logger.info(f"Solicitud {solicitud.id} dividida: {solicitud.fecha_inicio}..{mitad} y {mitad + timedelta(days=1)}..{solicitud.fecha_fin}")
+
+
+def actualizar_raiz(db: Session, raiz_id: int):
+    """
+    Suma en la raíz los resultados de sus ventanas y, cuando ya no queda
+    ninguna activa, la cierra: completada si todas lo están, si no error con
+    las ventanas que fallaron.
+
+    La fila de la raíz se bloquea antes de leer las ventanas: dos workers que
+    terminan ventanas hermanas a la vez suman uno después del otro, y el
+    segundo lee ya la ventana del primero (la lectura consistente empieza
+    después del bloqueo), así que la raíz nunca queda con un total viejo.
+    """
+    db.execute(text("SELECT id FROM sat_download_requests WHERE id = :id FOR UPDATE"), {"id": raiz_id})
+    ventanas = db.execute(text("""
+        SELECT estado, fecha_inicio, fecha_fin, numero_cfdis, resultado, mensaje
+        FROM sat_download_requests
+        WHERE parent_id = :id AND estado <> :dividida
+        ORDER BY fecha_inicio
+    """), {"id": raiz_id, "dividida": ESTADO_DIVIDIDA}).fetchall()
+
+    resultado = {}
+    for ventana in ventanas:
+        for clave, valor in _json(ventana.resultado, {}).items():
+            if isinstance(valor, int):
+                resultado[clave] = resultado.get(clave, 0) + valor
+    campos = {
+        'resultado': resultado,
+        'numero_cfdis': sum(ventana.numero_cfdis or 0 for ventana in ventanas)
+    }
+
+    if not any(ventana.estado in ESTADOS_ACTIVOS for ventana in ventanas):
+        fallidas = [ventana for ventana in ventanas if ventana.estado != ESTADO_COMPLETADA]
+        campos['estado'] = ESTADO_ERROR if fallidas else ESTADO_COMPLETADA
+        campos['mensaje'] = (
+            f"{len(fallidas)} de {len(ventanas)} ventanas sin completar: " + "; ".join(
+                f"{v.fecha_inicio}..{v.fecha_fin} {v.estado} ({v.mensaje or ''})" for v in fallidas
+            )
+        ) if fallidas else None
+        logger.info(f"Solicitud {raiz_id}: {len(ventanas)} ventanas terminadas, {len(fallidas)} con error | {resultado}")
+    _actualizar(db, raiz_id, **campos)
+
+
+def _solicitudes_en_sat(db: Session) -> int:
+    """Solicitudes enviadas que el SAT aún no termina (la e.firma es una para todo el sistema)"""
+    return db.execute(
+        text("SELECT COUNT(*) FROM sat_download_requests WHERE estado = :estado"),
+        {"estado": ESTADO_SOLICITADA}
+    ).scalar()
+
+
+def _enviar(db: Session, solicitud, sat_service, signer):
+    """
+    Envía la solicitud al SAT. satcfdi responde con un dict de los atributos
+    del SAT: IdSolicitud (vacío si no la aceptó), CodEstatus y Mensaje.
+    """
+    from satcfdi.pacs.sat import TipoDescargaMasivaTerceros
+
+    tipo_solicitud = (
+        TipoDescargaMasivaTerceros.CFDI if solicitud.tipo_solicitud == 'CFDI'
+        else TipoDescargaMasivaTerceros.METADATA
+    )
+    if solicitud.tipo == 'emitidos':
+        # El emisor es el RFC de la e.firma; el receptor solo filtra si se indicó
+        response = sat_service.recover_comprobante_emitted_request(
+            fecha_inicial=solicitud.fecha_inicio,
+            fecha_final=solicitud.fecha_fin,
+            rfc_receptor=solicitud.rfc_receptor or None,
+            tipo_solicitud=tipo_solicitud
+        )
+    else:
+        response = sat_service.recover_comprobante_received_request(
+            fecha_inicial=solicitud.fecha_inicio,
+            fecha_final=solicitud.fecha_fin,
+            rfc_receptor=signer.rfc,
+            rfc_emisor=solicitud.rfc_emisor or None,
+            tipo_solicitud=tipo_solicitud
+        )
+
+    id_solicitud = response.get('IdSolicitud')
+    codigo = response.get('CodEstatus')
+    if not id_solicitud and codigo == CODIGO_TOPE_MAXIMO:
+        _dividir(db, solicitud, codigo)
+        return
+    if not id_solicitud:
+        mensaje = response.get('Mensaje') or f"Solicitud no aceptada por el SAT (código {codigo})"
+        _actualizar(db, solicitud.id, estado=ESTADO_ERROR, codigo_estado=codigo, mensaje=mensaje)
+        logger.warning(f"Solicitud {solicitud.id}: el SAT no la aceptó ({codigo})")
+        return
+
+    _actualizar(
+        db, solicitud.id, settings.SAT_DESCARGA_VERIFICAR_INICIAL_SEGUNDOS,
+        estado=ESTADO_SOLICITADA, solicitud_id=id_solicitud, codigo_estado=codigo,
+        verificaciones=0, errores=0, mensaje=None
+    )
+    logger.info(f"Solicitud {solicitud.id} enviada al SAT: {id_solicitud}")
+
+
+def _verificar(db: Session, solicitud, sat_service):
+    """
+    Consulta el estado en el SAT; si terminó, pasa directo a la descarga.
+    satcfdi responde con un dict: EstadoSolicitud (int), CodigoEstadoSolicitud,
+    NumeroCFDIs, IdsPaquetes y Mensaje.
+    """
+    response = sat_service.recover_comprobante_status(solicitud.solicitud_id)
+    estado_sat = response.get('EstadoSolicitud')
+    codigo = response.get('CodigoEstadoSolicitud')
+    mensaje = response.get('Mensaje')
+
+    if codigo == CODIGO_TOPE_MAXIMO:
+        _dividir(db, solicitud, codigo)
+        return
+
+    if estado_sat in (1, 2):
+        # El intervalo vuelve al inicial cuando el SAT avanza de estado
+        verificaciones = solicitud.verificaciones + 1 if estado_sat == solicitud.estado_sat else 0
+        espera = espera_verificacion(verificaciones)
+        _actualizar(
+            db, solicitud.id, espera,
+            estado_sat=estado_sat, codigo_estado=codigo, verificaciones=verificaciones, errores=0
+        )
+        logger.info(f"Solicitud {solicitud.id}: {ESTADOS_SAT[estado_sat]}, siguiente verificación en {espera:.0f}s")
+        return
+
+    if estado_sat == 3:
+        paquetes = list(response.get('IdsPaquetes') or [])
+        _actualizar(
+            db, solicitud.id, _lease(),
+            estado=ESTADO_DESCARGANDO, estado_sat=estado_sat, codigo_estado=codigo,
+            numero_cfdis=response.get('NumeroCFDIs'), paquetes=paquetes, errores=0
+        )
+        logger.info(f"Solicitud {solicitud.id} terminada en el SAT: {len(paquetes)} paquetes")
+        _descargar(db, solicitud, sat_service, paquetes, [], {})
+        return
+
+    if estado_sat == 5 and codigo == CODIGO_SIN_INFORMACION:
+        # Periodo sin CFDIs: la sincronización terminó sin nada que descargar
+        _actualizar(
+            db, solicitud.id, estado=ESTADO_COMPLETADA, estado_sat=estado_sat, codigo_estado=codigo,
+            numero_cfdis=0, paquetes=[], mensaje=mensaje
+        )
+        return
+
+    estado = ESTADOS_SAT_FINALES.get(estado_sat, ESTADO_ERROR)
+    _actualizar(
+        db, solicitud.id, estado=estado, estado_sat=estado_sat, codigo_estado=codigo,
+        mensaje=mensaje or f"Estado del SAT: {ESTADOS_SAT.get(estado_sat, estado_sat)}"
+    )
+    logger.warning(f"Solicitud {solicitud.id} terminó como {estado} (SAT {estado_sat}, código {codigo})")
+
+
+def _ingerir(db: Session, client_id: str, paquete_id: str, archivo: BinaryIO) -> dict:
+    """Registra los CFDIs de un paquete con la ingesta por lotes"""
+    writer = CfdiBatchWriter(db, client_id, save_files=save_xml_and_pdf)
+    ingest_file(writer, f"{paquete_id}.zip", archivo)
+    stats = writer.close()
+    return {
+        'insertados': stats['insertados'],
+        'duplicados': stats['duplicados'],
+        'errores': len(writer.errors) - stats['duplicados']
+    }
+
+
+def _solicitar_faltantes(db: Session, solicitud, dias: List[str]) -> int:
+    """
+    Solicitudes CFDI (hijas de la misma raíz) para los días en que la
+    Metadata trae UUIDs que no están en `cfdi`: un rango por días
+    consecutivos, partido con `planear_ventanas` si excede el tope. Los CFDIs
+    que ya existen en esos días se descartan como duplicados en la ingesta.
+    No hace commit.
+    """
+    raiz = solicitud.parent_id or solicitud.id
+    ventanas = [
+        ventana
+        for inicio, fin in agrupar_dias(date.fromisoformat(dia) for dia in dias)
+        for ventana in planear_ventanas(db, solicitud.client_id, 'CFDI', inicio, fin)
+    ]
+    for inicio, fin in ventanas:
+        _insertar_solicitud(
+            db, solicitud.client_id, solicitud.user_id, solicitud.tipo, inicio, fin,
+            'CFDI', solicitud.rfc_emisor, solicitud.rfc_receptor, parent_id=raiz
+        )
+    return len(ventanas)
+
+
+def _descargar(db: Session, solicitud, sat_service, paquetes: list, descargados: list, resultado: dict):
+    """Descarga e ingiere los paquetes pendientes, registrando cada uno al terminarlo"""
+    incremental = solicitud.modo == MODO_INCREMENTAL and solicitud.tipo_solicitud == 'Metadata'
+    pendientes = [paquete_id for paquete_id in paquetes if paquete_id not in descargados]
+    with _renovar_reserva(solicitud.id):
+        for paquete_id, archivo in descargar_paquetes(sat_service, pendientes):
+            if isinstance(archivo, Exception):
+                # Los paquetes ya registrados no se vuelven a descargar en el reintento
+                raise archivo
+            with archivo:
+                if solicitud.tipo_solicitud == 'CFDI':
+                    for clave, valor in _ingerir(db, solicitud.client_id, paquete_id, archivo).items():
+                        resultado[clave] = resultado.get(clave, 0) + valor
+                elif incremental:
+                    stats, dias = conciliar_metadata(db, solicitud.client_id, leer_metadata(archivo))
+                    for clave, valor in stats.items():
+                        resultado[clave] = resultado.get(clave, 0) + valor
+                    # Los días faltantes se guardan con el avance: tras un reinicio no se pierden
+                    resultado['dias_faltantes'] = sorted(set(resultado.get('dias_faltantes', [])) | {d.isoformat() for d in dias})
+                else:
+                    guardar_paquete(archivo, solicitud.solicitud_id, paquete_id)
+            descargados.append(paquete_id)
+            _actualizar(db, solicitud.id, _lease(), paquetes_descargados=descargados, resultado=resultado, errores=0)
+            logger.info(f"Solicitud {solicitud.id}: paquete {paquete_id} ({len(descargados)}/{len(paquetes)}) | {resultado}")
+
+    if incremental:
+        resultado['solicitudes_cfdi'] = _solicitar_faltantes(db, solicitud, resultado.pop('dias_faltantes', []))
+    _actualizar(db, solicitud.id, estado=ESTADO_COMPLETADA, resultado=resultado, mensaje=None)
+    logger.info(f"Solicitud {solicitud.id} completada: {resultado}")
+
+
+def claim_next_step(db: Session):
+    """Toma la siguiente solicitud con un paso vencido y la reserva"""
+    row = db.execute(CLAIM_SQL, {"activos": list(ESTADOS_ACTIVOS)}).fetchone()
+    if not row:
+        db.rollback()
+        return None
+    db.execute(text("""
+        UPDATE sat_download_requests
+        SET next_check_at = NOW() + INTERVAL :segundos SECOND
+        WHERE id = :id
+    """), {"segundos": _lease(), "id": row.id})
+    db.commit()
+    return row
+
+
+def run_step(db: Session, solicitud):
+    """Ejecuta el paso que corresponde al estado de la solicitud"""
+    if solicitud.estado == ESTADO_PENDIENTE and _solicitudes_en_sat(db) >= settings.SAT_DESCARGA_MAX_SOLICITUDES_ACTIVAS:
+        # Límite de solicitudes simultáneas en el SAT: se envía cuando termine otra
+        db.rollback()
+        _actualizar(db, solicitud.id, settings.SAT_DESCARGA_VERIFICAR_INICIAL_SEGUNDOS)
+        return
+
+    try:
+        sat_service, signer = crear_servicio_sat()
+        if solicitud.estado == ESTADO_PENDIENTE:
+            _enviar(db, solicitud, sat_service, signer)
+        elif solicitud.estado == ESTADO_SOLICITADA:
+            _verificar(db, solicitud, sat_service)
+        else:
+            _descargar(
+                db, solicitud, sat_service,
+                _json(solicitud.paquetes, []), _json(solicitud.paquetes_descargados, []),
+                _json(solicitud.resultado, {})
+            )
+    except Exception as e:
+        db.rollback()
+        errores = solicitud.errores + 1
+        if errores >= settings.SAT_DESCARGA_MAX_ERRORES:
+            logger.error(f"Solicitud {solicitud.id} falló ({errores} errores seguidos): {str(e)}")
+            _actualizar(db, solicitud.id, estado=ESTADO_ERROR, errores=errores, mensaje=str(e))
+        else:
+            espera = espera_verificacion(errores)
+            logger.warning(f"Solicitud {solicitud.id}: {str(e)} (reintento en {espera:.0f}s)")
+            _actualizar(db, solicitud.id, espera, errores=errores, mensaje=str(e))
+
+    if solicitud.parent_id:
+        actualizar_raiz(db, solicitud.parent_id)
+
+
+def _worker_loop(worker_id: int):
+    logger.info(f"Scheduler de descarga masiva {worker_id} iniciado")
+    while not _stop_event.is_set():
+        db = SessionLocal()
+        try:
+            solicitud = claim_next_step(db)
+            if solicitud:
+                run_step(db, solicitud)
+                continue
+        except Exception as e:
+            logger.error(f"Scheduler de descarga masiva {worker_id}: {str(e)}")
+        finally:
+            db.close()
+        _stop_event.wait(settings.SAT_DESCARGA_POLL_SECONDS)
+
+
+def start_descarga_scheduler():
+    """Inicia los hilos del scheduler de descarga masiva (al iniciar la aplicación)"""
+    if _workers or settings.SAT_DESCARGA_WORKERS <= 0:
+        return
+    _stop_event.clear()
+    for worker_id in range(settings.SAT_DESCARGA_WORKERS):
+        worker = threading.Thread(target=_worker_loop, args=(worker_id,), name=f"sat-descarga-{worker_id}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+
+def stop_descarga_scheduler(timeout: float = 5.0):
+    """Detiene el scheduler; el paso en curso se retoma al vencer su reserva"""
+    _stop_event.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Validación por lote de CFDIs contra el SAT
+
+Se ejecuta como job (tipo 'validacion' en cfdi_jobs). Los CFDIs a validar se
+leen de la tabla `cfdi` por páginas (keyset sobre id); cada página se consulta
+al SAT con concurrencia limitada y sus resultados se escriben con un solo
+UPDATE masivo. Los resultados vigentes en la caché de validación no se
+consultan. El avance se reporta en el job después de cada página.
+"""
+import asyncio
+import json
+import logging
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services import cfdi_jobs, sat_validation_cache
+from app.services.cfdi_rollup import add_cfdis, remove_cfdis
+from app.services.sat_consulta import (
+    SatCircuitOpenError, SatConsultaClient, SatConsultaError,
+    estatus_validacion_from_estado, run_with_client
+)
+
+logger = logging.getLogger('cfdi_operations')
+
+JOB_VALIDACION = 'validacion'
+
+# Rondas de espera cuando el circuit breaker está abierto antes de dar por fallidos los CFDIs
+MAX_ESPERAS_CIRCUITO = 3
+
+
+def build_filters(client_id: str, filtros: dict) -> Tuple[str, dict, list]:
+    """
+    WHERE de los CFDIs a validar: lista de UUIDs o filtros de fecha/estatus.
+    Retorna (sql, parámetros, bindparams expandibles).
+    """
+    condiciones = ["client_id = :client_id"]
+    params = {"client_id": client_id}
+    expanding = []
+
+    if filtros.get('uuids'):
+        # Mismo criterio que la carga y el detalle: UUIDs en mayúsculas
+        condiciones.append("uuid IN :uuids")
+        params["uuids"] = list(dict.fromkeys(u.strip().upper() for u in filtros['uuids'] if u.strip()))
+        expanding.append(bindparam("uuids", expanding=True))
+    else:
+        if filtros.get('fecha_inicio'):
+            condiciones.append("fecha >= :fecha_inicio")
+            params["fecha_inicio"] = filtros['fecha_inicio']
+        if filtros.get('fecha_fin'):
+            # Rango semiabierto: incluye todo el día final
+            condiciones.append("fecha < :fecha_fin")
+            params["fecha_fin"] = (date.fromisoformat(filtros['fecha_fin']) + timedelta(days=1)).isoformat()
+        if filtros.get('estatus'):
+            condiciones.append("estatus_validacion IN :estatus")
+            params["estatus"] = filtros['estatus']
+            expanding.append(bindparam("estatus", expanding=True))
+
+    return " AND ".join(condiciones), params, expanding
+
+
+def count_cfdis(db: Session, client_id: str, filtros: dict) -> int:
+    where, params, expanding = build_filters(client_id, filtros)
+    query = text(f"SELECT COUNT(*) FROM cfdi WHERE {where}").bindparams(*expanding)
+    return db.execute(query, params).scalar() or 0
+
+
+def _fetch_page(db: Session, client_id: str, filtros: dict, after_id: int, limit: int) -> list:
+    where, params, expanding = build_filters(client_id, filtros)
+    query = text(f"""
+        SELECT id, uuid, emisor_rfc, receptor_rfc, total
+        FROM cfdi
+        WHERE {where} AND id > :after_id
+        ORDER BY id
+        LIMIT :limit
+    """).bindparams(*expanding)
+    return db.execute(query, {**params, "after_id": after_id, "limit": limit}).fetchall()
+
+
+def bulk_update_estatus(db: Session, client_id: str, resultados: List[Tuple[int, dict]]):
+    """
+    Escribe los resultados de una página con un solo UPDATE:
+    SET columna = CASE id WHEN ... THEN ... END WHERE id IN (...)
+
+    También actualiza cfdi_daily_rollup; el commit lo hace quien llama.
+    """
+    if not resultados:
+        return
+
+    casos_estatus = []
+    casos_respuesta = []
+    params = {"client_id": client_id}
+    for i, (cfdi_id, resultado) in enumerate(resultados):
+        casos_estatus.append(f"WHEN :id{i} THEN :estatus{i}")
+        casos_respuesta.append(f"WHEN :id{i} THEN :respuesta{i}")
+        params[f"id{i}"] = cfdi_id
+        params[f"estatus{i}"] = estatus_validacion_from_estado(resultado['estado'])
+        params[f"respuesta{i}"] = json.dumps({k: v for k, v in resultado.items() if k != 'origen'})
+    params["ids"] = [cfdi_id for cfdi_id, _ in resultados]
+
+    query = text(f"""
+        UPDATE cfdi
+        SET estatus_validacion = CASE id {' '.join(casos_estatus)} END,
+            validacion_sat_respuesta = CASE id {' '.join(casos_respuesta)} END,
+            validacion_sat_fecha = NOW()
+        WHERE client_id = :client_id AND id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+
+    # Los agregados diarios se mueven del estatus anterior al nuevo
+    remove_cfdis(db, client_id, params["ids"])
+    db.execute(query, params)
+    add_cfdis(db, client_id, params["ids"])
+
+
+async def consultar_pagina(client: SatConsultaClient, rows: list, concurrencia: int) -> list:
+    """
+    Consulta al SAT los CFDIs de una página con a lo sumo `concurrencia`
+    consultas simultáneas. Retorna [(row, resultado | excepción)] en el mismo orden.
+    """
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def consultar(row):
+        async with semaforo:
+            try:
+                return row, await client.consultar(row.uuid, row.emisor_rfc, row.receptor_rfc, float(row.total))
+            except SatConsultaError as e:
+                return row, e
+
+    return await asyncio.gather(*(consultar(row) for row in rows))
+
+
+def validar_pagina(rows: list, concurrencia: int) -> list:
+    """Consulta una página; si el circuito del SAT se abre, espera y reintenta esos CFDIs"""
+    resultados = {}
+    pendientes = rows
+    for espera in range(MAX_ESPERAS_CIRCUITO + 1):
+        salida = run_with_client(lambda client: consultar_pagina(client, pendientes, concurrencia))
+        pendientes = []
+        for row, resultado in salida:
+            if isinstance(resultado, SatCircuitOpenError) and espera < MAX_ESPERAS_CIRCUITO:
+                pendientes.append(row)
+            else:
+                resultados[row.id] = resultado
+        if not pendientes:
+            break
+        logger.warning(f"    ⚠ Circuito SAT abierto: {len(pendientes)} CFDIs en espera ({espera + 1}/{MAX_ESPERAS_CIRCUITO})")
+        cfdi_jobs.wait_or_stop(settings.SAT_CB_SEGUNDOS_ABIERTO)
+
+    return [(row, resultados[row.id]) for row in rows]
+
+
+@cfdi_jobs.register_job_handler(JOB_VALIDACION)
+def run_validation_job(db: Session, job: dict) -> dict:
+    """Valida contra el SAT los CFDIs seleccionados por los filtros del job"""
+    client_id = job['client_id']
+    filtros = job['payload'].get('filtros', {})
+    concurrencia = min(
+        job['payload'].get('concurrencia') or settings.SAT_VALIDACION_LOTE_CONCURRENCIA,
+        settings.SAT_CONSULTA_MAX_CONCURRENCIA
+    )
+    force_refresh = job['payload'].get('force_refresh', False)
+    pagina = settings.SAT_VALIDACION_LOTE_PAGINA
+
+    total = count_cfdis(db, client_id, filtros)
+    db.rollback()
+    cfdi_jobs.update_progress(db, job['id'], 0, 0, 0, 0, total=total)
+
+    contadores = {'procesados': 0, 'actualizados': 0, 'errores': 0, 'desde_cache': 0}
+    por_estado = {}
+    errores_detalle = []
+    after_id = 0
+
+    while True:
+        rows = _fetch_page(db, client_id, filtros, after_id, pagina)
+        db.rollback()
+        if not rows:
+            break
+        after_id = rows[-1].id
+
+        # Resultados vigentes en caché: solo se consultan al SAT los faltantes
+        keys = {row.id: sat_validation_cache.cache_key(row.uuid, row.emisor_rfc, row.receptor_rfc, row.total) for row in rows}
+        cacheados = {} if force_refresh else sat_validation_cache.get_many(db, keys.values())
+        por_consultar = [row for row in rows if keys[row.id] not in cacheados]
+        consultados = {row.id: resultado for row, resultado in validar_pagina(por_consultar, concurrencia)} if por_consultar else {}
+        contadores['desde_cache'] += len(rows) - len(por_consultar)
+
+        actualizar = []
+        nuevos_cache = []
+        for row in rows:
+            resultado = cacheados.get(keys[row.id]) or consultados[row.id]
+            if isinstance(resultado, Exception):
+                contadores['errores'] += 1
+                errores_detalle.append({'filename': row.uuid, 'error': str(resultado)})
+                continue
+            if row.id in consultados:
+                nuevos_cache.append((keys[row.id], resultado))
+            por_estado[resultado['estado']] = por_estado.get(resultado['estado'], 0) + 1
+            # Sin ConsultaResult (delay del SAT) no se toca el CFDI
+            if 'codigo_estatus' in resultado:
+                actualizar.append((row.id, resultado))
+
+        bulk_update_estatus(db, client_id, actualizar)
+        sat_validation_cache.store_many(db, nuevos_cache)
+        db.commit()
+
+        contadores['procesados'] += len(rows)
+        contadores['actualizados'] += len(actualizar)
+        cfdi_jobs.update_progress(
+            db, job['id'],
+            procesados=contadores['procesados'],
+            exitosos=contadores['actualizados'],
+            duplicados=0,
+            errores=contadores['errores']
+        )
+
+    logger.info(
+        f"Validación por lote (job {job['id']}): {contadores['procesados']} CFDIs, "
+        f"{contadores['actualizados']} actualizados, {contadores['errores']} errores | {por_estado}"
+    )
+
+    return {
+        **contadores,
+        'total': total,
+        'por_estado': por_estado,
+        'concurrencia': concurrencia,
+        'errores_detalle': errores_detalle
+    }
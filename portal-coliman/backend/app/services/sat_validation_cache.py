@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de resultados de validación del SAT
+
+Clave: (uuid, rfc emisor, rfc receptor, total), la misma información que la
+expresión impresa que se envía al SAT, así que la respuesta no depende del
+cliente del portal y la caché es compartida.
+
+Dos niveles:
+- LRU en memoria del proceso (SAT_CACHE_LRU_SIZE entradas)
+- Tabla `sat_validation_cache`, compartida entre procesos y reinicios
+
+La vigencia depende del estado: un CFDI solo pasa de Vigente a Cancelado,
+así que "Cancelado" se guarda por mucho tiempo y "Vigente" poco. Los errores
+de consulta no se guardan.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.ttl_lru import TTLLRU
+
+SELECT_SQL = text("""
+    SELECT cache_key, respuesta, consultado_at, expires_at
+    FROM sat_validation_cache
+    WHERE cache_key IN :keys AND expires_at > :ahora
+""").bindparams(bindparam("keys", expanding=True))
+
+UPSERT_SQL = text("""
+    INSERT INTO sat_validation_cache (cache_key, uuid, estado, respuesta, consultado_at, expires_at)
+    VALUES (:cache_key, :uuid, :estado, :respuesta, :consultado_at, :expires_at)
+    ON DUPLICATE KEY UPDATE
+        estado = VALUES(estado), respuesta = VALUES(respuesta),
+        consultado_at = VALUES(consultado_at), expires_at = VALUES(expires_at)
+""")
+
+
+def cache_key(uuid: str, rfc_emisor: str, rfc_receptor: str, total: float) -> str:
+    """Clave de caché (sha256 de los datos de la expresión impresa)"""
+    raw = f"{uuid.upper()}|{(rfc_emisor or '').upper()}|{(rfc_receptor or '').upper()}|{float(total):.6f}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def ttl_for(estado: str) -> timedelta:
+    """Vigencia de un resultado según el estado reportado por el SAT"""
+    if estado == 'Cancelado':
+        return timedelta(hours=settings.SAT_CACHE_TTL_CANCELADO_HORAS)
+    if estado == 'Vigente':
+        return timedelta(hours=settings.SAT_CACHE_TTL_VIGENTE_HORAS)
+    # No Encontrado u otros: el SAT puede tardar hasta 72 h en publicar un CFDI
+    return timedelta(hours=settings.SAT_CACHE_TTL_OTROS_HORAS)
+
+
+_lru = TTLLRU(settings.SAT_CACHE_LRU_SIZE)
+
+
+def get_many(db: Session, keys: Iterable[str]) -> Dict[str, dict]:
+    """Resultados vigentes en caché para las claves dadas (LRU y luego BD, una consulta)"""
+    ahora = datetime.now()
+    encontrados = {}
+    faltantes = []
+    for key in set(keys):
+        resultado = _lru.get(key, ahora)
+        if resultado is not None:
+            encontrados[key] = dict(resultado)
+        else:
+            faltantes.append(key)
+
+    if faltantes:
+        for row in db.execute(SELECT_SQL, {"keys": faltantes, "ahora": ahora}):
+            resultado = json.loads(row.respuesta)
+            resultado['consultado_at'] = row.consultado_at.isoformat() if row.consultado_at else None
+            _lru.put(row.cache_key, row.expires_at, resultado)
+            encontrados[row.cache_key] = dict(resultado)
+
+    return encontrados
+
+
+def get(db: Session, key: str) -> Optional[dict]:
+    return get_many(db, [key]).get(key)
+
+
+def store_many(db: Session, items: List[Tuple[str, dict]]):
+    """
+    Guarda resultados del SAT [(clave, resultado)]. Se ejecuta en la
+    transacción del llamador (junto con el UPDATE de cfdi).
+    """
+    if not items:
+        return
+
+    ahora = datetime.now()
+    rows = []
+    for key, resultado in items:
+        resultado = {k: v for k, v in resultado.items() if k not in ('origen', 'consultado_at')}
+        resultado['consultado_at'] = ahora.isoformat()
+        expires_at = ahora + ttl_for(resultado['estado'])
+        rows.append({
+            "cache_key": key,
+            "uuid": resultado['uuid'],
+            "estado": resultado['estado'],
+            "respuesta": json.dumps(resultado),
+            "consultado_at": ahora,
+            "expires_at": expires_at
+        })
+        _lru.put(key, expires_at, resultado)
+
+    db.execute(UPSERT_SQL, rows)
+
+
+def store(db: Session, key: str, resultado: dict):
+    store_many(db, [(key, resultado)])
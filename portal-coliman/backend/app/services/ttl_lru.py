@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+LRU en memoria con vencimiento por entrada
+
+Usado por las cachés del proceso (validación SAT, KPIs y reportes). Es
+seguro entre hilos: lo usan tanto el event loop como los workers de jobs.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+
+class TTLLRU:
+    """LRU con vencimiento, seguro entre hilos"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Any, Tuple[datetime, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, ahora: datetime) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, valor = item
+            if expires_at <= ahora:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return valor
+
+    def put(self, key, expires_at: datetime, valor):
+        with self._lock:
+            self._data[key] = (expires_at, valor)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Revisión de planes de ejecución (EXPLAIN) de las consultas de KPIs y reportes
+
+Ejecuta EXPLAIN sobre cada forma de consulta que usan KPIs, reportes, la
+validación por lote, el listado, la búsqueda y la exportación fiscal de
+CFDIs, y falla (código de salida 1) si alguna lee `cfdi`, `cfdi_daily_rollup`
+o `cfdi_search` con un recorrido completo, con un índice distinto al esperado
+o, en las consultas marcadas `sin_filesort`, ordenando fuera del índice.
+Sirve para detectar regresiones (un filtro que deja de ser por rango, un
+índice eliminado) antes de llegar a producción.
+
+Los planes dependen de los datos: correr contra una base con volumen
+representativo, por ejemplo la generada por el benchmark del dashboard.
+
+Ejecutar (desde backend/, contra una base MySQL 8 con las migraciones aplicadas):
+    python -m benchmarks.kpi_dashboard --generar --filas 1000000
+    python -m benchmarks.explain_reports --cliente BENCH_KPI
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import bindparam, create_engine, text  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.api.reports import FILTRO_CFDI, FILTRO_ROLLUP  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.services import cfdi_list, cfdi_search, cfdi_snapshot, fiscal_export, period_compare  # noqa: E402
+from app.services.cfdi_rollup import periodo_params  # noqa: E402
+from app.services.kpi_engine import AGREGADOS_SQL, TOP_SQL  # noqa: E402
+from app.services.sat_validacion import build_filters  # noqa: E402
+
+TABLAS_REVISADAS = ('cfdi', 'cfdi_daily_rollup', 'cfdi_search')
+
+
+class Consulta(NamedTuple):
+    nombre: str
+    sql: str
+    indices: set  # Índices aceptables para las tablas revisadas
+    params: Optional[dict] = None
+    expanding: tuple = ()
+    sin_filesort: bool = False  # El ORDER BY debe salir del índice (consultas por streaming)
+
+
+def consultas(client_id: str, fecha_inicio: str, fecha_fin: str) -> list:
+    params = periodo_params(client_id, fecha_inicio, fecha_fin)
+    inicio_mes = datetime.strptime(fecha_inicio, '%Y-%m-%d').date().replace(day=1)
+    where_lote, params_lote, expanding_lote = build_filters(client_id, {
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'estatus': ['pendiente', 'revision']
+    })
+
+    def listado(nombre: str, filtros: dict, indices: set) -> Consulta:
+        condiciones, params_listado = cfdi_list.build_filters(client_id, filtros)
+        sql = cfdi_list.LISTADO_SQL.format(where=' AND '.join(condiciones + [cfdi_list.CURSOR_FILTRO]))
+        cursor = {"cursor_created_at": datetime.now(), "cursor_id": 2 ** 62, "limit": 101}
+        return Consulta(nombre, sql, indices, {**params_listado, **cursor})
+
+    return [
+        Consulta("kpis: agregado del dashboard", AGREGADOS_SQL.text, {"PRIMARY"},
+                 {**params, "tendencia_desde": fecha_inicio}),
+        Consulta("kpis: top clientes/proveedores", TOP_SQL.text,
+                 {"idx_cfdi_client_tipo_fecha", "idx_cfdi_client_fecha"}, {**params, "top_n": 5}),
+        Consulta("kpis: detalle de periodo", """
+            SELECT dia, tipo_comprobante, SUM(cantidad), SUM(total)
+            FROM cfdi_daily_rollup
+            WHERE client_id = :client_id AND dia >= :inicio AND dia < :fin
+            GROUP BY dia, tipo_comprobante
+        """, {"PRIMARY"}, {"client_id": client_id, "inicio": inicio_mes, "fin": (inicio_mes + timedelta(days=32)).replace(day=1)}),
+        Consulta("reportes: totales del agregado diario", f"""
+            SELECT dia, tipo_comprobante, SUM(cantidad), SUM(total)
+            FROM cfdi_daily_rollup WHERE {FILTRO_ROLLUP}
+            GROUP BY dia, tipo_comprobante
+        """, {"PRIMARY"}),
+        Consulta("reportes: serie diaria de comparativas", period_compare.SERIE_SQL.text, {"PRIMARY"},
+                 {"client_id": client_id, "desde": inicio_mes - timedelta(days=400), "hasta": fecha_fin}),
+        Consulta("reportes: desglose por RFC", f"""
+            SELECT emisor_rfc, emisor_nombre, COUNT(*), SUM(total)
+            FROM cfdi WHERE tipo_comprobante = 'E' AND {FILTRO_CFDI}
+            GROUP BY emisor_rfc, emisor_nombre
+        """, {"idx_cfdi_client_tipo_fecha", "idx_cfdi_client_fecha"}),
+        Consulta("reportes: RFC únicos", f"""
+            SELECT COUNT(DISTINCT receptor_rfc), COUNT(DISTINCT emisor_rfc)
+            FROM cfdi WHERE {FILTRO_CFDI}
+        """, {"idx_cfdi_client_fecha"}),
+        Consulta("reportes: listado de facturas", f"""
+            SELECT uuid, fecha, total FROM cfdi WHERE {FILTRO_CFDI}
+            ORDER BY fecha DESC LIMIT 100
+        """, {"idx_cfdi_client_fecha"}),
+        Consulta("reportes: exportación fiscal", fiscal_export.FACTURAS_SQL.text,
+                 {"idx_cfdi_client_fecha_id"}, sin_filesort=True),
+        Consulta("reportes: pendientes de validación", f"""
+            SELECT uuid, fecha, total FROM cfdi
+            WHERE estatus_validacion = 'pendiente' AND {FILTRO_CFDI}
+            ORDER BY fecha DESC
+        """, {"idx_cfdi_client_estatus_fecha"}),
+        Consulta("validación por lote: página", f"""
+            SELECT id, uuid, emisor_rfc, receptor_rfc, total
+            FROM cfdi WHERE {where_lote} AND id > :after_id
+            ORDER BY id LIMIT :limit
+        """, {"idx_cfdi_client_estatus_fecha", "idx_cfdi_client_fecha", "PRIMARY"},
+                 {**params_lote, "after_id": 0, "limit": 200}, tuple(expanding_lote)),
+        listado("listado: página por cursor", {}, {"idx_cfdi_client_created"}),
+        listado("listado: filtro por emisor", {'emisor_rfc': 'XAXX010101000'}, {"idx_cfdi_client_emisor_created"}),
+        listado("listado: filtro por receptor", {'receptor_rfc': 'XAXX010101000'}, {"idx_cfdi_client_receptor_created"}),
+        listado("listado: filtro por estatus", {'estatus_validacion': 'pendiente'}, {"idx_cfdi_client_estatus_created"}),
+        Consulta("búsqueda: texto", cfdi_search.TEXTO_SQL.text, {"ft_cfdi_search_contenido", "PRIMARY"},
+                 {"client_id": client_id, "consulta": f"+{cfdi_search.token_cliente(client_id)} +factura*", "limit": 20}),
+        Consulta("búsqueda: folio con serie", cfdi_search.FOLIO_SQL.text, {"idx_cfdi_client_folio"},
+                 {"client_id": client_id, "limit": 20, **cfdi_search._folio_params("A-12345")},
+                 (bindparam("folios", expanding=True),)),
+        Consulta("búsqueda: prefijo de UUID", cfdi_search.UUID_SQL.text, {"unique_uuid_per_client"},
+                 {"client_id": client_id, "prefijo": "0A1B2C3D%", "limit": 20}),
+        Consulta("búsqueda: prefijo de RFC", cfdi_search.RFC_SQL.text,
+                 {"idx_cfdi_client_emisor_created", "idx_cfdi_client_receptor_created"},
+                 {"client_id": client_id, "rfc": "XAXX010101000", "prefijo": "XAXX01%", "limit": 20}),
+        Consulta("snapshot: cambios por updated_at", cfdi_snapshot.CAMBIOS_SQL.text, {"idx_cfdi_client_updated"},
+                 {"client_id": client_id, "desde": datetime.now() - timedelta(minutes=5)}),
+    ]
+
+
+def revisar(db: Session, consulta: Consulta, params: dict) -> list:
+    """Retorna los problemas encontrados en el plan (lista vacía si está bien)"""
+    query = text("EXPLAIN " + consulta.sql).bindparams(*consulta.expanding)
+    problemas = []
+    for row in db.execute(query, consulta.params or params).mappings():
+        if row['table'] not in TABLAS_REVISADAS:
+            continue
+        detalle = f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} ({row['Extra']})"
+        if row['type'] == 'ALL':
+            problemas.append(f"recorrido completo - {detalle}")
+        elif row['key'] not in consulta.indices:
+            problemas.append(f"índice inesperado (esperado {', '.join(sorted(consulta.indices))}) - {detalle}")
+        elif consulta.sin_filesort and 'filesort' in (row['Extra'] or ''):
+            problemas.append(f"ordenamiento fuera del índice - {detalle}")
+        else:
+            print(f"      {detalle}")
+    return problemas
+
+
+def main():
+    hoy = datetime.now()
+    parser = argparse.ArgumentParser(description="Revisión de planes EXPLAIN de KPIs y reportes")
+    parser.add_argument("--url", default=settings.DATABASE_URL, help="URL de la base de datos")
+    parser.add_argument("--cliente", default="BENCH_KPI", help="client_id con datos representativos")
+    parser.add_argument("--fecha-inicio", default=(hoy - timedelta(days=30)).strftime('%Y-%m-%d'))
+    parser.add_argument("--fecha-fin", default=hoy.strftime('%Y-%m-%d'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    params = periodo_params(args.cliente, args.fecha_inicio, args.fecha_fin)
+    fallas = 0
+    with Session(engine) as db:
+        for consulta in consultas(args.cliente, args.fecha_inicio, args.fecha_fin):
+            problemas = revisar(db, consulta, params)
+            print(f"{'FALLA' if problemas else 'OK':>5}  {consulta.nombre}")
+            for problema in problemas:
+                print(f"      {problema}")
+            fallas += bool(problemas)
+
+    print(f"\n{fallas} consultas con plan inesperado" if fallas else "\nTodos los planes usan los índices esperados")
+    sys.exit(1 if fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de /api/kpis/dashboard: nueve consultas contra el motor de dos pasadas
+
+Genera una tabla `cfdi` sintética (por defecto 5 millones de filas, bajo un
+client_id propio) y su agregado diario, mide ambas implementaciones y
+verifica que retornen lo mismo (termina con código 1 si difieren). La misma
+comparación corre sin MySQL en tests/test_kpi_engine.py.
+
+Ejecutar (desde backend/, contra una base MySQL 8 de pruebas):
+    python -m benchmarks.kpi_dashboard --generar --filas 5000000
+    python -m benchmarks.kpi_dashboard --fecha-inicio 2025-01-01 --fecha-fin 2025-12-31
+    python -m benchmarks.kpi_dashboard --limpiar
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import uuid as uuid_lib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.services.cfdi_rollup import periodo_params, rebuild_client  # noqa: E402
+from app.services.kpi_engine import TIPOS_COMPROBANTE, compute_dashboard, restar_meses  # noqa: E402
+
+CLIENT_ID = "BENCH_KPI"
+LOTE = 10000
+
+INSERT_SQL = text("""
+    INSERT INTO cfdi (
+        client_id, uuid, serie, folio, tipo_comprobante, fecha, emisor_rfc, emisor_nombre,
+        receptor_rfc, receptor_nombre, subtotal, total, forma_pago, metodo_pago,
+        estatus_validacion
+    ) VALUES (
+        :client_id, :uuid, :serie, :folio, :tipo_comprobante, :fecha, :emisor_rfc, :emisor_nombre,
+        :receptor_rfc, :receptor_nombre, :subtotal, :total, :forma_pago, :metodo_pago,
+        :estatus_validacion
+    )
+""")
+
+
+def generar(db: Session, filas: int, dias: int = 730):
+    """Inserta filas sintéticas repartidas en los últimos `dias` días"""
+    rng = random.Random(42)
+    rfcs = [f"RFC{n:06d}XX{n % 10}" for n in range(2000)]
+    tipos = ['I'] * 6 + ['E'] * 3 + ['P', 'N', 'T']
+    formas = ['01', '02', '03', '04', '28', '99', None]
+    series = ['A', 'B', 'FAC', None]
+    estatus = ['pendiente'] * 5 + ['valido'] * 4 + ['rechazado', 'revision']
+    ahora = datetime.now()
+
+    inicio = time.perf_counter()
+    for offset in range(0, filas, LOTE):
+        lote = []
+        for n in range(offset, offset + min(LOTE, filas - offset)):
+            emisor, receptor = rng.sample(rfcs, 2)
+            total = round(rng.lognormvariate(8, 1.2), 2)
+            lote.append({
+                "client_id": CLIENT_ID,
+                "uuid": str(uuid_lib.UUID(int=rng.getrandbits(128))).upper(),
+                "serie": rng.choice(series),
+                "folio": str(n + 1),
+                "tipo_comprobante": rng.choice(tipos),
+                "fecha": ahora - timedelta(seconds=rng.randrange(dias * 86400)),
+                "emisor_rfc": emisor,
+                "emisor_nombre": f"EMISOR {emisor}",
+                "receptor_rfc": receptor,
+                "receptor_nombre": f"RECEPTOR {receptor}",
+                "subtotal": round(total / 1.16, 2),
+                "total": total,
+                "forma_pago": rng.choice(formas),
+                "metodo_pago": rng.choice(['PUE', 'PPD']),
+                "estatus_validacion": rng.choice(estatus)
+            })
+        db.execute(INSERT_SQL, lote)
+        db.commit()
+        print(f"\r  {offset + len(lote):,} filas ({time.perf_counter() - inicio:.0f}s)", end="", flush=True)
+    print()
+
+    print("Calculando agregados diarios...")
+    rebuild_client(db, CLIENT_ID)
+    db.commit()
+
+
+def dashboard_actual(db: Session, client_id: str, fecha_inicio: str, fecha_fin: str, ahora: datetime) -> dict:
+    """Implementación anterior (nueve consultas sobre `cfdi`), acotada al cliente y a días completos para comparar"""
+    params = periodo_params(client_id, fecha_inicio, fecha_fin)
+    filtro = "client_id = :client_id AND fecha >= :fecha_inicio AND fecha < :fecha_fin_exclusiva"
+
+    def filas(sql, extra=None):
+        return db.execute(text(sql), {**params, **(extra or {})}).fetchall()
+
+    total = filas(f"SELECT COUNT(*) AS total FROM cfdi WHERE {filtro}")[0]
+    ingresos = filas(f"SELECT COALESCE(SUM(total), 0) AS s, COALESCE(AVG(total), 0) AS a FROM cfdi WHERE tipo_comprobante = 'I' AND {filtro}")[0]
+    egresos = filas(f"SELECT COALESCE(SUM(total), 0) AS s, COALESCE(AVG(total), 0) AS a FROM cfdi WHERE tipo_comprobante = 'E' AND {filtro}")[0]
+    tipos = filas(f"SELECT tipo_comprobante, COUNT(*) AS cantidad, SUM(total) AS monto FROM cfdi WHERE {filtro} GROUP BY tipo_comprobante")
+    clientes = filas(f"""
+        SELECT receptor_rfc AS rfc, receptor_nombre AS nombre, COUNT(*) AS num_facturas, SUM(total) AS monto
+        FROM cfdi WHERE tipo_comprobante = 'I' AND {filtro}
+        GROUP BY receptor_rfc, receptor_nombre ORDER BY monto DESC LIMIT 5
+    """)
+    proveedores = filas(f"""
+        SELECT emisor_rfc AS rfc, emisor_nombre AS nombre, COUNT(*) AS num_facturas, SUM(total) AS monto
+        FROM cfdi WHERE tipo_comprobante = 'E' AND {filtro}
+        GROUP BY emisor_rfc, emisor_nombre ORDER BY monto DESC LIMIT 5
+    """)
+    tendencia = filas("""
+        SELECT DATE_FORMAT(fecha, '%Y-%m') AS mes, tipo_comprobante, COUNT(*) AS cantidad, SUM(total) AS monto
+        FROM cfdi WHERE client_id = :client_id AND fecha >= :desde
+        GROUP BY DATE_FORMAT(fecha, '%Y-%m'), tipo_comprobante
+    """, {"desde": restar_meses(ahora, 6).date()})
+    validacion = filas(f"SELECT estatus_validacion, COUNT(*) AS cantidad FROM cfdi WHERE {filtro} GROUP BY estatus_validacion")
+    formas = filas(f"""
+        SELECT forma_pago, COUNT(*) AS cantidad, SUM(total) AS monto FROM cfdi
+        WHERE forma_pago IS NOT NULL AND {filtro}
+        GROUP BY forma_pago ORDER BY cantidad DESC LIMIT 5
+    """)
+
+    meses = {}
+    for row in tendencia:
+        if row.tipo_comprobante not in ('I', 'E'):
+            continue
+        mes = meses.setdefault(row.mes, {'mes': row.mes, 'ingresos': 0, 'egresos': 0, 'cantidad_ingresos': 0, 'cantidad_egresos': 0})
+        clave = 'ingresos' if row.tipo_comprobante == 'I' else 'egresos'
+        mes[clave] = float(row.monto or 0)
+        mes[f'cantidad_{clave}'] = row.cantidad
+
+    def top(rows):
+        return [{"rfc": r.rfc, "nombre": r.nombre, "num_facturas": r.num_facturas, "total": float(r.monto or 0)} for r in rows]
+
+    return {
+        "periodo": {"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin},
+        "resumen_general": {
+            "total_cfdis": total.total,
+            "total_ingresos": float(ingresos.s),
+            "promedio_ingresos": float(ingresos.a),
+            "total_egresos": float(egresos.s),
+            "promedio_egresos": float(egresos.a),
+            "utilidad": float(ingresos.s) - float(egresos.s)
+        },
+        "distribucion_tipos": [
+            {"tipo": TIPOS_COMPROBANTE.get(r.tipo_comprobante, r.tipo_comprobante), "codigo": r.tipo_comprobante,
+             "cantidad": r.cantidad, "monto": float(r.monto or 0)}
+            for r in tipos
+        ],
+        "top_clientes": top(clientes),
+        "top_proveedores": top(proveedores),
+        "tendencia_mensual": sorted(meses.values(), key=lambda x: x['mes']),
+        "estado_validacion": [{"estado": r.estatus_validacion, "cantidad": r.cantidad} for r in validacion],
+        "formas_pago": [{"forma_pago": r.forma_pago, "cantidad": r.cantidad, "monto_total": float(r.monto or 0)} for r in formas]
+    }
+
+
+def normalizar(valor):
+    """Redondea montos y ordena listas sin orden garantizado para comparar"""
+    if isinstance(valor, float):
+        return round(valor, 2)
+    if isinstance(valor, dict):
+        return {k: normalizar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        elementos = [normalizar(v) for v in valor]
+        return sorted(elementos, key=repr)
+    return valor
+
+
+def medir(func, repeticiones: int):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = func()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultado
+
+
+def main():
+    hoy = datetime.now()
+    parser = argparse.ArgumentParser(description="Benchmark de KPIs del dashboard")
+    parser.add_argument("--url", default=settings.DATABASE_URL, help="URL de la base de datos de pruebas")
+    parser.add_argument("--generar", action="store_true", help="Insertar filas sintéticas antes de medir")
+    parser.add_argument("--filas", type=int, default=5_000_000)
+    parser.add_argument("--limpiar", action="store_true", help="Borrar las filas sintéticas y salir")
+    parser.add_argument("--fecha-inicio", default=(hoy - timedelta(days=365)).strftime('%Y-%m-%d'))
+    parser.add_argument("--fecha-fin", default=hoy.strftime('%Y-%m-%d'))
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    with Session(engine) as db:
+        if args.limpiar:
+            db.execute(text("DELETE FROM cfdi WHERE client_id = :client_id"), {"client_id": CLIENT_ID})
+            db.execute(text("DELETE FROM cfdi_daily_rollup WHERE client_id = :client_id"), {"client_id": CLIENT_ID})
+            db.commit()
+            return
+        if args.generar:
+            print(f"Generando {args.filas:,} CFDIs sintéticos...")
+            generar(db, args.filas)
+
+        filas = db.execute(text("SELECT COUNT(*) FROM cfdi WHERE client_id = :client_id"), {"client_id": CLIENT_ID}).scalar()
+        print(f"Filas de {CLIENT_ID}: {filas:,} | periodo: {args.fecha_inicio} a {args.fecha_fin}")
+
+        t_actual, r_actual = medir(lambda: dashboard_actual(db, CLIENT_ID, args.fecha_inicio, args.fecha_fin, hoy), args.repeticiones)
+        t_motor, r_motor = medir(lambda: compute_dashboard(db, CLIENT_ID, args.fecha_inicio, args.fecha_fin, ahora=hoy), args.repeticiones)
+
+        print(f"{'implementación':>16} {'mediana (s)':>12}")
+        print(f"{'9 consultas':>16} {t_actual:>12.3f}")
+        print(f"{'agregado diario':>16} {t_motor:>12.3f}  ({t_actual / t_motor:.2f}x)")
+        if normalizar(r_actual) != normalizar(r_motor):
+            print("DIFERENCIAS en los resultados")
+            sys.exit(1)
+        print("Resultados iguales")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark del pool de parseo de CFDIs: throughput contra número de procesos
+
+Usa los XML de ejemplo de `Insumos XML/2025/12/18`, replicados para simular
+una carga grande.
+
+Ejecutar (desde backend/):
+    python -m benchmarks.parse_pool
+    python -m benchmarks.parse_pool --replicas 200 --workers 1,2,4,8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.cfdi_parse_pool import _parse_one, parse_many  # noqa: E402
+
+SAMPLE_DIR = Path(__file__).resolve().parents[3] / "Insumos XML" / "2025" / "12" / "18"
+
+
+def load_samples(folder: Path, replicas: int) -> list:
+    xmls = [path.read_bytes() for path in sorted(folder.glob("*.xml"))]
+    if not xmls:
+        raise SystemExit(f"No se encontraron XML en {folder}")
+    return xmls * replicas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pool de parseo de CFDIs")
+    parser.add_argument("--carpeta", default=str(SAMPLE_DIR), help="Carpeta con XML de ejemplo")
+    parser.add_argument("--replicas", type=int, default=100, help="Veces que se replica el conjunto de ejemplo")
+    parser.add_argument("--workers", default=None, help="Lista de procesos a probar, ej. 1,2,4,8")
+    args = parser.parse_args()
+
+    xmls = load_samples(Path(args.carpeta), args.replicas)
+    cpus = os.cpu_count() or 1
+    workers_list = [int(w) for w in args.workers.split(",")] if args.workers else sorted({1, 2, 4, cpus})
+
+    print(f"XMLs: {len(xmls)} ({sum(len(x) for x in xmls) / 1024 / 1024:.1f} MB) | CPUs: {cpus}")
+    print(f"{'procesos':>8} {'segundos':>10} {'XML/s':>10} {'speedup':>8}")
+
+    base = None
+    for workers in workers_list:
+        if workers == 1:
+            inicio = time.perf_counter()
+            resultados = [_parse_one(x) for x in xmls]
+        else:
+            # Mismo contexto que el pool de la aplicación
+            contexto = multiprocessing.get_context('forkserver')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as executor:
+                # Calentar el pool para no medir el arranque de los procesos
+                list(executor.map(_parse_one, xmls[:workers]))
+                inicio = time.perf_counter()
+                resultados = parse_many(xmls, executor=executor)
+        segundos = time.perf_counter() - inicio
+
+        errores = sum(1 for _, error in resultados if error)
+        base = base or segundos
+        print(f"{workers:>8} {segundos:>10.3f} {len(xmls) / segundos:>10.0f} {base / segundos:>7.2f}x"
+              + (f"  ({errores} errores)" if errores else ""))
+
+
+if __name__ == "__main__":
+    main()
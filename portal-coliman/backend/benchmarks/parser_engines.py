@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los motores de parseo de CFDI: ElementTree contra lxml
+
+Mide XML/s de cada motor sobre los XML de ejemplo y compara los campos que
+ambos extraen. Las diferencias esperadas se reportan aparte:
+- total_impuestos_*: etree toma el primer cfdi:Impuestos del documento, que
+  suele ser el de un concepto; lxml toma el del comprobante.
+
+Ejecutar (desde backend/):
+    python -m benchmarks.parser_engines
+    python -m benchmarks.parser_engines --replicas 200
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.cfdi_parser import parse_cfdi_etree, parse_cfdi_lxml  # noqa: E402
+
+SAMPLE_DIR = Path(__file__).resolve().parents[3] / "Insumos XML" / "2025" / "12" / "18"
+
+CAMPOS_ESPERADOS_DISTINTOS = {'sello', 'total_impuestos_trasladados', 'total_impuestos_retenidos'}
+
+
+def medir(nombre: str, funcion, xmls: list) -> list:
+    inicio = time.perf_counter()
+    resultados = [funcion(x) for x in xmls]
+    segundos = time.perf_counter() - inicio
+    print(f"{nombre:>8} {segundos:>10.3f} {len(xmls) / segundos:>10.0f}")
+    return resultados
+
+
+def comparar(xmls: list):
+    diferencias = {}
+    for xml in xmls:
+        a, b = parse_cfdi_etree(xml), parse_cfdi_lxml(xml)
+        for campo, valor in a.items():
+            if campo in CAMPOS_ESPERADOS_DISTINTOS:
+                continue
+            if b.get(campo) != valor:
+                diferencias[campo] = diferencias.get(campo, 0) + 1
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de motores de parseo de CFDI")
+    parser.add_argument("--carpeta", default=str(SAMPLE_DIR), help="Carpeta con XML de ejemplo")
+    parser.add_argument("--replicas", type=int, default=100, help="Veces que se replica el conjunto de ejemplo")
+    args = parser.parse_args()
+
+    muestras = [path.read_bytes() for path in sorted(Path(args.carpeta).glob("*.xml"))]
+    if not muestras:
+        raise SystemExit(f"No se encontraron XML en {args.carpeta}")
+    xmls = muestras * args.replicas
+
+    print(f"XMLs: {len(xmls)} ({sum(len(x) for x in xmls) / 1024 / 1024:.1f} MB)")
+    print(f"{'motor':>8} {'segundos':>10} {'XML/s':>10}")
+    medir("etree", parse_cfdi_etree, xmls)
+    medir("lxml", parse_cfdi_lxml, xmls)
+
+    diferencias = comparar(muestras)
+    if diferencias:
+        print(f"Campos con diferencias: {diferencias}")
+    else:
+        print(f"Sin diferencias en {len(muestras)} XML (excluyendo {sorted(CAMPOS_ESPERADOS_DISTINTOS)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark del cliente de consulta del SAT contra el mock local
+
+Compara el cliente asíncrono compartido (pool + límite de concurrencia)
+contra una consulta a la vez, con la latencia y tasa de fallas indicadas.
+
+Ejecutar (desde backend/):
+    python -m benchmarks.sat_consulta --consultas 200 --latencia 0.2 --fallas 0.05
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid as uuid_lib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.sat_consulta import SatConsultaClient, SatConsultaError  # noqa: E402
+from benchmarks.sat_mock_server import start_mock_server  # noqa: E402
+
+
+async def correr(url: str, uuids: list, concurrencia: int) -> dict:
+    client = SatConsultaClient(url=url, max_concurrency=concurrencia, backoff_base=0.05)
+    estados = {}
+
+    async def una(uuid: str):
+        try:
+            resultado = await client.consultar(uuid, "AAA010101AAA", "BBB010101BBB", 100.0)
+            estados[resultado['estado']] = estados.get(resultado['estado'], 0) + 1
+        except SatConsultaError as e:
+            estados[type(e).__name__] = estados.get(type(e).__name__, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(u) for u in uuids))
+    segundos = time.perf_counter() - inicio
+    await client.aclose()
+    return {'segundos': segundos, 'estados': estados}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cliente de consulta SAT")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--latencia", type=float, default=0.2)
+    parser.add_argument("--fallas", type=float, default=0.05)
+    parser.add_argument("--concurrencia", default="1,10,20", help="Lista de concurrencias a probar")
+    args = parser.parse_args()
+
+    server, url, contador = start_mock_server(0, args.latencia, args.fallas)
+    uuids = [str(uuid_lib.uuid4()).upper() for _ in range(args.consultas)]
+
+    print(f"Consultas: {args.consultas} | latencia: {args.latencia}s | fallas: {args.fallas:.0%}")
+    print(f"{'concurrencia':>12} {'segundos':>10} {'consultas/s':>12}  estados")
+    for concurrencia in [int(c) for c in args.concurrencia.split(",")]:
+        resultado = asyncio.run(correr(url, uuids, concurrencia))
+        print(f"{concurrencia:>12} {resultado['segundos']:>10.2f} {args.consultas / resultado['segundos']:>12.1f}  {resultado['estados']}")
+
+    print(f"Peticiones HTTP recibidas por el mock (incluye reintentos): {contador['consultas']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Servidor SOAP simulado del ConsultaCFDIService del SAT (solo librería estándar)
+
+Sirve para probar el cliente de consulta sin salir a internet. Responde en
+`/ConsultaCFDIService.svc` con latencia y tasa de fallas configurables. El
+estado es determinista por UUID: los que terminan en 0 aparecen como
+"Cancelado", los que terminan en 1 como "No Encontrado" (sin ConsultaResult),
+el resto como "Vigente".
+
+Ejecutar (desde backend/):
+    python -m benchmarks.sat_mock_server --port 8765 --latencia 0.2 --fallas 0.1
+
+y apuntar el backend al mock:
+    SAT_CONSULTA_URL=http://localhost:8765/ConsultaCFDIService.svc
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPUESTA = """<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><ConsultaResponse xmlns="http://tempuri.org/"><ConsultaResult xmlns:a="http://schemas.datacontract.org/2004/07/Sat.Cfdi.Negocio.ConsultaCfdi.Servicio" xmlns:i="http://www.w3.org/2001/XMLSchema-instance"><a:CodigoEstatus>{codigo}</a:CodigoEstatus><a:EsCancelable>{cancelable}</a:EsCancelable><a:Estado>{estado}</a:Estado><a:EstatusCancelacion>{estatus_cancelacion}</a:EstatusCancelacion><a:ValidacionEFOS>200</a:ValidacionEFOS></ConsultaResult></ConsultaResponse></s:Body></s:Envelope>"""
+
+RESPUESTA_VACIA = """<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><ConsultaResponse xmlns="http://tempuri.org/"/></s:Body></s:Envelope>"""
+
+UUID_RE = re.compile(r"id=([0-9A-Fa-f-]{36})")
+
+
+def respuesta_para(uuid: str) -> str:
+    ultimo = uuid[-1]
+    if ultimo == '0':
+        return RESPUESTA.format(codigo="S - Comprobante obtenido satisfactoriamente.", cancelable="No cancelable",
+                                estado="Cancelado", estatus_cancelacion="Cancelado sin aceptación")
+    if ultimo == '1':
+        return RESPUESTA_VACIA
+    return RESPUESTA.format(codigo="S - Comprobante obtenido satisfactoriamente.", cancelable="Cancelable con aceptación",
+                            estado="Vigente", estatus_cancelacion="")
+
+
+def make_handler(latencia: float, fallas: float, contador: dict):
+    class ConsultaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', 'replace')
+            with contador['lock']:
+                contador['consultas'] += 1
+            if latencia:
+                time.sleep(latencia * random.uniform(0.5, 1.5))
+
+            if random.random() < fallas:
+                payload, status = b"Service Unavailable", 503
+            else:
+                match = UUID_RE.search(body)
+                payload = respuesta_para(match.group(1) if match else "0" * 36).encode('utf-8')
+                status = 200
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ConsultaHandler
+
+
+def start_mock_server(port: int = 0, latencia: float = 0.0, fallas: float = 0.0):
+    """
+    Inicia el mock en un hilo. Retorna (server, url, contador); detener con
+    server.shutdown().
+    """
+    contador = {'consultas': 0, 'lock': threading.Lock()}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latencia, fallas, contador))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/ConsultaCFDIService.svc"
+    return server, url, contador
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock del ConsultaCFDIService del SAT")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.2, help="Latencia media por consulta (segundos)")
+    parser.add_argument("--fallas", type=float, default=0.0, help="Proporción de respuestas 503 (0-1)")
+    args = parser.parse_args()
+
+    server, url, _ = start_mock_server(args.port, args.latencia, args.fallas)
+    print(f"Mock SAT escuchando en {url} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de /api/search: latencia (p50/p95) por modo de búsqueda
+
+Usa los CFDIs sintéticos del benchmark del dashboard; las consultas se toman
+de los mismos datos (palabras de los nombres, prefijos de RFC y de UUID,
+folios). El índice de texto es compartido: para medir el efecto de otros
+clientes, generar datos de varios clientes antes de medir. Sale con código 1
+si el p95 de algún modo pasa de --objetivo-ms.
+
+Ejecutar (desde backend/, contra una base MySQL 8 con las migraciones aplicadas):
+    python -m benchmarks.kpi_dashboard --generar --filas 1000000
+    python -m benchmarks.search_latency --indexar
+    python -m benchmarks.search_latency --consultas 500
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.services.cfdi_search import clasificar, reindex_client, search_cfdis  # noqa: E402
+
+
+def muestras(db: Session, client_id: str, cantidad: int) -> list:
+    """Consultas de ejemplo: texto de dos palabras, prefijo de RFC, prefijo de UUID y folio"""
+    rng = random.Random(7)
+    filas = db.execute(text("""
+        SELECT uuid, emisor_rfc, receptor_nombre, serie, folio FROM cfdi
+        WHERE client_id = :client_id ORDER BY id LIMIT 5000
+    """), {"client_id": client_id}).fetchall()
+    if not filas:
+        raise SystemExit(f"No hay CFDIs para {client_id}; generar con benchmarks.kpi_dashboard")
+
+    consultas = []
+    for _ in range(cantidad):
+        fila = rng.choice(filas)
+        consultas += [
+            fila.receptor_nombre.lower(),
+            fila.emisor_rfc[:rng.randint(6, len(fila.emisor_rfc))],
+            fila.uuid[:rng.randint(9, 13)],
+        ]
+        if fila.folio:
+            consultas.append(f"{fila.serie}-{fila.folio}" if fila.serie else fila.folio)
+    return consultas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia de /api/search")
+    parser.add_argument("--url", default=settings.DATABASE_URL, help="URL de la base de datos")
+    parser.add_argument("--cliente", default="BENCH_KPI", help="client_id con datos representativos")
+    parser.add_argument("--indexar", action="store_true", help="Reconstruir cfdi_search del cliente antes de medir")
+    parser.add_argument("--consultas", type=int, default=200, help="Consultas por modo")
+    parser.add_argument("--limite", type=int, default=20, help="Resultados por consulta")
+    parser.add_argument("--objetivo-ms", type=float, default=50.0, help="p95 máximo aceptable por modo")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    with Session(engine) as db:
+        if args.indexar:
+            inicio = time.perf_counter()
+            reindex_client(db, args.cliente)
+            db.commit()
+            print(f"Índice reconstruido en {time.perf_counter() - inicio:.1f}s")
+
+        tiempos = {}
+        for consulta in muestras(db, args.cliente, args.consultas):
+            inicio = time.perf_counter()
+            modo, rows = search_cfdis(db, args.cliente, consulta, args.limite)
+            tiempos.setdefault(modo, []).append((time.perf_counter() - inicio) * 1000)
+            if not rows:
+                print(f"  sin resultados: {consulta!r} ({clasificar(consulta)})")
+
+    print(f"{'modo':>6} {'consultas':>10} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8}")
+    excedidos = []
+    for modo, valores in sorted(tiempos.items()):
+        p95 = statistics.quantiles(valores, n=20)[-1] if len(valores) > 1 else valores[0]
+        print(f"{modo:>6} {len(valores):>10} {statistics.median(valores):>8.1f} {p95:>8.1f} {max(valores):>8.1f}")
+        if p95 > args.objetivo_ms:
+            excedidos.append(modo)
+    if excedidos:
+        print(f"p95 arriba de {args.objetivo_ms:.0f} ms: {', '.join(excedidos)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
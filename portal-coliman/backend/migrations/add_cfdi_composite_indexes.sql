@@ -0,0 +1,17 @@
+-- Índices compuestos de `cfdi` para KPIs, reportes y validación por lote
+-- Todas las consultas filtran primero por client_id y después por un rango de
+-- fecha (fecha >= :inicio AND fecha < :fin), así que client_id va al inicio.
+-- Se crean en línea (ALGORITHM=INPLACE, LOCK=NONE): la tabla sigue aceptando
+-- lecturas y escrituras mientras se construyen. Ejecutar una sola vez.
+-- Revisar los planes después con: python -m benchmarks.explain_reports
+
+USE agentsat_portal;
+
+ALTER TABLE cfdi
+    -- Totales por periodo y tipo (cubre COUNT/SUM(total) sin leer la fila)
+    ADD INDEX idx_cfdi_client_fecha (client_id, fecha, tipo_comprobante, total),
+    -- Desgloses por RFC y top clientes/proveedores de un tipo en un periodo
+    ADD INDEX idx_cfdi_client_tipo_fecha (client_id, tipo_comprobante, fecha),
+    -- Pendientes de validación y validación por lote filtrada por estatus
+    ADD INDEX idx_cfdi_client_estatus_fecha (client_id, estatus_validacion, fecha),
+    ALGORITHM=INPLACE, LOCK=NONE;
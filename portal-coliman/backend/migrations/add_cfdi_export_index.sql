@@ -0,0 +1,12 @@
+-- Índice de `cfdi` por fecha e id dentro de un cliente
+-- Lo usa la exportación fiscal (app/services/fiscal_export.py):
+-- WHERE client_id = ? AND fecha en rango ORDER BY fecha DESC, id DESC.
+-- Con el id en el índice el orden sale de él (sin filesort) y las filas de
+-- una factura con sus conceptos quedan juntas sin depender del plan del join.
+-- Se crea en línea (ALGORITHM=INPLACE, LOCK=NONE). Ejecutar una sola vez.
+
+USE agentsat_portal;
+
+ALTER TABLE cfdi
+    ADD INDEX idx_cfdi_client_fecha_id (client_id, fecha, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,20 @@
+-- Índices de `cfdi` para el listado paginado por cursor (GET /api/cfdis/list)
+-- El listado ordena por (created_at, id) descendente dentro de un cliente y
+-- continúa después de la última fila vista, así que cada filtro del listado
+-- necesita un índice que termine en created_at para no ordenar en memoria.
+-- tipo_comprobante no lleva índice propio: con cinco valores posibles casi
+-- no reduce filas y se resuelve sobre idx_cfdi_client_created.
+-- Se crean en línea (ALGORITHM=INPLACE, LOCK=NONE). Ejecutar una sola vez.
+-- Revisar los planes después con: python -m benchmarks.explain_reports
+
+USE agentsat_portal;
+
+ALTER TABLE cfdi
+    -- Listado sin filtros (InnoDB agrega id al final del índice)
+    ADD INDEX idx_cfdi_client_created (client_id, created_at),
+    -- Listado filtrado por emisor o receptor
+    ADD INDEX idx_cfdi_client_emisor_created (client_id, emisor_rfc, created_at),
+    ADD INDEX idx_cfdi_client_receptor_created (client_id, receptor_rfc, created_at),
+    -- Listado filtrado por estatus de validación
+    ADD INDEX idx_cfdi_client_estatus_created (client_id, estatus_validacion, created_at),
+    ALGORITHM=INPLACE, LOCK=NONE;
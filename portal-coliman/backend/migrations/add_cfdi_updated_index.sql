@@ -0,0 +1,10 @@
+-- Índice de `cfdi` por fecha de modificación dentro de un cliente
+-- Lo usa la sincronización incremental del snapshot de analítica en memoria
+-- (app/services/cfdi_snapshot.py): WHERE client_id = ? AND updated_at >= ?
+-- Se crea en línea (ALGORITHM=INPLACE, LOCK=NONE). Ejecutar una sola vez.
+
+USE agentsat_portal;
+
+ALTER TABLE cfdi
+    ADD INDEX idx_cfdi_client_updated (client_id, updated_at),
+    ALGORITHM=INPLACE, LOCK=NONE;
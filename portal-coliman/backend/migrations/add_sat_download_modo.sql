@@ -0,0 +1,9 @@
+-- Sincronización incremental de la descarga masiva del SAT
+-- modo 'incremental': cada ventana se pide primero como Metadata, se cruza
+-- contra `cfdi` y solo los días con UUIDs faltantes se piden como CFDI
+-- (app/services/sat_descarga.py). Ejecutar una sola vez.
+
+USE agentsat_portal;
+
+ALTER TABLE sat_download_requests
+    ADD COLUMN modo VARCHAR(12) NOT NULL DEFAULT 'completa' COMMENT 'completa o incremental (Metadata primero)' AFTER tipo_solicitud;
@@ -0,0 +1,10 @@
+-- Sincronizaciones divididas en ventanas (descarga masiva del SAT)
+-- Un periodo que excede el tope de CFDIs por solicitud del SAT se registra
+-- como raíz 'dividida' y cada ventana es una solicitud con parent_id = raíz
+-- (app/services/sat_descarga.py). Ejecutar una sola vez.
+
+USE agentsat_portal;
+
+ALTER TABLE sat_download_requests
+    ADD COLUMN parent_id INT NULL COMMENT 'Sincronización raíz cuando el periodo se dividió en ventanas' AFTER user_id,
+    ADD INDEX idx_sat_download_parent (parent_id);
@@ -0,0 +1,13 @@
+-- Almacenamiento por contenido de XML/PDF de CFDIs (Insumos XML/cas/ab/cd/<sha256>.ext)
+-- Un registro por contenido único; ref_count = CFDIs que lo referencian
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS cfdi_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    path VARCHAR(120) NOT NULL COMMENT 'Ruta relativa a Insumos XML',
+    size BIGINT NOT NULL DEFAULT 0,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
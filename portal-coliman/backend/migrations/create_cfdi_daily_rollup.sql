@@ -0,0 +1,43 @@
+-- Agregados diarios de CFDIs para KPIs y reportes
+-- Una fila por (cliente, día, tipo, forma de pago, método de pago, estatus).
+-- La mantienen la ingesta y la validación en la misma transacción que `cfdi`.
+-- forma_pago / metodo_pago vacíos ('') representan NULL en cfdi (forman parte de la llave).
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS cfdi_daily_rollup (
+    client_id VARCHAR(50) NOT NULL,
+    dia DATE NOT NULL,
+    tipo_comprobante ENUM('I', 'E', 'T', 'N', 'P') NOT NULL,
+    forma_pago VARCHAR(3) NOT NULL DEFAULT '',
+    metodo_pago VARCHAR(3) NOT NULL DEFAULT '',
+    estatus_validacion ENUM('pendiente', 'valido', 'rechazado', 'revision') NOT NULL,
+    cantidad INT NOT NULL DEFAULT 0,
+    subtotal DECIMAL(18,2) NOT NULL DEFAULT 0,
+    descuento DECIMAL(18,2) NOT NULL DEFAULT 0,
+    total DECIMAL(18,2) NOT NULL DEFAULT 0,
+    impuestos_trasladados DECIMAL(18,2) NOT NULL DEFAULT 0,
+    impuestos_retenidos DECIMAL(18,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, dia, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Carga inicial a partir de los CFDIs existentes
+INSERT INTO cfdi_daily_rollup (
+    client_id, dia, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion,
+    cantidad, subtotal, descuento, total, impuestos_trasladados, impuestos_retenidos
+)
+SELECT
+    client_id, DATE(fecha), tipo_comprobante, COALESCE(forma_pago, ''), COALESCE(metodo_pago, ''),
+    COALESCE(estatus_validacion, 'pendiente'),
+    COUNT(*), COALESCE(SUM(subtotal), 0), COALESCE(SUM(descuento), 0), COALESCE(SUM(total), 0),
+    COALESCE(SUM(total_impuestos_trasladados), 0), COALESCE(SUM(total_impuestos_retenidos), 0)
+FROM cfdi
+GROUP BY client_id, DATE(fecha), tipo_comprobante, COALESCE(forma_pago, ''), COALESCE(metodo_pago, ''),
+    COALESCE(estatus_validacion, 'pendiente')
+ON DUPLICATE KEY UPDATE
+    cantidad = VALUES(cantidad),
+    subtotal = VALUES(subtotal),
+    descuento = VALUES(descuento),
+    total = VALUES(total),
+    impuestos_trasladados = VALUES(impuestos_trasladados),
+    impuestos_retenidos = VALUES(impuestos_retenidos);
@@ -0,0 +1,20 @@
+-- Manifiesto de importación de CFDIs desde carpeta (import-folder)
+-- Permite omitir archivos sin cambios y retomar importaciones interrumpidas
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS cfdi_import_manifest (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    path VARCHAR(500) NOT NULL COMMENT 'Ruta relativa a la carpeta de importación',
+    size BIGINT NOT NULL,
+    mtime_ns BIGINT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    uuid VARCHAR(36) NULL,
+    estado VARCHAR(20) NOT NULL COMMENT 'Estado: importado, duplicado, error',
+    mensaje VARCHAR(500) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_path_per_client (client_id, path),
+    INDEX idx_manifest_sha256 (client_id, sha256)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,27 @@
+-- Tabla de jobs en segundo plano de CFDIs (ingesta de cargas, etc.)
+-- Ejecutar después de la creación inicial de tablas
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS cfdi_jobs (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    user_id INT NULL,
+    job_type VARCHAR(30) NOT NULL COMMENT 'Tipo de job: ingesta',
+    estado VARCHAR(20) NOT NULL DEFAULT 'en_cola' COMMENT 'Estado: en_cola, procesando, completado, error',
+    payload JSON NULL COMMENT 'Parámetros del job (archivos guardados, etc.)',
+    total INT NULL COMMENT 'Elementos por procesar, si se conoce de antemano',
+    procesados INT NOT NULL DEFAULT 0,
+    exitosos INT NOT NULL DEFAULT 0,
+    duplicados INT NOT NULL DEFAULT 0,
+    errores INT NOT NULL DEFAULT 0,
+    errores_detalle JSON NULL COMMENT 'Primeros errores (filename, error)',
+    resultado JSON NULL COMMENT 'Estadísticas finales del job',
+    mensaje_error TEXT NULL,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_cfdi_jobs_cola (estado, job_type, id),
+    INDEX idx_cfdi_jobs_client (client_id, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,33 @@
+-- Índice de búsqueda de CFDIs (GET /api/search)
+-- Una fila por CFDI con nombres y RFC de emisor y receptor, serie, folio y
+-- descripciones de los conceptos, bajo un índice FULLTEXT. La mantiene la
+-- ingesta en la misma transacción que `cfdi`; se borra en cascada con el CFDI.
+-- El índice FULLTEXT se crea después de la carga inicial (es más rápido que
+-- mantenerlo fila por fila durante el INSERT). Ejecutar una sola vez.
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS cfdi_search (
+    cfdi_id INT PRIMARY KEY,
+    client_id VARCHAR(50) NOT NULL,
+    contenido MEDIUMTEXT NOT NULL,
+    FOREIGN KEY (cfdi_id) REFERENCES cfdi(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Carga inicial a partir de los CFDIs existentes
+SET SESSION group_concat_max_len = 1048576;
+
+INSERT INTO cfdi_search (cfdi_id, client_id, contenido)
+SELECT
+    c.id, c.client_id,
+    CONCAT_WS(' ',
+        c.emisor_nombre, c.receptor_nombre, c.emisor_rfc, c.receptor_rfc,
+        c.serie, c.folio, CONCAT(c.serie, c.folio),
+        GROUP_CONCAT(DISTINCT cc.descripcion SEPARATOR ' ')
+    )
+FROM cfdi c
+LEFT JOIN cfdi_conceptos cc ON cc.cfdi_id = c.id
+GROUP BY c.id
+ON DUPLICATE KEY UPDATE contenido = VALUES(contenido);
+
+ALTER TABLE cfdi_search ADD FULLTEXT INDEX ft_cfdi_search_contenido (contenido);
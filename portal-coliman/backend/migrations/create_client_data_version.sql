@@ -0,0 +1,12 @@
+-- Versión de los datos de CFDI por cliente
+-- Se incrementa en la misma transacción que cualquier cambio al agregado diario
+-- (ingesta o validación); la caché de KPIs y reportes descarta los resultados
+-- calculados con una versión anterior.
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS client_data_version (
+    client_id VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
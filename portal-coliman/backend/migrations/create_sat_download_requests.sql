@@ -0,0 +1,34 @@
+-- Solicitudes de descarga masiva del SAT (orquestador en segundo plano)
+-- El scheduler del backend envía la solicitud, verifica su estado con
+-- backoff y descarga e ingiere los paquetes en cuanto están listos
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS sat_download_requests (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    user_id INT NULL,
+    tipo VARCHAR(10) NOT NULL COMMENT 'emitidos o recibidos',
+    tipo_solicitud VARCHAR(10) NOT NULL DEFAULT 'CFDI' COMMENT 'CFDI o Metadata',
+    fecha_inicio DATE NOT NULL,
+    fecha_fin DATE NOT NULL,
+    rfc_emisor VARCHAR(13) NULL,
+    rfc_receptor VARCHAR(13) NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente' COMMENT 'Estado: pendiente, solicitada, descargando, completada, error, rechazada, vencida',
+    solicitud_id VARCHAR(50) NULL COMMENT 'IdSolicitud del SAT',
+    estado_sat TINYINT NULL COMMENT 'EstadoSolicitud del SAT (1 aceptada ... 6 vencida)',
+    codigo_estado VARCHAR(10) NULL COMMENT 'CodigoEstadoSolicitud del SAT',
+    numero_cfdis INT NULL,
+    paquetes JSON NULL COMMENT 'Ids de paquete reportados por el SAT',
+    paquetes_descargados JSON NULL COMMENT 'Ids de paquete ya descargados e ingeridos',
+    resultado JSON NULL COMMENT 'Estadísticas acumuladas de la ingesta',
+    verificaciones INT NOT NULL DEFAULT 0 COMMENT 'Verificaciones sin cambio de estado (backoff)',
+    errores INT NOT NULL DEFAULT 0 COMMENT 'Errores seguidos al hablar con el SAT',
+    mensaje TEXT NULL,
+    next_check_at DATETIME NOT NULL COMMENT 'Siguiente paso del scheduler (también lease mientras se procesa)',
+    finished_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_sat_download_cola (estado, next_check_at),
+    INDEX idx_sat_download_client (client_id, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
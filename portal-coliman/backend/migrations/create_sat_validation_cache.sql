@@ -0,0 +1,15 @@
+-- Caché de resultados de validación del SAT (ConsultaCFDIService)
+-- Clave: sha256(uuid|rfc emisor|rfc receptor|total); compartida entre clientes
+
+USE agentsat_portal;
+
+CREATE TABLE IF NOT EXISTS sat_validation_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    uuid VARCHAR(36) NOT NULL,
+    estado VARCHAR(30) NOT NULL COMMENT 'Estado reportado por el SAT: Vigente, Cancelado, No Encontrado',
+    respuesta JSON NOT NULL COMMENT 'Resultado completo de la consulta',
+    consultado_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL COMMENT 'Vigencia según el estado',
+    INDEX idx_sat_cache_uuid (uuid),
+    INDEX idx_sat_cache_expires (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
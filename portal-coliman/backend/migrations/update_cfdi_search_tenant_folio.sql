@@ -0,0 +1,16 @@
+-- Búsqueda de CFDIs: token del cliente en el índice FULLTEXT e índice de folio
+-- - Cada documento de cfdi_search empieza con 't' + 16 hex de MD5(client_id)
+--   (app/services/cfdi_search.py: token_cliente); la búsqueda de texto lo
+--   exige y MySQL solo evalúa los documentos del cliente.
+-- - Folio exacto por cliente para las búsquedas por folio / serie-folio.
+-- El índice de folio se crea en línea (ALGORITHM=INPLACE, LOCK=NONE).
+-- Ejecutar una sola vez (el UPDATE reescribe todos los documentos).
+
+USE agentsat_portal;
+
+UPDATE cfdi_search
+SET contenido = CONCAT('t', LEFT(MD5(client_id), 16), ' ', contenido);
+
+ALTER TABLE cfdi
+    ADD INDEX idx_cfdi_client_folio (client_id, folio),
+    ALGORITHM=INPLACE, LOCK=NONE;
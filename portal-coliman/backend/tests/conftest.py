@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures comunes de las pruebas unitarias (sin BD ni servidor)
+"""
+from pathlib import Path
+
+import pytest
+
+# Los XML de ejemplo viven en "C:/Git/Coliman/Insumos XML" (copiados tal cual
+# desde Windows, por eso el patrón no fija el nombre de la primera carpeta)
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+MUESTRAS_XML = sorted(BACKEND_DIR.glob('C*/Git/Coliman/Insumos XML/**/*.xml'))
+
+
+@pytest.fixture(scope='session')
+def xml_muestras():
+    """Lista de (nombre, contenido) de los CFDI de ejemplo del repositorio"""
+    if not MUESTRAS_XML:
+        pytest.skip('No hay XML de ejemplo en el repositorio')
+    return [(path.name, path.read_bytes()) for path in MUESTRAS_XML]
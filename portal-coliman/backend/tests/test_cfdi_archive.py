@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la extracción de pares XML/PDF desde archivos comprimidos
+"""
+import io
+import zipfile
+
+import pytest
+
+from app.services import cfdi_archive
+from app.services.cfdi_archive import _index_pairs, extract_compressed_file, is_compressed_filename
+
+
+def zip_en_memoria(miembros: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for nombre, contenido in miembros.items():
+            z.writestr(nombre, contenido)
+    return buffer.getvalue()
+
+
+MIEMBROS = {
+    'lote/AAA.xml': b'<xml a/>',
+    'lote/AAA.pdf': b'%PDF a',
+    'lote\\BBB.XML': b'<xml b/>',
+    'CCC.pdf': b'%PDF sin xml',
+    'notas.txt': b'ignorado',
+}
+
+
+@pytest.mark.parametrize('nombre, esperado', [
+    ('cfdis.zip', True), ('CFDIS.RAR', True), ('enero.7z', True),
+    ('factura.xml', False), ('cfdis.zip.pdf', False), ('cfdis.tar.gz', False),
+])
+def test_is_compressed_filename(nombre, esperado):
+    assert is_compressed_filename(nombre) is esperado
+
+
+def test_index_pairs_agrupa_por_nombre_base_y_descarta_pdf_sueltos():
+    pares = _index_pairs(list(MIEMBROS))
+
+    assert pares == [
+        {'xml': 'lote/AAA.xml', 'pdf': 'lote/AAA.pdf'},
+        {'xml': 'lote\\BBB.XML', 'pdf': None},
+    ]
+
+
+@pytest.mark.parametrize('como_archivo', [False, True])
+def test_zip_entrega_pares_con_contenido(como_archivo):
+    contenido = zip_en_memoria(MIEMBROS)
+    fuente = io.BytesIO(contenido) if como_archivo else contenido
+
+    pares = list(extract_compressed_file(fuente, 'CFDIS.ZIP'))
+
+    assert pares == [
+        {'xml': ('AAA.xml', b'<xml a/>'), 'pdf': ('AAA.pdf', b'%PDF a')},
+        {'xml': ('BBB.XML', b'<xml b/>'), 'pdf': None},
+    ]
+
+
+@pytest.mark.parametrize('tamano_pasada', [1, 64])
+def test_7z_entrega_los_mismos_pares(monkeypatch, tamano_pasada):
+    py7zr = pytest.importorskip('py7zr')
+    monkeypatch.setattr(cfdi_archive, 'SEVEN_ZIP_BATCH', tamano_pasada)
+    buffer = io.BytesIO()
+    with py7zr.SevenZipFile(buffer, 'w') as z:
+        for nombre, contenido in MIEMBROS.items():
+            z.writestr(contenido, nombre.replace('\\', '/'))
+    buffer.seek(0)
+
+    pares = sorted(extract_compressed_file(buffer, 'cfdis.7z'), key=lambda p: p['xml'][0])
+
+    assert [p['xml'] for p in pares] == [('AAA.xml', b'<xml a/>'), ('BBB.XML', b'<xml b/>')]
+    assert pares[0]['pdf'] == ('AAA.pdf', b'%PDF a')
+
+
+def test_archivo_danado_no_lanza():
+    assert list(extract_compressed_file(b'esto no es un zip', 'cfdis.zip')) == []
+
+
+def test_extension_no_soportada_no_entrega_nada():
+    assert list(extract_compressed_file(b'...', 'cfdis.tar')) == []
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del detalle de CFDIs por lote; las consultas corren sobre SQLite
+"""
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.services import cfdi_detail
+from app.services.cfdi_detail import load_cfdi, load_cfdis, stream_ndjson
+
+
+@pytest.fixture(scope='module')
+def engine():
+    engine = create_engine('sqlite://', poolclass=StaticPool,
+                           connect_args={'detect_types': sqlite3.PARSE_DECLTYPES, 'check_same_thread': False})
+    with engine.begin() as conexion:
+        # uuid sin distinguir mayúsculas, como la collation utf8mb4_unicode_ci de MySQL
+        conexion.execute(text("""CREATE TABLE cfdi (
+            id INTEGER PRIMARY KEY, client_id TEXT, uuid TEXT COLLATE NOCASE, fecha TEXT, tipo_comprobante TEXT,
+            serie TEXT, folio TEXT, emisor_rfc TEXT, emisor_nombre TEXT, emisor_regimen TEXT,
+            receptor_rfc TEXT, receptor_nombre TEXT, receptor_uso_cfdi TEXT,
+            subtotal REAL, descuento REAL, total REAL, moneda TEXT, tipo_cambio REAL,
+            total_impuestos_trasladados REAL, total_impuestos_retenidos REAL,
+            metodo_pago TEXT, forma_pago TEXT, xml_path TEXT, estatus_validacion TEXT,
+            created_at TIMESTAMP)"""))
+        conexion.execute(text("""CREATE TABLE cfdi_conceptos (
+            id INTEGER PRIMARY KEY, cfdi_id INTEGER, clave_prod_serv TEXT, cantidad REAL,
+            clave_unidad TEXT, descripcion TEXT, valor_unitario REAL, importe REAL, descuento REAL)"""))
+        conexion.execute(text("""
+            INSERT INTO cfdi (id, client_id, uuid, fecha, total, subtotal, tipo_cambio, created_at)
+            VALUES (:id, :client_id, :uuid, '2025-01-01', :total, :total, NULL, '2025-01-02 08:00:00')
+        """), [
+            {"id": n, "client_id": 'C2' if n == 4 else 'C1', "uuid": f'uuid-{n}', "total": 100.0 * n}
+            for n in range(1, 6)
+        ])
+        # Conceptos insertados fuera de orden: se regresan por cfdi y en orden de captura
+        conexion.execute(text("""
+            INSERT INTO cfdi_conceptos (id, cfdi_id, descripcion, cantidad, importe, descuento)
+            VALUES (:id, :cfdi_id, :descripcion, 1, 10, NULL)
+        """), [
+            {"id": 3, "cfdi_id": 2, "descripcion": 'B2'},
+            {"id": 1, "cfdi_id": 2, "descripcion": 'B1'},
+            {"id": 2, "cfdi_id": 1, "descripcion": 'A1'},
+            {"id": 4, "cfdi_id": 4, "descripcion": 'de otro cliente'},
+        ])
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    consultas = []
+
+    def registrar(conexion, cursor, sql, *args):
+        consultas.append(sql)
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    sesion = sessionmaker(bind=engine)()
+    sesion.consultas = consultas
+    yield sesion
+    sesion.close()
+    event.remove(engine, 'before_cursor_execute', registrar)
+
+
+def test_dos_consultas_por_lote(db):
+    cfdis, no_encontrados = load_cfdis(db, 'C1', ids=[3, 1, 2])
+
+    assert [c['id'] for c in cfdis] == [3, 1, 2]
+    assert no_encontrados == {'ids': [], 'uuids': []}
+    assert len(db.consultas) == 2
+    assert [c['descripcion'] for c in cfdis[2]['conceptos']] == ['B1', 'B2']
+    assert [c['descripcion'] for c in cfdis[1]['conceptos']] == ['A1']
+    assert cfdis[0]['conceptos'] == []
+
+
+def test_orden_pedido_sin_repetir_y_no_encontrados(db):
+    cfdis, no_encontrados = load_cfdis(db, 'C1', ids=[2, 99, 4, 2], uuids=['UUID-1', 'uuid-2', 'uuid-404'])
+
+    # Primero los ids y después los UUIDs (sin distinguir mayúsculas); el 2 sale una vez
+    assert [c['id'] for c in cfdis] == [2, 1]
+    # El 4 existe pero es de otro cliente
+    assert no_encontrados == {'ids': [99, 4], 'uuids': ['UUID-404']}
+
+
+def test_sin_pedidos_no_consulta(db):
+    assert load_cfdis(db, 'C1') == ([], {'ids': [], 'uuids': []})
+    assert db.consultas == []
+
+
+def test_serializacion_y_detalle_individual(db):
+    cfdi = load_cfdi(db, 'C1', 2)
+
+    assert cfdi['total'] == 200.0
+    # NULL: tipo de cambio 1 y montos en cero
+    assert cfdi['tipo_cambio'] == 1
+    assert cfdi['descuento'] == 0
+    assert cfdi['conceptos'][0] == {
+        'clave_prod_serv': None, 'cantidad': 1.0, 'clave_unidad': None, 'descripcion': 'B1',
+        'valor_unitario': 0, 'importe': 10.0, 'descuento': 0,
+    }
+    assert load_cfdi(db, 'C1', 4) is None
+
+
+def test_stream_ndjson_por_bloques(engine, monkeypatch):
+    monkeypatch.setattr(cfdi_detail, 'SessionLocal', sessionmaker(bind=engine))
+    monkeypatch.setattr(cfdi_detail, 'BLOQUE_NDJSON', 2)
+
+    partes = list(stream_ndjson('C1', [1, 99, 3], ['uuid-1', 'uuid-5']))
+    lineas = [json.loads(linea) for parte in partes for linea in parte.decode('utf-8').splitlines()]
+
+    assert len(partes) == 3
+    # El 1 pedido por id y por UUID en bloques distintos sale una vez
+    assert [linea.get('id') for linea in lineas] == [1, 99, 3, 5]
+    assert lineas[1] == {'id': 99, 'error': 'no encontrado'}
+    assert lineas[0]['created_at'] == '2025-01-02T08:00:00'
+    assert [c['descripcion'] for c in lineas[0]['conceptos']] == ['A1']
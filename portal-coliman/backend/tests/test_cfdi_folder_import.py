@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la importación incremental de carpetas (el manifiesto y la tabla
+cfdi se simulan en memoria)
+"""
+import os
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import cfdi_folder_import, cfdi_ingestion
+from app.services.cfdi_folder_import import FolderImport
+from app.services.cfdi_ingestion import CfdiBatchWriter
+
+
+class BaseFalsa:
+    """Sesión con el manifiesto y los UUIDs registrados en memoria"""
+
+    def __init__(self):
+        self.manifiesto = {}
+        self.uuids = set()
+
+    def execute(self, sql, params):
+        if sql is cfdi_folder_import.SELECT_MANIFEST_SQL:
+            return [SimpleNamespace(**fila) for fila in self.manifiesto.values()]
+        for fila in params:
+            self.manifiesto[fila['path']] = fila
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = BaseFalsa()
+    monkeypatch.setattr(cfdi_ingestion, 'find_existing_uuids',
+                        lambda _, client_id, uuids: {u.upper(): 1 for u in uuids if u.upper() in db.uuids})
+    monkeypatch.setattr(CfdiBatchWriter, '_insert_rows',
+                        lambda self, rows: db.uuids.update(e['cfdi_data']['uuid'].upper() for e in rows))
+    monkeypatch.setattr(cfdi_folder_import, 'save_xml_and_pdf', lambda nombre, contenido, pdf: (nombre, None))
+    return db
+
+
+@pytest.fixture
+def carpeta(tmp_path, xml_muestras):
+    dia = tmp_path / '2025' / '12' / '18'
+    dia.mkdir(parents=True)
+    for nombre, contenido in xml_muestras[:3]:
+        (dia / nombre).write_bytes(contenido)
+    (dia / 'roto.xml').write_bytes(b'<cfdi:Comprobante')
+    (dia / 'leeme.txt').write_bytes(b'no es xml')
+    return tmp_path
+
+
+def importar(db, carpeta, retry_errors=False) -> dict:
+    return FolderImport(db, 'C1', carpeta, retry_errors=retry_errors).run()
+
+
+def estados(db) -> dict:
+    return {path.rsplit('/', 1)[-1]: fila['estado'] for path, fila in db.manifiesto.items()}
+
+
+def test_primera_importacion_registra_todo(db, carpeta):
+    stats = importar(db, carpeta)
+
+    assert stats['archivos'] == 4
+    assert stats['procesados'] == 4
+    assert stats['insertados'] == 3
+    assert list(estados(db).values()).count('importado') == 3
+    assert estados(db)['roto.xml'] == 'error'
+    assert all(path.startswith('2025/12/18/') for path in db.manifiesto)
+
+
+def test_segunda_importacion_solo_hace_stat(db, carpeta, monkeypatch):
+    importar(db, carpeta)
+    monkeypatch.setattr(CfdiBatchWriter, 'add_xml', lambda *a, **k: pytest.fail('no debe leer ni parsear'))
+
+    stats = importar(db, carpeta)
+
+    assert stats['sin_cambios'] == 4
+    assert stats['procesados'] == 0
+
+
+def test_contenido_conocido_no_se_parsea(db, carpeta, xml_muestras):
+    importar(db, carpeta)
+    dia = carpeta / '2025' / '12' / '18'
+    primero, segundo = xml_muestras[0][0], xml_muestras[1][0]
+    # Archivo tocado (mismo contenido, otro mtime) y copia con otro nombre
+    os.utime(dia / primero, ns=(1, 1))
+    shutil.copy(dia / segundo, dia / 'copia.xml')
+
+    stats = importar(db, carpeta)
+
+    assert stats['contenido_conocido'] == 2
+    assert stats['procesados'] == 0
+    assert estados(db)[primero] == 'importado'
+    assert estados(db)['copia.xml'] == 'duplicado'
+    assert db.manifiesto['2025/12/18/copia.xml']['uuid'] == db.manifiesto[f'2025/12/18/{segundo}']['uuid']
+
+
+def test_errores_se_reintentan_solo_si_se_pide(db, carpeta):
+    importar(db, carpeta)
+    assert importar(db, carpeta)['procesados'] == 0
+
+    stats = importar(db, carpeta, retry_errors=True)
+
+    assert stats['procesados'] == 1
+    assert estados(db)['roto.xml'] == 'error'
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del registro por lotes de CFDIs (sin BD: la sesión es un doble)
+"""
+import re
+
+import pytest
+
+from app.services import cfdi_ingestion
+from app.services.cfdi_ingestion import CfdiBatchWriter, build_cfdi_params, build_concepto_params
+from app.services.cfdi_parser import parse_cfdi_lxml
+
+
+class SesionFalsa:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def cfdi(uuid: str) -> dict:
+    return {'uuid': uuid, 'conceptos': [{'importe': 1.0}, {'importe': 2.0}]}
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """Writer con lotes de 3 cuyo INSERT solo registra las filas recibidas"""
+    monkeypatch.setattr(cfdi_ingestion, 'find_existing_uuids', lambda db, client_id, uuids: {'AAA': 1})
+    insertados = []
+    monkeypatch.setattr(CfdiBatchWriter, '_insert_rows', lambda self, rows: insertados.append(list(rows)))
+    w = CfdiBatchWriter(SesionFalsa(), 'C1', lambda nombre, contenido, pdf: (f'x/{nombre}', None), chunk_size=3)
+    w.insertados = insertados
+    return w
+
+
+def test_build_cfdi_params_desde_muestra(xml_muestras):
+    nombre, contenido = xml_muestras[0]
+    datos = parse_cfdi_lxml(contenido)
+
+    params = build_cfdi_params('C1', datos, 'ab/cd.xml', None)
+
+    assert params['uuid'] == datos['uuid']
+    assert params['total'] == datos['total']
+    assert params['total_impuestos_trasladados'] == datos.get('total_impuestos_trasladados', 0)
+    assert params['estatus_validacion'] == 'pendiente'
+    # Cada placeholder del INSERT multi-fila tiene su parámetro y viceversa
+    assert set(params) == set(re.findall(r':(\w+)', cfdi_ingestion.INSERT_CFDI_SQL.text))
+
+
+def test_build_concepto_params_valores_por_omision():
+    params = build_concepto_params(7, {'descripcion': 'Servicio'})
+
+    assert params == {
+        'cfdi_id': 7, 'clave_prod_serv': None, 'clave_unidad': None, 'cantidad': 0,
+        'descripcion': 'Servicio', 'valor_unitario': 0, 'importe': 0, 'descuento': 0
+    }
+
+
+def test_un_commit_por_lote_y_duplicados(writer):
+    # 'aaa' ya existe (sin distinguir mayúsculas) y 'bbb' se repite dentro del lote
+    for i, uuid in enumerate(['aaa', 'BBB', 'bbb', 'CCC']):
+        writer.add(f'f{i}.xml', f'f{i}.xml', b'<xml/>', cfdi(uuid))
+    stats = writer.close()
+
+    assert [[e['cfdi_data']['uuid'] for e in lote] for lote in writer.insertados] == [['BBB'], ['CCC']]
+    assert writer.db.commits == 2
+    assert stats['lotes'] == 2
+    assert stats['insertados'] == 2
+    assert stats['duplicados'] == 2
+    assert stats['conceptos'] == 4
+    assert writer.processed == 4
+
+
+def test_sin_uuid_es_error_sin_tocar_bd(writer):
+    writer.add('f.xml', 'f.xml', b'<xml/>', {'uuid': None})
+    writer.close()
+
+    assert writer.errors == [{'filename': 'f.xml', 'error': 'No se encontró UUID en el XML'}]
+    assert writer.db.commits == 0
+
+
+def test_lote_fallido_se_reintenta_fila_por_fila(monkeypatch):
+    monkeypatch.setattr(cfdi_ingestion, 'find_existing_uuids', lambda db, client_id, uuids: {})
+
+    def insertar(self, rows):
+        if len(rows) > 1 or rows[0]['cfdi_data']['uuid'] == 'MALO':
+            raise ValueError('Data too long')
+
+    monkeypatch.setattr(CfdiBatchWriter, '_insert_rows', insertar)
+    w = CfdiBatchWriter(SesionFalsa(), 'C1', lambda nombre, contenido, pdf: (nombre, None), chunk_size=10)
+    for uuid in ['UNO', 'MALO', 'DOS']:
+        w.add(f'{uuid}.xml', f'{uuid}.xml', b'<xml/>', cfdi(uuid))
+    stats = w.close()
+
+    assert stats['insertados'] == 2
+    assert [r['uuid'] for r in w.results] == ['UNO', 'DOS']
+    assert w.errors == [{'filename': 'MALO.xml', 'error': 'Data too long'}]
+    assert w.db.commits == 2
+    assert w.db.rollbacks == 2
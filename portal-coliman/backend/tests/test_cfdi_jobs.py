@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la ejecución de jobs e ingesta en segundo plano (sin BD: la tabla
+cfdi_jobs y el INSERT de CFDIs se sustituyen por dobles)
+"""
+import io
+import zipfile
+
+import pytest
+
+from app.services import cfdi_ingestion, cfdi_jobs
+from app.services.cfdi_ingestion import CfdiBatchWriter
+
+
+class SesionFalsa:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def terminados(monkeypatch):
+    """Registra las llamadas a finish_job en lugar de escribir en cfdi_jobs"""
+    llamadas = []
+    monkeypatch.setattr(
+        cfdi_jobs, 'finish_job',
+        lambda db, job_id, estado, resultado=None, errores_detalle=None, mensaje_error=None:
+            llamadas.append((job_id, estado, resultado, errores_detalle, mensaje_error))
+    )
+    return llamadas
+
+
+def job(job_type: str, payload: dict = None) -> dict:
+    return {'id': 1, 'client_id': 'C1', 'user_id': 1, 'job_type': job_type, 'payload': payload or {}}
+
+
+def test_run_job_completa_y_separa_el_detalle_de_errores(monkeypatch, terminados):
+    monkeypatch.setitem(cfdi_jobs.JOB_HANDLERS, 'prueba', lambda db, j: {'n': 3, 'errores_detalle': ['e']})
+
+    cfdi_jobs.run_job(SesionFalsa(), job('prueba'))
+
+    assert terminados == [(1, cfdi_jobs.ESTADO_COMPLETADO, {'n': 3}, ['e'], None)]
+
+
+def test_run_job_tipo_desconocido(terminados):
+    cfdi_jobs.run_job(SesionFalsa(), job('no_existe'))
+
+    assert terminados[0][1] == cfdi_jobs.ESTADO_ERROR
+    assert 'no soportado' in terminados[0][4]
+
+
+def test_run_job_handler_que_falla_hace_rollback(monkeypatch, terminados):
+    def falla(db, j):
+        raise RuntimeError('disco lleno')
+
+    monkeypatch.setitem(cfdi_jobs.JOB_HANDLERS, 'prueba', falla)
+    db = SesionFalsa()
+
+    cfdi_jobs.run_job(db, job('prueba'))
+
+    assert db.rollbacks == 1
+    assert terminados == [(1, cfdi_jobs.ESTADO_ERROR, None, None, 'disco lleno')]
+
+
+def test_ingesta_reporta_avance_y_limpia_la_carga(monkeypatch, tmp_path, xml_muestras, terminados):
+    insertados = []
+    avances = []
+    borrados = []
+    monkeypatch.setattr(cfdi_ingestion, 'find_existing_uuids', lambda db, client_id, uuids: {})
+    monkeypatch.setattr(CfdiBatchWriter, '_insert_rows', lambda self, rows: insertados.extend(rows))
+    monkeypatch.setattr(cfdi_jobs, 'save_xml_and_pdf', lambda nombre, contenido, pdf: (nombre, None))
+    monkeypatch.setattr(cfdi_jobs, 'update_progress', lambda db, job_id, **contadores: avances.append(contadores))
+    monkeypatch.setattr(cfdi_jobs, 'remove_upload_dir', borrados.append)
+
+    (nombre_xml, contenido_xml), *resto = xml_muestras
+    (tmp_path / nombre_xml).write_bytes(contenido_xml)
+    with zipfile.ZipFile(tmp_path / 'lote.zip', 'w') as z:
+        for nombre, contenido in resto[:4] + [(nombre_xml, contenido_xml)]:
+            z.writestr(nombre, contenido)
+    (tmp_path / 'notas.txt').write_bytes(b'x')
+
+    archivos = [
+        {'filename': nombre_xml, 'path': str(tmp_path / nombre_xml)},
+        {'filename': 'lote.zip', 'path': str(tmp_path / 'lote.zip')},
+        {'filename': 'notas.txt', 'path': str(tmp_path / 'notas.txt')},
+        {'filename': 'perdido.xml', 'path': str(tmp_path / 'perdido.xml')},
+    ]
+    cfdi_jobs.run_job(SesionFalsa(), job(cfdi_jobs.JOB_INGESTA, {'archivos': archivos, 'job_key': 'k1'}))
+
+    (_, estado, resultado, errores, _), = terminados
+    assert estado == cfdi_jobs.ESTADO_COMPLETADO
+    assert len(insertados) == 5
+    assert resultado['total_files'] == 4
+    assert resultado['rendimiento']['duplicados'] == 1
+    assert sorted(e['filename'] for e in errores) == ['lote.zip > ' + nombre_xml, 'notas.txt', 'perdido.xml']
+    assert avances[-1] == {'procesados': 8, 'exitosos': 5, 'duplicados': 1, 'errores': 2}
+    assert borrados == ['k1']
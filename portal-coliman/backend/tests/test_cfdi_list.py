@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del listado por cursor (keyset) de CFDIs; la consulta corre sobre SQLite
+"""
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.services.cfdi_list import (
+    CursorInvalidoError, build_filters, decode_cursor, encode_cursor, fetch_offset_page, fetch_page
+)
+
+
+@pytest.mark.parametrize('created_at, cfdi_id', [
+    (datetime(2025, 1, 31, 23, 59, 59), 1),
+    (datetime(1999, 12, 31, 0, 0, 0), 2 ** 40),
+])
+def test_cursor_ida_y_vuelta(created_at, cfdi_id):
+    cursor = encode_cursor(created_at, cfdi_id)
+
+    assert decode_cursor(cursor) == (created_at, cfdi_id)
+    # Opaco y seguro en una URL: sin relleno ni caracteres reservados
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+
+
+def test_cursor_descarta_microsegundos():
+    # created_at es TIMESTAMP sin fracción: el cursor guarda solo segundos
+    assert decode_cursor(encode_cursor(datetime(2025, 1, 1, 8, 0, 0, 999999), 5)) == (datetime(2025, 1, 1, 8), 5)
+
+
+@pytest.mark.parametrize('cursor', ['', 'no-es-base64!', 'MjAyNS0wMS0wMQ', 'eHx5', 'MjAyNS0wMS0wMSAwMDowMDowMHxhYmM'])
+def test_cursor_invalido(cursor):
+    with pytest.raises(CursorInvalidoError):
+        decode_cursor(cursor)
+
+
+def test_filtros_por_rango_de_fechas():
+    condiciones, params = build_filters('C1', {'fecha_inicio': '2025-01-01', 'fecha_fin': '2025-01-31',
+                                               'emisor_rfc': 'AAA010101AAA', 'receptor_rfc': None})
+
+    assert condiciones == ["client_id = :client_id", "fecha >= :fecha_inicio",
+                           "fecha < :fecha_fin_exclusiva", "emisor_rfc = :emisor_rfc"]
+    assert params['fecha_fin_exclusiva'] == '2025-02-01'
+
+
+@pytest.fixture(scope='module')
+def db():
+    # created_at como TIMESTAMP para que SQLite lo regrese como datetime, igual que MySQL
+    sesion = Session(create_engine('sqlite://', connect_args={'detect_types': sqlite3.PARSE_DECLTYPES}))
+    sesion.execute(text("""CREATE TABLE cfdi (
+        id INTEGER PRIMARY KEY, client_id TEXT, uuid TEXT, fecha TEXT, tipo_comprobante TEXT,
+        emisor_rfc TEXT, emisor_nombre TEXT, receptor_rfc TEXT, receptor_nombre TEXT,
+        subtotal REAL, total REAL, moneda TEXT, estatus_validacion TEXT, created_at TIMESTAMP)"""))
+    rng = random.Random(5)
+    base = datetime(2025, 3, 1)
+    # Cargas por lote: muchas filas comparten created_at
+    sesion.execute(text("""
+        INSERT INTO cfdi (id, client_id, uuid, fecha, emisor_rfc, created_at)
+        VALUES (:id, :client_id, :uuid, '2025-01-01', :emisor_rfc, :created_at)
+    """), [{
+        "id": n, "client_id": 'C1' if n % 4 else 'C2', "uuid": f'U-{n}',
+        "emisor_rfc": rng.choice(['AAA', 'BBB']),
+        "created_at": (base + timedelta(seconds=rng.randrange(20))).strftime('%Y-%m-%d %H:%M:%S')
+    } for n in range(1, 201)])
+    yield sesion
+    sesion.close()
+
+
+def recorrer(db, filtros: dict, limit: int) -> list:
+    ids, cursor, paginas = [], None, 0
+    while True:
+        filas, cursor = fetch_page(db, 'C1', filtros, cursor, limit)
+        ids.extend(f.id for f in filas)
+        paginas += 1
+        if cursor is None:
+            return ids, paginas
+
+
+@pytest.mark.parametrize('filtros', [{}, {'emisor_rfc': 'AAA'}])
+@pytest.mark.parametrize('limit', [1, 7, 150])
+def test_paginas_recorren_todo_una_vez_en_orden(db, filtros, limit):
+    ids, paginas = recorrer(db, filtros, limit)
+
+    esperados = [f.id for f in fetch_offset_page(db, 'C1', filtros, 0, 1000)]
+    assert ids == esperados
+    assert len(ids) == len(set(ids))
+    assert paginas == max(1, -(-len(esperados) // limit))
+
+
+def test_ultima_pagina_exacta_no_tiene_cursor(db):
+    total = len(fetch_offset_page(db, 'C1', {}, 0, 1000))
+
+    filas, cursor = fetch_page(db, 'C1', {}, None, total)
+
+    assert len(filas) == total and cursor is None
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del parseo por lotes: orden de resultados, errores por XML y cuándo
+se usa el pool de procesos
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services import cfdi_parse_pool
+from app.services.cfdi_parse_pool import parse_many
+
+
+class PoolEspia:
+    """Executor en el mismo proceso que registra cómo se le reparte el trabajo"""
+    _max_workers = 2
+
+    def __init__(self):
+        self.chunksizes = []
+
+    def map(self, func, items, chunksize=1):
+        self.chunksizes.append(chunksize)
+        return map(func, items)
+
+
+def test_orden_y_errores_por_xml(xml_muestras):
+    contenidos = [contenido for _, contenido in xml_muestras[:3]]
+
+    resultados = parse_many([contenidos[0], b'<no cierra', contenidos[1], contenidos[2]])
+
+    assert [error is None for _, error in resultados] == [True, False, True, True]
+    assert resultados[1][0] is None
+    assert resultados[1][1].startswith('Error al parsear XML')
+    assert [datos['uuid'].upper() for datos, _ in resultados if datos] == [
+        nombre[:-4] for nombre, _ in xml_muestras[:3]
+    ]
+
+
+def test_cargas_chicas_no_usan_el_pool(monkeypatch):
+    monkeypatch.setattr(cfdi_parse_pool, 'get_parse_executor', lambda: (_ for _ in ()).throw(AssertionError))
+    monkeypatch.setattr(cfdi_parse_pool.settings, 'CFDI_PARSE_PARALLEL_MIN', 10)
+
+    assert len(parse_many([b'<a/>'] * 9)) == 9
+
+
+def test_un_solo_nucleo_no_usa_el_pool(monkeypatch):
+    monkeypatch.setattr(cfdi_parse_pool, 'get_parse_executor', lambda: (_ for _ in ()).throw(AssertionError))
+    monkeypatch.setattr(cfdi_parse_pool.settings, 'CFDI_PARSE_PARALLEL_MIN', 1)
+    monkeypatch.setattr(cfdi_parse_pool.settings, 'CFDI_PARSE_WORKERS', 4)
+    monkeypatch.setattr(cfdi_parse_pool.os, 'cpu_count', lambda: 1)
+
+    assert len(parse_many([b'<a/>'] * 50)) == 50
+
+
+def test_varios_nucleos_reparten_en_bloques(monkeypatch):
+    pool = PoolEspia()
+    monkeypatch.setattr(cfdi_parse_pool, 'get_parse_executor', lambda: pool)
+    monkeypatch.setattr(cfdi_parse_pool.settings, 'CFDI_PARSE_PARALLEL_MIN', 1)
+    monkeypatch.setattr(cfdi_parse_pool.settings, 'CFDI_PARSE_WORKERS', 2)
+    monkeypatch.setattr(cfdi_parse_pool.os, 'cpu_count', lambda: 2)
+
+    resultados = parse_many([b'<a/>'] * 80)
+
+    assert len(resultados) == 80
+    assert pool.chunksizes == [10]
+
+
+def test_pool_de_procesos_real(xml_muestras):
+    contenidos = [contenido for _, contenido in xml_muestras]
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        en_pool = parse_many(contenidos, executor=pool)
+
+    assert en_pool == parse_many(contenidos)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Paridad entre los motores de parseo lxml y etree
+"""
+import pytest
+
+from app.services.cfdi_parser import _CfdiTarget, parse_cfdi_etree, parse_cfdi_lxml
+
+# Campos que solo existen en uno de los dos motores
+SOLO_LXML = {'sello_fe', 'fecha_timbrado', 'complementos'}
+SOLO_ETREE = {'sello'}
+
+
+def test_lxml_y_etree_coinciden_en_las_muestras(xml_muestras):
+    for nombre, contenido in xml_muestras:
+        rapido = parse_cfdi_lxml(contenido)
+        original = parse_cfdi_etree(contenido)
+
+        for campo in SOLO_LXML:
+            rapido.pop(campo, None)
+        for campo in SOLO_ETREE:
+            original.pop(campo, None)
+        assert rapido == original, nombre
+
+
+def test_impuestos_son_los_del_comprobante():
+    xml = b'''<?xml version="1.0" encoding="UTF-8"?>
+<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0" Total="116" SubTotal="100">
+  <cfdi:Conceptos>
+    <cfdi:Concepto Importe="100">
+      <cfdi:Impuestos><cfdi:Traslados><cfdi:Traslado Importe="16"/></cfdi:Traslados></cfdi:Impuestos>
+    </cfdi:Concepto>
+  </cfdi:Conceptos>
+  <cfdi:Impuestos TotalImpuestosTrasladados="16.00" TotalImpuestosRetenidos="1.50"/>
+</cfdi:Comprobante>'''
+
+    for parse in (parse_cfdi_lxml, parse_cfdi_etree):
+        datos = parse(xml)
+        assert datos['total_impuestos_trasladados'] == 16.0
+        assert datos['total_impuestos_retenidos'] == 1.5
+
+
+@pytest.mark.parametrize('tag', [
+    'Comprobante',
+    '{http://www.sat.gob.mx/cfd/4}Comprobante',
+])
+def test_target_acepta_tags_con_y_sin_namespace(tag):
+    target = _CfdiTarget()
+    target.start(tag, {'Version': '4.0', 'Total': '10'})
+    datos = target.close()
+
+    assert datos['version'] == ('4.0' if tag.startswith('{') else None)
+    assert target.depth == 1
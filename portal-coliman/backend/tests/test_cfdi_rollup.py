@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Agregado diario: sumar y restar CFDIs incrementalmente debe dar lo mismo que
+recalcular desde cero
+
+Corre sobre SQLite; el ON DUPLICATE KEY UPDATE de MySQL se traduce al
+ON CONFLICT ... DO UPDATE equivalente.
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.services import cfdi_rollup
+from app.services.cfdi_rollup import periodo_params
+
+LLAVE = "client_id, dia, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion"
+COLUMNAS = ['cantidad', 'subtotal', 'descuento', 'total', 'impuestos_trasladados', 'impuestos_retenidos']
+
+
+def a_sqlite(sql: str) -> str:
+    sql = sql.replace('ON DUPLICATE KEY UPDATE', f'ON CONFLICT ({LLAVE}) DO UPDATE SET')
+    for columna in COLUMNAS:
+        sql = sql.replace(f'VALUES({columna})', f'excluded.{columna}')
+    return sql
+
+
+@pytest.fixture
+def db(monkeypatch):
+    versiones = []
+    monkeypatch.setattr(cfdi_rollup, 'bump_data_version', lambda db, client_id: versiones.append(client_id))
+    for nombre in ('SUMAR_SQL', 'RESTAR_SQL', 'REBUILD_SQL'):
+        original = getattr(cfdi_rollup, nombre)
+        monkeypatch.setattr(cfdi_rollup, nombre, text(a_sqlite(original.text)).bindparams(*original._bindparams.values()))
+
+    sesion = Session(create_engine('sqlite://'))
+    sesion.execute(text("""CREATE TABLE cfdi (
+        id INTEGER PRIMARY KEY, client_id TEXT, fecha TEXT, tipo_comprobante TEXT,
+        forma_pago TEXT, metodo_pago TEXT, estatus_validacion TEXT, subtotal REAL, descuento REAL,
+        total REAL, total_impuestos_trasladados REAL, total_impuestos_retenidos REAL)"""))
+    sesion.execute(text(f"""CREATE TABLE cfdi_daily_rollup (
+        client_id TEXT, dia TEXT, tipo_comprobante TEXT, forma_pago TEXT, metodo_pago TEXT,
+        estatus_validacion TEXT, {', '.join(f'{c} REAL' for c in COLUMNAS)}, PRIMARY KEY ({LLAVE}))"""))
+
+    rng = random.Random(3)
+    inicio = datetime(2025, 1, 1)
+    sesion.execute(text("""
+        INSERT INTO cfdi VALUES (:id, :client_id, :fecha, :tipo, :forma, :metodo, :estatus, :total, 0, :total, 1, 0)
+    """), [{
+        "id": n, "client_id": 'C1' if n % 5 else 'C2',
+        "fecha": (inicio + timedelta(hours=rng.randrange(24 * 20))).strftime('%Y-%m-%d %H:%M:%S'),
+        "tipo": rng.choice('IEP'), "forma": rng.choice(['01', '03', None]), "metodo": rng.choice(['PUE', None]),
+        "estatus": rng.choice(['pendiente', 'valido', None]), "total": round(rng.uniform(1, 1000), 2)
+    } for n in range(1, 301)])
+    sesion.versiones = versiones
+    yield sesion
+    sesion.close()
+
+
+def agregados(db, client_id='C1') -> dict:
+    filas = db.execute(text(f"""
+        SELECT {LLAVE}, {', '.join(COLUMNAS)} FROM cfdi_daily_rollup WHERE client_id = :c
+    """), {"c": client_id})
+    return {tuple(f[:6]): tuple(round(v, 2) for v in f[6:]) for f in filas}
+
+
+def test_sumar_y_restar_igual_a_recalcular(db):
+    ids = [r.id for r in db.execute(text("SELECT id FROM cfdi WHERE client_id = 'C1' ORDER BY id"))]
+    for inicio in range(0, len(ids), 50):
+        cfdi_rollup.add_cfdis(db, 'C1', ids[inicio:inicio + 50])
+    quitados = ids[::7]
+    cfdi_rollup.remove_cfdis(db, 'C1', quitados)
+    incremental = agregados(db)
+
+    db.execute(text("DELETE FROM cfdi WHERE id IN (%s)" % ','.join(map(str, quitados))))
+    cfdi_rollup.rebuild_client(db, 'C1')
+
+    assert incremental == agregados(db)
+    assert all(valores[0] > 0 for valores in incremental.values())
+    assert agregados(db, 'C2') == {}
+
+
+def test_nulos_van_como_cadena_vacia_en_la_llave(db):
+    cfdi_rollup.rebuild_client(db, 'C1')
+
+    llaves = agregados(db)
+    assert all(forma is not None and metodo is not None for _, _, _, forma, metodo, _ in llaves)
+    assert {estatus for *_, estatus in llaves} == {'pendiente', 'valido'}
+
+
+def test_cada_cambio_invalida_la_cache(db):
+    cfdi_rollup.add_cfdis(db, 'C1', [])
+    cfdi_rollup.remove_cfdis(db, 'C1', [])
+    assert db.versiones == []
+
+    cfdi_rollup.add_cfdis(db, 'C1', [1])
+    cfdi_rollup.remove_cfdis(db, 'C1', [1])
+    cfdi_rollup.rebuild_client(db, 'C1')
+    assert db.versiones == ['C1', 'C1', 'C1']
+
+
+def test_periodo_de_dias_completos():
+    assert periodo_params('C1', '2024-02-01', '2024-02-29') == {
+        "client_id": 'C1',
+        "fecha_inicio": '2024-02-01',
+        "fecha_fin": '2024-02-29',
+        "fecha_fin_exclusiva": '2024-03-01'
+    }
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la clasificación de consultas de búsqueda y de los folios candidatos
+"""
+import pytest
+
+from app.services import cfdi_search
+from app.services.cfdi_search import _folio_params, clasificar, search_cfdis, token_cliente
+
+
+@pytest.mark.parametrize('consulta, esperado', [
+    # Serie y folio, con o sin separador
+    ('A-12345', ('folio', 'A-12345')),
+    ('  a-12345 ', ('folio', 'A-12345')),
+    ('FAC 0042', ('folio', 'FAC 0042')),
+    # Un número largo también es hexadecimal: sin guion ni 32 caracteres es folio
+    ('12345678', ('folio', '12345678')),
+    # 32 hexadecimales sin guiones: UUID, normalizado al formato 8-4-4-4-12
+    ('0a333840a579490dbb17027850be7a78', ('uuid', '0A333840-A579-490D-BB17-027850BE7A78')),
+    ('0A333840-A579-490D', ('uuid', '0A333840-A579-490D')),
+    ('0A333840-A579-490D-BB17-027850BE7A78', ('uuid', '0A333840-A579-490D-BB17-027850BE7A78')),
+    # 32 caracteres hexadecimales sin dígitos: es una palabra, no un UUID
+    ('abcdefabcdefabcdefabcdefabcdefab', ('texto', '+abcdefabcdefabcdefabcdefabcdefab*')),
+    ('AAA010101AAA', ('rfc', 'AAA010101AAA')),
+    ('xaxx0101', ('rfc', 'XAXX0101')),
+    # Palabras: obligatorias y por prefijo
+    ('ferret', ('texto', '+ferret*')),
+    ('Ferretería el Águila', ('texto', '+ferretería* +águila*')),
+    # Los operadores de BOOLEAN MODE del usuario no llegan a MySQL
+    ('+ferret* -"tornillo" ~x', ('texto', '+ferret* +tornillo*')),
+    ('ferret FERRET', ('texto', '+ferret*')),
+    # Más corto que el token mínimo del índice: solo puede ser folio exacto
+    ('de', ('folio', 'DE')),
+    ('7', ('folio', '7')),
+])
+def test_clasificar(consulta, esperado):
+    assert clasificar(consulta) == esperado
+
+
+@pytest.mark.parametrize('consulta', ['', '   ', '--', 'a b', '"de" +la'])
+def test_clasificar_sin_palabras_buscables(consulta):
+    with pytest.raises(ValueError):
+        clasificar(consulta)
+
+
+@pytest.mark.parametrize('termino, esperado', [
+    ('A-12345', {'folios': ['12345', 'A12345', 'A-12345'], 'serie': 'A', 'numero': '12345'}),
+    ('FAC 0042', {'folios': ['0042', 'FAC0042', 'FAC 0042'], 'serie': 'FAC', 'numero': '0042'}),
+    # Sin separador el término completo ya es serie + número: sin repetidos
+    ('FAC0042', {'folios': ['0042', 'FAC0042'], 'serie': 'FAC', 'numero': '0042'}),
+    ('12345678', {'folios': ['12345678'], 'serie': None, 'numero': '12345678'}),
+    ('DE', {'folios': ['DE'], 'serie': None, 'numero': 'DE'}),
+])
+def test_folio_params(termino, esperado):
+    assert _folio_params(termino) == esperado
+
+
+class ConsultasFalsas:
+    """Sesión que regresa filas según la consulta ejecutada"""
+
+    def __init__(self, respuestas):
+        self.respuestas = respuestas
+        self.ejecutadas = []
+
+    def execute(self, sql, params):
+        self.ejecutadas.append((sql, params))
+        filas = self.respuestas.get(sql, [])
+        return type('R', (), {'fetchall': lambda self: filas})()
+
+
+def test_rfc_sin_resultados_se_busca_como_folio():
+    db = ConsultasFalsas({cfdi_search.FOLIO_SQL: ['fila']})
+
+    modo, filas = search_cfdis(db, 'C1', 'FAC123', 20)
+
+    assert (modo, filas) == ('folio', ['fila'])
+    assert [sql for sql, _ in db.ejecutadas] == [cfdi_search.RFC_SQL, cfdi_search.FOLIO_SQL]
+    assert db.ejecutadas[1][1]['folios'] == ['123', 'FAC123']
+
+
+def test_texto_exige_el_token_del_cliente():
+    db = ConsultasFalsas({})
+
+    search_cfdis(db, 'C1', 'ferret', 20)
+
+    (sql, params), = db.ejecutadas
+    assert sql is cfdi_search.TEXTO_SQL
+    assert params['consulta'] == f'+{token_cliente("C1")} +ferret*'
+    assert token_cliente('C1') != token_cliente('C2')
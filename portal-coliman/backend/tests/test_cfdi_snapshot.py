@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del snapshot columnar: aplicación de lotes, agrupaciones y
+sincronización (incremental y recarga completa fuera del lock)
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.services import cfdi_snapshot
+from app.services.cfdi_snapshot import CfdiSnapshot
+
+np = pytest.importorskip('numpy')
+
+AHORA_DB = datetime(2025, 6, 1, 12, 0)
+
+
+def fila(id, dia, total, tipo='I', forma='03', metodo='PUE', estatus='vigente',
+         emisor='AAA010101AAA', receptor='BBB010101BBB', nombre_emisor='Emisor', nombre_receptor='Receptor'):
+    return (id, date(2025, 1, dia), total, tipo, forma, metodo, estatus,
+            emisor, nombre_emisor, receptor, nombre_receptor)
+
+
+def snapshot_con(*filas):
+    snapshot = CfdiSnapshot('C1')
+    snapshot._aplicar(snapshot._codificar(filas))
+    return snapshot
+
+
+def test_aplicar_agrega_y_mantiene_orden_por_id():
+    snapshot = snapshot_con(fila(5, 1, 10), fila(2, 1, 20))
+    snapshot._aplicar(snapshot._codificar([fila(9, 2, 30), fila(1, 2, 40)]))
+
+    assert snapshot.id.tolist() == [1, 2, 5, 9]
+    # Las demás columnas se reordenan con el id
+    assert snapshot.total.tolist() == [4000, 2000, 1000, 3000]
+
+
+def test_aplicar_sobrescribe_existentes_sin_duplicar():
+    snapshot = snapshot_con(fila(1, 1, 10), fila(2, 1, 20), fila(3, 1, 30))
+    snapshot._aplicar(snapshot._codificar([fila(2, 1, 20, estatus='cancelado'), fila(4, 3, 0.015)]))
+
+    assert snapshot.id.tolist() == [1, 2, 3, 4]
+    estatus = [snapshot.estatus_dic.valores[c] for c in snapshot.estatus.tolist()]
+    assert estatus == ['vigente', 'cancelado', 'vigente', 'vigente']
+    # Centavos redondeados
+    assert snapshot.total.tolist() == [1000, 2000, 3000, 2]
+
+
+def test_aplicar_lote_vacio_no_cambia_nada():
+    snapshot = snapshot_con(fila(1, 1, 10))
+    snapshot._aplicar({columna: valores[:0] for columna, valores in snapshot._codificar([fila(7, 1, 1)]).items()})
+
+    assert snapshot.id.tolist() == [1]
+
+
+def test_estatus_nulo_es_pendiente():
+    snapshot = snapshot_con(fila(1, 1, 10, estatus=None))
+
+    assert snapshot.agrupar(['estatus']) == [{'estatus': 'pendiente', 'cantidad': 1, 'total': 10.0}]
+
+
+def test_agrupar_por_varias_dimensiones():
+    snapshot = snapshot_con(
+        fila(1, 1, 100.10),
+        fila(2, 1, 50, tipo='E'),
+        fila(3, 2, 0.20),
+        fila(4, 31, 10, forma=None),
+    )
+
+    assert snapshot.agrupar(['dia', 'tipo']) == [
+        {'dia': '2025-01-01', 'tipo': 'I', 'cantidad': 1, 'total': 100.1},
+        {'dia': '2025-01-01', 'tipo': 'E', 'cantidad': 1, 'total': 50.0},
+        {'dia': '2025-01-02', 'tipo': 'I', 'cantidad': 1, 'total': 0.2},
+        {'dia': '2025-01-31', 'tipo': 'I', 'cantidad': 1, 'total': 10.0},
+    ]
+    assert snapshot.agrupar(['mes', 'forma_pago']) == [
+        {'mes': '2025-01', 'forma_pago': None, 'cantidad': 1, 'total': 10.0},
+        {'mes': '2025-01', 'forma_pago': '03', 'cantidad': 3, 'total': 150.3},
+    ]
+
+
+def test_agrupar_top_y_filtro():
+    snapshot = snapshot_con(
+        fila(1, 1, 10, emisor='AAA010101AAA', nombre_emisor='Uno'),
+        fila(2, 1, 10, emisor='CCC010101CCC', nombre_emisor='Tres'),
+        fila(3, 1, 10, emisor='CCC010101CCC', nombre_emisor='Tres SA'),
+        fila(4, 5, 100, emisor='DDD010101DDD', nombre_emisor='Cuatro'),
+    )
+
+    # El nombre es el último visto para el RFC
+    assert snapshot.agrupar(['emisor'], top=1, orden='cantidad') == [
+        {'emisor': {'rfc': 'CCC010101CCC', 'nombre': 'Tres SA'}, 'cantidad': 2, 'total': 20.0},
+    ]
+    assert [g['emisor']['rfc'] for g in snapshot.agrupar(['emisor'], top=2)] == ['DDD010101DDD', 'CCC010101CCC']
+
+    mascara = snapshot.filtro(fecha_fin=date(2025, 1, 4), emisor_rfc='ccc010101ccc')
+    assert snapshot.agrupar(['dia'], mascara) == [{'dia': '2025-01-01', 'cantidad': 2, 'total': 20.0}]
+    assert snapshot.agrupar(['dia'], snapshot.filtro(tipo='N')) == []
+
+
+class BaseFalsa:
+    """Sesión que responde las consultas del snapshot desde una lista de filas"""
+
+    def __init__(self, filas):
+        self.filas = list(filas)
+        self.version = 1
+        self.conteo = None  # None: igual al número de filas
+        self.cargas = 0
+        self.desde = None
+        self.al_cargar = None
+
+    def execute(self, sql, params=None):
+        if sql is cfdi_snapshot.CARGA_SQL:
+            self.cargas += 1
+            if self.al_cargar:
+                self.al_cargar()
+            return Resultado(filas=self.filas)
+        if sql is cfdi_snapshot.CAMBIOS_SQL:
+            self.desde = params['desde']
+            return Resultado(filas=self.filas[-1:])
+        if sql is cfdi_snapshot.CONTEO_SQL:
+            return Resultado(escalar=len(self.filas) if self.conteo is None else self.conteo)
+        if sql is cfdi_snapshot.AHORA_SQL:
+            return Resultado(escalar=AHORA_DB)
+        return Resultado(escalar=self.version)
+
+
+class Resultado:
+    def __init__(self, filas=(), escalar=None):
+        self.filas = filas
+        self.escalar = escalar
+
+    def scalar(self):
+        return self.escalar
+
+    def partitions(self, tamano):
+        if self.filas:
+            yield list(self.filas)
+
+
+@pytest.fixture(autouse=True)
+def snapshots_limpios(monkeypatch):
+    monkeypatch.setattr(cfdi_snapshot, '_snapshots', cfdi_snapshot.TTLLRU(10))
+
+
+def test_misma_version_no_consulta_filas():
+    db = BaseFalsa([fila(1, 1, 10)])
+    with cfdi_snapshot.snapshot_de(db, 'C1') as primero:
+        pass
+    with cfdi_snapshot.snapshot_de(db, 'C1') as segundo:
+        assert len(segundo) == 1
+
+    assert segundo is primero
+    assert db.cargas == 1
+    assert db.desde is None
+
+
+def test_version_nueva_lee_cambios_con_margen():
+    db = BaseFalsa([fila(1, 1, 10)])
+    with cfdi_snapshot.snapshot_de(db, 'C1') as primero:
+        pass
+
+    db.filas.append(fila(2, 2, 20))
+    db.version = 2
+    with cfdi_snapshot.snapshot_de(db, 'C1') as segundo:
+        assert segundo.id.tolist() == [1, 2]
+
+    assert segundo is primero
+    assert db.cargas == 1
+    assert db.desde == AHORA_DB - timedelta(seconds=cfdi_snapshot.settings.ANALYTICS_SNAPSHOT_OVERLAP_SECONDS)
+
+
+def test_conteo_distinto_reemplaza_el_snapshot():
+    db = BaseFalsa([fila(1, 1, 10), fila(2, 1, 20)])
+    with cfdi_snapshot.snapshot_de(db, 'C1') as primero:
+        pass
+
+    # Un borrado: los cambios no lo traen, el conteo sí
+    del db.filas[0]
+    db.version = 2
+    with cfdi_snapshot.snapshot_de(db, 'C1') as segundo:
+        assert segundo.id.tolist() == [2]
+
+    assert segundo is not primero
+    assert db.cargas == 2
+    with cfdi_snapshot.snapshot_de(db, 'C1') as tercero:
+        assert tercero is segundo
+
+
+def test_vencido_recarga_completo(monkeypatch):
+    db = BaseFalsa([fila(1, 1, 10)])
+    with cfdi_snapshot.snapshot_de(db, 'C1') as primero:
+        pass
+    primero.cargado -= timedelta(seconds=cfdi_snapshot.settings.ANALYTICS_SNAPSHOT_TTL_SECONDS + 1)
+
+    with cfdi_snapshot.snapshot_de(db, 'C1') as segundo:
+        pass
+
+    assert segundo is not primero
+    assert db.cargas == 2
+
+
+def test_recarga_completa_no_toma_el_lock_del_snapshot_anterior():
+    db = BaseFalsa([fila(1, 1, 10)])
+    with cfdi_snapshot.snapshot_de(db, 'C1') as primero:
+        pass
+    primero.cargado = datetime(2000, 1, 1)
+
+    # Durante la carga, las consultas sobre el snapshot anterior no esperan
+    libre = []
+
+    def al_cargar():
+        libre.append(primero.lock.acquire(blocking=False))
+        if libre[-1]:
+            primero.lock.release()
+
+    db.al_cargar = al_cargar
+    with cfdi_snapshot.snapshot_de(db, 'C1') as segundo:
+        assert segundo.lock.locked()
+
+    assert libre == [True]
+    assert not primero.lock.locked()
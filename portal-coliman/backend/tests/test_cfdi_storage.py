@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del almacenamiento por contenido de XML/PDF
+"""
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import cfdi_storage
+from app.services.cfdi_storage import (
+    add_blob_refs, cas_relative_path, gc_unreferenced_blobs, resolve_path, save_xml_and_pdf, store_blob
+)
+
+
+class SesionFalsa:
+    def __init__(self, referenciados=()):
+        self.referenciados = referenciados
+        self.upserts = []
+
+    def execute(self, sql, params=None):
+        if sql is cfdi_storage.UPSERT_BLOB_SQL:
+            self.upserts.append(params)
+            return None
+        return [SimpleNamespace(sha256=s) for s in self.referenciados]
+
+
+def envejecer(path, segundos=2 * cfdi_storage.GC_MIN_AGE_SECONDS):
+    antes = time.time() - segundos
+    os.utime(path, (antes, antes))
+
+
+def test_ruta_por_contenido():
+    sha = hashlib.sha256(b'x').hexdigest()
+
+    assert cas_relative_path(sha, '.XML') == f'cas/{sha[:2]}/{sha[2:4]}/{sha}.xml'
+
+
+def test_mismo_contenido_se_escribe_una_vez(tmp_path):
+    primera = store_blob(b'<cfdi/>', 'xml', str(tmp_path))
+    archivo = tmp_path / primera
+    envejecer(archivo)
+    mtime_anterior = archivo.stat().st_mtime
+
+    segunda = store_blob(b'<cfdi/>', 'xml', str(tmp_path))
+
+    assert segunda == primera
+    assert archivo.read_bytes() == b'<cfdi/>'
+    # Reutilizar el blob lo "toca" para protegerlo del GC
+    assert archivo.stat().st_mtime > mtime_anterior
+    assert [p.name for p in archivo.parent.iterdir()] == [archivo.name]
+
+
+def test_xml_y_pdf(tmp_path):
+    xml, pdf = save_xml_and_pdf('A.xml', b'<a/>', ('A.PDF', b'%PDF'), str(tmp_path))
+
+    assert xml.endswith('.xml') and pdf.endswith('.pdf')
+    assert save_xml_and_pdf('B.xml', b'<a/>', None, str(tmp_path)) == (xml, None)
+
+
+@pytest.mark.parametrize('guardada, relativa', [
+    ('cas/ab/cd/abcd.xml', 'cas/ab/cd/abcd.xml'),
+    ('Insumos XML/2024/01/31/F.xml', '2024/01/31/F.xml'),
+    ('2024\\01\\31\\F.pdf', '2024/01/31/F.pdf'),
+])
+def test_resolve_path_formatos(tmp_path, guardada, relativa):
+    assert resolve_path(guardada, str(tmp_path)) == (tmp_path / relativa).resolve()
+
+
+@pytest.mark.parametrize('guardada', ['../../etc/passwd', 'Insumos XML/../secreto.xml', '', None])
+def test_resolve_path_no_sale_de_insumos(tmp_path, guardada):
+    assert resolve_path(guardada, str(tmp_path)) is None
+
+
+def test_referencias_se_cuentan_por_blob(tmp_path):
+    xml = store_blob(b'<a/>', 'xml', str(tmp_path))
+    db = SesionFalsa()
+
+    add_blob_refs(db, [xml, None, xml, '2024/01/31/F.xml'], str(tmp_path))
+
+    assert db.upserts == [[{'sha256': hashlib.sha256(b'<a/>').hexdigest(), 'path': xml, 'size': 4, 'refs': 2}]]
+
+
+def test_gc_borra_solo_huerfanos_viejos(tmp_path):
+    referenciado = store_blob(b'<ref/>', 'xml', str(tmp_path))
+    huerfano = store_blob(b'<huerfano/>', 'xml', str(tmp_path))
+    reciente = store_blob(b'<reciente/>', 'xml', str(tmp_path))
+    envejecer(tmp_path / referenciado)
+    envejecer(tmp_path / huerfano)
+
+    stats = gc_unreferenced_blobs(SesionFalsa([hashlib.sha256(b'<ref/>').hexdigest()]), str(tmp_path))
+
+    assert stats == {'eliminados': 1, 'bytes': len(b'<huerfano/>')}
+    assert (tmp_path / referenciado).exists()
+    assert (tmp_path / reciente).exists()
+    assert not (tmp_path / huerfano).exists()
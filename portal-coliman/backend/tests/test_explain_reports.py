@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la revisión de planes EXPLAIN (sin MySQL): los índices esperados
+existen en el esquema y las reglas del plan se aplican como se documentan
+"""
+import re
+from pathlib import Path
+
+import pytest
+
+from benchmarks.explain_reports import Consulta, consultas, revisar
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+ESQUEMA = BACKEND_DIR.parent / 'docker' / 'mysql' / 'create_cfdi_tables.sql'
+MIGRACIONES = sorted((BACKEND_DIR / 'migrations').glob('*.sql'))
+
+
+def indices_en(sql: str) -> set:
+    return set(re.findall(r'(?:INDEX|KEY)\s+(\w+)\s*\(', sql))
+
+
+@pytest.fixture(scope='module')
+def esperados() -> set:
+    return {indice for c in consultas('C1', '2025-01-01', '2025-01-31') for indice in c.indices} - {'PRIMARY'}
+
+
+def test_indices_esperados_existen_en_el_esquema_docker(esperados):
+    assert esperados - indices_en(ESQUEMA.read_text(encoding='utf-8')) == set()
+
+
+def test_indices_esperados_tienen_migracion(esperados):
+    migraciones = ''.join(m.read_text(encoding='utf-8') for m in MIGRACIONES)
+    # Los índices originales de `cfdi` no necesitan migración; los agregados después sí
+    originales = {'unique_uuid_per_client', 'idx_uuid', 'idx_emisor_rfc', 'idx_receptor_rfc', 'idx_fecha', 'idx_estatus'}
+    nuevos = esperados - originales
+
+    assert nuevos - indices_en(migraciones) == set()
+
+
+class PlanFalso:
+    def __init__(self, filas):
+        self.filas = filas
+
+    def execute(self, query, params):
+        assert query.text.startswith('EXPLAIN ')
+        return self
+
+    def mappings(self):
+        return self.filas
+
+
+def fila(table='cfdi', type='range', key='idx_cfdi_client_fecha_id', extra='Using where'):
+    return {'table': table, 'type': type, 'key': key, 'rows': 10, 'Extra': extra}
+
+
+EXPORTACION = Consulta('exportación', 'SELECT 1', {'idx_cfdi_client_fecha_id'}, sin_filesort=True)
+
+
+@pytest.mark.parametrize('filas, problema', [
+    ([fila()], None),
+    ([fila(table='cfdi_conceptos', type='ALL', key=None)], None),
+    ([fila(type='ALL', key=None)], 'recorrido completo'),
+    ([fila(key='idx_fecha')], 'índice inesperado'),
+    ([fila(extra='Using where; Using filesort')], 'ordenamiento fuera del índice'),
+])
+def test_reglas_del_plan(filas, problema):
+    problemas = revisar(PlanFalso(filas), EXPORTACION, {})
+
+    if problema is None:
+        assert problemas == []
+    else:
+        assert len(problemas) == 1 and problemas[0].startswith(problema)
+
+
+def test_filesort_solo_importa_si_se_pide():
+    consulta = EXPORTACION._replace(sin_filesort=False)
+
+    assert revisar(PlanFalso([fila(extra='Using filesort')]), consulta, {}) == []
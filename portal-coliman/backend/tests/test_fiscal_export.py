@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la exportación fiscal en CSV y XLSX (la consulta corre sobre SQLite)
+"""
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import fiscal_export
+from app.services.fiscal_export import ENCABEZADO_FACTURAS, _valor, stream_csv, stream_xlsx
+
+REPORTE = {
+    'periodo': {'fecha_inicio': '2025-01-01', 'fecha_fin': '2025-01-31'},
+    'generado_en': '2025-02-01 10:00:00',
+    'generado_por': 'admin',
+    'resumen_general': {
+        'total_ingresos': 300.0, 'total_egresos': 50.0, 'utilidad_bruta': 250.0,
+        'total_iva_trasladado': 48.0, 'total_isr_retenido': 0.0
+    },
+    'resumen_por_tipo': [
+        {'tipo': 'Ingreso', 'codigo': 'I', 'cantidad': 2, 'subtotal': 258.62, 'descuento': 0,
+         'total': 300.0, 'iva_trasladado': 41.38, 'isr_retenido': 0}
+    ],
+    'desglose_emisores': [],
+    'desglose_receptores': [],
+}
+
+
+@pytest.fixture
+def base(monkeypatch):
+    engine = create_engine('sqlite://')
+    with engine.begin() as con:
+        con.execute(text("""CREATE TABLE cfdi (
+            id INTEGER PRIMARY KEY, client_id TEXT, uuid TEXT, tipo_comprobante TEXT, serie TEXT, folio TEXT,
+            fecha TEXT, emisor_rfc TEXT, emisor_nombre TEXT, receptor_rfc TEXT, receptor_nombre TEXT,
+            subtotal REAL, descuento REAL, total REAL, total_impuestos_trasladados REAL,
+            total_impuestos_retenidos REAL, moneda TEXT, metodo_pago TEXT, forma_pago TEXT,
+            estatus_validacion TEXT)"""))
+        con.execute(text("""CREATE TABLE cfdi_conceptos (
+            id INTEGER PRIMARY KEY, cfdi_id INTEGER, clave_prod_serv TEXT, clave_unidad TEXT,
+            cantidad REAL, descripcion TEXT, valor_unitario REAL, importe REAL, descuento REAL)"""))
+        # Dos facturas con la misma fecha: el id decide el orden y mantiene juntos sus conceptos
+        for id_, uuid, fecha, cliente in [(1, 'U-1', '2025-01-10 09:00:00', 'C1'),
+                                          (2, 'U-2', '2025-01-10 09:00:00', 'C1'),
+                                          (3, 'U-3', '2025-01-31 23:59:59', 'C1'),
+                                          (4, 'U-4', '2025-02-01 00:00:00', 'C1'),
+                                          (5, 'U-5', '2025-01-15 00:00:00', 'C2')]:
+            con.execute(text("""INSERT INTO cfdi (id, client_id, uuid, tipo_comprobante, fecha, total)
+                                VALUES (:id, :c, :u, 'I', :f, 100)"""), {"id": id_, "c": cliente, "u": uuid, "f": fecha})
+        for cfdi_id, descripcion in [(1, 'a'), (2, 'b'), (1, 'c'), (2, 'd')]:
+            con.execute(text("INSERT INTO cfdi_conceptos (cfdi_id, descripcion, importe) VALUES (:i, :d, 50)"),
+                        {"i": cfdi_id, "d": descripcion})
+    monkeypatch.setattr(fiscal_export, 'SessionLocal', sessionmaker(bind=engine))
+
+
+def test_valor():
+    assert _valor(Decimal('10.50')) == 10.5
+    assert _valor(datetime(2025, 1, 2, 3, 4, 5)) == '2025-01-02 03:04:05'
+    assert _valor('x') == 'x' and _valor(None) is None
+
+
+def test_facturas_en_orden_y_conceptos_juntos(base):
+    filas = list(fiscal_export.iter_facturas('C1', '2025-01-01', '2025-01-31'))
+
+    uuids = [f[0] for f in filas]
+    assert uuids[0] == 'U-3'
+    assert uuids[1:3] == ['U-2', 'U-2'] and uuids[3:] == ['U-1', 'U-1']
+    assert sorted(f[21] for f in filas[1:3]) == ['b', 'd']
+    # Una factura sin conceptos ocupa una fila con los campos del concepto vacíos
+    assert filas[0][18:] == [None] * 7
+    assert all(len(f) == len(ENCABEZADO_FACTURAS) for f in filas)
+
+
+def test_csv_por_bloques(base, monkeypatch):
+    monkeypatch.setattr(fiscal_export, 'FILAS_POR_LOTE', 2)
+
+    bloques = list(stream_csv(REPORTE, 'C1'))
+    texto = b''.join(bloques).decode('utf-8')
+
+    assert texto.startswith('\ufeffReporte Fiscal')
+    # Resumen, dos lotes de 2 filas y el resto (vacío)
+    assert len(bloques) == 4
+    filas = list(csv.reader(io.StringIO(texto.lstrip('\ufeff'))))
+    inicio = filas.index(['Facturas'])
+    assert filas[inicio + 1] == ENCABEZADO_FACTURAS
+    assert [f[0] for f in filas[inicio + 2:]] == ['U-3', 'U-2', 'U-2', 'U-1', 'U-1']
+
+
+def test_xlsx_reparte_facturas_en_hojas(base, monkeypatch):
+    openpyxl = pytest.importorskip('openpyxl')
+    monkeypatch.setattr(fiscal_export, 'MAX_FILAS_HOJA', 3)
+
+    libro = openpyxl.load_workbook(io.BytesIO(b''.join(stream_xlsx(REPORTE, 'C1'))), read_only=True)
+
+    assert libro.sheetnames == ['Reporte Fiscal', 'Resumen por tipo', 'Desglose emisores', 'Desglose receptores',
+                                'Facturas', 'Facturas (2)', 'Facturas (3)']
+    hojas = [list(libro[n].values) for n in libro.sheetnames[4:]]
+    assert all(list(h[0]) == ENCABEZADO_FACTURAS for h in hojas)
+    assert [fila[0] for h in hojas for fila in h[1:]] == ['U-3', 'U-2', 'U-2', 'U-1', 'U-1']
+
+
+def test_xlsx_sin_facturas_tiene_hoja_vacia(base):
+    openpyxl = pytest.importorskip('openpyxl')
+    reporte = {**REPORTE, 'periodo': {'fecha_inicio': '2030-01-01', 'fecha_fin': '2030-01-31'}}
+
+    libro = openpyxl.load_workbook(io.BytesIO(b''.join(stream_xlsx(reporte, 'C1'))), read_only=True)
+
+    assert [list(f) for f in libro['Facturas'].values] == [ENCABEZADO_FACTURAS]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de KPIs del dashboard contra la implementación anterior de nueve consultas
+
+Ambas implementaciones corren sobre la misma tabla `cfdi` sintética en SQLite
+(con DATE_FORMAT registrado como función) y el agregado diario se llena con
+el mismo INSERT ... SELECT de cfdi_rollup, sin el ON DUPLICATE KEY UPDATE que
+SQLite no entiende (la tabla empieza vacía).
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from app.services import cfdi_rollup
+from app.services.kpi_engine import compute_dashboard, resolver_periodo, restar_meses
+from benchmarks.kpi_dashboard import dashboard_actual, normalizar
+
+CLIENT_ID = 'C1'
+AHORA = datetime(2025, 6, 15, 12, 0, 0)
+
+CREATE_SQL = [
+    """CREATE TABLE cfdi (
+        id INTEGER PRIMARY KEY, client_id TEXT, uuid TEXT, tipo_comprobante TEXT, fecha TEXT,
+        emisor_rfc TEXT, emisor_nombre TEXT, receptor_rfc TEXT, receptor_nombre TEXT,
+        subtotal REAL, descuento REAL, total REAL,
+        total_impuestos_trasladados REAL, total_impuestos_retenidos REAL,
+        forma_pago TEXT, metodo_pago TEXT, estatus_validacion TEXT)""",
+    """CREATE TABLE cfdi_daily_rollup (
+        client_id TEXT, dia TEXT, tipo_comprobante TEXT, forma_pago TEXT, metodo_pago TEXT,
+        estatus_validacion TEXT, cantidad INTEGER, subtotal REAL, descuento REAL, total REAL,
+        impuestos_trasladados REAL, impuestos_retenidos REAL)""",
+]
+
+INSERT_SQL = text("""
+    INSERT INTO cfdi (client_id, uuid, tipo_comprobante, fecha, emisor_rfc, emisor_nombre,
+        receptor_rfc, receptor_nombre, subtotal, descuento, total,
+        total_impuestos_trasladados, total_impuestos_retenidos,
+        forma_pago, metodo_pago, estatus_validacion)
+    VALUES (:client_id, :uuid, :tipo_comprobante, :fecha, :emisor_rfc, :emisor_nombre,
+        :receptor_rfc, :receptor_nombre, :subtotal, 0, :total, 0, 0,
+        :forma_pago, :metodo_pago, :estatus_validacion)
+""")
+
+
+def generar(filas: int) -> list:
+    """CFDIs repartidos en los 400 días previos a AHORA, más otro cliente que no debe contar"""
+    rng = random.Random(7)
+    rfcs = [f"RFC{n:03d}" for n in range(40)]
+    cfdis = []
+    for n in range(filas):
+        emisor, receptor = rng.sample(rfcs, 2)
+        total = round(rng.lognormvariate(7, 1), 2)
+        cfdis.append({
+            "client_id": CLIENT_ID if n % 10 else 'OTRO',
+            "uuid": f"U-{n}",
+            "tipo_comprobante": rng.choice('IIIIEEPNT'),
+            "fecha": (AHORA - timedelta(seconds=rng.randrange(400 * 86400))).strftime('%Y-%m-%d %H:%M:%S'),
+            "emisor_rfc": emisor,
+            "emisor_nombre": f"EMISOR {emisor}",
+            "receptor_rfc": receptor,
+            "receptor_nombre": f"RECEPTOR {receptor}",
+            "subtotal": round(total / 1.16, 2),
+            "total": total,
+            "forma_pago": rng.choice(['01', '03', '04', '28', '99', None]),
+            "metodo_pago": rng.choice(['PUE', 'PPD', None]),
+            "estatus_validacion": rng.choice(['pendiente', 'valido', 'rechazado', 'revision'])
+        })
+    return cfdis
+
+
+@pytest.fixture(scope='module')
+def db():
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def funciones_mysql(conexion, _):
+        conexion.create_function(
+            'DATE_FORMAT', 2, lambda valor, formato: datetime.fromisoformat(str(valor)).strftime(formato)
+        )
+
+    with Session(engine) as sesion:
+        for sql in CREATE_SQL:
+            sesion.execute(text(sql))
+        sesion.execute(INSERT_SQL, generar(3000))
+        rebuild = cfdi_rollup.APPLY_SQL.format(signo=1, filtro='').split('ON DUPLICATE KEY UPDATE')[0]
+        sesion.execute(text(rebuild), {"client_id": CLIENT_ID})
+        sesion.commit()
+        yield sesion
+
+
+@pytest.mark.parametrize('fecha_inicio, fecha_fin', [
+    ('2025-05-16', '2025-06-15'),   # últimos 30 días (por defecto)
+    ('2024-06-15', '2025-06-15'),   # un año, la tendencia cae dentro del periodo
+    ('2024-07-01', '2024-09-30'),   # periodo fuera de la ventana de tendencia
+    ('2025-06-15', '2025-06-15'),   # un solo día, fecha_fin completa
+    ('2030-01-01', '2030-01-31'),   # sin CFDIs
+])
+def test_dashboard_igual_a_la_implementacion_anterior(db, fecha_inicio, fecha_fin):
+    anterior = dashboard_actual(db, CLIENT_ID, fecha_inicio, fecha_fin, AHORA)
+    nuevo = compute_dashboard(db, CLIENT_ID, fecha_inicio, fecha_fin, ahora=AHORA)
+
+    assert normalizar(nuevo) == normalizar(anterior)
+
+
+def test_el_periodo_con_datos_no_es_trivial(db):
+    resultado = compute_dashboard(db, CLIENT_ID, '2024-06-15', '2025-06-15', ahora=AHORA)
+
+    assert resultado['resumen_general']['total_cfdis'] > 1000
+    assert len(resultado['top_clientes']) == 5
+    assert len(resultado['tendencia_mensual']) == 7
+    assert len(resultado['formas_pago']) == 5
+
+
+@pytest.mark.parametrize('fecha, meses, esperado', [
+    (datetime(2025, 6, 15), 6, datetime(2024, 12, 15)),
+    (datetime(2025, 8, 31), 6, datetime(2025, 2, 28)),
+    (datetime(2024, 8, 31), 6, datetime(2024, 2, 29)),
+    (datetime(2025, 3, 31), 1, datetime(2025, 2, 28)),
+    (datetime(2025, 1, 10, 8, 30), 13, datetime(2023, 12, 10, 8, 30)),
+])
+def test_restar_meses(fecha, meses, esperado):
+    assert restar_meses(fecha, meses) == esperado
+
+
+def test_resolver_periodo():
+    assert resolver_periodo('2025-01-01', '2025-01-31') == ('2025-01-01', '2025-01-31')
+    assert resolver_periodo(None, '2025-01-31') == ('2025-01-01', '2025-01-31')
+    inicio, fin = resolver_periodo(None, None)
+    assert fin == datetime.now().strftime('%Y-%m-%d')
+    assert (datetime.strptime(fin, '%Y-%m-%d') - datetime.strptime(inicio, '%Y-%m-%d')).days == 30
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de las ventanas de comparación y de la serie diaria del agregado
+"""
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.period_compare import (
+    CANTIDAD, EGRESOS, INGRESOS, MAX_COMPARACIONES, MAX_DIAS_SERIE, MAX_DIAS_VENTANA,
+    SerieDiaria, Ventana, comparar, parse_comparaciones, tendencia,
+)
+
+np = pytest.importorskip('numpy')
+
+
+def ventana(inicio: str, fin: str) -> Ventana:
+    return Ventana(date.fromisoformat(inicio), date.fromisoformat(fin))
+
+
+@pytest.mark.parametrize('comparar_con, inicio, fin, actual, referencia', [
+    ('anterior', '2025-03-01', '2025-03-31', ('2025-03-01', '2025-03-31'), ('2025-01-29', '2025-02-28')),
+    ('anterior', '2025-03-15', '2025-03-15', ('2025-03-15', '2025-03-15'), ('2025-03-14', '2025-03-14')),
+    # El 31 pasa al último día del mes destino (y al 29 en bisiesto)
+    ('mes_anterior', '2025-03-31', '2025-03-31', ('2025-03-31', '2025-03-31'), ('2025-02-28', '2025-02-28')),
+    ('mes_anterior', '2025-01-01', '2025-01-31', ('2025-01-01', '2025-01-31'), ('2024-12-01', '2024-12-31')),
+    ('anio_anterior', '2024-02-29', '2024-02-29', ('2024-02-29', '2024-02-29'), ('2023-02-28', '2023-02-28')),
+    ('ultimos_12_meses', '2025-06-01', '2025-06-30', ('2024-07-01', '2025-06-30'), ('2023-07-01', '2024-06-30')),
+    ('2024-01-01:2024-01-10', '2025-01-01', '2025-01-31', ('2025-01-01', '2025-01-31'), ('2024-01-01', '2024-01-10')),
+])
+def test_parse_comparaciones(comparar_con, inicio, fin, actual, referencia):
+    comparacion, = parse_comparaciones(comparar_con, inicio, fin)
+
+    assert comparacion.nombre == comparar_con
+    assert comparacion.actual == ventana(*actual)
+    assert comparacion.referencia == ventana(*referencia)
+
+
+def test_parse_comparaciones_sin_repetidos_ni_vacios():
+    comparaciones = parse_comparaciones(' anterior,, anio_anterior ,anterior', '2025-03-01', '2025-03-31')
+
+    assert [c.nombre for c in comparaciones] == ['anterior', 'anio_anterior']
+    assert parse_comparaciones('', '2025-03-01', '2025-03-31') == []
+
+
+@pytest.mark.parametrize('comparar_con, inicio, fin', [
+    ('semana', '2025-03-01', '2025-03-31'),
+    ('anterior', '2025-03-31', '2025-03-01'),
+    ('anterior', '2025-02-30', '2025-03-01'),
+    ('2024-01-10:2024-01-01', '2025-03-01', '2025-03-31'),
+    ('2024-01-01', '2025-03-01', '2025-03-31'),
+    ('2024-01-01:2024-01-02:2024-01-03', '2025-03-01', '2025-03-31'),
+    ('2024-01-01:2024-13-01', '2025-03-01', '2025-03-31'),
+    ('anterior', '2015-01-01', '2025-01-01'),
+    ('2000-01-01:2010-01-01', '2025-03-01', '2025-03-31'),
+    ('1990-01-01:1990-01-02', '2025-03-01', '2025-03-31'),
+    (','.join(f'2024-01-{d:02d}:2024-01-{d:02d}' for d in range(1, MAX_COMPARACIONES + 2)), '2025-03-01', '2025-03-31'),
+])
+def test_parse_comparaciones_invalidas(comparar_con, inicio, fin):
+    with pytest.raises(ValueError):
+        parse_comparaciones(comparar_con, inicio, fin)
+
+
+def test_topes_de_ventana_y_serie():
+    inicio = date(2025, 1, 1)
+    fin = inicio + timedelta(days=MAX_DIAS_VENTANA - 1)
+    assert parse_comparaciones('', inicio.isoformat(), fin.isoformat()) == []
+
+    lejano = fin - timedelta(days=MAX_DIAS_SERIE - 1)
+    rango = f'{lejano.isoformat()}:{lejano.isoformat()}'
+    assert len(parse_comparaciones(rango, inicio.isoformat(), fin.isoformat())) == 1
+
+
+def fila(dia: date, cantidad: int, cantidad_ingresos: int, ingresos: float, egresos: float):
+    return SimpleNamespace(dia=dia, cantidad=cantidad, cantidad_ingresos=cantidad_ingresos,
+                           ingresos=ingresos, egresos=egresos)
+
+
+def serie_aleatoria(desde: date, hasta: date, semilla: int = 7):
+    azar = random.Random(semilla)
+    filas = []
+    dia = desde
+    while dia <= hasta:
+        if azar.random() < 0.6:
+            cantidad_ingresos = azar.randint(0, 5)
+            filas.append(fila(dia, cantidad_ingresos + azar.randint(0, 3), cantidad_ingresos,
+                              round(azar.uniform(0, 10000), 2) if cantidad_ingresos else 0, round(azar.uniform(0, 500), 2)))
+        dia += timedelta(days=1)
+    return filas
+
+
+def suma_directa(filas, v: Ventana, campo: str):
+    return sum(getattr(f, campo) for f in filas if v.inicio <= f.dia <= v.fin)
+
+
+def test_serie_sumas_coinciden_con_suma_directa():
+    desde, hasta = date(2024, 1, 1), date(2025, 6, 30)
+    filas = serie_aleatoria(desde, hasta)
+    serie = SerieDiaria(desde, hasta, filas)
+    ventanas = [
+        ventana('2024-01-01', '2025-06-30'),
+        ventana('2024-02-29', '2024-02-29'),
+        ventana('2025-01-15', '2025-03-14'),
+        # Fuera de la serie por ambos lados: los días faltantes cuentan en cero
+        ventana('2023-12-01', '2024-01-10'),
+        ventana('2025-06-20', '2025-07-31'),
+        ventana('2026-01-01', '2026-01-31'),
+    ]
+
+    sumas = serie.sumas(ventanas)
+
+    for i, v in enumerate(ventanas):
+        assert sumas[CANTIDAD, i] == suma_directa(filas, v, 'cantidad')
+        assert sumas[INGRESOS, i] == round(suma_directa(filas, v, 'ingresos') * 100)
+        assert sumas[EGRESOS, i] == round(suma_directa(filas, v, 'egresos') * 100)
+
+
+def test_serie_tramo_y_media_movil():
+    desde, hasta = date(2025, 1, 1), date(2025, 3, 31)
+    filas = serie_aleatoria(desde, hasta, semilla=3)
+    serie = SerieDiaria(desde, hasta, filas)
+    v = ventana('2025-02-01', '2025-03-31')
+
+    tramo = serie.tramo(v)
+    assert tramo.shape[1] == v.dias
+    assert tramo[CANTIDAD].sum() == suma_directa(filas, v, 'cantidad')
+
+    media = serie.media_movil(v, 7)
+    for i in (0, 10, v.dias - 1):
+        dia = v.inicio + timedelta(days=i)
+        esperado = suma_directa(filas, Ventana(dia - timedelta(days=6), dia), 'ingresos') * 100 / 7
+        assert media[INGRESOS, i] == pytest.approx(esperado)
+
+
+def test_serie_vacia_y_nulos():
+    serie = SerieDiaria(date(2025, 1, 1), date(2025, 1, 3),
+                        [fila(date(2025, 1, 2), None, None, None, 12.345)])
+
+    assert serie.valores[:, 1].tolist() == [0, 0, 0, 1234]
+    assert SerieDiaria(date(2025, 1, 1), date(2025, 1, 3), []).acumulado.sum() == 0
+
+
+def test_comparar_variaciones():
+    desde, hasta = date(2025, 1, 1), date(2025, 2, 28)
+    filas = [
+        fila(date(2025, 1, 10), 2, 2, 100, 10),
+        fila(date(2025, 2, 10), 5, 4, 150, 0),
+    ]
+    serie = SerieDiaria(desde, hasta, filas)
+    comparaciones = parse_comparaciones('mes_anterior,2024-01-01:2024-01-31', '2025-02-01', '2025-02-28')
+
+    mes, vacio = comparar(serie, comparaciones)
+
+    assert mes['referencia'] == {'fecha_inicio': '2025-01-01', 'fecha_fin': '2025-01-28'}
+    assert mes['kpis']['ingresos'] == {'valor': 150.0, 'referencia': 100.0, 'diferencia': 50.0, 'variacion': 50.0}
+    assert mes['kpis']['utilidad'] == {'valor': 150.0, 'referencia': 90.0, 'diferencia': 60.0, 'variacion': 66.67}
+    assert mes['kpis']['ticket_promedio']['valor'] == 37.5
+    assert mes['kpis']['total_cfdis'] == {'valor': 5, 'referencia': 2, 'diferencia': 3, 'variacion': 150.0}
+    # Referencia sin datos: variación 0, no división entre cero
+    assert vacio['kpis']['ingresos']['variacion'] == 0.0
+    assert vacio['kpis']['ticket_promedio']['referencia'] == 0.0
+    assert comparar(serie, []) == []
+
+
+def test_tendencia_solo_dias_con_cfdis():
+    desde = date(2025, 1, 1)
+    filas = [fila(desde + timedelta(days=d), 1, 1, 70, 0) for d in (30, 35)]
+    serie = SerieDiaria(desde, date(2025, 2, 28), filas)
+
+    dias = tendencia(serie, ventana('2025-01-31', '2025-02-28'))
+
+    assert [d['fecha'] for d in dias] == ['2025-01-31', '2025-02-05']
+    assert dias[0]['ingresos_media_7'] == 10.0
+    assert dias[1]['ingresos_media_7'] == 20.0
+    assert dias[1]['ingresos_media_30'] == round(140 / 30, 2)
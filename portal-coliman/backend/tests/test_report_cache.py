@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché de KPIs y reportes y del LRU con vencimiento
+"""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.kpis import get_cache_stats
+from app.services import report_cache
+from app.services.ttl_lru import TTLLRU
+
+AHORA = datetime(2025, 6, 1, 12, 0)
+
+
+def test_lru_vence_por_entrada():
+    lru = TTLLRU(10)
+    lru.put('a', AHORA + timedelta(seconds=5), 1)
+
+    assert lru.get('a', AHORA) == 1
+    assert lru.get('a', AHORA + timedelta(seconds=5)) is None
+    # La entrada vencida se elimina al leerla
+    assert len(lru) == 0
+
+
+def test_lru_desaloja_la_menos_usada():
+    lru = TTLLRU(2)
+    vence = AHORA + timedelta(hours=1)
+    lru.put('a', vence, 1)
+    lru.put('b', vence, 2)
+    lru.get('a', AHORA)
+
+    lru.put('c', vence, 3)
+
+    assert lru.get('b', AHORA) is None
+    assert lru.get('a', AHORA) == 1
+    assert lru.get('c', AHORA) == 3
+
+
+def test_lru_reemplazar_no_crece():
+    lru = TTLLRU(2)
+    for valor in range(5):
+        lru.put('a', AHORA + timedelta(hours=1), valor)
+
+    assert len(lru) == 1
+    assert lru.get('a', AHORA) == 4
+
+
+class Versiones:
+    """Sesión que solo responde la versión de datos del cliente"""
+
+    def __init__(self):
+        self.version = 0
+
+    def execute(self, sql, params):
+        return SimpleNamespace(scalar=lambda: self.version)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(report_cache, '_lru', TTLLRU(100))
+    monkeypatch.setattr(report_cache, '_stats', {})
+    monkeypatch.setattr(report_cache.settings, 'REPORT_CACHE_TTL_SECONDS', 300)
+    return report_cache
+
+
+def contador():
+    llamadas = []
+
+    def compute():
+        llamadas.append(1)
+        return {'n': len(llamadas)}
+    return compute, llamadas
+
+
+def test_acierto_hasta_que_cambia_la_version(cache):
+    db = Versiones()
+    compute, llamadas = contador()
+    periodo = ('2025-01-01', '2025-01-31')
+
+    assert cache.cached(db, 'dashboard', 'C1', periodo, compute) == {'n': 1}
+    assert cache.cached(db, 'dashboard', 'C1', periodo, compute) == {'n': 1}
+    db.version += 1
+    assert cache.cached(db, 'dashboard', 'C1', periodo, compute) == {'n': 2}
+
+    assert len(llamadas) == 2
+    assert cache.stats()['por_endpoint']['dashboard'] == {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333}
+
+
+def test_clave_por_cliente_endpoint_y_periodo(cache):
+    db = Versiones()
+    compute, llamadas = contador()
+    for endpoint, cliente, periodo in [('dashboard', 'C1', 'p'), ('dashboard', 'C2', 'p'),
+                                       ('fiscal', 'C1', 'p'), ('dashboard', 'C1', 'q')]:
+        cache.cached(db, endpoint, cliente, periodo, compute)
+
+    assert len(llamadas) == 4
+
+
+def test_ttl_cero_desactiva_la_cache(cache, monkeypatch):
+    monkeypatch.setattr(report_cache.settings, 'REPORT_CACHE_TTL_SECONDS', 0)
+    compute, llamadas = contador()
+
+    cache.cached(Versiones(), 'dashboard', 'C1', 'p', compute)
+    cache.cached(Versiones(), 'dashboard', 'C1', 'p', compute)
+
+    assert len(llamadas) == 2
+    assert cache.stats()['hits'] == 0
+
+
+def test_periodo_normalizado():
+    assert report_cache.normalizar_periodo('2025-1-5', '2025-01-31') == ('2025-01-05', '2025-01-31')
+    with pytest.raises(ValueError):
+        report_cache.normalizar_periodo('2025-02-30', '2025-03-01')
+
+
+@pytest.mark.parametrize('rol', ['admin', 'superadmin'])
+def test_stats_para_administradores(cache, rol):
+    assert 'hit_ratio' in asyncio.run(get_cache_stats(SimpleNamespace(role=rol)))
+
+
+def test_stats_rechaza_otros_roles(cache):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_cache_stats(SimpleNamespace(role='user')))
+
+    assert error.value.status_code == 403
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del cliente de consulta del SAT: circuit breaker, reintentos y
+lectura de la respuesta SOAP (el SAT se simula con httpx.MockTransport)
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import sat_consulta
+from app.services.sat_consulta import (
+    CircuitBreaker, SatCircuitOpenError, SatConsultaClient, SatConsultaError, SatTimeoutError,
+    build_expresion_impresa, parse_consulta_response
+)
+
+RESPUESTA_VIGENTE = b'''<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>
+<ConsultaResponse xmlns="http://tempuri.org/"><ConsultaResult
+ xmlns:a="http://schemas.datacontract.org/2004/07/Sat.Cfdi.Negocio.ConsultaCfdi.Servicio">
+<a:CodigoEstatus>S - Comprobante obtenido satisfactoriamente.</a:CodigoEstatus>
+<a:EsCancelable>Cancelable sin aceptacion</a:EsCancelable>
+<a:Estado>Vigente</a:Estado>
+<a:EstatusCancelacion/>
+<a:ValidacionEFOS>200</a:ValidacionEFOS>
+</ConsultaResult></ConsultaResponse></s:Body></s:Envelope>'''
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(sat_consulta.time, 'monotonic', reloj)
+    return reloj
+
+
+def test_circuito_se_abre_tras_el_umbral(reloj):
+    cb = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        cb.record_failure()
+        assert cb.state == 'cerrado' and cb.allow()
+
+    cb.record_failure()
+
+    assert cb.state == 'abierto'
+    assert not cb.allow()
+
+
+def test_medio_abierto_deja_pasar_una_sola_prueba(reloj):
+    cb = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    cb.record_failure()
+    reloj.ahora += 30
+
+    assert cb.state == 'medio_abierto'
+    assert cb.allow()
+    assert not cb.allow()
+
+    cb.record_success()
+    assert cb.state == 'cerrado'
+    assert cb.failures == 0
+
+
+def test_prueba_fallida_reabre_el_circuito(reloj):
+    cb = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    cb.record_failure()
+    reloj.ahora += 31
+    assert cb.allow()
+
+    cb.record_failure()
+
+    assert cb.state == 'abierto'
+    reloj.ahora += 29
+    assert not cb.allow()
+
+
+def test_prueba_cancelada_se_libera_sin_contar(reloj):
+    cb = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    cb.record_failure()
+    reloj.ahora += 30
+    assert cb.allow()
+
+    cb.release_probe()
+
+    assert cb.failures == 1
+    assert cb.allow()
+
+
+def test_expresion_impresa():
+    assert build_expresion_impresa('U-1', 'AAA', 'BBB', 116.5, 'abcdefgh') == \
+        '?re=AAA&rr=BBB&tt=116.500000&id=U-1&fe=abcdefgh'
+    assert build_expresion_impresa('U-1', 'AAA', 'BBB', 1).endswith('&id=U-1')
+
+
+def test_parse_respuesta_vigente():
+    resultado = parse_consulta_response(RESPUESTA_VIGENTE, 'U-1')
+
+    assert resultado['estado'] == 'Vigente'
+    assert resultado['validacion_efos'] == '200'
+    assert resultado['estatus_cancelacion'] == 'No Disponible'
+
+
+def test_parse_respuesta_sin_resultado():
+    resultado = parse_consulta_response(b'<Envelope><Body/></Envelope>', 'U-1')
+
+    assert resultado['estado'] == 'No Encontrado'
+    assert 'mensaje' in resultado
+
+
+def consultar(respuestas, consultas=1, retries=2, fallas=5):
+    """
+    Ejecuta `consultas` consultas seguidas contra un SAT simulado que responde
+    en orden `respuestas`. Retorna (resultados o excepciones, llamadas, breaker)
+    """
+    llamadas = []
+
+    def handler(request):
+        llamadas.append(request)
+        respuesta = respuestas[min(len(llamadas), len(respuestas)) - 1]
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    async def run():
+        client = SatConsultaClient(url='https://sat.test/consulta', retries=retries, backoff_base=0.0001)
+        client.breaker = CircuitBreaker(fallas, 60)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client._semaphore = asyncio.Semaphore(1)
+        resultados = []
+        try:
+            for _ in range(consultas):
+                try:
+                    resultados.append(await client.consultar('U-1', 'AAA', 'BBB', 10))
+                except SatConsultaError as e:
+                    resultados.append(e)
+        finally:
+            await client.aclose()
+        return resultados, llamadas, client.breaker
+
+    return asyncio.run(run())
+
+
+def test_reintenta_5xx_y_timeouts():
+    resultados, llamadas, breaker = consultar([
+        httpx.Response(503),
+        httpx.ReadTimeout('lento'),
+        httpx.Response(200, content=RESPUESTA_VIGENTE),
+    ])
+
+    assert resultados[0]['estado'] == 'Vigente'
+    assert len(llamadas) == 3
+    assert breaker.failures == 0
+
+
+def test_reintentos_agotados_cuentan_una_falla():
+    resultados, llamadas, breaker = consultar([httpx.ReadTimeout('lento')], retries=1)
+
+    assert isinstance(resultados[0], SatTimeoutError)
+    assert len(llamadas) == 2
+    assert breaker.failures == 1
+
+
+def test_4xx_no_se_reintenta_ni_cuenta_como_falla():
+    resultados, llamadas, breaker = consultar([httpx.Response(400)])
+
+    assert isinstance(resultados[0], SatConsultaError)
+    assert len(llamadas) == 1
+    assert breaker.failures == 0
+
+
+def test_circuito_abierto_no_consulta():
+    resultados, llamadas, breaker = consultar([httpx.ConnectError('sin red')], consultas=2, retries=0, fallas=1)
+
+    assert type(resultados[0]) is SatConsultaError
+    assert isinstance(resultados[1], SatCircuitOpenError)
+    assert len(llamadas) == 1
+    assert breaker.state == 'abierto'
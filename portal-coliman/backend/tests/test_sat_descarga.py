@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la descarga masiva del SAT sin BD ni red: decodificación y
+descarga concurrente de paquetes, planeación de ventanas, conciliación de
+Metadata y servicio SAT por hilo
+"""
+import base64
+import io
+import threading
+import zipfile
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import sat_descarga
+from app.services.sat_descarga import (
+    TOPE_CFDIS, SatDescargaError, agrupar_dias, conciliar_metadata, decodificar_paquete,
+    descargar_paquetes, leer_metadata, planear_ventanas,
+)
+
+
+def zip_de(archivos: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for nombre, contenido in archivos.items():
+            zf.writestr(nombre, contenido)
+    return buffer.getvalue()
+
+
+CONTENIDO = zip_de({f'{i}.xml': f'<cfdi id="{i}"/>' * 50 for i in range(20)})
+
+
+@pytest.mark.parametrize('bloque', [1, 3, 4, 7, 76, 1 << 20])
+@pytest.mark.parametrize('separador', ['', '\n', '\r\n', ' '])
+def test_decodificar_paquete_en_bloques(monkeypatch, bloque, separador):
+    monkeypatch.setattr(sat_descarga, 'BLOQUE_BASE64', bloque)
+    codificado = base64.b64encode(CONTENIDO).decode('ascii')
+    # Saltos de línea cada 76 caracteres (MIME), que no coinciden con los bloques
+    paquete = separador.join(codificado[i:i + 76] for i in range(0, len(codificado), 76))
+
+    for entrada in (paquete, paquete.encode('ascii')):
+        with decodificar_paquete(entrada) as archivo:
+            assert archivo.read() == CONTENIDO
+
+
+@pytest.mark.parametrize('paquete', ['QUJDRA=', 'QUJDR', 'QUJD\nR'])
+def test_decodificar_paquete_incompleto(monkeypatch, paquete):
+    monkeypatch.setattr(sat_descarga, 'BLOQUE_BASE64', 2)
+
+    with pytest.raises(SatDescargaError):
+        decodificar_paquete(paquete)
+
+
+class SatFalso:
+    """Servicio SAT falso: responde (encabezado, base64) por paquete"""
+
+    paquetes = {}
+    en_curso = 0
+    maximo = 0
+    lock = threading.Lock()
+
+    def __init__(self, signer=None):
+        self.signer = signer
+
+    def recover_comprobante_download(self, id_paquete):
+        cls = type(self)
+        with cls.lock:
+            cls.en_curso += 1
+            cls.maximo = max(cls.maximo, cls.en_curso)
+        try:
+            respuesta = cls.paquetes[id_paquete]
+            if isinstance(respuesta, Exception):
+                raise respuesta
+            return respuesta
+        finally:
+            with cls.lock:
+                cls.en_curso -= 1
+
+
+@pytest.fixture
+def sat():
+    SatFalso.paquetes = {}
+    SatFalso.maximo = 0
+    return SatFalso(signer=object())
+
+
+def test_descargar_paquetes_entrega_archivos_y_errores(sat):
+    aceptado = {'CodEstatus': '5000', 'Mensaje': 'Solicitud Aceptada'}
+    SatFalso.paquetes = {
+        f'P{i}': (aceptado, base64.b64encode(f'zip {i}'.encode()).decode()) for i in range(10)
+    }
+    SatFalso.paquetes['P3'] = ({'CodEstatus': '5008', 'Mensaje': 'Máximo de descargas permitidas'}, None)
+    SatFalso.paquetes['P5'] = ConnectionError('sin red')
+
+    resultado = dict(descargar_paquetes(sat, list(SatFalso.paquetes), concurrencia=3))
+
+    assert sorted(resultado) == sorted(SatFalso.paquetes)
+    assert resultado['P0'].read() == b'zip 0'
+    assert isinstance(resultado['P3'], SatDescargaError)
+    assert '5008' in str(resultado['P3'])
+    assert isinstance(resultado['P5'], ConnectionError)
+    assert SatFalso.maximo <= 3
+
+
+def test_descargar_paquetes_no_adelanta_mas_que_la_concurrencia(sat):
+    aceptado = {'CodEstatus': '5000'}
+    SatFalso.paquetes = {f'P{i}': (aceptado, 'QUJD') for i in range(6)}
+    descargas = []
+    original = SatFalso.recover_comprobante_download
+
+    def contar(self, id_paquete):
+        descargas.append(id_paquete)
+        return original(self, id_paquete)
+
+    SatFalso.recover_comprobante_download = contar
+    try:
+        paquetes = descargar_paquetes(sat, list(SatFalso.paquetes), concurrencia=2)
+        next(paquetes)
+        # Un paquete entregado sin consumir y a lo más dos en curso
+        assert len(descargas) <= 3
+        assert len(list(paquetes)) == 5
+    finally:
+        SatFalso.recover_comprobante_download = original
+
+
+class ConteosFalsos:
+    """Sesión que responde los CFDIs registrados por día (CONTEO_DIARIO_SQL)"""
+
+    def __init__(self, conteos: dict):
+        self.conteos = conteos
+        self.params = None
+
+    def execute(self, sql, params):
+        assert sql is sat_descarga.CONTEO_DIARIO_SQL
+        self.params = params
+        return [
+            SimpleNamespace(dia=dia, cantidad=cantidad) for dia, cantidad in self.conteos.items()
+            if params['fecha_inicio'] <= dia <= params['fecha_fin']
+        ]
+
+
+def dias(inicio: date, n: int, cantidad: int) -> dict:
+    return {inicio + timedelta(days=i): cantidad for i in range(n)}
+
+
+ENERO = date(2024, 1, 1)
+# 80% del tope de CFDI por solicitud
+PLANEADO = int(TOPE_CFDIS['CFDI'] * sat_descarga.OCUPACION_PLANEADA)
+
+
+@pytest.mark.parametrize('max_dias, conteos, fin, esperado', [
+    # Sin datos: solo el tope de días
+    (0, {}, date(2024, 12, 31), [(ENERO, date(2024, 12, 31))]),
+    (31, {}, date(2024, 3, 15), [
+        (ENERO, date(2024, 1, 31)), (date(2024, 2, 1), date(2024, 3, 2)), (date(2024, 3, 3), date(2024, 3, 15)),
+    ]),
+    # Justo en el tope cabe; un CFDI más abre otra ventana
+    (0, dias(ENERO, 4, PLANEADO // 4), date(2024, 1, 4), [(ENERO, date(2024, 1, 4))]),
+    (0, {**dias(ENERO, 4, PLANEADO // 4), date(2024, 1, 5): 1}, date(2024, 1, 6), [
+        (ENERO, date(2024, 1, 4)), (date(2024, 1, 5), date(2024, 1, 6)),
+    ]),
+    # Un día que solo ya excede va solo (el SAT lo rechazará con 5003)
+    (0, {date(2024, 1, 2): PLANEADO * 3}, date(2024, 1, 3), [
+        (ENERO, ENERO), (date(2024, 1, 2), date(2024, 1, 2)), (date(2024, 1, 3), date(2024, 1, 3)),
+    ]),
+    (0, {ENERO: PLANEADO * 3}, ENERO, [(ENERO, ENERO)]),
+])
+def test_planear_ventanas(monkeypatch, max_dias, conteos, fin, esperado):
+    monkeypatch.setattr(sat_descarga.settings, 'SAT_DESCARGA_VENTANA_MAX_DIAS', max_dias)
+    db = ConteosFalsos(conteos)
+
+    assert planear_ventanas(db, 'C1', 'CFDI', ENERO, fin) == esperado
+    assert db.params == {'client_id': 'C1', 'fecha_inicio': ENERO, 'fecha_fin': fin}
+
+
+def test_planear_ventanas_cubre_el_periodo_sin_huecos(monkeypatch):
+    monkeypatch.setattr(sat_descarga.settings, 'SAT_DESCARGA_VENTANA_MAX_DIAS', 31)
+    conteos = {ENERO + timedelta(days=i): (i * 7919) % 30000 for i in range(366)}
+    fin = date(2024, 12, 31)
+
+    for tipo in ('CFDI', 'Metadata'):
+        ventanas = planear_ventanas(ConteosFalsos(conteos), 'C1', tipo, ENERO, fin)
+
+        assert ventanas[0][0] == ENERO and ventanas[-1][1] == fin
+        for (_, fin_anterior), (inicio, _) in zip(ventanas, ventanas[1:]):
+            assert inicio == fin_anterior + timedelta(days=1)
+        for inicio, fin_ventana in ventanas:
+            assert (fin_ventana - inicio).days < 31
+            estimado = sum(c for d, c in conteos.items() if inicio <= d <= fin_ventana)
+            assert estimado <= TOPE_CFDIS[tipo] * sat_descarga.OCUPACION_PLANEADA or inicio == fin_ventana
+
+
+@pytest.mark.parametrize('dias_entrada, esperado', [
+    ([], []),
+    ([ENERO], [(ENERO, ENERO)]),
+    # Desordenados y repetidos; el cambio de mes y el 29 de febrero son consecutivos
+    ([date(2024, 1, 3), ENERO, date(2024, 1, 2), date(2024, 1, 2), date(2024, 1, 7)],
+     [(ENERO, date(2024, 1, 3)), (date(2024, 1, 7), date(2024, 1, 7))]),
+    ([date(2024, 2, 28), date(2024, 3, 1), date(2024, 2, 29)], [(date(2024, 2, 28), date(2024, 3, 1))]),
+    ([date(2023, 12, 31), ENERO, date(2024, 1, 3)], [(date(2023, 12, 31), ENERO), (date(2024, 1, 3), date(2024, 1, 3))]),
+])
+def test_agrupar_dias(dias_entrada, esperado):
+    assert agrupar_dias(dias_entrada) == esperado
+
+
+ENCABEZADO = ('Uuid~RfcEmisor~NombreEmisor~RfcReceptor~NombreReceptor~RfcPac~FechaEmision~'
+              'FechaCertificacionSat~Monto~EfectoComprobante~Estatus~FechaCancelacion')
+
+
+def test_leer_metadata():
+    txt = '\r\n'.join([
+        ENCABEZADO,
+        'AAAA-1~AAA010101AAA~Emisor SA~BBB010101BBB~Receptor~SAT970701NN3~2024-01-05 10:00:00~'
+        '2024-01-05 10:01:00~116.00~I~1~',
+        # '~' dentro de los nombres: UUID, fechas y estatus siguen en su lugar
+        'AAAA-2~AAA010101AAA~Emisor ~ SA~BBB010101BBB~Rec~ep~tor~SAT970701NN3~2024-01-06 10:00:00~'
+        '2024-01-06 10:01:00~50.00~E~0~2024-02-01 09:00:00',
+        '',
+        'basura',
+    ])
+    paquete = io.BytesIO(zip_de({
+        'metadata.txt': ('\ufeff' + txt).encode('utf-8'),
+        'leeme.pdf': b'no es metadata',
+    }))
+
+    registros = list(leer_metadata(paquete))
+
+    assert [r['Uuid'] for r in registros] == ['AAAA-1', 'AAAA-2']
+    assert registros[0]['NombreEmisor'] == 'Emisor SA'
+    assert registros[0]['Estatus'] == '1'
+    assert registros[1]['FechaEmision'] == '2024-01-06 10:00:00'
+    assert registros[1]['Monto'] == '50.00'
+    assert registros[1]['Estatus'] == '0'
+    assert registros[1]['FechaCancelacion'] == '2024-02-01 09:00:00'
+
+
+class CfdisFalsos:
+    """Sesión con los CFDIs del cliente para EXISTENTES_SQL"""
+
+    def __init__(self, cfdis):
+        self.cfdis = {c.uuid.upper(): c for c in cfdis}
+        self.bloques = []
+        self.commits = 0
+
+    def execute(self, sql, params):
+        assert sql is sat_descarga.EXISTENTES_SQL
+        self.bloques.append(params['uuids'])
+        return [self.cfdis[u] for u in params['uuids'] if u in self.cfdis]
+
+    def commit(self):
+        self.commits += 1
+
+
+def cfdi(id, uuid, estatus):
+    return SimpleNamespace(id=id, uuid=uuid, emisor_rfc='AAA010101AAA', receptor_rfc='BBB010101BBB',
+                           total=116.0, estatus_validacion=estatus)
+
+
+def test_conciliar_metadata(monkeypatch):
+    actualizados, en_cache = [], []
+    monkeypatch.setattr(sat_descarga, 'BLOQUE_UUIDS', 2)
+    monkeypatch.setattr(sat_descarga, 'bulk_update_estatus', lambda db, client_id, filas: actualizados.extend(filas))
+    monkeypatch.setattr(sat_descarga.sat_validation_cache, 'store_many', lambda db, items: en_cache.extend(items))
+    db = CfdisFalsos([
+        cfdi(1, 'u-vigente', 'valido'),
+        cfdi(2, 'U-CANCELADO', 'valido'),
+        cfdi(3, 'U-YA-CANCELADO', 'rechazado'),
+        cfdi(4, 'U-REVISION', 'revision'),
+    ])
+    registros = [
+        {'Uuid': ' U-VIGENTE ', 'Estatus': '1', 'FechaEmision': '2024-01-01 10:00:00'},
+        {'Uuid': 'u-cancelado', 'Estatus': '0', 'FechaEmision': '2024-01-01 10:00:00',
+         'FechaCancelacion': '2024-01-09 12:00:00'},
+        {'Uuid': 'U-YA-CANCELADO', 'Estatus': '0', 'FechaEmision': '2024-01-02 10:00:00'},
+        {'Uuid': 'U-REVISION', 'Estatus': '0', 'FechaEmision': '2024-01-02 10:00:00'},
+        {'Uuid': 'U-NUEVO-1', 'Estatus': '1', 'FechaEmision': '2024-01-03 10:00:00'},
+        {'Uuid': 'U-NUEVO-2', 'Estatus': '1', 'FechaEmision': 'sin fecha'},
+        {'Uuid': '', 'Estatus': '1', 'FechaEmision': '2024-01-04 10:00:00'},
+        {'Uuid': 'U-NUEVO-1', 'Estatus': '1', 'FechaEmision': '2024-01-05 10:00:00'},
+    ]
+
+    stats, dias_faltantes = conciliar_metadata(db, 'C1', registros)
+
+    # El UUID repetido cae en otro bloque: cuenta dos veces y aporta los días de ambas filas
+    assert stats == {'metadata_uuids': 7, 'existentes': 4, 'faltantes': 3, 'estatus_actualizados': 1}
+    assert dias_faltantes == {date(2024, 1, 3), date(2024, 1, 5)}
+    assert [len(b) for b in db.bloques] == [2, 2, 2, 1] and db.commits == 4
+    # Solo cambia el válido que la Metadata reporta cancelado; 'revision' no se toca
+    (id_cfdi, resultado), = actualizados
+    assert id_cfdi == 2
+    assert resultado['estado'] == 'Cancelado'
+    assert resultado['fecha_cancelacion'] == '2024-01-09 12:00:00'
+    # Todos los cancelados van a la caché de validación, aunque no cambien
+    assert [r['uuid'] for _, r in en_cache] == ['U-CANCELADO', 'U-YA-CANCELADO', 'U-REVISION']
+
+
+class SatPorHilo:
+    creados = []
+
+    def __init__(self, signer):
+        self.signer = signer
+        SatPorHilo.creados.append(self)
+
+
+@pytest.fixture
+def fiel(monkeypatch):
+    """e.firma falsa: cuenta las cargas y cambia con el mtime"""
+    satcfdi_sat = pytest.importorskip('satcfdi.pacs.sat')
+    estado = {'mtime': 1, 'cargas': 0}
+
+    def cargar(mtime):
+        estado['cargas'] += 1
+        return ('AAA010101AAA', mtime), object()
+
+    SatPorHilo.creados = []
+    monkeypatch.setattr(satcfdi_sat, 'SAT', SatPorHilo)
+    monkeypatch.setattr(sat_descarga, '_servicio_sat', None)
+    monkeypatch.setattr(sat_descarga, '_servicio_hilo', threading.local())
+    monkeypatch.setattr(sat_descarga, '_fiel_mtime', lambda: estado['mtime'])
+    monkeypatch.setattr(sat_descarga, '_cargar_signer', cargar)
+    return estado
+
+
+def test_signer_se_carga_una_vez_y_el_servicio_es_por_hilo(fiel):
+    servicio, signer = sat_descarga.crear_servicio_sat()
+    assert sat_descarga.crear_servicio_sat() == (servicio, signer)
+
+    otros = []
+    hilo = threading.Thread(target=lambda: otros.append(sat_descarga.crear_servicio_sat()))
+    hilo.start()
+    hilo.join()
+    (servicio_hilo, signer_hilo), = otros
+
+    assert fiel['cargas'] == 1
+    assert signer_hilo is signer
+    assert servicio_hilo is not servicio
+    assert sat_descarga.servicio_del_hilo(servicio) is servicio
+
+
+def test_nueva_efirma_recarga_el_signer_y_el_servicio(fiel):
+    servicio, signer = sat_descarga.crear_servicio_sat()
+
+    fiel['mtime'] = 2
+    nuevo, nuevo_signer = sat_descarga.crear_servicio_sat()
+    assert nuevo_signer is not signer and nuevo is not servicio
+
+    sat_descarga.invalidar_servicio_sat()
+    sat_descarga.crear_servicio_sat()
+    assert fiel['cargas'] == 3
+
+
+def test_sin_efirma_no_se_guarda(fiel):
+    # Sin fiel_config.json no hay mtime: se carga cada vez (y falla en _cargar_signer)
+    fiel['mtime'] = None
+    sat_descarga.crear_servicio_sat()
+    sat_descarga.crear_servicio_sat()
+
+    assert fiel['cargas'] == 2
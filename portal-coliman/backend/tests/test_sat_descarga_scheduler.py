@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de los pasos del scheduler de descarga masiva contra un SAT falso;
+la tabla sat_download_requests vive en SQLite
+"""
+import base64
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from app.services import sat_descarga
+from app.services.sat_descarga import claim_next_step, crear_solicitud, espera_verificacion, run_step
+
+pytest.importorskip('satcfdi.pacs.sat')
+
+INICIO = datetime(2025, 1, 10, 12, 0)
+
+
+@pytest.fixture
+def reloj():
+    return {'ahora': INICIO}
+
+
+@pytest.fixture
+def db(reloj):
+    engine = create_engine('sqlite://', connect_args={'detect_types': sqlite3.PARSE_DECLTYPES})
+
+    @event.listens_for(engine, 'connect')
+    def funciones(conexion, _):
+        conexion.create_function('NOW', 0, lambda: reloj['ahora'].strftime('%Y-%m-%d %H:%M:%S'))
+
+    @event.listens_for(engine, 'before_cursor_execute', retval=True)
+    def traducir(conexion, cursor, sql, params, contexto, varios):
+        # Dialecto de MySQL usado por el módulo
+        sql = sql.replace('NOW() + INTERVAL ? SECOND', "datetime(NOW(), '+' || ? || ' seconds')")
+        return re.sub(r'FOR UPDATE( SKIP LOCKED)?', '', sql), params
+
+    sesion = Session(engine)
+    # Fechas como DATE y TIMESTAMP para que SQLite las regrese como date/datetime, igual que MySQL
+    sesion.execute(text("""CREATE TABLE sat_download_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, client_id TEXT, user_id INTEGER, parent_id INTEGER,
+        tipo TEXT, tipo_solicitud TEXT, modo TEXT DEFAULT 'completa', fecha_inicio DATE, fecha_fin DATE,
+        rfc_emisor TEXT, rfc_receptor TEXT, estado TEXT, solicitud_id TEXT, estado_sat INTEGER,
+        codigo_estado TEXT, numero_cfdis INTEGER, paquetes TEXT, paquetes_descargados TEXT, resultado TEXT,
+        verificaciones INTEGER DEFAULT 0, errores INTEGER DEFAULT 0, mensaje TEXT,
+        next_check_at TIMESTAMP, finished_at TIMESTAMP, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"""))
+    sesion.execute(text("CREATE TABLE cfdi_daily_rollup (client_id TEXT, dia DATE, tipo_comprobante TEXT, cantidad INTEGER)"))
+    sesion.commit()
+    yield sesion
+    sesion.close()
+
+
+class SatFalso:
+    """Respuestas (dicts, como las de satcfdi) por método; una excepción se lanza"""
+
+    respuestas = {}
+    llamadas = []
+
+    def __init__(self, signer=None):
+        self.signer = signer
+
+    def _responder(self, metodo, **kwargs):
+        SatFalso.llamadas.append((metodo, kwargs))
+        respuesta = SatFalso.respuestas[metodo]
+        if callable(respuesta):
+            respuesta = respuesta(**kwargs)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    def recover_comprobante_emitted_request(self, **kwargs):
+        return self._responder('solicitar', **kwargs)
+
+    def recover_comprobante_received_request(self, **kwargs):
+        return self._responder('solicitar', **kwargs)
+
+    def recover_comprobante_status(self, id_solicitud):
+        return self._responder('verificar', id_solicitud=id_solicitud)
+
+    def recover_comprobante_download(self, id_paquete):
+        return self._responder('descargar', id_paquete=id_paquete)
+
+
+@pytest.fixture
+def sat(monkeypatch, tmp_path):
+    SatFalso.respuestas = {}
+    SatFalso.llamadas = []
+    servicio = SatFalso(signer=SimpleNamespace(rfc='AAA010101AAA'))
+    monkeypatch.setattr(sat_descarga, 'crear_servicio_sat', lambda: (servicio, servicio.signer))
+    monkeypatch.setattr(sat_descarga, 'DOWNLOADS_DIR', str(tmp_path))
+    monkeypatch.setattr(sat_descarga.settings, 'SAT_DESCARGA_VENTANA_MAX_DIAS', 31)
+    return SatFalso
+
+
+def fila(db, solicitud_id):
+    return db.execute(text(f"""
+        SELECT {sat_descarga.COLUMNAS} FROM sat_download_requests WHERE id = :id
+    """), {"id": solicitud_id}).fetchone()
+
+
+def paso(db, solicitud_id):
+    run_step(db, fila(db, solicitud_id))
+    return fila(db, solicitud_id)
+
+
+ACEPTADA = {'IdSolicitud': 'S-1', 'CodEstatus': '5000', 'Mensaje': 'Solicitud Aceptada'}
+
+
+def estado_sat(estado, codigo='5000', paquetes=(), numero=0, mensaje=''):
+    return {'EstadoSolicitud': estado, 'CodigoEstadoSolicitud': codigo, 'CodEstatus': '5000',
+            'IdsPaquetes': list(paquetes), 'NumeroCFDIs': numero, 'Mensaje': mensaje}
+
+
+@pytest.mark.parametrize('verificaciones, esperado', [(0, 60), (1, 90), (2, 135), (10, 1800), (50, 1800)])
+def test_espera_verificacion(verificaciones, esperado):
+    assert espera_verificacion(verificaciones) == pytest.approx(esperado)
+
+
+def test_flujo_completo_hasta_descargar(db, sat, reloj, tmp_path):
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'recibidos', date(2025, 1, 1), date(2025, 1, 5), 'Metadata')
+    sat.respuestas = {'solicitar': ACEPTADA}
+
+    solicitud = paso(db, solicitud_id)
+    assert (solicitud.estado, solicitud.solicitud_id) == ('solicitada', 'S-1')
+    assert solicitud.next_check_at == INICIO + timedelta(seconds=60)
+    _, enviada = sat.llamadas[0]
+    assert enviada['rfc_receptor'] == 'AAA010101AAA' and enviada['fecha_inicial'] == date(2025, 1, 1)
+
+    # Sin cambio de estado el intervalo crece; al avanzar vuelve al inicial
+    sat.respuestas['verificar'] = estado_sat(1)
+    assert paso(db, solicitud_id).verificaciones == 0
+    solicitud = paso(db, solicitud_id)
+    assert solicitud.verificaciones == 1
+    assert solicitud.next_check_at == INICIO + timedelta(seconds=90)
+    sat.respuestas['verificar'] = estado_sat(2)
+    assert paso(db, solicitud_id).verificaciones == 0
+
+    sat.respuestas['verificar'] = estado_sat(3, paquetes=['P1', 'P2'], numero=12)
+    sat.respuestas['descargar'] = lambda id_paquete: ({'CodEstatus': '5000'}, base64.b64encode(id_paquete.encode()).decode())
+    solicitud = paso(db, solicitud_id)
+
+    assert solicitud.estado == 'completada'
+    assert solicitud.numero_cfdis == 12
+    assert solicitud.finished_at == INICIO
+    assert sorted(p.name for p in (tmp_path / 'S-1').iterdir()) == ['P1.zip', 'P2.zip']
+    assert (tmp_path / 'S-1' / 'P2.zip').read_bytes() == b'P2'
+
+
+def test_descarga_retomada_no_repite_paquetes(db, sat):
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5), 'Metadata')
+    sat.respuestas = {
+        'solicitar': ACEPTADA,
+        'verificar': estado_sat(3, paquetes=['P1', 'P2'], numero=2),
+        'descargar': lambda id_paquete: (
+            ConnectionError('sin red') if id_paquete == 'P2' else ({'CodEstatus': '5000'}, 'UDE=')
+        ),
+    }
+    paso(db, solicitud_id)
+
+    solicitud = paso(db, solicitud_id)
+    assert (solicitud.estado, solicitud.errores) == ('descargando', 1)
+    assert solicitud.paquetes_descargados == '["P1"]'
+
+    sat.respuestas['descargar'] = lambda id_paquete: ({'CodEstatus': '5000'}, 'UDI=')
+    sat.llamadas.clear()
+    assert paso(db, solicitud_id).estado == 'completada'
+    assert [kwargs['id_paquete'] for metodo, kwargs in sat.llamadas] == ['P2']
+
+
+@pytest.mark.parametrize('respuesta, estado, mensaje', [
+    (estado_sat(5, codigo='5004', mensaje='No se encontró la información'), 'completada', 'No se encontró la información'),
+    (estado_sat(5, codigo='5002', mensaje='Se agotó las solicitudes de por vida'), 'rechazada', 'Se agotó las solicitudes de por vida'),
+    (estado_sat(6), 'vencida', 'Estado del SAT: Vencida'),
+    (estado_sat(4), 'error', 'Estado del SAT: Error'),
+])
+def test_estados_finales_del_sat(db, sat, respuesta, estado, mensaje):
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5))
+    sat.respuestas = {'solicitar': ACEPTADA, 'verificar': respuesta}
+    paso(db, solicitud_id)
+
+    solicitud = paso(db, solicitud_id)
+
+    assert (solicitud.estado, solicitud.mensaje) == (estado, mensaje)
+
+
+def test_solicitud_no_aceptada(db, sat):
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5))
+    sat.respuestas = {'solicitar': {'IdSolicitud': '', 'CodEstatus': '305', 'Mensaje': 'Certificado Inválido'}}
+
+    solicitud = paso(db, solicitud_id)
+
+    assert (solicitud.estado, solicitud.codigo_estado, solicitud.mensaje) == ('error', '305', 'Certificado Inválido')
+
+
+def test_errores_seguidos_con_backoff_hasta_marcar_error(db, sat, monkeypatch):
+    monkeypatch.setattr(sat_descarga.settings, 'SAT_DESCARGA_MAX_ERRORES', 3)
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5))
+    sat.respuestas = {'solicitar': TimeoutError('El SAT no responde')}
+
+    solicitud = paso(db, solicitud_id)
+    assert (solicitud.estado, solicitud.errores) == ('pendiente', 1)
+    assert solicitud.next_check_at == INICIO + timedelta(seconds=90)
+    assert paso(db, solicitud_id).errores == 2
+
+    solicitud = paso(db, solicitud_id)
+    assert (solicitud.estado, solicitud.errores, solicitud.mensaje) == ('error', 3, 'El SAT no responde')
+
+
+def test_tope_del_sat_parte_la_ventana_y_la_raiz_suma_las_mitades(db, sat):
+    solicitud_id = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 4))
+    sat.respuestas = {'solicitar': {'IdSolicitud': '', 'CodEstatus': '5003', 'Mensaje': 'Tope máximo'}}
+
+    assert paso(db, solicitud_id).estado == 'dividida'
+    hijas = [r.id for r in db.execute(text(
+        "SELECT id FROM sat_download_requests WHERE parent_id = :id ORDER BY fecha_inicio"), {"id": solicitud_id})]
+    assert [(fila(db, h).fecha_inicio, fila(db, h).fecha_fin) for h in hijas] == [
+        (date(2025, 1, 1), date(2025, 1, 2)), (date(2025, 1, 3), date(2025, 1, 4)),
+    ]
+
+    # Una hija sin CFDIs en el SAT y la otra que no se puede partir más (un solo día)
+    sat.respuestas = {'solicitar': ACEPTADA, 'verificar': estado_sat(5, codigo='5004')}
+    paso(db, hijas[0])
+    paso(db, hijas[0])
+    assert fila(db, solicitud_id).estado == 'dividida'
+
+    sat.respuestas = {'solicitar': {'IdSolicitud': '', 'CodEstatus': '5003'}}
+    paso(db, hijas[1])
+    nietas = [r.id for r in db.execute(text(
+        "SELECT id FROM sat_download_requests WHERE parent_id = :id AND id > :ultima ORDER BY fecha_inicio"
+    ), {"id": solicitud_id, "ultima": hijas[1]})]
+    assert len(nietas) == 2
+    for nieta in nietas:
+        paso(db, nieta)
+
+    raiz = sat_descarga.get_solicitud(db, solicitud_id, 'C1')
+    assert raiz['estado'] == 'error'
+    assert [v['estado'] for v in raiz['ventanas']] == ['completada', 'error', 'error']
+    assert raiz['mensaje'].startswith('2 de 3 ventanas sin completar: 2025-01-03..2025-01-03 error')
+
+
+def test_limite_de_solicitudes_en_el_sat(db, sat, monkeypatch, reloj):
+    monkeypatch.setattr(sat_descarga.settings, 'SAT_DESCARGA_MAX_SOLICITUDES_ACTIVAS', 1)
+    sat.respuestas = {'solicitar': ACEPTADA}
+    primera = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5))
+    segunda = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 2, 1), date(2025, 2, 5))
+
+    assert paso(db, primera).estado == 'solicitada'
+    solicitud = paso(db, segunda)
+
+    assert solicitud.estado == 'pendiente'
+    assert solicitud.next_check_at == INICIO + timedelta(seconds=60)
+    assert len(sat.llamadas) == 1
+
+
+def test_claim_reserva_el_paso_vencido(db, sat, reloj):
+    primera = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 1, 1), date(2025, 1, 5))
+    reloj['ahora'] = INICIO + timedelta(seconds=1)
+    segunda = crear_solicitud(db, 'C1', 7, 'emitidos', date(2025, 2, 1), date(2025, 2, 5))
+
+    assert claim_next_step(db).id == primera
+    assert fila(db, primera).next_check_at == reloj['ahora'] + timedelta(minutes=sat_descarga.settings.SAT_DESCARGA_LEASE_MINUTOS)
+    assert claim_next_step(db).id == segunda
+    # Ambas reservadas: nada vencido hasta que pase el plazo
+    assert claim_next_step(db) is None
+    reloj['ahora'] += timedelta(minutes=sat_descarga.settings.SAT_DESCARGA_LEASE_MINUTOS, seconds=1)
+    assert claim_next_step(db).id == primera
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del filtro de CFDIs de la validación por lote
+"""
+from app.services.sat_validacion import build_filters
+
+
+def test_uuids_se_normalizan_a_mayusculas():
+    where, params, expanding = build_filters('C1', {
+        'uuids': [' 6d890680-d9d6-4d76-b9c2-636e15efd7c3', '6D890680-D9D6-4D76-B9C2-636E15EFD7C3', ' '],
+        'estatus': ['valido']
+    })
+
+    assert where == "client_id = :client_id AND uuid IN :uuids"
+    assert params['uuids'] == ['6D890680-D9D6-4D76-B9C2-636E15EFD7C3']
+    assert [b.key for b in expanding] == ['uuids']
+
+
+def test_fecha_fin_incluye_todo_el_dia():
+    where, params, expanding = build_filters('C1', {
+        'fecha_inicio': '2025-01-01', 'fecha_fin': '2025-01-31', 'estatus': ['pendiente']
+    })
+
+    assert "fecha < :fecha_fin" in where
+    assert params['fecha_fin'] == '2025-02-01'
+    assert params['estatus'] == ['pendiente']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché de validación del SAT (la tabla se simula con un doble)
+"""
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import sat_validation_cache
+from app.services.sat_validation_cache import cache_key, get_many, store_many, ttl_for
+from app.services.ttl_lru import TTLLRU
+
+
+class TablaFalsa:
+    """Sesión que guarda los UPSERT y responde los SELECT de sat_validation_cache"""
+
+    def __init__(self):
+        self.filas = {}
+        self.selects = []
+
+    def execute(self, sql, params):
+        if sql is sat_validation_cache.UPSERT_SQL:
+            for fila in params:
+                self.filas[fila['cache_key']] = SimpleNamespace(**fila)
+            return None
+        self.selects.append(sorted(params['keys']))
+        return [f for k, f in self.filas.items() if k in params['keys'] and f.expires_at > params['ahora']]
+
+
+@pytest.fixture(autouse=True)
+def lru_vacio(monkeypatch):
+    monkeypatch.setattr(sat_validation_cache, '_lru', TTLLRU(100))
+
+
+def resultado(estado: str, uuid: str = 'U-1') -> dict:
+    return {'uuid': uuid, 'estado': estado, 'es_cancelable': 'No Disponible', 'origen': 'sat'}
+
+
+def test_clave_no_depende_de_mayusculas_ni_del_formato_del_total():
+    assert cache_key('abc', 'aaa010101aaa', 'xexx010101000', 116) == \
+        cache_key('ABC', 'AAA010101AAA', 'XEXX010101000', 116.0)
+    assert cache_key('ABC', 'AAA', 'BBB', 116) != cache_key('ABC', 'AAA', 'BBB', 116.01)
+
+
+def test_vigencia_por_estado():
+    assert ttl_for('Cancelado') > ttl_for('Vigente') > ttl_for('No Encontrado')
+    assert ttl_for('Expresión inválida') == ttl_for('No Encontrado')
+
+
+def test_lo_guardado_se_lee_de_memoria_sin_consultar_la_tabla():
+    db = TablaFalsa()
+    store_many(db, [('k1', resultado('Vigente'))])
+
+    encontrados = get_many(db, ['k1'])
+
+    assert encontrados['k1']['estado'] == 'Vigente'
+    assert 'origen' not in encontrados['k1']
+    assert db.selects == []
+    assert json.loads(db.filas['k1'].respuesta)['estado'] == 'Vigente'
+
+
+def test_faltantes_se_buscan_en_una_sola_consulta(monkeypatch):
+    db = TablaFalsa()
+    store_many(db, [('k1', resultado('Cancelado', 'U-1')), ('k2', resultado('Vigente', 'U-2'))])
+    monkeypatch.setattr(sat_validation_cache, '_lru', TTLLRU(100))
+
+    encontrados = get_many(db, ['k1', 'k2', 'k3'])
+
+    assert set(encontrados) == {'k1', 'k2'}
+    assert db.selects == [['k1', 'k2', 'k3']]
+    # Lo leído de la tabla queda en memoria
+    get_many(db, ['k1', 'k2'])
+    assert len(db.selects) == 1
+
+
+def test_resultados_vencidos_no_se_regresan():
+    db = TablaFalsa()
+    store_many(db, [('k1', resultado('No Encontrado'))])
+    db.filas['k1'].expires_at = datetime.now() - timedelta(seconds=1)
+    sat_validation_cache._lru.put('k1', datetime.now() - timedelta(seconds=1), {'estado': 'No Encontrado'})
+
+    assert get_many(db, ['k1']) == {}
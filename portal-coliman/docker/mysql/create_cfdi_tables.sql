@@ -63,7 +63,17 @@ CREATE TABLE IF NOT EXISTS cfdi (
     INDEX idx_emisor_rfc (emisor_rfc),
     INDEX idx_receptor_rfc (receptor_rfc),
     INDEX idx_fecha (fecha),
-    INDEX idx_estatus (estatus_validacion)
+    INDEX idx_estatus (estatus_validacion),
+    INDEX idx_cfdi_client_fecha (client_id, fecha, tipo_comprobante, total),
+    INDEX idx_cfdi_client_fecha_id (client_id, fecha, id),
+    INDEX idx_cfdi_client_tipo_fecha (client_id, tipo_comprobante, fecha),
+    INDEX idx_cfdi_client_estatus_fecha (client_id, estatus_validacion, fecha),
+    INDEX idx_cfdi_client_created (client_id, created_at),
+    INDEX idx_cfdi_client_emisor_created (client_id, emisor_rfc, created_at),
+    INDEX idx_cfdi_client_receptor_created (client_id, receptor_rfc, created_at),
+    INDEX idx_cfdi_client_estatus_created (client_id, estatus_validacion, created_at),
+    INDEX idx_cfdi_client_updated (client_id, updated_at),
+    INDEX idx_cfdi_client_folio (client_id, folio)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- =====================================================
@@ -100,6 +110,151 @@ CREATE TABLE IF NOT EXISTS validaciones (
     INDEX idx_cfdi_id (cfdi_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- =====================================================
+-- TABLA: cfdi_jobs
+-- =====================================================
+CREATE TABLE IF NOT EXISTS cfdi_jobs (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    user_id INT NULL,
+    job_type VARCHAR(30) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'en_cola',
+    payload JSON NULL,
+    total INT NULL,
+    procesados INT NOT NULL DEFAULT 0,
+    exitosos INT NOT NULL DEFAULT 0,
+    duplicados INT NOT NULL DEFAULT 0,
+    errores INT NOT NULL DEFAULT 0,
+    errores_detalle JSON NULL,
+    resultado JSON NULL,
+    mensaje_error TEXT NULL,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_cfdi_jobs_cola (estado, job_type, id),
+    INDEX idx_cfdi_jobs_client (client_id, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: cfdi_import_manifest
+-- =====================================================
+CREATE TABLE IF NOT EXISTS cfdi_import_manifest (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    path VARCHAR(500) NOT NULL,
+    size BIGINT NOT NULL,
+    mtime_ns BIGINT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    uuid VARCHAR(36) NULL,
+    estado VARCHAR(20) NOT NULL,
+    mensaje VARCHAR(500) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_path_per_client (client_id, path),
+    INDEX idx_manifest_sha256 (client_id, sha256)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: cfdi_blobs
+-- =====================================================
+CREATE TABLE IF NOT EXISTS cfdi_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    path VARCHAR(120) NOT NULL,
+    size BIGINT NOT NULL DEFAULT 0,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: sat_validation_cache
+-- =====================================================
+CREATE TABLE IF NOT EXISTS sat_validation_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    uuid VARCHAR(36) NOT NULL,
+    estado VARCHAR(30) NOT NULL,
+    respuesta JSON NOT NULL,
+    consultado_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    INDEX idx_sat_cache_uuid (uuid),
+    INDEX idx_sat_cache_expires (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: cfdi_daily_rollup
+-- =====================================================
+CREATE TABLE IF NOT EXISTS cfdi_daily_rollup (
+    client_id VARCHAR(50) NOT NULL,
+    dia DATE NOT NULL,
+    tipo_comprobante ENUM('I', 'E', 'T', 'N', 'P') NOT NULL,
+    forma_pago VARCHAR(3) NOT NULL DEFAULT '',
+    metodo_pago VARCHAR(3) NOT NULL DEFAULT '',
+    estatus_validacion ENUM('pendiente', 'valido', 'rechazado', 'revision') NOT NULL,
+    cantidad INT NOT NULL DEFAULT 0,
+    subtotal DECIMAL(18,2) NOT NULL DEFAULT 0,
+    descuento DECIMAL(18,2) NOT NULL DEFAULT 0,
+    total DECIMAL(18,2) NOT NULL DEFAULT 0,
+    impuestos_trasladados DECIMAL(18,2) NOT NULL DEFAULT 0,
+    impuestos_retenidos DECIMAL(18,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, dia, tipo_comprobante, forma_pago, metodo_pago, estatus_validacion)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: client_data_version
+-- =====================================================
+CREATE TABLE IF NOT EXISTS client_data_version (
+    client_id VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: cfdi_search
+-- =====================================================
+CREATE TABLE IF NOT EXISTS cfdi_search (
+    cfdi_id INT PRIMARY KEY,
+    client_id VARCHAR(50) NOT NULL,
+    contenido MEDIUMTEXT NOT NULL,
+    FOREIGN KEY (cfdi_id) REFERENCES cfdi(id) ON DELETE CASCADE,
+    FULLTEXT INDEX ft_cfdi_search_contenido (contenido)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =====================================================
+-- TABLA: sat_download_requests
+-- =====================================================
+CREATE TABLE IF NOT EXISTS sat_download_requests (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    client_id VARCHAR(50) NOT NULL,
+    user_id INT NULL,
+    parent_id INT NULL,
+    tipo VARCHAR(10) NOT NULL,
+    tipo_solicitud VARCHAR(10) NOT NULL DEFAULT 'CFDI',
+    modo VARCHAR(12) NOT NULL DEFAULT 'completa',
+    fecha_inicio DATE NOT NULL,
+    fecha_fin DATE NOT NULL,
+    rfc_emisor VARCHAR(13) NULL,
+    rfc_receptor VARCHAR(13) NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    solicitud_id VARCHAR(50) NULL,
+    estado_sat TINYINT NULL,
+    codigo_estado VARCHAR(10) NULL,
+    numero_cfdis INT NULL,
+    paquetes JSON NULL,
+    paquetes_descargados JSON NULL,
+    resultado JSON NULL,
+    verificaciones INT NOT NULL DEFAULT 0,
+    errores INT NOT NULL DEFAULT 0,
+    mensaje TEXT NULL,
+    next_check_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_sat_download_cola (estado, next_check_at),
+    INDEX idx_sat_download_client (client_id, created_at),
+    INDEX idx_sat_download_parent (parent_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- =====================================================
 -- INSERTAR CLIENTE DE PRUEBA (si no existe)
 -- =====================================================
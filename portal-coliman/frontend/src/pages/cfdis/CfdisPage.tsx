@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import {
   Box,
   Typography,
@@ -69,6 +69,8 @@ const CfdisPage: React.FC = () => {
   const [page, setPage] = useState(0);
   const [rowsPerPage, setRowsPerPage] = useState(25);
   const [total, setTotal] = useState(0);
+  // cursors[n] = cursor para pedir la página n (la página 0 no lleva cursor)
+  const [cursors, setCursors] = useState<(string | null)[]>([null]);
 
   const [filters, setFilters] = useState({
     emisor_rfc: '',
@@ -81,19 +83,43 @@ const CfdisPage: React.FC = () => {
   const [fechaFin, setFechaFin] = useState<Dayjs | null>(null);
   const [validatingCfdis, setValidatingCfdis] = useState<Set<number>>(new Set());
 
-  const fetchCfdis = async () => {
+  // Filtros que se envían al backend. El backend compara RFC exacto: un RFC
+  // a medio escribir (menos de 12 caracteres) solo filtra la página actual
+  const filterParams = useMemo(() => {
+    const rfcCompleto = (rfc: string) => {
+      const valor = rfc.trim().toUpperCase();
+      return valor.length >= 12 ? valor : undefined;
+    };
+    return {
+      fecha_inicio: fechaInicio?.isValid() ? fechaInicio.format('YYYY-MM-DD') : undefined,
+      fecha_fin: fechaFin?.isValid() ? fechaFin.format('YYYY-MM-DD') : undefined,
+      emisor_rfc: rfcCompleto(filters.emisor_rfc),
+      receptor_rfc: rfcCompleto(filters.receptor_rfc),
+      tipo_comprobante: filters.tipo_comprobante || undefined,
+      estatus_validacion: filters.estatus_validacion || undefined,
+    };
+  }, [filters, fechaInicio, fechaFin]);
+  const filterKey = JSON.stringify(filterParams);
+  const lastFilterKey = useRef(filterKey);
+
+  const fetchCfdis = async (pageCursors: (string | null)[] = cursors) => {
     setLoading(true);
     try {
-      console.log('Fetching CFDIs with params:', { skip: page * rowsPerPage, limit: rowsPerPage });
-      const response = await api.get('/api/cfdis/list', {
-        params: {
-          skip: page * rowsPerPage,
-          limit: rowsPerPage,
-        },
-      });
+      // Con cursor conocido se pagina por llave; si se salta a una página sin
+      // cursor (ej. la última) se usa skip
+      const params = pageCursors[page] !== undefined
+        ? { ...filterParams, cursor: pageCursors[page] || undefined, limit: rowsPerPage }
+        : { ...filterParams, skip: page * rowsPerPage, limit: rowsPerPage };
+      console.log('Fetching CFDIs with params:', params);
+      const response = await api.get('/api/cfdis/list', { params });
       console.log('CFDIs response:', response.data);
       setCfdis(response.data.data || []);
       setTotal(response.data.total || 0);
+      if (response.data.next_cursor) {
+        const nextCursors = [...pageCursors];
+        nextCursors[page + 1] = response.data.next_cursor;
+        setCursors(nextCursors);
+      }
     } catch (error: any) {
       console.error('Error fetching CFDIs:', error);
       console.error('Error response:', error.response?.data);
@@ -109,11 +135,24 @@ const CfdisPage: React.FC = () => {
   };
 
   useEffect(() => {
-    if (tabValue === 1) {
-      fetchCfdis();
+    if (tabValue !== 1) {
+      return;
+    }
+    // Los cursores son de la consulta anterior: al cambiar un filtro se
+    // vuelve a la primera página
+    if (filterKey !== lastFilterKey.current) {
+      lastFilterKey.current = filterKey;
+      setCursors([null]);
+      if (page !== 0) {
+        setPage(0);
+        return;
+      }
+      fetchCfdis([null]);
+      return;
     }
+    fetchCfdis();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [tabValue, page, rowsPerPage]);
+  }, [tabValue, page, rowsPerPage, filterKey]);
 
   const handleTabChange = (event: React.SyntheticEvent, newValue: number) => {
     setTabValue(newValue);
@@ -124,13 +163,15 @@ const CfdisPage: React.FC = () => {
   };
 
   const handleChangeRowsPerPage = (event: React.ChangeEvent<HTMLInputElement>) => {
+    setCursors([null]);
     setRowsPerPage(parseInt(event.target.value, 10));
     setPage(0);
   };
 
   const handleUploadComplete = () => {
     // Always fetch latest CFDIs
-    fetchCfdis();
+    setCursors([null]);
+    fetchCfdis([null]);
     // Switch to list tab to show results
     if (tabValue !== 1) {
       setTabValue(1);
@@ -184,24 +225,14 @@ const CfdisPage: React.FC = () => {
     }
   };
 
+  // Fechas, tipo, estatus y RFC completos los filtra el backend; aquí solo
+  // se aplican los RFC parciales sobre la página cargada
   const getFilteredCfdis = () => {
     return cfdis.filter((cfdi) => {
-      if (filters.emisor_rfc && !cfdi.emisor_rfc.toLowerCase().includes(filters.emisor_rfc.toLowerCase())) {
-        return false;
-      }
-      if (filters.receptor_rfc && !cfdi.receptor_rfc.toLowerCase().includes(filters.receptor_rfc.toLowerCase())) {
-        return false;
-      }
-      if (filters.tipo_comprobante && cfdi.tipo_comprobante !== filters.tipo_comprobante) {
-        return false;
-      }
-      if (filters.estatus_validacion && cfdi.estatus_validacion !== filters.estatus_validacion) {
-        return false;
-      }
-      if (fechaInicio && dayjs(cfdi.fecha).isBefore(fechaInicio, 'day')) {
+      if (filters.emisor_rfc && !cfdi.emisor_rfc.toLowerCase().includes(filters.emisor_rfc.trim().toLowerCase())) {
         return false;
       }
-      if (fechaFin && dayjs(cfdi.fecha).isAfter(fechaFin, 'day')) {
+      if (filters.receptor_rfc && !cfdi.receptor_rfc.toLowerCase().includes(filters.receptor_rfc.trim().toLowerCase())) {
         return false;
       }
       return true;
@@ -398,7 +429,7 @@ const CfdisPage: React.FC = () => {
                 </Grid>
               </Grid>
               <Box sx={{ mt: 2, display: 'flex', gap: 1 }}>
-                <Button size="small" variant="outlined" startIcon={<RefreshIcon />} onClick={fetchCfdis}>Actualizar</Button>
+                <Button size="small" variant="outlined" startIcon={<RefreshIcon />} onClick={() => fetchCfdis()}>Actualizar</Button>
                 <Button size="small" variant="outlined" onClick={clearFilters}>Limpiar Filtros</Button>
               </Box>
             </Paper>
@@ -75,6 +75,12 @@ const DescargaMasivaSATPage: React.FC = () => {
         tipo_solicitud: 'CFDI',
       });
 
+      if (response.data.sincronizacion) {
+        // El periodo excede el tope del SAT: se dividió y lo procesa el backend
+        setMessage({ type: 'success', text: response.data.mensaje });
+        return;
+      }
+
       const nuevaSolicitud: Solicitud = {
         solicitud_id: response.data.solicitud_id,
         tipo: 'emitidos',
@@ -117,6 +123,12 @@ const DescargaMasivaSATPage: React.FC = () => {
         tipo_solicitud: 'CFDI',
       });
 
+      if (response.data.sincronizacion) {
+        // El periodo excede el tope del SAT: se dividió y lo procesa el backend
+        setMessage({ type: 'success', text: response.data.mensaje });
+        return;
+      }
+
       const nuevaSolicitud: Solicitud = {
         solicitud_id: response.data.solicitud_id,
         tipo: 'recibidos',